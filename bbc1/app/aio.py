@@ -0,0 +1,695 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2017 beyond-blockchain.org.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import asyncio
+
+import sys
+sys.path.append("../../")
+
+from bbc1.common import bbclib, message_key_types
+from bbc1.common.bbclib import ServiceMessageType as MsgType, StorageType
+from bbc1.common.message_key_types import KeyType, PayloadType, CompressionType
+from bbc1.common.bbc_error import *
+from bbc1.common import logger
+
+DEFAULT_CORE_PORT = 9000
+DEFAULT_TIMEOUT = 30
+RECONNECT_INTERVAL = 1
+MAX_RECONNECT_INTERVAL = 30
+RECV_BUFFER_SIZE = 65536
+
+
+class CoreConnection:
+    """
+    Connection to a core node. When the connection is lost, the requests sent through it fail with ConnectionError,
+    and the connection is re-established (and the user_id is registered again) with exponential backoff.
+    """
+    def __init__(self, client, host, port):
+        self.client = client
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+        self.connected = None
+        self.task = None
+        self.closing = False
+        self.core_accepted_compression = 0
+
+    def start(self):
+        self.closing = False
+        self.connected = asyncio.Event()
+        self.task = asyncio.ensure_future(self.run())
+
+    def is_connected(self):
+        return self.connected is not None and self.connected.is_set()
+
+    async def close(self):
+        self.closing = True
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self):
+        """
+        (internal use) connect to the core node and receive messages until close() is called
+        """
+        interval = RECONNECT_INTERVAL
+        while not self.closing:
+            try:
+                self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            except OSError as e:
+                self.client.logger.info("Failed to connect to %s:%d (%s)" % (self.host, self.port, e))
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, MAX_RECONNECT_INTERVAL)
+                continue
+            interval = RECONNECT_INTERVAL
+            try:
+                await self.register()
+                self.connected.set()
+                await self.receiver_loop()
+            except (OSError, ValueError) as e:
+                self.client.logger.info("TCP disconnect from %s:%d: %s" % (self.host, self.port, e))
+            finally:
+                self.disconnected()
+            if not self.closing:
+                await asyncio.sleep(interval)
+
+    async def register(self):
+        """
+        (internal use) register the user_id in the asset_groups (again after reconnection)
+        """
+        if self.client.user_id is None:
+            return
+        for asset_group_id in self.client.asset_groups:
+            await self.send(self.client.make_message_structure(asset_group_id, MsgType.REGISTER))
+
+    async def receiver_loop(self):
+        codec = message_key_types.MessageCodec(max_message_size=self.client.max_message_size)
+        while True:
+            buf = await self.reader.read(RECV_BUFFER_SIZE)
+            if len(buf) == 0:
+                break
+            for payload_type, msg in codec.feed(buf):
+                self.core_accepted_compression = codec.accepted_compression
+                self.client.deliver(msg)
+
+    def disconnected(self):
+        """
+        (internal use) close the socket and fail the requests waiting for the responses through this connection
+        """
+        self.connected.clear()
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+        for query_id, (future, connection) in list(self.client.pending_requests.items()):
+            if connection is self:
+                del self.client.pending_requests[query_id]
+                if not future.done():
+                    future.set_exception(ConnectionError("Disconnected from %s:%d" % (self.host, self.port)))
+
+    async def send(self, dat):
+        """
+        Serialize and send the message
+
+        :param dat:
+        :return:
+        """
+        if self.writer is None:
+            raise ConnectionError("Not connected to %s:%d" % (self.host, self.port))
+        compression_type = CompressionType.Type_none
+        if self.client.compression:
+            compression_type = message_key_types.select_compression_type(self.core_accepted_compression)
+        parts = message_key_types.make_message_parts(self.client.payload_type, dat, compression_type=compression_type)
+        self.writer.writelines(parts)
+        await self.writer.drain()
+
+
+class AioBBcAppClient:
+    """
+    asyncio client of bbc_core (it does not depend on gevent).
+    The client keeps a connection to each of the core nodes given, and the operations of BBcAppClient are
+    coroutines returning the response message (dictionary) having the same query_id as the request.
+    Read operations (search, cross_ref, verification) and inserts are distributed over the connected core nodes
+    in round robin, while system configuration, signature gathering and user messages are pinned to the first
+    connected core node. Messages that are not responses (e.g., sign requests and messages from other users)
+    are put in the queue read by receive_message(), unless a handler is set by set_message_handler().
+    """
+    def __init__(self, cores=(('127.0.0.1', DEFAULT_CORE_PORT),), logname="-", loglevel="none",
+                 max_message_size=message_key_types.DEFAULT_MAX_MESSAGE_SIZE, payload_type=PayloadType.Type_msgpack,
+                 compression=False, timeout=DEFAULT_TIMEOUT):
+        """
+        Create the client (call connect() to start the connections)
+
+        :param cores: list of (host, port) of core nodes
+        :param logname:
+        :param loglevel:
+        :param max_message_size:
+        :param payload_type:
+        :param compression:
+        :param timeout: default timeout (sec) to wait for a response
+        """
+        self.logger = logger.get_logger(key="bbc_app_aio", level=loglevel, logname=logname)
+        self.connections = [CoreConnection(self, host, port) for host, port in cores]
+        self.max_message_size = max_message_size
+        self.payload_type = payload_type
+        self.compression = compression
+        self.timeout = timeout
+        self.asset_groups = set()
+        self.user_id = None
+        self.query_id = (0).to_bytes(2, 'little')
+        self.pending_requests = dict()
+        self.gathering = dict()     # query_id: [user_ids not responded yet, responses] of gather_signatures
+        self.messages = None
+        self.message_handler = None
+        self.next_index = 0
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        await self.close()
+
+    async def connect(self, timeout=None):
+        """
+        Start the connections and wait until one of them is established
+
+        :param timeout: timeout sec (None means the default timeout)
+        :return: True if connected to at least one core node
+        """
+        if self.messages is None:
+            self.messages = asyncio.Queue()
+        for connection in self.connections:
+            if connection.task is None:
+                connection.start()
+        waiters = [asyncio.ensure_future(c.connected.wait()) for c in self.connections]
+        done, pending = await asyncio.wait(waiters, timeout=timeout or self.timeout,
+                                           return_when=asyncio.FIRST_COMPLETED)
+        for waiter in pending:
+            waiter.cancel()
+        return len(done) > 0
+
+    async def close(self):
+        """
+        Close all connections (reconnection stops)
+
+        :return:
+        """
+        for connection in self.connections:
+            await connection.close()
+
+    def set_user_id(self, identifier):
+        """
+        Set user_id of the object
+
+        :param identifier:
+        :return:
+        """
+        self.user_id = identifier
+
+    def set_asset_group_id(self, asset_group_id):
+        """
+        Set asset_group_id (before register_to_core)
+
+        :param asset_group_id:
+        :return:
+        """
+        self.asset_groups.add(asset_group_id)
+
+    def set_message_handler(self, handler):
+        """
+        Set the function (or coroutine function) handler(dat) to process messages that are not responses
+
+        :param handler: None means the messages are put in the queue
+        :return:
+        """
+        self.message_handler = handler
+
+    def make_message_structure(self, asset_group_id, cmd):
+        """
+        (internal use) make a base message structure for sending to the core node
+
+        :param asset_group_id:
+        :param cmd:
+        :return:
+        """
+        self.query_id = ((int.from_bytes(self.query_id, 'little') + 1) % 65536).to_bytes(2, 'little')
+        return {
+            KeyType.command: cmd,
+            KeyType.asset_group_id: asset_group_id,
+            KeyType.source_user_id: self.user_id,
+            KeyType.query_id: self.query_id,
+            KeyType.status: ESUCCESS,
+        }
+
+    def select_connection(self):
+        """
+        Choose a connected core node in round robin
+
+        :return: CoreConnection
+        """
+        for i in range(len(self.connections)):
+            connection = self.connections[(self.next_index + i) % len(self.connections)]
+            if connection.is_connected():
+                self.next_index = (self.next_index + i + 1) % len(self.connections)
+                return connection
+        raise ConnectionError("No core node is connected")
+
+    def primary_connection(self):
+        """
+        Choose the first connected core node (for the operations that must stay on one core node)
+
+        :return: CoreConnection
+        """
+        for connection in self.connections:
+            if connection.is_connected():
+                return connection
+        raise ConnectionError("No core node is connected")
+
+    async def request(self, dat, connection=None, timeout=None):
+        """
+        Send the request and wait for the response with the same query_id
+
+        :param dat: message made by make_message_structure()
+        :param connection: CoreConnection (None means select_connection())
+        :param timeout: timeout sec (None means the default timeout)
+        :return: response message (asyncio.TimeoutError or ConnectionError is raised on failure)
+        """
+        if connection is None:
+            connection = self.select_connection()
+        query_id = dat[KeyType.query_id]
+        future = asyncio.get_event_loop().create_future()
+        self.pending_requests[query_id] = (future, connection)
+        try:
+            await connection.send(dat)
+            return await asyncio.wait_for(future, timeout or self.timeout)
+        finally:
+            entry = self.pending_requests.get(query_id)
+            if entry is not None and entry[0] is future:
+                del self.pending_requests[query_id]
+
+    async def send(self, dat, connection=None):
+        """
+        Send the message that has no response
+
+        :param dat: message made by make_message_structure()
+        :param connection: CoreConnection (None means primary_connection())
+        :return: True/False
+        """
+        if KeyType.asset_group_id not in dat or KeyType.source_user_id not in dat:
+            self.logger.warn("Message must include asset_group_id and source_id")
+            return False
+        try:
+            if connection is None:
+                connection = self.primary_connection()
+            await connection.send(dat)
+        except (OSError, ValueError) as e:
+            self.logger.error(e)
+            return False
+        return True
+
+    def deliver(self, dat):
+        """
+        (internal use) set the response to the waiting request, or give the message to the handler/queue
+
+        :param dat: received message
+        :return:
+        """
+        if dat.get(KeyType.command) not in bbclib.MESSAGES_FROM_OTHERS:
+            query_id = dat.get(KeyType.query_id)
+            entry = self.pending_requests.get(query_id)
+            if entry is not None:
+                if query_id in self.gathering:
+                    signers, responses = self.gathering[query_id]
+                    responses.append(dat)
+                    signers.discard(dat.get(KeyType.source_user_id))
+                    if len(signers) > 0 and KeyType.source_user_id in dat:
+                        return
+                    dat = responses
+                del self.pending_requests[query_id]
+                if not entry[0].done():
+                    entry[0].set_result(dat)
+                return
+        if self.message_handler is None:
+            self.messages.put_nowait(dat)
+            return
+        ret = self.message_handler(dat)
+        if asyncio.iscoroutine(ret):
+            asyncio.ensure_future(ret)
+
+    async def receive_message(self, timeout=None):
+        """
+        Wait for a message that is not a response (e.g., sign request or message from other user)
+
+        :param timeout: timeout sec (None means waiting forever)
+        :return: message (asyncio.TimeoutError is raised on timeout)
+        """
+        return await asyncio.wait_for(self.messages.get(), timeout)
+
+    async def domain_setup(self, domain_id, module_name=None):
+        """
+        Set up domain with the specified network module (maybe used by a system administrator)
+
+        :param domain_id:
+        :param module_name:
+        :return:
+        """
+        dat = self.make_message_structure(None, MsgType.REQUEST_SETUP_DOMAIN)
+        dat[KeyType.domain_id] = domain_id
+        if module_name is not None:
+            dat[KeyType.network_module] = module_name
+        return await self.request(dat, self.primary_connection())
+
+    async def get_domain_peerlist(self, domain_id):
+        """
+        Get peer list of the domain from the core node (maybe used by a system administrator)
+
+        :param domain_id:
+        :return:
+        """
+        dat = self.make_message_structure(None, MsgType.REQUEST_GET_PEERLIST)
+        dat[KeyType.domain_id] = domain_id
+        return await self.request(dat, self.primary_connection())
+
+    async def set_domain_static_node(self, domain_id, node_id, ipv4, ipv6, port):
+        """
+        Set static node to the core node (maybe used by a system administrator)
+
+        :param domain_id:
+        :param node_id:
+        :param ipv4:
+        :param ipv6:
+        :param port:
+        :return:
+        """
+        dat = self.make_message_structure(None, MsgType.REQUEST_SET_STATIC_NODE)
+        dat[KeyType.domain_id] = domain_id
+        dat[KeyType.peer_info] = [node_id, ipv4, ipv6, port]
+        return await self.request(dat, self.primary_connection())
+
+    async def send_domain_ping(self, domain_id, ipv4, ipv6, port):
+        """
+        Send domain ping to notify the existence of the node (maybe used by a system administrator)
+
+        :param domain_id:
+        :param ipv4:
+        :param ipv6:
+        :param port:
+        :return:
+        """
+        dat = self.make_message_structure(None, MsgType.DOMAIN_PING)
+        dat[KeyType.domain_id] = domain_id
+        dat[KeyType.ipv4_address] = ipv4
+        dat[KeyType.ipv6_address] = ipv6
+        dat[KeyType.port_number] = port
+        return await self.send(dat)
+
+    async def register_asset_group(self, domain_id, asset_group_id,
+                                   storage_type=StorageType.FILESYSTEM, storage_path=None,
+                                   advertise_in_domain0=False):
+        """
+        Register an asset_group in the core node (maybe used by a system administrator)
+
+        :param domain_id:
+        :param asset_group_id:
+        :param storage_type:
+        :param storage_path:
+        :param advertise_in_domain0:
+        :return:
+        """
+        dat = self.make_message_structure(asset_group_id, MsgType.REQUEST_SETUP_ASSET_GROUP)
+        dat[KeyType.domain_id] = domain_id
+        dat[KeyType.storage_type] = storage_type
+        dat[KeyType.advertise_in_domain0] = advertise_in_domain0
+        if storage_path is not None:
+            dat[KeyType.storage_path] = storage_path
+        return await self.request(dat, self.primary_connection())
+
+    async def get_bbc_config(self):
+        """
+        Get config file of bbc_core (maybe used by a system administrator)
+
+        :return:
+        """
+        dat = self.make_message_structure(None, MsgType.REQUEST_GET_CONFIG)
+        return await self.request(dat, self.primary_connection())
+
+    async def get_domain_list(self):
+        """
+        Get domain_id list in bbc_core (maybe used by a system administrator)
+
+        :return:
+        """
+        dat = self.make_message_structure(None, MsgType.REQUEST_GET_DOMAINLIST)
+        return await self.request(dat, self.primary_connection())
+
+    async def manipulate_ledger_subsystem(self, enable=False):
+        """
+        start/stop ledger_subsystem on the bbc_core (maybe used by a system administrator)
+
+        :param enable: True->start, False->stop
+        :return:
+        """
+        dat = self.make_message_structure(None, MsgType.REQUEST_MANIP_LEDGER_SUBSYS)
+        dat[KeyType.ledger_subsys_manip] = enable
+        return await self.request(dat, self.primary_connection())
+
+    async def get_stats(self):
+        """
+        Get the statistics of commands and spans in bbc_core (maybe used by a system administrator)
+
+        :return:
+        """
+        dat = self.make_message_structure(None, MsgType.REQUEST_GET_STATS)
+        return await self.request(dat, self.primary_connection())
+
+    async def manipulate_profiler(self, enable=False, sample_rate=None):
+        """
+        start/stop the sampling profiler in bbc_core (maybe used by a system administrator)
+
+        :param enable: True->start, False->stop
+        :param sample_rate: probability that a command is profiled (0-1)
+        :return:
+        """
+        dat = self.make_message_structure(None, MsgType.REQUEST_MANIP_PROFILER)
+        dat[KeyType.profiler_manip] = enable
+        if sample_rate is not None:
+            dat[KeyType.profile_sample_rate] = sample_rate
+        return await self.request(dat, self.primary_connection())
+
+    async def register_to_core(self):
+        """
+        Register the client (user_id) to all the connected core nodes (it is registered again on reconnection)
+
+        :return: True if registered to at least one core node
+        """
+        result = False
+        for connection in self.connections:
+            if not connection.is_connected():
+                continue
+            try:
+                await connection.register()
+                result = True
+            except (OSError, ValueError) as e:
+                self.logger.error(e)
+        return result
+
+    async def unregister_from_core(self):
+        """
+        Unregister and disconnect from all the core nodes
+
+        :return:
+        """
+        for connection in self.connections:
+            connection.closing = True
+            if connection.is_connected():
+                await self.send(self.make_message_structure(None, MsgType.UNREGISTER), connection)
+        await self.close()
+        return True
+
+    async def get_cross_refs(self, asset_group_id, number):
+        """
+        Get cross_refs
+
+        :param asset_group_id:
+        :param number:
+        :return:
+        """
+        dat = self.make_message_structure(asset_group_id, MsgType.REQUEST_CROSS_REF)
+        dat[KeyType.count] = number
+        return await self.request(dat)
+
+    async def gather_signatures(self, asset_group_id, tx_obj, reference_obj=None, destinations=None,
+                                asset_files=None):
+        """
+        Request to gather signatures from the specified user_ids
+
+        :param asset_group_id:
+        :param tx_obj:
+        :param reference_obj: BBcReference object
+        :param destinations: list of destination user_ids
+        :param asset_files: dictionary of {asset_id: file_content}
+        :return: list of the responses from the destinations
+        """
+        if reference_obj is None and destinations is None:
+            return None
+        dat = self.make_message_structure(asset_group_id, MsgType.REQUEST_GATHER_SIGNATURE)
+        dat[KeyType.transaction_data] = tx_obj.serialize()
+        if reference_obj is not None:
+            dat[KeyType.destination_user_ids] = reference_obj.get_destinations()
+            referred_transactions = dict()
+            referred_transactions.update(reference_obj.get_referred_transaction())
+            if len(referred_transactions) > 0:
+                dat[KeyType.transactions] = referred_transactions
+        elif destinations is not None:
+            dat[KeyType.destination_user_ids] = destinations
+        if isinstance(asset_files, dict):
+            dat[KeyType.all_asset_files] = asset_files
+        signers = set(dat[KeyType.destination_user_ids]) - {self.user_id}
+        if len(signers) == 0:
+            return []
+        query_id = dat[KeyType.query_id]
+        self.gathering[query_id] = [signers, []]
+        try:
+            return await self.request(dat, self.primary_connection())
+        finally:
+            self.gathering.pop(query_id, None)
+
+    async def sendback_signature(self, asset_group_id, dst, ref_index, sig, query_id=None):
+        """
+        Send back the signed transaction to the source
+
+        :param asset_group_id:
+        :param dst:
+        :param ref_index: Which reference in transaction the signature is for
+        :param sig:
+        :param query_id: query_id in the sign request (the source can match the signature with its request)
+        :return:
+        """
+        dat = self.make_message_structure(asset_group_id, MsgType.RESPONSE_SIGNATURE)
+        if query_id is not None:
+            dat[KeyType.query_id] = query_id
+        dat[KeyType.destination_user_id] = dst
+        dat[KeyType.ref_index] = ref_index
+        dat[KeyType.signature] = sig.serialize()
+        return await self.send(dat)
+
+    async def sendback_denial_of_sign(self, asset_group_id, dst, reason_text, query_id=None):
+        """
+        Send back the denial of sign the transaction
+
+        :param asset_group_id:
+        :param dst:
+        :param reason_text:
+        :param query_id: query_id in the sign request
+        :return:
+        """
+        dat = self.make_message_structure(asset_group_id, MsgType.RESPONSE_SIGNATURE)
+        if query_id is not None:
+            dat[KeyType.query_id] = query_id
+        dat[KeyType.destination_user_id] = dst
+        dat[KeyType.status] = EOTHER
+        dat[KeyType.reason] = reason_text
+        return await self.send(dat)
+
+    async def insert_transaction(self, asset_group_id, tx_obj):
+        """
+        Request to insert a legitimate transaction
+
+        :param asset_group_id:
+        :param tx_obj: Transaction object (not deserialized one)
+        :return:
+        """
+        if tx_obj.transaction_id is None:
+            tx_obj.digest()
+        dat = self.make_message_structure(asset_group_id, MsgType.REQUEST_INSERT)
+        dat[KeyType.transaction_data] = tx_obj.serialize()
+        ast = dict()
+        for evt in tx_obj.events:
+            if evt.asset is None:
+                continue
+            asset_digest, content = evt.asset.get_asset_file()
+            if content is not None:
+                ast[evt.asset.asset_id] = content
+        dat[KeyType.all_asset_files] = ast
+        return await self.request(dat)
+
+    async def search_asset(self, asset_group_id, asset_id):
+        """
+        Search request for the specified asset. This would return transaction_data (and asset_file file content)
+
+        :param asset_group_id:
+        :param asset_id:
+        :return:
+        """
+        dat = self.make_message_structure(asset_group_id, MsgType.REQUEST_SEARCH_ASSET)
+        dat[KeyType.asset_id] = asset_id
+        return await self.request(dat)
+
+    async def search_transaction(self, asset_group_id, transaction_id):
+        """
+        Search request for transaction_data
+
+        :param asset_group_id:
+        :param transaction_id:
+        :return:
+        """
+        dat = self.make_message_structure(asset_group_id, MsgType.REQUEST_SEARCH_TRANSACTION)
+        dat[KeyType.transaction_id] = transaction_id
+        return await self.request(dat)
+
+    async def register_in_ledger_subsystem(self, asset_group_id, transaction_id):
+        """
+        Register transaction_id in the ledger_subsystem
+
+        :param asset_group_id:
+        :param transaction_id:
+        :return:
+        """
+        dat = self.make_message_structure(asset_group_id, MsgType.REQUEST_REGISTER_HASH_IN_SUBSYS)
+        dat[KeyType.transaction_id] = transaction_id
+        return await self.request(dat, self.primary_connection())
+
+    async def verify_in_ledger_subsystem(self, asset_group_id, transaction_id):
+        """
+        Verify transaction_id in the ledger_subsystem
+
+        :param asset_group_id:
+        :param transaction_id:
+        :return:
+        """
+        dat = self.make_message_structure(asset_group_id, MsgType.REQUEST_VERIFY_HASH_IN_SUBSYS)
+        dat[KeyType.transaction_id] = transaction_id
+        return await self.request(dat)
+
+    async def send_message(self, msg, asset_group_id, dst_user_id):
+        """
+        Send peer-to-peer message to the specified user_id
+
+        :param msg:
+        :param asset_group_id:
+        :param dst_user_id:
+        :return:
+        """
+        dat = self.make_message_structure(asset_group_id, MsgType.MESSAGE)
+        dat[KeyType.destination_user_id] = dst_user_id
+        dat[KeyType.message] = msg
+        return await self.send(dat)
@@ -18,6 +18,7 @@ import gevent
 from gevent import monkey
 monkey.patch_all()
 from gevent import socket
+from gevent.event import AsyncResult
 import json
 import traceback
 import queue
@@ -29,11 +30,13 @@ sys.path.append("../../")
 
 from bbc1.common import bbclib, message_key_types
 from bbc1.common.bbclib import NodeInfo, ServiceMessageType as MsgType, StorageType
-from bbc1.common.message_key_types import KeyType, PayloadType
+from bbc1.common.message_key_types import KeyType, PayloadType, CompressionType
 from bbc1.common.bbc_error import *
 from bbc1.common import logger
+from bbc1.common.dispatcher import Dispatcher
 
 DEFAULT_CORE_PORT = 9000
+RECONNECT_INTERVAL = 5
 MAPPING_FILE = ".bbc_id_mappings"
 
 
@@ -102,13 +105,31 @@ def get_id_from_mappings(name, asset_group_id):
 
 
 class BBcAppClient:
-    def __init__(self, host='127.0.0.1', port=DEFAULT_CORE_PORT, logname="-", loglevel="none"):
+    """
+    Client of bbc_core.
+    By default, the responses are given to the callback object (e.g., Callback.synchronize() waits for them).
+    If pipelined is True, a request that has a response returns gevent.event.AsyncResult instead of True,
+    which is set to the response message (dictionary) having the same query_id, so that many requests can be
+    in flight on one connection. Unmatched messages (e.g., sign requests and messages from other users) are
+    still given to the callback object.
+    """
+    def __init__(self, host='127.0.0.1', port=DEFAULT_CORE_PORT, logname="-", loglevel="none",
+                 max_message_size=message_key_types.DEFAULT_MAX_MESSAGE_SIZE, payload_type=PayloadType.Type_msgpack,
+                 compression=False, pipelined=False):
         self.logger = logger.get_logger(key="bbc_app", level=loglevel, logname=logname)
         self.connection = socket.create_connection((host, port))
+        self.connected = True
+        self.max_message_size = max_message_size
+        self.payload_type = payload_type
+        self.compression = compression
+        self.core_accepted_compression = 0
         self.callback = Callback(log=self.logger)
         self.asset_groups = set()
         self.user_id = None
         self.query_id = (0).to_bytes(2, 'little')
+        self.pipelined = pipelined
+        self.pending_requests = dict()
+        self.gathering = dict()     # query_id: [user_ids not responded yet, responses] of gather_signatures
         self.start_receiver_loop()
 
     def set_callback(self, callback_obj):
@@ -147,7 +168,7 @@ class BBcAppClient:
         :param cmd:
         :return:
         """
-        self.query_id = ((int.from_bytes(self.query_id, 'little') + 1) // 65536).to_bytes(2, 'little')
+        self.query_id = ((int.from_bytes(self.query_id, 'little') + 1) % 65536).to_bytes(2, 'little')
         return {
             KeyType.command: cmd,
             KeyType.asset_group_id: asset_group_id,
@@ -161,14 +182,75 @@ class BBcAppClient:
         (internal use) send the message to the core node
 
         :param dat:
-        :return:
+        :return: True/False (AsyncResult if pipelined and the request has a response)
+        """
+        if self.pipelined and dat[KeyType.command] in bbclib.REQUESTS_WITH_RESPONSE:
+            return self.send_request(dat)
+        return self.send_message_to_core(dat)
+
+    def send_request(self, dat):
+        """
+        Send the request and return the object to get the response with the same query_id
+
+        For REQUEST_GATHER_SIGNATURE, get() returns the list of the responses from all the destinations.
+
+        :param dat: message made by make_message_structure()
+        :return: gevent.event.AsyncResult (get() returns the response message or raises an exception on failure)
+        """
+        result = AsyncResult()
+        query_id = dat[KeyType.query_id]
+        if dat[KeyType.command] == MsgType.REQUEST_GATHER_SIGNATURE:
+            signers = set(dat[KeyType.destination_user_ids]) - {dat[KeyType.source_user_id]}
+            if len(signers) == 0:
+                result.set([])
+                return result
+            self.gathering[query_id] = [signers, []]
+        self.pending_requests[query_id] = result
+        if not self.send_message_to_core(dat):
+            self.pending_requests.pop(query_id, None)
+            self.gathering.pop(query_id, None)
+            result.set_exception(ConnectionError("Failed to send the request"))
+        return result
+
+    def resolve_request(self, dat):
+        """
+        (internal use) set the response to the AsyncResult of the request
+
+        :param dat: received message
+        :return: True if the message is the response to a pending request
+        """
+        if len(self.pending_requests) == 0 or dat.get(KeyType.command) in bbclib.MESSAGES_FROM_OTHERS:
+            return False
+        query_id = dat.get(KeyType.query_id)
+        if query_id not in self.pending_requests:
+            return False
+        if query_id in self.gathering:
+            signers, responses = self.gathering[query_id]
+            responses.append(dat)
+            signers.discard(dat.get(KeyType.source_user_id))
+            if len(signers) > 0 and KeyType.source_user_id in dat:
+                return True
+            del self.gathering[query_id]
+            dat = responses
+        self.pending_requests.pop(query_id).set(dat)
+        return True
+
+    def send_message_to_core(self, dat):
+        """
+        (internal use) serialize and send the message
+
+        :param dat:
+        :return: True/False
         """
         if KeyType.asset_group_id not in dat or KeyType.source_user_id not in dat:
             self.logger.warn("Message must include asset_group_id and source_id")
             return False
         try:
-            msg = message_key_types.make_message(PayloadType.Type_msgpack, dat)
-            self.connection.sendall(msg)
+            compression_type = CompressionType.Type_none
+            if self.compression:
+                compression_type = message_key_types.select_compression_type(self.core_accepted_compression)
+            parts = message_key_types.make_message_parts(self.payload_type, dat, compression_type=compression_type)
+            message_key_types.sendall_message_parts(self.connection, parts)
         except Exception as e:
             self.logger.error(e)
             return False
@@ -284,6 +366,30 @@ class BBcAppClient:
         dat[KeyType.ledger_subsys_manip] = enable
         return self.send_msg(dat)
 
+    def get_stats(self):
+        """
+        Get the statistics of commands and spans in bbc_core (maybe used by a system administrator)
+
+        :return:
+        """
+        dat = self.make_message_structure(None, MsgType.REQUEST_GET_STATS)
+        return self.send_msg(dat)
+
+    def manipulate_profiler(self, enable=False, sample_rate=None):
+        """
+        start/stop the sampling profiler in bbc_core (maybe used by a system administrator).
+        When stopped, the profile is written into the working directory of bbc_core
+
+        :param enable: True->start, False->stop
+        :param sample_rate: probability that a command is profiled (0-1)
+        :return:
+        """
+        dat = self.make_message_structure(None, MsgType.REQUEST_MANIP_PROFILER)
+        dat[KeyType.profiler_manip] = enable
+        if sample_rate is not None:
+            dat[KeyType.profile_sample_rate] = sample_rate
+        return self.send_msg(dat)
+
     def register_to_core(self):
         """
         Register the client (user_id) to the core node. After that, the client can communicate with the core node
@@ -325,7 +431,7 @@ class BBcAppClient:
         :param reference_obj: BBcReference object
         :param destinations: list of destination user_ids
         :param asset_files: dictionary of {asset_id: file_content}
-        :return:
+        :return: True/False (AsyncResult of the list of the responses from the destinations if pipelined)
         """
         if reference_obj is None and destinations is None:
             return False
@@ -343,7 +449,7 @@ class BBcAppClient:
             dat[KeyType.all_asset_files] = asset_files
         return self.send_msg(dat)
 
-    def sendback_signature(self, asset_group_id, dst, ref_index, sig):
+    def sendback_signature(self, asset_group_id, dst, ref_index, sig, query_id=None):
         """
         Send back the signed transaction to the source
 
@@ -351,24 +457,30 @@ class BBcAppClient:
         :param dst:
         :param ref_index: Which reference in transaction the signature is for
         :param sig:
+        :param query_id: query_id in the sign request (the source can match the signature with its request)
         :return:
         """
         dat = self.make_message_structure(asset_group_id, MsgType.RESPONSE_SIGNATURE)
+        if query_id is not None:
+            dat[KeyType.query_id] = query_id
         dat[KeyType.destination_user_id] = dst
         dat[KeyType.ref_index] = ref_index
         dat[KeyType.signature] = sig.serialize()
         return self.send_msg(dat)
 
-    def sendback_denial_of_sign(self, asset_group_id, dst, reason_text):
+    def sendback_denial_of_sign(self, asset_group_id, dst, reason_text, query_id=None):
         """
         Send back the denial of sign the transaction
 
         :param asset_group_id:
         :param dst:
         :param reason_text:
+        :param query_id: query_id in the sign request
         :return:
         """
         dat = self.make_message_structure(asset_group_id, MsgType.RESPONSE_SIGNATURE)
+        if query_id is not None:
+            dat[KeyType.query_id] = query_id
         dat[KeyType.destination_user_id] = dst
         dat[KeyType.status] = EOTHER
         dat[KeyType.reason] = reason_text
@@ -463,22 +575,26 @@ class BBcAppClient:
         #gevent.joinall(jobs)
 
     def receiver_loop(self):
-        msg_parser = message_key_types.Message()
+        codec = message_key_types.MessageCodec(max_message_size=self.max_message_size)
         try:
             while True:
                 buf = self.connection.recv(8192)
                 if len(buf) == 0:
                     break
-                msg_parser.recv(buf)
-                while True:
-                    msg = msg_parser.parse()
-                    if msg is None:
-                        break
-                    self.callback.dispatch(msg, msg_parser.payload_type)
+                for payload_type, msg in codec.feed(buf):
+                    self.core_accepted_compression = codec.accepted_compression
+                    if not self.resolve_request(msg):
+                        self.callback.dispatch(msg, payload_type)
         except Exception as e:
             self.logger.info("TCP disconnect: %s" % e)
             print(traceback.format_exc())
         self.connection.close()
+        self.connected = False
+        pending = self.pending_requests
+        self.pending_requests = dict()
+        self.gathering = dict()
+        for result in pending.values():
+            result.set_exception(ConnectionError("Disconnected from the core"))
 
 
 class Callback:
@@ -488,52 +604,53 @@ class Callback:
     def __init__(self, log=None):
         self.logger = log
         self.queue = queue.Queue()
+        self.peer_stats = dict()
+        self.dispatcher = Dispatcher()
+        for cmd, handler in (
+                (MsgType.RESPONSE_SEARCH_TRANSACTION, self.proc_resp_search_transaction),
+                (MsgType.RESPONSE_SEARCH_ASSET, self.proc_resp_search_asset),
+                (MsgType.RESPONSE_GATHER_SIGNATURE, self.proc_resp_gather_signature),
+                (MsgType.REQUEST_SIGNATURE, self.proc_cmd_sign_request),
+                (MsgType.RESPONSE_SIGNATURE, self.proc_resp_sign_request),
+                (MsgType.RESPONSE_INSERT, self.proc_resp_insert),
+                (MsgType.RESPONSE_CROSS_REF, self.proc_resp_cross_ref),
+                (MsgType.MESSAGE, self.proc_user_message),
+                (MsgType.RESPONSE_REGISTER_HASH_IN_SUBSYS, self.proc_resp_register_hash),
+                (MsgType.RESPONSE_VERIFY_HASH_IN_SUBSYS, self.proc_resp_verify_hash),
+                (MsgType.RESPONSE_SETUP_ASSET_GROUP, self.proc_resp_asset_group_setup),
+                (MsgType.RESPONSE_SETUP_DOMAIN, self.proc_resp_domain_setup),
+                (MsgType.RESPONSE_GET_PEERLIST, self.proc_resp_get_peerlist),
+                (MsgType.RESPONSE_GET_DOMAINLIST, self.proc_resp_get_domainlist),
+                (MsgType.RESPONSE_SET_STATIC_NODE, self.proc_resp_set_peer),
+                (MsgType.RESPONSE_GET_CONFIG, self.proc_resp_get_config),
+                (MsgType.RESPONSE_MANIP_LEDGER_SUBSYS, self.proc_resp_ledger_subsystem),
+                (MsgType.RESPONSE_GET_STATS, self.proc_resp_get_stats),
+                (MsgType.RESPONSE_MANIP_PROFILER, self.proc_resp_profiler)):
+            self.dispatcher.register(cmd, handler)
 
     def set_logger(self, log):
         self.logger = log
 
+    def register_handler(self, cmd, handler):
+        """
+        Register (or replace) the function to process the message of the command
+
+        :param cmd: ServiceMessageType value
+        :param handler: function handler(dat)
+        :return:
+        """
+        self.dispatcher.register(cmd, handler)
+
     def dispatch(self, dat, payload_type):
         #self.logger.debug("Received: %s" % dat)
         if KeyType.command not in dat:
             self.logger.warn("No command exists")
             return
-        if dat[KeyType.command] == MsgType.RESPONSE_SEARCH_TRANSACTION:
-            self.proc_resp_search_transaction(dat)
-        elif dat[KeyType.command] == MsgType.RESPONSE_SEARCH_ASSET:
-            self.proc_resp_search_asset(dat)
-        elif dat[KeyType.command] == MsgType.RESPONSE_GATHER_SIGNATURE:
-            self.proc_resp_gather_signature(dat)
-        elif dat[KeyType.command] == MsgType.REQUEST_SIGNATURE:
-            self.proc_cmd_sign_request(dat)
-        elif dat[KeyType.command] == MsgType.RESPONSE_SIGNATURE:
-            self.proc_resp_sign_request(dat)
-        elif dat[KeyType.command] == MsgType.RESPONSE_INSERT:
-            self.proc_resp_insert(dat)
-        elif dat[KeyType.command] == MsgType.RESPONSE_CROSS_REF:
-            self.proc_resp_cross_ref(dat)
-        elif dat[KeyType.command] == MsgType.MESSAGE:
-            self.proc_user_message(dat)
-        elif dat[KeyType.command] == MsgType.RESPONSE_REGISTER_HASH_IN_SUBSYS:
-            self.proc_resp_register_hash(dat)
-        elif dat[KeyType.command] == MsgType.RESPONSE_VERIFY_HASH_IN_SUBSYS:
-            self.proc_resp_verify_hash(dat)
-        elif dat[KeyType.command] == MsgType.RESPONSE_SETUP_ASSET_GROUP:
-            self.proc_resp_asset_group_setup(dat)
-        elif dat[KeyType.command] == MsgType.RESPONSE_SETUP_DOMAIN:
-            self.proc_resp_domain_setup(dat)
-        elif dat[KeyType.command] == MsgType.RESPONSE_GET_PEERLIST:
-            self.proc_resp_get_peerlist(dat)
-        elif dat[KeyType.command] == MsgType.RESPONSE_GET_DOMAINLIST:
-            self.proc_resp_get_domainlist(dat)
-        elif dat[KeyType.command] == MsgType.RESPONSE_SET_STATIC_NODE:
-            self.proc_resp_set_peer(dat)
-        elif dat[KeyType.command] == MsgType.RESPONSE_GET_CONFIG:
-            self.proc_resp_get_config(dat)
-        elif dat[KeyType.command] == MsgType.RESPONSE_MANIP_LEDGER_SUBSYS:
-            self.proc_resp_ledger_subsystem(dat)
-
-        else:
+        handler = self.dispatcher.get(dat[KeyType.command])
+        if handler is None:
             self.logger.warn("No method to process for command=%d" % dat[KeyType.command])
+            return
+        handler(dat)
 
     def synchronize(self, timeout=None):
         """
@@ -602,7 +719,7 @@ class Callback:
 
     def proc_resp_get_peerlist(self, dat):
         """
-        Return node info
+        Return node info. Statistics of the peers (see NodeInfo.get_stats()) are kept in self.peer_stats
 
         :param dat:
         :return: list of node info (the first one is that of the connecting core)
@@ -610,6 +727,9 @@ class Callback:
         if KeyType.peer_list not in dat:
             self.queue.put(None)
             return
+        self.peer_stats = dict()
+        for stats in dat.get(KeyType.peer_stats, []):
+            self.peer_stats[bytes(stats[0])] = stats[1:]
         peerlist = dat[KeyType.peer_list]
         results = []
         count = int.from_bytes(peerlist[:4], 'little')
@@ -652,4 +772,265 @@ class Callback:
     def proc_resp_ledger_subsystem(self, dat):
         self.queue.put(dat)
 
+    def proc_resp_get_stats(self, dat):
+        """
+        Return the statistics of bbc_core
+
+        :param dat:
+        :return: dictionary (see Instrumentation.get_stats())
+        """
+        if KeyType.core_stats not in dat:
+            self.queue.put(None)
+            return
+        self.queue.put(json.loads(dat[KeyType.core_stats]))
+
+    def proc_resp_profiler(self, dat):
+        self.queue.put(dat)
+
 
+class BBcAppClientPool(BBcAppClient):
+    """
+    Client of multiple bbc_core nodes (in a domain), which has the same methods as BBcAppClient in pipelined mode.
+    A connection (BBcAppClient) is kept to each core node and the user_id is registered on all of them.
+    Searches, verifications, cross_ref requests and inserts are sent to the core node having the fewest
+    outstanding requests (a search or verification is sent again to another core node if the connection is lost),
+    while system configuration, signature gathering and messages stay on the primary core node,
+    which is changed only when its connection is lost. Lost connections are re-established in background.
+    """
+    BALANCED_REQUESTS = {
+        MsgType.REQUEST_SEARCH_ASSET, MsgType.REQUEST_SEARCH_TRANSACTION, MsgType.REQUEST_CROSS_REF,
+        MsgType.REQUEST_VERIFY_HASH_IN_SUBSYS, MsgType.REQUEST_INSERT,
+    }
+    RETRIED_REQUESTS = {
+        MsgType.REQUEST_SEARCH_ASSET, MsgType.REQUEST_SEARCH_TRANSACTION, MsgType.REQUEST_VERIFY_HASH_IN_SUBSYS,
+    }
+
+    def __init__(self, cores=(('127.0.0.1', DEFAULT_CORE_PORT),), logname="-", loglevel="none",
+                 max_message_size=message_key_types.DEFAULT_MAX_MESSAGE_SIZE, payload_type=PayloadType.Type_msgpack,
+                 compression=False, reconnect_interval=RECONNECT_INTERVAL):
+        """
+        Create object and connect to the core nodes (unreachable ones are retried in background)
+
+        :param cores: list of (host, port) of core nodes
+        :param logname:
+        :param loglevel:
+        :param max_message_size:
+        :param payload_type:
+        :param compression:
+        :param reconnect_interval: interval sec to check the connections and reconnect
+        """
+        self.logger = logger.get_logger(key="bbc_app_pool", level=loglevel, logname=logname)
+        self.logname = logname
+        self.loglevel = loglevel
+        self.cores = list(cores)
+        self.max_message_size = max_message_size
+        self.payload_type = payload_type
+        self.compression = compression
+        self.reconnect_interval = reconnect_interval
+        self.callback = Callback(log=self.logger)
+        self.pool_callback = PoolCallback(self)
+        self.asset_groups = set()
+        self.user_id = None
+        self.query_id = (0).to_bytes(2, 'little')
+        self.pipelined = True
+        self.pending_requests = dict()
+        self.gathering = dict()
+        self.registered = False
+        self.clients = [None for i in range(len(self.cores))]
+        self.primary = None
+        self.next_index = 0
+        for i in range(len(self.cores)):
+            self.connect(i)
+        self.monitor = gevent.spawn(self.monitor_loop)
+
+    def connect(self, index):
+        """
+        (internal use) connect to the core node (and register the user_id if registered)
+
+        :param index: index in cores
+        :return: True/False
+        """
+        host, port = self.cores[index]
+        try:
+            client = BBcAppClient(host=host, port=port, logname=self.logname, loglevel=self.loglevel,
+                                  max_message_size=self.max_message_size, payload_type=self.payload_type,
+                                  compression=self.compression, pipelined=True)
+        except OSError as e:
+            self.logger.info("Failed to connect to %s:%d (%s)" % (host, port, e))
+            return False
+        client.set_callback(self.pool_callback)
+        client.set_user_id(self.user_id)
+        client.asset_groups = self.asset_groups
+        if self.registered:
+            client.register_to_core()
+        self.clients[index] = client
+        return True
+
+    def monitor_loop(self):
+        """
+        (internal use) reconnect to the core nodes whose connections are lost
+        """
+        while True:
+            gevent.sleep(self.reconnect_interval)
+            for i, client in enumerate(self.clients):
+                if client is None or not client.connected:
+                    self.connect(i)
+
+    def get_clients(self):
+        """
+        :return: list of the connected BBcAppClient objects
+        """
+        return [c for c in self.clients if c is not None and c.connected]
+
+    def select_client(self):
+        """
+        Choose the connected core node having the fewest outstanding requests (ties are broken in round robin)
+
+        :return: BBcAppClient
+        """
+        selected = None
+        num = len(self.clients)
+        for i in range(num):
+            client = self.clients[(self.next_index + i) % num]
+            if client is None or not client.connected:
+                continue
+            if selected is None or len(client.pending_requests) < len(selected.pending_requests):
+                selected = client
+        self.next_index = (self.next_index + 1) % num
+        if selected is None:
+            raise ConnectionError("No core node is connected")
+        return selected
+
+    def primary_client(self):
+        """
+        Return the core node for the operations that must stay on one core node (e.g., gathering signatures)
+
+        :return: BBcAppClient
+        """
+        if self.primary is not None and self.primary.connected:
+            return self.primary
+        clients = self.get_clients()
+        if len(clients) == 0:
+            raise ConnectionError("No core node is connected")
+        if self.primary is not None:
+            self.logger.info("primary core node is changed")
+        self.primary = clients[0]
+        return self.primary
+
+    def set_user_id(self, identifier):
+        """
+        Set user_id of the object
+
+        :param identifier:
+        :return:
+        """
+        self.user_id = identifier
+        for client in self.clients:
+            if client is not None:
+                client.set_user_id(identifier)
+
+    def send_msg(self, dat):
+        """
+        (internal use) send the message to one of the core nodes
+
+        :param dat:
+        :return: True/False (AsyncResult if the request has a response)
+        """
+        cmd = dat[KeyType.command]
+        if cmd in BBcAppClientPool.BALANCED_REQUESTS:
+            return self.send_request(dat, retry=cmd in BBcAppClientPool.RETRIED_REQUESTS)
+        try:
+            client = self.primary_client()
+        except ConnectionError as e:
+            self.logger.error(e)
+            if cmd in bbclib.REQUESTS_WITH_RESPONSE:
+                result = AsyncResult()
+                result.set_exception(e)
+                return result
+            return False
+        if cmd in bbclib.REQUESTS_WITH_RESPONSE:
+            return self.send_request(dat, client)
+        return client.send_message_to_core(dat)
+
+    def send_request(self, dat, client=None, retry=False):
+        """
+        Send the request and return the object to get the response with the same query_id
+
+        :param dat: message made by make_message_structure()
+        :param client: BBcAppClient to send the request (None means select_client())
+        :param retry: send the request again to another core node if the connection is lost
+        :return: gevent.event.AsyncResult (get() returns the response message or raises an exception on failure)
+        """
+        result = AsyncResult()
+        self.forward_request(dat, client, retry, result)
+        return result
+
+    def forward_request(self, dat, client, retry, result):
+        """
+        (internal use) send the request through the connection and set the response to result
+
+        :param dat:
+        :param client: BBcAppClient (None means select_client())
+        :param retry:
+        :param result: AsyncResult returned by send_request()
+        :return:
+        """
+        try:
+            if client is None:
+                client = self.select_client()
+        except ConnectionError as e:
+            result.set_exception(e)
+            return
+
+        def relay(response):
+            if response.successful():
+                result.set(response.value)
+            elif retry and len(self.get_clients()) > 0:
+                gevent.spawn(self.forward_request, dat, None, False, result)
+            else:
+                result.set_exception(response.exception)
+        client.send_request(dat).rawlink(relay)
+
+    def register_to_core(self):
+        """
+        Register the client (user_id) to all the core nodes (it is registered again on reconnection)
+
+        :return:
+        """
+        self.registered = True
+        for client in self.get_clients():
+            client.register_to_core()
+        return True
+
+    def unregister_from_core(self):
+        """
+        Unregister and disconnect from all the core nodes
+
+        :return:
+        """
+        self.registered = False
+        self.monitor.kill()
+        for client in self.get_clients():
+            client.unregister_from_core()
+        return True
+
+
+class PoolCallback(Callback):
+    """
+    (internal use) callback of the connections in BBcAppClientPool.
+    A signature that arrives through another core node than the request (sent back by a user connecting to
+    the other core node) is set to the request, and other messages are given to the callback of the pool
+    """
+    def __init__(self, pool):
+        super(PoolCallback, self).__init__(log=pool.logger)
+        self.pool = pool
+
+    def set_logger(self, log):
+        pass
+
+    def dispatch(self, dat, payload_type):
+        if dat.get(KeyType.command) == MsgType.RESPONSE_GATHER_SIGNATURE:
+            for client in self.pool.clients:
+                if client is not None and client.resolve_request(dat):
+                    return
+        self.pool.callback.dispatch(dat, payload_type)
@@ -33,6 +33,9 @@ libbbcsig = CDLL("%s/libbbcsig.so" % directory)
 
 domain_global_0 = binascii.a2b_hex("0000000000000000000000000000000000000000000000000000000000000000")
 
+RTT_SMOOTHING = 0.125       # weight of a new sample in the smoothed RTT (same as TCP SRTT)
+LOSS_RATE_SMOOTHING = 0.1   # weight of a new sample in the loss rate
+
 error_code = -1
 error_text = ""
 
@@ -802,6 +805,10 @@ class ServiceMessageType:
     DOMAIN_PING = 12
     REQUEST_GET_DOMAINLIST = 13
     RESPONSE_GET_DOMAINLIST = 14
+    REQUEST_GET_STATS = 15
+    RESPONSE_GET_STATS = 16
+    REQUEST_MANIP_PROFILER = 17
+    RESPONSE_MANIP_PROFILER = 18
 
     REGISTER = 32
     UNREGISTER = 33
@@ -827,6 +834,22 @@ class ServiceMessageType:
     RESPONSE_VERIFY_HASH_IN_SUBSYS = 131
 
 
+# requests whose responses are returned to the requesting user with the same query_id
+REQUESTS_WITH_RESPONSE = {
+    ServiceMessageType.REQUEST_SETUP_DOMAIN, ServiceMessageType.REQUEST_GET_PEERLIST,
+    ServiceMessageType.REQUEST_SET_STATIC_NODE, ServiceMessageType.REQUEST_SETUP_ASSET_GROUP,
+    ServiceMessageType.REQUEST_GET_CONFIG, ServiceMessageType.REQUEST_MANIP_LEDGER_SUBSYS,
+    ServiceMessageType.REQUEST_GET_DOMAINLIST, ServiceMessageType.REQUEST_GET_STATS,
+    ServiceMessageType.REQUEST_MANIP_PROFILER, ServiceMessageType.REQUEST_GATHER_SIGNATURE,
+    ServiceMessageType.REQUEST_INSERT, ServiceMessageType.REQUEST_SEARCH_ASSET,
+    ServiceMessageType.REQUEST_SEARCH_TRANSACTION, ServiceMessageType.REQUEST_CROSS_REF,
+    ServiceMessageType.REQUEST_REGISTER_HASH_IN_SUBSYS, ServiceMessageType.REQUEST_VERIFY_HASH_IN_SUBSYS,
+}
+
+# messages that carry the query_id of another user (they are never responses to the receiver's requests)
+MESSAGES_FROM_OTHERS = {ServiceMessageType.REQUEST_SIGNATURE, ServiceMessageType.MESSAGE}
+
+
 def is_less_than(val_a, val_b):
     """
     return True if val_a is less than val_b (evaluate as integer)
@@ -869,6 +892,10 @@ class NodeInfo:
         self.created_at = self.updated_at = time.time()
         self.is_alive = False
         self.disconnect_at = 0
+        self.accepted_compression = 0
+        self.rtt = None
+        self.loss_rate = 0.0
+        self.inflight = 0
 
     def __lt__(self, other):
         if self.is_alive and other.is_alive:
@@ -900,6 +927,53 @@ class NodeInfo:
             self.port = port
         self.updated_at = time.time()
 
+    def record_request(self):
+        """
+        Count a request sent to the node (the response is recorded by record_response/record_loss)
+
+        :return:
+        """
+        self.inflight += 1
+
+    def record_response(self, rtt):
+        """
+        Record the round trip time of a request and update the smoothed RTT and loss rate
+
+        :param rtt: round trip time (sec)
+        :return:
+        """
+        self.inflight = max(0, self.inflight - 1)
+        if self.rtt is None:
+            self.rtt = rtt
+        else:
+            self.rtt += RTT_SMOOTHING * (rtt - self.rtt)
+        self.loss_rate -= LOSS_RATE_SMOOTHING * self.loss_rate
+
+    def record_loss(self):
+        """
+        Record a request that was not responded
+
+        :return:
+        """
+        self.inflight = max(0, self.inflight - 1)
+        self.loss_rate += LOSS_RATE_SMOOTHING * (1.0 - self.loss_rate)
+
+    def record_cancel(self):
+        """
+        Record a request that is no longer waited for (neither success nor loss)
+
+        :return:
+        """
+        self.inflight = max(0, self.inflight - 1)
+
+    def get_stats(self):
+        """
+        Return statistics of the node
+
+        :return: list of node_id, smoothed RTT (None if not measured), loss rate, inflight and is_alive
+        """
+        return [self.node_id, self.rtt, self.loss_rate, self.inflight, self.is_alive]
+
     def get_nodeinfo(self):
         ipv4 = socket.inet_pton(socket.AF_INET, self.ipv4)
         ipv6 = socket.inet_pton(socket.AF_INET6, self.ipv6)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2017 beyond-blockchain.org.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+class Dispatcher:
+    """
+    Table of the handlers of commands with middlewares.
+    A middleware is a function middleware(cmd, handler) that returns a function taking the same arguments as handler
+    (e.g., to validate the message, record metrics or check authorization before calling handler).
+    The handlers wrapped by the middlewares are built when a handler or a middleware is added,
+    so that dispatching a message is a dictionary lookup.
+    """
+    def __init__(self):
+        self.handlers = dict()
+        self.middlewares = []
+        self.table = dict()
+
+    def __contains__(self, cmd):
+        return cmd in self.table
+
+    def get(self, cmd):
+        """
+        Return the handler of the command wrapped by the middlewares
+
+        :param cmd: command
+        :return: function (None if not registered)
+        """
+        return self.table.get(cmd)
+
+    def register(self, cmd, handler):
+        """
+        Register (or replace) the handler of the command
+
+        :param cmd: command
+        :param handler: function
+        :return:
+        """
+        self.handlers[cmd] = handler
+        self.build(cmd)
+
+    def unregister(self, cmd):
+        self.handlers.pop(cmd, None)
+        self.table.pop(cmd, None)
+
+    def add_middleware(self, middleware, commands=None):
+        """
+        Add a middleware. The middleware added first is called first.
+
+        :param middleware: function middleware(cmd, handler) that returns the wrapped handler
+        :param commands: list of commands to apply the middleware to (None means all commands)
+        :return:
+        """
+        self.middlewares.append((middleware, None if commands is None else set(commands)))
+        for cmd in self.handlers.keys():
+            self.build(cmd)
+
+    def remove_middleware(self, middleware):
+        self.middlewares = [m for m in self.middlewares if m[0] != middleware]
+        for cmd in self.handlers.keys():
+            self.build(cmd)
+
+    def build(self, cmd):
+        """
+        (internal use) wrap the handler of the command by the middlewares
+
+        :param cmd: command
+        :return:
+        """
+        handler = self.handlers[cmd]
+        for middleware, commands in reversed(self.middlewares):
+            if commands is None or cmd in commands:
+                handler = middleware(cmd, handler)
+        self.table[cmd] = handler
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2017 beyond-blockchain.org.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import collections
+import time
+
+
+class LRUCache:
+    """
+    Bounded cache with Least Recently Used eviction and optional time-to-live of entries.
+    All operations are O(1) (the entries are kept in an OrderedDict in the order of use).
+    """
+    def __init__(self, max_size=1000, ttl=None):
+        """
+        Create cache
+
+        :param max_size: max number of entries
+        :param ttl: lifetime of an entry after it is put (sec). None means no expiration
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()   # key: [expire_at, value]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        entry = self.entries.get(key)
+        return entry is not None and not self._is_expired(key, entry)
+
+    def _is_expired(self, key, entry):
+        if entry[0] is None or entry[0] > time.time():
+            return False
+        del self.entries[key]
+        self.expirations += 1
+        return True
+
+    def get(self, key, default=None):
+        """
+        Get the value and mark the entry as the most recently used one
+
+        :param key:
+        :param default: returned if the key is not cached or expired
+        :return: value
+        """
+        entry = self.entries.get(key)
+        if entry is None or self._is_expired(key, entry):
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value, ttl=None):
+        """
+        Put the value (the least recently used entry is evicted if the cache is full)
+
+        :param key:
+        :param value:
+        :param ttl: lifetime of the entry (sec) instead of the default one of the cache
+        :return:
+        """
+        if ttl is None:
+            ttl = self.ttl
+        self.entries[key] = [None if ttl is None else time.time() + ttl, value]
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        """
+        Remove the entry
+
+        :param key:
+        :param default: returned if the key is not cached
+        :return: value
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return default
+        return entry[1]
+
+    def clear(self):
+        self.entries.clear()
+
+    def purge_expired(self):
+        """
+        Remove all expired entries
+
+        :return: number of removed entries
+        """
+        now = time.time()
+        expired = [key for key, entry in self.entries.items() if entry[0] is not None and entry[0] <= now]
+        for key in expired:
+            del self.entries[key]
+        self.expirations += len(expired)
+        return len(expired)
+
+    def get_stats(self):
+        """
+        Return the statistics of the cache
+
+        :return: dictionary of size, max_size, hits, misses, evictions and expirations
+        """
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
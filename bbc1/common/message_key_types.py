@@ -16,6 +16,32 @@ limitations under the License.
 """
 import msgpack
 import struct
+import zlib
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class CompressionType:
+    Type_none = 0
+    Type_zlib = 1
+    Type_zstd = 2   # available only if zstandard package is installed
+
+
+# payload_version in the header: bit 0-3: CompressionType of the body, bit 4: PRESET_DICTIONARY is used,
+#                                bit 8-15: bitmask of CompressionType that the sender can decode
+COMPRESSION_TYPE_MASK = 0x000F
+COMPRESSION_DICTIONARY_FLAG = 0x0010
+COMPRESSION_ACCEPT_SHIFT = 8
+COMPRESSION_THRESHOLD = 256
+COMPRESSION_DICTIONARY_LIMIT = 4096
+COMPRESSION_LEVEL = 3
+
+ACCEPTED_COMPRESSION = 1 << CompressionType.Type_zlib
+if zstandard is not None:
+    ACCEPTED_COMPRESSION |= 1 << CompressionType.Type_zstd
+zstd_dictionary = None
 
 
 def to_4byte(val, offset=0):
@@ -26,17 +52,171 @@ def to_2byte(val, offset=0):
     return (val+offset).to_bytes(2, 'big')   # network byte order
 
 
-def make_message(payload_type, msg, payload_version=0):
+def make_message_parts(payload_type, msg, payload_version=0, compression_type=0,
+                       compression_threshold=COMPRESSION_THRESHOLD):
+    """
+    Serialize msg and make the header separately (for gather-write).
+    The header always advertises the compression types this node can decode (see get_accepted_compression).
+
+    :param payload_type: PayloadType value
+    :param msg: dictionary to send
+    :param payload_version:
+    :param compression_type: CompressionType value to compress the body with
+    :param compression_threshold: the body is compressed only if it is this size or larger
+    :return: list of [header, body]
+    """
     if payload_type == PayloadType.Type_msgpack:
         dat = msgpack.packb(msg)
     elif payload_type == PayloadType.Type_binary:
         dat = make_TLV_formatted_message(msg)
     else:
         return None
-    msg = bytearray()
-    msg.extend(struct.pack(">HHI", payload_type, payload_version, len(dat)))
-    msg.extend(dat)
-    return msg
+    payload_version |= ACCEPTED_COMPRESSION << COMPRESSION_ACCEPT_SHIFT
+    if compression_type != CompressionType.Type_none and len(dat) >= compression_threshold:
+        compressed, flags = compress_body(compression_type, dat)
+        if len(compressed) < len(dat):
+            dat = compressed
+            payload_version |= flags
+    return [struct.pack(">HHI", payload_type, payload_version, len(dat)), dat]
+
+
+def make_message(payload_type, msg, payload_version=0, compression_type=0,
+                 compression_threshold=COMPRESSION_THRESHOLD):
+    parts = make_message_parts(payload_type, msg, payload_version, compression_type, compression_threshold)
+    if parts is None:
+        return None
+    return b"".join(parts)
+
+
+def sendall_message_parts(sock, parts):
+    """
+    Send header and body with a single sendmsg() call without joining them (if possible)
+
+    :param sock: socket object
+    :param parts: list of bytes-like objects returned by make_message_parts()
+    :return:
+    """
+    if not hasattr(sock, "sendmsg"):
+        sock.sendall(b"".join(parts))
+        return
+    buffers = [memoryview(p) for p in parts]
+    while len(buffers) > 0:
+        sent = sock.sendmsg(buffers)
+        while sent > 0:
+            if sent >= len(buffers[0]):
+                sent -= len(buffers[0])
+                buffers.pop(0)
+            else:
+                buffers[0] = buffers[0][sent:]
+                sent = 0
+
+
+def get_accepted_compression(payload_version):
+    """
+    Get the compression types that the sender of a message can decode
+
+    :param payload_version: payload_version in the header of a received message
+    :return: bitmask of (1 << CompressionType value)
+    """
+    return (payload_version >> COMPRESSION_ACCEPT_SHIFT) & 0xFF
+
+
+def select_compression_type(accepted):
+    """
+    Choose the compression type for messages to a peer (zstd is preferred)
+
+    :param accepted: bitmask returned by get_accepted_compression() for the peer
+    :return: CompressionType value (Type_none if nothing is common)
+    """
+    accepted &= ACCEPTED_COMPRESSION
+    for compression_type in (CompressionType.Type_zstd, CompressionType.Type_zlib):
+        if accepted & (1 << compression_type):
+            return compression_type
+    return CompressionType.Type_none
+
+
+def compress_body(compression_type, dat):
+    """
+    Compress serialized message. A small message is compressed with PRESET_DICTIONARY.
+
+    :param compression_type: CompressionType value
+    :param dat: serialized message
+    :return: compressed data and the flags to set in payload_version
+    """
+    flags = compression_type
+    use_dictionary = len(dat) <= COMPRESSION_DICTIONARY_LIMIT
+    if use_dictionary:
+        flags |= COMPRESSION_DICTIONARY_FLAG
+    if compression_type == CompressionType.Type_zlib:
+        if use_dictionary:
+            compressor = zlib.compressobj(COMPRESSION_LEVEL, zdict=PRESET_DICTIONARY)
+        else:
+            compressor = zlib.compressobj(COMPRESSION_LEVEL)
+        return compressor.compress(dat) + compressor.flush(), flags
+    if compression_type == CompressionType.Type_zstd and zstandard is not None:
+        if use_dictionary:
+            compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL, dict_data=get_zstd_dictionary())
+        else:
+            compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL)
+        return compressor.compress(dat), flags
+    raise ValueError("unsupported compression type %d" % compression_type)
+
+
+def decompress_body(payload_version, dat, max_size=None):
+    """
+    Decompress the body of a received message
+
+    :param payload_version: payload_version in the header
+    :param dat: body of the message
+    :param max_size: ValueError is raised if the decompressed data is larger than this
+    :return: decompressed data (dat itself if not compressed)
+    """
+    compression_type = payload_version & COMPRESSION_TYPE_MASK
+    if compression_type == CompressionType.Type_none:
+        return dat
+    if max_size is None:
+        max_size = DEFAULT_MAX_MESSAGE_SIZE
+    use_dictionary = payload_version & COMPRESSION_DICTIONARY_FLAG
+    if compression_type == CompressionType.Type_zlib:
+        if use_dictionary:
+            decompressor = zlib.decompressobj(zdict=PRESET_DICTIONARY)
+        else:
+            decompressor = zlib.decompressobj()
+        result = decompressor.decompress(dat, max_size)
+        if len(decompressor.unconsumed_tail) > 0:
+            raise ValueError("too large message after decompression")
+        if not decompressor.eof:
+            raise ValueError("incomplete compressed data")
+        return result
+    if compression_type == CompressionType.Type_zstd and zstandard is not None:
+        if zstandard.frame_content_size(dat) > max_size:
+            raise ValueError("too large message after decompression")
+        if use_dictionary:
+            decompressor = zstandard.ZstdDecompressor(dict_data=get_zstd_dictionary())
+        else:
+            decompressor = zstandard.ZstdDecompressor()
+        return decompressor.decompress(dat, max_output_size=max_size)
+    raise ValueError("unsupported compression type %d" % compression_type)
+
+
+def get_zstd_dictionary():
+    global zstd_dictionary
+    if zstd_dictionary is None:
+        zstd_dictionary = zstandard.ZstdCompressionDict(PRESET_DICTIONARY, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+    return zstd_dictionary
+
+
+def decode_payload(payload_type, payload_version, dat, max_size=None):
+    """
+    Decompress (if needed) and deserialize the body of a received message
+
+    :param payload_type: PayloadType value
+    :param payload_version: payload_version in the header
+    :param dat: body of the message
+    :param max_size: max size of the decompressed data
+    :return: deserialized message
+    """
+    return deserialize_data(payload_type, decompress_body(payload_version, dat, max_size))
 
 
 def deserialize_data(payload_type, dat):
@@ -47,23 +227,73 @@ def deserialize_data(payload_type, dat):
     return None
 
 
+TLV_HEADER = struct.Struct(">4sI")  # KeyType (4-byte tag), length of value
+TLV_MSGPACK_FLAG = 0x80000000     # set in the length if the value is serialized with msgpack
+TLV_INT = struct.Struct(">q")
+
+
 def make_TLV_formatted_message(msg):
-    dat = bytearray()
-    for k, v in msg.itmes():
-        dat.extend(k)
-        length = len(v).to_bytes(4, 'little')
-        dat.extend(length)
-        if isinstance(v, list):
-            dat.extend(make_TLV_formatted_message(v))
-    return bytes(dat)
+    """
+    Serialize a dictionary whose keys are KeyType values in TLV format.
+    A value of the type given in TLV_VALUE_TYPES (bytes if not listed) is stored as is,
+    and other values (e.g., list, dict, bool) are serialized with msgpack.
+
+    :param msg: dictionary to send
+    :return: bytes
+    """
+    parts = []
+    for k, v in msg.items():
+        if len(k) != 4:
+            raise ValueError("TLV key must be 4 bytes")
+        value_type = TLV_VALUE_TYPES.get(k, bytes)
+        flag = 0
+        if type(v) is not value_type:
+            v = msgpack.packb(v)
+            flag = TLV_MSGPACK_FLAG
+        elif value_type is int:
+            if -(1 << 63) <= v < (1 << 63):
+                v = TLV_INT.pack(v)
+            else:
+                v = msgpack.packb(v)
+                flag = TLV_MSGPACK_FLAG
+        elif value_type is str:
+            v = v.encode()
+        parts.append(TLV_HEADER.pack(k, len(v) | flag))
+        parts.append(v)
+    return b"".join(parts)
 
 
 def make_dictionary_from_TLV_format(dat):
+    """
+    Deserialize TLV formatted data into a dictionary
+
+    :param dat: bytes-like object made by make_TLV_formatted_message()
+    :return: dictionary
+    """
     msg = dict()
+    unpack_header = TLV_HEADER.unpack_from
+    header_size = TLV_HEADER.size
+    decoders = TLV_DECODERS
     ptr = 0
-    while ptr < len(dat):
-        T, L = struct.unpack("II")
-    return
+    end = len(dat)
+    while ptr < end:
+        if ptr + header_size > end:
+            raise ValueError("truncated TLV header")
+        tag, length = unpack_header(dat, ptr)
+        ptr += header_size
+        if length & TLV_MSGPACK_FLAG:
+            length &= ~TLV_MSGPACK_FLAG
+            decoder = msgpack.unpackb
+        else:
+            decoder = decoders.get(tag, bytes)
+        if ptr + length > end:
+            raise ValueError("truncated TLV value")
+        msg[tag] = decoder(dat[ptr:ptr+length])
+        ptr += length
+    return msg
+
+
+DEFAULT_MAX_MESSAGE_SIZE = 64 * 1024 * 1024
 
 
 class PayloadType:
@@ -71,48 +301,179 @@ class PayloadType:
     Type_msgpack = 1
 
 
+
+
 class Message:
+    """
+    Receive buffer and parser of messages. Parsed data is not removed from the buffer one by one,
+    but the buffer is compacted at once when the consumed part becomes large enough.
+    """
     HEADER_LEN = 8  # Type, length of data_body, data_body
+    COMPACTION_THRESHOLD = 65536
 
     def __init__(self):
         self.pending_buf = bytearray()
+        self.read_pos = 0
         self.is_new_chunk = True
-        self.msg_body = None
         self.payload_type = 0
         self.format_version = 0
         self.msg_len = 0
 
     def recv(self, dat):
+        if self.read_pos == len(self.pending_buf):
+            self.pending_buf.clear()
+            self.read_pos = 0
+        elif self.read_pos > Message.COMPACTION_THRESHOLD:
+            del self.pending_buf[:self.read_pos]
+            self.read_pos = 0
         self.pending_buf.extend(dat)
 
     def parse(self):
-        #print(" > pending_buf=%d,%d"%(len(self.pending_buf), Message.HEADER_LEN))
+        available = len(self.pending_buf) - self.read_pos
         if self.is_new_chunk:
-            if len(self.pending_buf) < Message.HEADER_LEN:
+            if available < Message.HEADER_LEN:
                 return None
-            self.payload_type, self.format_version, self.msg_len = struct.unpack(">HHI",
-                                                                                 self.pending_buf[:Message.HEADER_LEN])
+            self.payload_type, self.format_version, self.msg_len = struct.unpack_from(">HHI", self.pending_buf,
+                                                                                      self.read_pos)
+            self.read_pos += Message.HEADER_LEN
+            available -= Message.HEADER_LEN
             self.is_new_chunk = False
-            self.msg_body = None
-            #print("  >> msg_len=%d"%(self.msg_len))
 
         if self.msg_len == 0:
             self.is_new_chunk = True
-            self.msg_body = []
-            self.pending_buf = self.pending_buf[Message.HEADER_LEN:]
-            #print("  --self.msg_len == Message.HEADER_LEN -->true")
             return None
 
-        if self.msg_len > 0 and len(self.pending_buf) >= self.msg_len+Message.HEADER_LEN:
+        if available >= self.msg_len:
             self.is_new_chunk = True
-            self.msg_body = self.pending_buf[Message.HEADER_LEN:(self.msg_len+Message.HEADER_LEN)]
-            self.pending_buf = self.pending_buf[(self.msg_len+Message.HEADER_LEN):]
-            #print("  --self.msg_len > Message.HEADER_LEN -->true")
-            return deserialize_data(self.payload_type, self.msg_body)
-        #print(" --->>> false")
+            start = self.read_pos
+            self.read_pos += self.msg_len
+            with memoryview(self.pending_buf) as buf, buf[start:self.read_pos] as body:
+                return decode_payload(self.payload_type, self.format_version, body)
         return None
 
 
+class MessageCodec:
+    """
+    Per-connection decoder of a byte stream. A msgpack body split across received chunks is fed into a persistent
+    msgpack.Unpacker as the chunks arrive, while the 8-byte header (>HHI) still delimits every message.
+    A body contained in a single chunk is decoded in place without being copied.
+    """
+    HEADER_LEN = 8
+
+    def __init__(self, max_message_size=DEFAULT_MAX_MESSAGE_SIZE):
+        """
+        Create the codec
+
+        :param max_message_size: ValueError is raised if a header announces a larger body
+        """
+        self.max_message_size = max_message_size
+        self.unpacker = msgpack.Unpacker(max_buffer_size=max_message_size)
+        self.header = bytearray()
+        self.body = bytearray()
+        self.fed_len = 0
+        self.remaining = 0
+        self.payload_type = 0
+        self.format_version = 0
+        self.msg_len = 0
+        self.streaming = False
+        self.accepted_compression = 0
+
+    def feed(self, dat):
+        """
+        Feed received data and get the messages completed by it
+
+        :param dat: received bytes
+        :return: list of (payload_type, message)
+        """
+        results = []
+        with memoryview(dat) as view:
+            pos = 0
+            end = len(view)
+            if self.remaining > 0 or len(self.header) > 0:
+                pos = self.feed_partial(view, 0, results)
+            while pos < end:
+                if end - pos < MessageCodec.HEADER_LEN:
+                    self.header.extend(view[pos:])
+                    break
+                self.payload_type, self.format_version, self.msg_len = struct.unpack_from(">HHI", view, pos)
+                self.check_header()
+                pos += MessageCodec.HEADER_LEN
+                if pos + self.msg_len > end:
+                    self.remaining = self.msg_len
+                    pos = self.feed_partial(view, pos, results)
+                    continue
+                if self.msg_len > 0:
+                    with view[pos:pos+self.msg_len] as body:
+                        results.append((self.payload_type, decode_payload(self.payload_type, self.format_version,
+                                                                          body, self.max_message_size)))
+                pos += self.msg_len
+        return results
+
+    def feed_partial(self, view, pos, results):
+        """
+        (internal use) continue the message that spans received chunks
+
+        :param view: memoryview of received data
+        :param pos: current position in view
+        :param results: list to which the completed message is appended
+        :return: next position in view
+        """
+        if self.remaining == 0:
+            need = MessageCodec.HEADER_LEN - len(self.header)
+            self.header.extend(view[pos:pos+need])
+            pos += min(need, len(view) - pos)
+            if len(self.header) < MessageCodec.HEADER_LEN:
+                return pos
+            self.payload_type, self.format_version, self.msg_len = struct.unpack(">HHI", self.header)
+            self.header.clear()
+            self.check_header()
+            self.remaining = self.msg_len
+            if self.remaining == 0:
+                return pos
+        size = min(self.remaining, len(view) - pos)
+        if self.streaming:
+            self.unpacker.feed(view[pos:pos+size])
+            self.fed_len += size
+        else:
+            self.body.extend(view[pos:pos+size])
+        self.remaining -= size
+        if self.remaining == 0:
+            results.append((self.payload_type, self.decode_body()))
+        return pos + size
+
+    def check_header(self):
+        """
+        (internal use) validate the header of the next message
+
+        :return:
+        """
+        if self.payload_type not in (PayloadType.Type_msgpack, PayloadType.Type_binary):
+            raise ValueError("unknown payload type %d" % self.payload_type)
+        if self.msg_len > self.max_message_size:
+            raise ValueError("too large message (%d bytes)" % self.msg_len)
+        compression_type = self.format_version & COMPRESSION_TYPE_MASK
+        self.streaming = self.payload_type == PayloadType.Type_msgpack and compression_type == CompressionType.Type_none
+        self.accepted_compression = get_accepted_compression(self.format_version)
+
+    def decode_body(self):
+        """
+        (internal use) get the object from the unpacker (or decode the buffered body)
+
+        :return: deserialized message
+        """
+        if not self.streaming:
+            dat = decode_payload(self.payload_type, self.format_version, self.body, self.max_message_size)
+            self.body = bytearray()
+            return dat
+        try:
+            dat = self.unpacker.unpack()
+        except msgpack.OutOfData:
+            raise ValueError("incomplete message body")
+        if hasattr(self.unpacker, "tell") and self.unpacker.tell() != self.fed_len:
+            raise ValueError("message body does not match the length in the header")
+        return dat
+
+
 class KeyType:
     status = to_4byte(0)    # status code in bbc_error
     reason = to_4byte(1)    # text
@@ -125,6 +486,8 @@ class KeyType:
     query_id = to_4byte(12)      # query_id from bbc_app
     nonce = to_4byte(13)
     count = to_4byte(14)
+    snapshot_cursor = to_4byte(15)
+    snapshot_next_cursor = to_4byte(16)
 
     ledger_subsys_manip = to_4byte(0, 0x20)     # enable/disable ledger_subsystem
     ledger_subsys_register = to_4byte(1, 0x20)
@@ -143,6 +506,18 @@ class KeyType:
     ipv4_address = to_4byte(9, 0x30)
     ipv6_address = to_4byte(10, 0x30)
     port_number = to_4byte(11, 0x30)
+    peer_stats = to_4byte(12, 0x30)
+    user_directory = to_4byte(13, 0x30)
+    asset_group_withdrawn = to_4byte(14, 0x30)
+    peer_list_removed = to_4byte(15, 0x30)
+    peer_list_version = to_4byte(16, 0x30)
+    peer_list_digest = to_4byte(17, 0x30)
+    core_stats = to_4byte(18, 0x30)
+    profiler_manip = to_4byte(19, 0x30)
+    profile_sample_rate = to_4byte(20, 0x30)
+    profile_file = to_4byte(21, 0x30)
+    asset_group_version = to_4byte(22, 0x30)
+    asset_group_digest = to_4byte(23, 0x30)
 
     resource_id = to_4byte(0, 0x40)
     resource_type = to_4byte(1, 0x40)
@@ -160,6 +535,7 @@ class KeyType:
     asset_group_id = to_4byte(1, 0x60)
     transaction_id = to_4byte(2, 0x60)
     asset_id = to_4byte(3, 0x60)
+    transaction_ids = to_4byte(4, 0x60)
 
     transaction_data = to_4byte(0, 0x70)
     transactions = to_4byte(1, 0x70)
@@ -168,5 +544,64 @@ class KeyType:
     all_asset_files = to_4byte(4, 0x70)
     signature = to_4byte(5, 0x70)
     cross_refs = to_4byte(6, 0x70)
+    range_digests = to_4byte(7, 0x70)
+    snapshot_rows = to_4byte(8, 0x70)
+
+
+
+
+TLV_VALUE_TYPES = {
+    KeyType.status: int,
+    KeyType.reason: str,
+    KeyType.command: int,
+    KeyType.count: int,
+    KeyType.storage_type: int,
+    KeyType.storage_path: str,
+    KeyType.ipv4_address: str,
+    KeyType.ipv6_address: str,
+    KeyType.port_number: int,
+    KeyType.resource_type: int,
+    KeyType.ref_index: int,
+}
+
+TLV_DECODERS = {
+    int: lambda v: TLV_INT.unpack(v)[0],
+    str: lambda v: str(v, 'utf-8'),
+}
+TLV_DECODERS = {k: TLV_DECODERS[t] for k, t in TLV_VALUE_TYPES.items()}
+
+
+def make_preset_dictionary():
+    """
+    Make the dictionary for compressing small messages. The content must be identical on all nodes, so it is built
+    from fixed templates of frequent messages (KeyType tags, ids, and a serialized transaction with its events,
+    references and signatures) instead of being trained from the actual traffic.
+
+    :return: bytes
+    """
+    zero_id = bytes(32)
+    id_field = struct.pack(">H", 32) + zero_id  # bbclib.to_bigint()
+    asset = id_field + id_field + id_field + struct.pack(">IH", 0, 0)
+    event = id_field + struct.pack(">HHH", 1, 0, 1) + id_field + struct.pack(">HH", 0, 0) + \
+        struct.pack(">I", len(asset)) + asset
+    reference = id_field + id_field + struct.pack(">HHH", 0, 1, 0)
+    signature = struct.pack(">II", 1, 65 * 8) + b'\x04' + bytes(64) + struct.pack(">I", 64 * 8) + bytes(64)
+    transaction = struct.pack(">IQH", 0, 0, 1) + struct.pack(">I", len(event)) + event + \
+        struct.pack(">H", 1) + struct.pack(">I", len(reference)) + reference + struct.pack(">H", 0) + \
+        struct.pack(">H", 1) + struct.pack(">I", len(signature)) + signature
+    templates = [
+        {KeyType.domain_id: zero_id, KeyType.source_node_id: zero_id, KeyType.destination_node_id: zero_id,
+         KeyType.p2p_msg_type: to_2byte(0), KeyType.nonce: bytes(8), KeyType.asset_group_id: zero_id,
+         KeyType.resource_id: zero_id, KeyType.resource_type: 0, KeyType.resource: transaction},
+        {KeyType.command: 0, KeyType.query_id: bytes(2), KeyType.status: 0, KeyType.source_user_id: zero_id,
+         KeyType.destination_user_id: zero_id, KeyType.asset_group_id: zero_id, KeyType.transaction_id: zero_id,
+         KeyType.transaction_data: transaction, KeyType.all_asset_files: {zero_id: b''}},
+    ]
+    dat = bytearray()
+    for msg in templates:
+        dat.extend(msgpack.packb(msg))
+        dat.extend(make_TLV_formatted_message(msg))
+    return bytes(dat)
 
 
+PRESET_DICTIONARY = make_preset_dictionary()
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2017 beyond-blockchain.org.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import binascii
+import random
+
+import sys
+sys.path.extend(["../../"])
+from bbc1.common.message_key_types import KeyType
+from bbc1.core.bbc_ledger import ResourceType
+from bbc1.core import bbc_network, query_management
+
+
+INTERVAL = 600
+SESSION_TIMEOUT = 60
+MAX_BYTES_PER_SESSION = 4 * 1024 * 1024
+MAX_BYTES_PER_MESSAGE = 512 * 1024
+LEAF_SIZE = 64              # transaction_ids are listed when a range has at most this number of transactions
+FANOUT = 16                 # a differing range is split into this number of subranges
+MAX_RANGES_PER_MESSAGE = 256
+MAX_IDS_PER_MESSAGE = 256
+ID_SPACE = 1 << 256
+
+ticker = query_management.get_ticker()
+
+
+def split_range(start, end):
+    """
+    Split [start, end) of transaction_id space into FANOUT subranges
+
+    :param start: 32-byte transaction_id
+    :param end: 32-byte transaction_id (None means the end of the space)
+    :return: list of [start, end]
+    """
+    lower = int.from_bytes(start, 'big')
+    upper = ID_SPACE if end is None else int.from_bytes(end, 'big')
+    step = max(1, (upper - lower) // FANOUT)
+    ranges = []
+    pos = lower
+    while pos < upper:
+        nxt = min(upper, pos + step)
+        if upper - nxt < step:
+            nxt = upper
+        ranges.append([pos.to_bytes(32, 'big'), None if nxt == ID_SPACE else nxt.to_bytes(32, 'big')])
+        pos = nxt
+    return ranges
+
+
+class AntiEntropy:
+    """
+    Background synchronization of transactions between the peers in a domain.
+    A node pulls from a peer: it sends the digests of transaction_id ranges, the peer returns the ranges that differ
+    (with the list of transaction_ids if a range is small enough), and the missing transactions are transferred.
+    Only one request is in flight in a session, and a session stops when the received bytes exceed the limit.
+    """
+    def __init__(self, domain, interval=INTERVAL, max_bytes_per_session=MAX_BYTES_PER_SESSION,
+                 max_bytes_per_message=MAX_BYTES_PER_MESSAGE):
+        """
+        Start the timer of anti-entropy sessions
+
+        :param domain: DomainBase object
+        :param interval: interval of sessions (sec)
+        :param max_bytes_per_session: max bytes of transactions received in a session
+        :param max_bytes_per_message: max bytes of transactions in a RESPONSE_TRANSACTIONS message
+        """
+        self.domain = domain
+        self.interval = interval
+        self.max_bytes_per_session = max_bytes_per_session
+        self.max_bytes_per_message = max_bytes_per_message
+        self.timer = None
+        self.set_timer()
+
+    def set_timer(self):
+        self.timer = query_management.exec_func_after(self.start_sessions,
+                                                      random.randint(int(self.interval / 2), int(self.interval * 1.5)))
+
+    def stop(self):
+        self.timer.deactivate()
+
+    def start_sessions(self, query_entry=None):
+        """
+        (internal use) start a session with a peer for each asset_group
+
+        :param query_entry:
+        :return:
+        """
+        self.set_timer()
+        peers = self.domain.select_peers(3)
+        if len(peers) == 0:
+            return
+        for asset_group_id in self.domain.get_asset_group_ids():
+            self.start_session(random.choice(peers), asset_group_id)
+
+    def start_session(self, node_id, asset_group_id):
+        """
+        Start synchronization of the asset_group with the peer
+
+        :param node_id: peer to pull transactions from
+        :param asset_group_id:
+        :return: QueryEntry of the session
+        """
+        self.domain.logger.debug("[%s] start anti-entropy with %s" % (self.domain.shortname,
+                                                                      binascii.b2a_hex(node_id[:4])))
+        session = query_management.QueryEntry(expire_after=SESSION_TIMEOUT,
+                                              callback_expire=self.session_finished,
+                                              data={KeyType.node_id: node_id,
+                                                    KeyType.asset_group_id: asset_group_id,
+                                                    'ranges': [[bytes(32), None]],
+                                                    'missing': [],
+                                                    'requested': [],
+                                                    'received': 0,
+                                                    'stored': 0})
+        self.proceed(session)
+        return session
+
+    def session_finished(self, session):
+        self.domain.logger.debug("[%s] anti-entropy finished: %d transactions stored" %
+                                 (self.domain.shortname, session.data['stored']))
+
+    def proceed(self, session):
+        """
+        (internal use) send the next request of the session (transfer precedes digest comparison)
+
+        :param session: QueryEntry of the session
+        :return:
+        """
+        if not session.active:
+            return
+        if len(session.data['missing']) > 0 and session.data['received'] < self.max_bytes_per_session:
+            session.data['requested'] = session.data['missing'][:MAX_IDS_PER_MESSAGE]
+            del session.data['missing'][:MAX_IDS_PER_MESSAGE]
+            self.send_request_transactions(session)
+        elif len(session.data['ranges']) > 0 and session.data['received'] < self.max_bytes_per_session:
+            ranges = session.data['ranges'][:MAX_RANGES_PER_MESSAGE]
+            del session.data['ranges'][:MAX_RANGES_PER_MESSAGE]
+            self.send_request_range_digest(session, ranges)
+        else:
+            session.force_expire()
+
+    def get_range_digests(self, asset_group_id, ranges):
+        ledger = self.domain.network.core.ledger_manager
+        digests = []
+        for start, end in ranges:
+            count, digest = ledger.get_range_digest(self.domain.domain_id, asset_group_id, start, end)
+            digests.append([start, end, count, digest])
+        return digests
+
+    def send_request_range_digest(self, session, ranges):
+        asset_group_id = session.data[KeyType.asset_group_id]
+        msg = self.domain.make_message(dst_node_id=session.data[KeyType.node_id], nonce=session.nonce,
+                                       msg_type=bbc_network.InfraMessageTypeBase.REQUEST_RANGE_DIGEST)
+        msg[KeyType.asset_group_id] = asset_group_id
+        msg[KeyType.range_digests] = self.get_range_digests(asset_group_id, ranges)
+        self.domain.send_message_to_peer(msg, self.domain.default_payload_type)
+
+    def send_request_transactions(self, session):
+        msg = self.domain.make_message(dst_node_id=session.data[KeyType.node_id], nonce=session.nonce,
+                                       msg_type=bbc_network.InfraMessageTypeBase.REQUEST_TRANSACTIONS)
+        msg[KeyType.asset_group_id] = session.data[KeyType.asset_group_id]
+        msg[KeyType.transaction_ids] = session.data['requested']
+        self.domain.send_message_to_peer(msg, self.domain.default_payload_type)
+
+    def process_REQUEST_RANGE_DIGEST(self, msg):
+        """
+        Compare the digests with the local ledger and return the ranges that differ
+
+        :param msg:
+        :return:
+        """
+        asset_group_id = msg[KeyType.asset_group_id]
+        ledger = self.domain.network.core.ledger_manager
+        results = []
+        for start, end, count, digest in msg[KeyType.range_digests][:MAX_RANGES_PER_MESSAGE]:
+            start = bytes(start)
+            end = None if end is None else bytes(end)
+            my_count, my_digest = ledger.get_range_digest(self.domain.domain_id, asset_group_id, start, end)
+            if my_count == count and my_digest == digest:
+                continue
+            if my_count <= LEAF_SIZE:
+                results.append([start, end, ledger.get_transaction_ids(self.domain.domain_id, asset_group_id,
+                                                                       start, end)])
+            else:
+                results.append([start, end, None])
+        reply = self.domain.make_message(dst_node_id=msg[KeyType.source_node_id], nonce=msg[KeyType.nonce],
+                                         msg_type=bbc_network.InfraMessageTypeBase.RESPONSE_RANGE_DIGEST)
+        reply[KeyType.asset_group_id] = asset_group_id
+        reply[KeyType.range_digests] = results
+        self.domain.send_message_to_peer(reply, self.domain.default_payload_type)
+
+    def process_RESPONSE_RANGE_DIGEST(self, msg):
+        """
+        Queue the missing transactions and the subranges to compare next
+
+        :param msg:
+        :return:
+        """
+        session = ticker.get_entry(msg[KeyType.nonce])
+        if session is None or not session.active or session.data[KeyType.node_id] != msg[KeyType.source_node_id]:
+            return
+        asset_group_id = session.data[KeyType.asset_group_id]
+        ledger = self.domain.network.core.ledger_manager
+        for start, end, txids in msg[KeyType.range_digests]:
+            start = bytes(start)
+            end = None if end is None else bytes(end)
+            if txids is None:
+                session.data['ranges'].extend(split_range(start, end))
+                continue
+            mine = set(ledger.get_transaction_ids(self.domain.domain_id, asset_group_id, start, end))
+            session.data['missing'].extend(bytes(txid) for txid in txids if bytes(txid) not in mine)
+        self.proceed(session)
+
+    def process_REQUEST_TRANSACTIONS(self, msg):
+        """
+        Return the requested transactions (as many as fit in max_bytes_per_message)
+
+        :param msg:
+        :return:
+        """
+        asset_group_id = msg[KeyType.asset_group_id]
+        ledger = self.domain.network.core.ledger_manager
+        transactions = []
+        size = 0
+        count = 0
+        for txid in msg[KeyType.transaction_ids][:MAX_IDS_PER_MESSAGE]:
+            txdata = ledger.find_locally(self.domain.domain_id, asset_group_id, bytes(txid),
+                                         ResourceType.Transaction_data)
+            if txdata is not None:
+                if size > 0 and size + len(txdata) > self.max_bytes_per_message:
+                    break
+                transactions.append(txdata)
+                size += len(txdata)
+            count += 1
+        reply = self.domain.make_message(dst_node_id=msg[KeyType.source_node_id], nonce=msg[KeyType.nonce],
+                                         msg_type=bbc_network.InfraMessageTypeBase.RESPONSE_TRANSACTIONS)
+        reply[KeyType.asset_group_id] = asset_group_id
+        reply[KeyType.transactions] = transactions
+        reply[KeyType.count] = count
+        self.domain.send_message_to_peer(reply, self.domain.default_payload_type)
+
+    def process_RESPONSE_TRANSACTIONS(self, msg):
+        """
+        Store the received transactions. Those not sent because of the message size limit are requested again.
+
+        :param msg:
+        :return:
+        """
+        session = ticker.get_entry(msg[KeyType.nonce])
+        if session is None or not session.active or session.data[KeyType.node_id] != msg[KeyType.source_node_id]:
+            return
+        asset_group_id = session.data[KeyType.asset_group_id]
+        for txdata in msg[KeyType.transactions]:
+            session.data['received'] += len(txdata)
+            self.domain.store_resource_locally(asset_group_id, None, ResourceType.Transaction_data, txdata)
+            session.data['stored'] += 1
+        count = msg.get(KeyType.count, len(session.data['requested']))
+        if 0 < count < len(session.data['requested']):
+            session.data['missing'][0:0] = session.data['requested'][count:]
+        session.data['requested'] = []
+        self.proceed(session)
@@ -39,6 +39,8 @@ current_config = {
     'client': {
         'ipv6': False,
         'port': DEFAULT_CORE_PORT,
+        'max_message_size': 64 * 1024 * 1024,
+        'compression': False,
     },
     'ledger': {
         'type': "sqlite3",
@@ -53,9 +55,44 @@ current_config = {
         'ipv6': False,
         'p2p_port': DEFAULT_P2P_PORT,
         'max_connections': 100,
+        'connection_pool': {
+            'idle_timeout': 300,
+            'max_connections_per_peer': 2,
+            'write_queue_size': 256,
+            'max_message_size': 64 * 1024 * 1024,
+        },
+        'compression': {
+            'enabled': True,
+            'threshold': 256,
+        },
+        'anti_entropy': {
+            'enabled': True,
+            'interval': 600,
+            'max_bytes_per_session': 4 * 1024 * 1024,
+            'max_bytes_per_message': 512 * 1024,
+        },
+        'snapshot': {
+            'enabled': True,
+            'max_bytes_per_message': 1024 * 1024,
+        },
+        'cross_ref': {
+            'batch_size': 32,
+            'batch_delay': 1,
+            'max_buffer_size': 10000,
+            'max_list_size': 10000,
+        },
+        'proxy_search': {
+            'cache_size': 1000,
+            'cache_ttl': 300,
+        },
         'modules': {
             'simple_cluster': {
                 'test': 1,
+                'hedged_lookup_num': 3,
+                'hedge_delay': 0,
+                'replication_factor': 0,
+                'protocol_period': 5,
+                'suspect_timeout': 15,
             },
             'p2p_kademlia': {
                 'concurrent_lookup_num': 3,
@@ -85,6 +122,11 @@ current_config = {
         'contract': 'BBcAnchor',
         'contract_address': '',
     },
+    'instrumentation': {
+        'enabled': True,
+        'spans': False,
+        'profile_sample_rate': 0.01,
+    },
     'ledger_subsystem': {
         'subsystem': 'ethereum',
         'max_transactions': 4096,
@@ -159,5 +201,6 @@ class BBcConfig:
                 'storage_type': StorageType.FILESYSTEM,
                 'storage_path': None,
                 'advertise_in_domain0': False,
+                'replication_factor': None,
             }
         return dc['asset_group_ids'][asset_group_str]
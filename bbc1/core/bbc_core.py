@@ -26,14 +26,18 @@ import os
 import signal
 import hashlib
 import binascii
+import collections
+import json
 import traceback
 
 import sys
 sys.path.extend(["../../"])
 from bbc1.common import bbclib, message_key_types, logger
-from bbc1.common.message_key_types import KeyType, PayloadType, to_2byte
+from bbc1.common.message_key_types import KeyType, PayloadType, CompressionType, to_2byte
 from bbc1.common.bbclib import BBcTransaction, ServiceMessageType as MsgType, StorageType
-from bbc1.core import bbc_network, bbc_storage, query_management
+from bbc1.common.lru_cache import LRUCache
+from bbc1.common.dispatcher import Dispatcher
+from bbc1.core import bbc_network, bbc_storage, query_management, instrumentation
 from bbc1.core.bbc_config import BBcConfig
 from bbc1.core.bbc_ledger import BBcLedger, ResourceType
 from bbc1.core import ledger_subsystem
@@ -47,6 +51,14 @@ POOL_SIZE = 1000
 DURATION_GIVEUP_GET = 10
 GET_RETRY_COUNT = 3
 INTERVAL_RETRY = 3
+MAX_CROSS_REF_LIST = 10000
+PROXY_CACHE_SIZE = 1000
+PROXY_CACHE_TTL = 300
+SIGN_REQUEST_CACHE_SIZE = 10000
+SIGN_REQUEST_TTL = 600
+MAX_SIGN_REQUESTS_PER_USER = 100
+
+COMMAND_NAMES = {v: k for k, v in vars(MsgType).items() if k.isupper()}
 
 ticker = query_management.get_ticker()
 core_service = None
@@ -121,8 +133,24 @@ class BBcCoreService:
         self.logger.debug("config = %s" % conf)
         self.test_tx_obj = BBcTransaction()
         self.user_id_sock_mapping = dict()
+        self.sock_encoding = dict()
         self.asset_group_domain_mapping = dict()
-        self.cross_ref_list = []
+        self.cross_ref_list = collections.deque(maxlen=conf['network'].get('cross_ref', dict()).get(
+            'max_list_size', MAX_CROSS_REF_LIST))
+        proxy_conf = conf['network'].get('proxy_search', dict())
+        self.proxy_cache = LRUCache(max_size=proxy_conf.get('cache_size', PROXY_CACHE_SIZE),
+                                    ttl=proxy_conf.get('cache_ttl', PROXY_CACHE_TTL))
+        self.sign_requests = LRUCache(max_size=SIGN_REQUEST_CACHE_SIZE, ttl=SIGN_REQUEST_TTL)
+        self.max_message_size = conf['client'].get('max_message_size', message_key_types.DEFAULT_MAX_MESSAGE_SIZE)
+        stats_conf = conf.get('instrumentation', dict())
+        self.stats = instrumentation.Instrumentation(workingdir=self.config.working_dir,
+                                                     enabled=stats_conf.get('enabled', True),
+                                                     spans_enabled=stats_conf.get('spans', False))
+        self.stats.profile_sample_rate = stats_conf.get('profile_sample_rate', instrumentation.PROFILE_SAMPLE_RATE)
+        self.dispatcher = Dispatcher()
+        self.dispatcher.add_middleware(lambda cmd, handler: self.stats.wrap(COMMAND_NAMES.get(cmd, str(cmd)), handler))
+        self.register_builtin_commands()
+        self.compression_enabled = conf['client'].get('compression', False)
         self.ledger_manager = BBcLedger(self.config)
         self.storage_manager = bbc_storage.BBcStorage(self.config)
         self.networking = bbc_network.BBcNetwork(self.config, core=self, p2p_port=p2p_port, use_global=use_global,
@@ -149,10 +177,11 @@ class BBcCoreService:
         except KeyboardInterrupt:
             pass
 
-    def send_message(self, dat):
+    def send_message(self, dat, sock=None):
         """
         Send message to bbc_app (TCP client)
         :param dat:
+        :param sock: socket of the client (looked up by asset_group_id and destination_user_id if None)
         :return:
         """
         if KeyType.asset_group_id not in dat or KeyType.destination_user_id not in dat:
@@ -163,31 +192,81 @@ class BBcCoreService:
         try:
             asset_group_id = dat[KeyType.asset_group_id]
             user_id = dat[KeyType.destination_user_id]
-            sock = self.user_id_sock_mapping[asset_group_id][user_id]
-            sock.sendall(message_key_types.make_message(PayloadType.Type_msgpack, dat))
+            if sock is None:
+                sock = self.user_id_sock_mapping[asset_group_id][user_id]
+            parts = self.make_message_parts_for_client(sock, dat)
+            message_key_types.sendall_message_parts(sock, parts)
         except Exception as e:
             self.logger.error("send error: %s" % dat)
-            self.user_id_sock_mapping[asset_group_id].pop(user_id, None)
+            self.user_id_sock_mapping.get(asset_group_id, {}).pop(user_id, None)
             return False
+        if dat.get(KeyType.command) == MsgType.REQUEST_SIGNATURE:
+            self.remember_sign_request(dat)
         return True
 
+    def remember_sign_request(self, dat):
+        """
+        (internal use) keep the query_id of REQUEST_SIGNATURE delivered to the signer connecting to this node,
+        so that the signature is sent back with the query_id of the gather_signatures request
+
+        :param dat: REQUEST_SIGNATURE message
+        :return:
+        """
+        key = (dat[KeyType.asset_group_id], dat[KeyType.destination_user_id], dat[KeyType.source_user_id])
+        query_ids = self.sign_requests.get(key, collections.deque(maxlen=MAX_SIGN_REQUESTS_PER_USER))
+        query_ids.append(dat[KeyType.query_id])
+        self.sign_requests.put(key, query_ids)
+
+    def get_sign_request_query_id(self, dat):
+        """
+        (internal use) return the query_id of the sign request that RESPONSE_SIGNATURE replies to.
+        The query_id in the response is used if the signer has set it, otherwise the oldest request is taken.
+
+        :param dat: RESPONSE_SIGNATURE message
+        :return: query_id
+        """
+        query_ids = self.sign_requests.get((dat[KeyType.asset_group_id], dat[KeyType.source_user_id],
+                                            dat[KeyType.destination_user_id]))
+        if query_ids is None or len(query_ids) == 0:
+            return dat[KeyType.query_id]
+        if dat[KeyType.query_id] in query_ids:
+            query_ids.remove(dat[KeyType.query_id])
+            return dat[KeyType.query_id]
+        return query_ids.popleft()
+
     def send_raw_message(self, socket, dat):
         try:
-            socket.sendall(message_key_types.make_message(PayloadType.Type_msgpack, dat))
+            parts = self.make_message_parts_for_client(socket, dat)
+            message_key_types.sendall_message_parts(socket, parts)
         except Exception as e:
             self.logger.error("send error: %s" % e)
         return True
 
+    def make_message_parts_for_client(self, sock, dat):
+        """
+        Serialize a message to the client in the payload type the client uses,
+        and compress it if enabled in config and the client can decode it
+
+        :param sock: socket of the client
+        :param dat:
+        :return: list of [header, body]
+        """
+        payload_type, accepted = self.sock_encoding.get(sock, (PayloadType.Type_msgpack, 0))
+        compression_type = CompressionType.Type_none
+        if self.compression_enabled:
+            compression_type = message_key_types.select_compression_type(accepted)
+        return message_key_types.make_message_parts(payload_type, dat, compression_type=compression_type)
+
     def send_to_other_user(self, asset_group_id, dst_user_id, src_user_id, msg):
         if dst_user_id in self.user_id_sock_mapping[asset_group_id]:
             return self.send_message(msg)
         domain_id = self.asset_group_domain_mapping[asset_group_id]
         return self.networking.route_message(domain_id, asset_group_id, dst_user_id, src_user_id, msg)
 
-    def error_reply(self, msg=None, err_code=EINVALID_COMMAND, txt=""):
+    def error_reply(self, msg=None, err_code=EINVALID_COMMAND, txt="", sock=None):
         msg[KeyType.status] = err_code
         msg[KeyType.reason] = txt
-        self.send_message(msg)
+        self.send_message(msg, sock)
 
     def handler(self, socket, address):
         """
@@ -199,19 +278,16 @@ class BBcCoreService:
         """
         #self.logger.debug("New connection")
         mappings = []
-        msg_parser = message_key_types.Message()
+        codec = message_key_types.MessageCodec(max_message_size=self.max_message_size)
         try:
             while True:
                 wait_read(socket.fileno())
                 buf = socket.recv(8192)
                 if len(buf) == 0:
                     break
-                msg_parser.recv(buf)
-                while True:
-                    msg = msg_parser.parse()
-                    if msg is None:
-                        break
-                    disconnection, new_info = self.process(socket, msg, msg_parser.payload_type)
+                for payload_type, msg in codec.feed(buf):
+                    self.sock_encoding[socket] = (payload_type, codec.accepted_compression)
+                    disconnection, new_info = self.process(socket, msg, payload_type)
                     if disconnection:
                         break
                     if new_info is not None:
@@ -220,6 +296,7 @@ class BBcCoreService:
             self.logger.info("TCP disconnect: %s" % e)
             traceback.print_exc()
         self.logger.debug("closing socket")
+        self.sock_encoding.pop(socket, None)
         try:
             for info in mappings:
                 self.user_id_sock_mapping[info[0]].pop(info[1], None)
@@ -251,248 +328,309 @@ class BBcCoreService:
                 return False
         return True
 
+    def register_command(self, cmd, handler, required_params=()):
+        """
+        Register (or replace) the handler of the command. Plugin modules can add commands in the same way.
+
+        :param cmd: ServiceMessageType value
+        :param handler: function handler(socket, dat) that returns None or (disconnection, new_info)
+        :param required_params: KeyType values that the message must have
+        :return:
+        """
+        if len(required_params) > 0:
+            handler = self.make_param_checker(cmd, handler, required_params)
+        self.dispatcher.register(cmd, handler)
+
+    def add_middleware(self, middleware, commands=None):
+        """
+        Add a middleware to the handlers of the commands (see bbc1.common.dispatcher.Dispatcher)
+
+        :param middleware: function middleware(cmd, handler) that returns the wrapped handler
+        :param commands: list of ServiceMessageType values (None means all commands)
+        :return:
+        """
+        self.dispatcher.add_middleware(middleware, commands)
+
+    def make_param_checker(self, cmd, handler, required_params):
+        """
+        (internal use) wrap the handler to check that the message has the required parameters
+
+        :param cmd:
+        :param handler:
+        :param required_params:
+        :return: function
+        """
+        name = COMMAND_NAMES.get(cmd, str(cmd))
+        required_params = list(required_params)
+
+        def checked(socket, dat):
+            if not self.param_check(required_params, dat):
+                self.logger.debug("%s: bad format" % name)
+                return False, None
+            return handler(socket, dat)
+        return checked
+
+    def register_builtin_commands(self):
+        self.register_command(MsgType.REQUEST_SEARCH_TRANSACTION, self.process_REQUEST_SEARCH_TRANSACTION,
+                              [KeyType.asset_group_id, KeyType.transaction_id])
+        self.register_command(MsgType.REQUEST_SEARCH_ASSET, self.process_REQUEST_SEARCH_ASSET,
+                              [KeyType.asset_group_id, KeyType.asset_id])
+        self.register_command(MsgType.REQUEST_GATHER_SIGNATURE, self.process_REQUEST_GATHER_SIGNATURE,
+                              [KeyType.asset_group_id, KeyType.transaction_data])
+        self.register_command(MsgType.REQUEST_INSERT, self.process_REQUEST_INSERT,
+                              [KeyType.asset_group_id, KeyType.transaction_data, KeyType.all_asset_files])
+        self.register_command(MsgType.RESPONSE_SIGNATURE, self.process_RESPONSE_SIGNATURE,
+                              [KeyType.asset_group_id, KeyType.destination_user_id, KeyType.source_user_id])
+        self.register_command(MsgType.REQUEST_CROSS_REF, self.process_REQUEST_CROSS_REF)
+        self.register_command(MsgType.MESSAGE, self.process_MESSAGE,
+                              [KeyType.asset_group_id, KeyType.source_user_id, KeyType.destination_user_id])
+        self.register_command(MsgType.REQUEST_REGISTER_HASH_IN_SUBSYS, self.process_REQUEST_REGISTER_HASH_IN_SUBSYS,
+                              [KeyType.asset_group_id, KeyType.transaction_id])
+        self.register_command(MsgType.REQUEST_VERIFY_HASH_IN_SUBSYS, self.process_REQUEST_VERIFY_HASH_IN_SUBSYS,
+                              [KeyType.asset_group_id, KeyType.transaction_id])
+        self.register_command(MsgType.REGISTER, self.process_REGISTER,
+                              [KeyType.asset_group_id, KeyType.source_user_id])
+        self.register_command(MsgType.UNREGISTER, self.process_UNREGISTER)
+        self.register_command(MsgType.REQUEST_SETUP_ASSET_GROUP, self.process_REQUEST_SETUP_ASSET_GROUP)
+        self.register_command(MsgType.REQUEST_SETUP_DOMAIN, self.process_REQUEST_SETUP_DOMAIN)
+        self.register_command(MsgType.REQUEST_GET_PEERLIST, self.process_REQUEST_GET_PEERLIST)
+        self.register_command(MsgType.REQUEST_SET_STATIC_NODE, self.process_REQUEST_SET_STATIC_NODE)
+        self.register_command(MsgType.REQUEST_GET_CONFIG, self.process_REQUEST_GET_CONFIG)
+        self.register_command(MsgType.REQUEST_GET_DOMAINLIST, self.process_REQUEST_GET_DOMAINLIST)
+        self.register_command(MsgType.DOMAIN_PING, self.process_DOMAIN_PING,
+                              [KeyType.domain_id, KeyType.source_user_id, KeyType.ipv4_address,
+                               KeyType.ipv6_address, KeyType.port_number])
+        self.register_command(MsgType.REQUEST_GET_STATS, self.process_REQUEST_GET_STATS)
+        self.register_command(MsgType.REQUEST_MANIP_PROFILER, self.process_REQUEST_MANIP_PROFILER)
+        self.register_command(MsgType.REQUEST_MANIP_LEDGER_SUBSYS, self.process_REQUEST_MANIP_LEDGER_SUBSYS)
+
     def process(self, socket, dat, payload_type):
         """
-        Process received message
+        Process received message by the handler registered for the command
 
         :param socket:
         :param dat:
         :param payload_type: PayloadType value of msg
-        :return:
+        :return: disconnection flag (True if the client unregisters) and (asset_group_id, user_id) if registered
         """
         #self.logger.debug("process message from %s: %s" % (binascii.b2a_hex(dat[KeyType.source_user_id]), dat))
         if not self.param_check([KeyType.command, KeyType.source_user_id], dat):
             self.logger.debug("message has bad format")
             return False, None
-        cmd = dat[KeyType.command]
-        if cmd == MsgType.REQUEST_SEARCH_TRANSACTION:
-            if not self.param_check([KeyType.asset_group_id, KeyType.transaction_id], dat):
-                self.logger.debug("REQUEST_SEARCH_TRANSACTION: bad format")
-                return False, None
-            result = self.search_transaction_by_txid(dat[KeyType.asset_group_id], dat[KeyType.transaction_id],
-                                                     dat[KeyType.source_user_id], dat[KeyType.query_id])
-            if result is not None:
-                self.send_message(result)
-
-        elif cmd == MsgType.REQUEST_SEARCH_ASSET:
-            if not self.param_check([KeyType.asset_group_id, KeyType.asset_id], dat):
-                self.logger.debug("REQUEST_SEARCH_ASSET: bad format")
-                return False, None
-            retmsg = make_message_structure(MsgType.RESPONSE_SEARCH_ASSET,
-                                            dat[KeyType.asset_group_id],
-                                            dat[KeyType.source_user_id], dat[KeyType.query_id])
-            result = self.search_asset_by_asid(dat[KeyType.asset_group_id], dat[KeyType.asset_id], dat[KeyType.source_user_id], dat[KeyType.query_id])
-            if isinstance(result, dict):
-                retmsg.update(result)
-                self.send_message(retmsg)
-
-        elif cmd == MsgType.REQUEST_GATHER_SIGNATURE:
-            if not self.param_check([KeyType.asset_group_id, KeyType.transaction_data], dat):
-                self.logger.debug("REQUEST_GATHER_SIGNATURE: bad format")
-                return False, None
-            if not self.distribute_transaction_to_gather_signatures(dat[KeyType.asset_group_id], dat):
-                retmsg = make_message_structure(MsgType.RESPONSE_GATHER_SIGNATURE,
-                                                dat[KeyType.asset_group_id], dat[KeyType.source_user_id], dat[KeyType.query_id])
-                self.error_reply(msg=retmsg, err_code=EINVALID_COMMAND, txt="Fail to forward transaction")
-
-        elif cmd == MsgType.REQUEST_INSERT:
-            if not self.param_check([KeyType.asset_group_id, KeyType.transaction_data,
-                                     KeyType.all_asset_files], dat):
-                self.logger.debug("REQUEST_INSERT: bad format")
-                return False, None
-            transaction_data = dat[KeyType.transaction_data]
-            asset_files = dat[KeyType.all_asset_files]
-            retmsg = make_message_structure(MsgType.RESPONSE_INSERT,
-                                            dat[KeyType.asset_group_id], dat[KeyType.source_user_id], dat[KeyType.query_id])
-            ret = self.insert_transaction(dat[KeyType.asset_group_id], transaction_data, asset_files)
-            if isinstance(ret, str):
-                self.error_reply(msg=retmsg, err_code=EINVALID_COMMAND, txt=ret)
-            else:
-                retmsg.update(ret)
-                self.send_message(retmsg)
-
-        elif cmd == MsgType.RESPONSE_SIGNATURE:
-            if not self.param_check([KeyType.asset_group_id, KeyType.destination_user_id, KeyType.source_user_id], dat):
-                self.logger.debug("RESPONSE_SIGNATURE: bad format")
-                return False, None
+        handler = self.dispatcher.get(dat[KeyType.command])
+        if handler is None:
+            self.logger.error("Bad command/response: %s" % dat[KeyType.command])
+            return False, None
+        ret = handler(socket, dat)
+        if ret is None:
+            return False, None
+        return ret
+
+    def process_REQUEST_SEARCH_TRANSACTION(self, socket, dat):
+        result = self.search_transaction_by_txid(dat[KeyType.asset_group_id], dat[KeyType.transaction_id],
+                                                 dat[KeyType.source_user_id], dat[KeyType.query_id], socket)
+        if result is not None:
+            self.send_message(result, socket)
+
+    def process_REQUEST_SEARCH_ASSET(self, socket, dat):
+        retmsg = make_message_structure(MsgType.RESPONSE_SEARCH_ASSET,
+                                        dat[KeyType.asset_group_id],
+                                        dat[KeyType.source_user_id], dat[KeyType.query_id])
+        result = self.search_asset_by_asid(dat[KeyType.asset_group_id], dat[KeyType.asset_id],
+                                           dat[KeyType.source_user_id], dat[KeyType.query_id], socket)
+        if isinstance(result, dict):
+            retmsg.update(result)
+            self.send_message(retmsg, socket)
+
+    def process_REQUEST_GATHER_SIGNATURE(self, socket, dat):
+        if not self.distribute_transaction_to_gather_signatures(dat[KeyType.asset_group_id], dat):
             retmsg = make_message_structure(MsgType.RESPONSE_GATHER_SIGNATURE,
-                                            dat[KeyType.asset_group_id], dat[KeyType.destination_user_id], dat[KeyType.query_id])
-            if KeyType.signature in dat:
-                retmsg[KeyType.signature] = dat[KeyType.signature]
-                retmsg[KeyType.ref_index] = dat[KeyType.ref_index]
-            elif KeyType.status not in dat:
-                retmsg[KeyType.status] = EOTHER
-                retmsg[KeyType.reason] = dat[KeyType.reason]
-            elif dat[KeyType.status] < ESUCCESS:
-                retmsg[KeyType.status] = dat[KeyType.status]
-                retmsg[KeyType.reason] = dat[KeyType.reason]
-            retmsg[KeyType.source_user_id] = dat[KeyType.source_user_id]
-            self.send_to_other_user(dat[KeyType.asset_group_id],
-                                    dat[KeyType.destination_user_id],
-                                    dat[KeyType.source_user_id],
-                                    retmsg)
-
-        elif cmd == MsgType.REQUEST_CROSS_REF:
-            if KeyType.count in dat:
-                num = dat[KeyType.count]
-            else:
-                num = 1
-            retmsg = make_message_structure(MsgType.RESPONSE_CROSS_REF,
-                                            dat[KeyType.asset_group_id], dat[KeyType.source_user_id], dat[KeyType.query_id])
-            retmsg[KeyType.cross_refs] = self.pop_cross_refs(num=num)
-            self.send_message(retmsg)
-
-        elif cmd == MsgType.MESSAGE:
-            if not self.param_check([KeyType.asset_group_id, KeyType.source_user_id, KeyType.destination_user_id], dat):
-                self.logger.debug("MESSAGE: bad format")
-                return False, None
-            domain_id = self.asset_group_domain_mapping[dat[KeyType.asset_group_id]]
-            self.networking.route_message(domain_id, dat[KeyType.asset_group_id],
-                                          dat[KeyType.destination_user_id],
-                                          dat[KeyType.source_user_id], dat)
-
-        elif cmd == MsgType.REQUEST_REGISTER_HASH_IN_SUBSYS:
-            if not self.param_check([KeyType.asset_group_id, KeyType.transaction_id], dat):
-                self.logger.debug("REQUEST_REGISTER_HASH_IN_SUBSYS: bad format")
-                return False, None
-            asset_group_id = dat[KeyType.asset_group_id]
-            transaction_id = dat[KeyType.transaction_id]
-            self.ledger_subsystem.register_transaction(asset_group_id=asset_group_id, transaction_id=transaction_id)
-            retmsg = make_message_structure(MsgType.RESPONSE_REGISTER_HASH_IN_SUBSYS,
                                             dat[KeyType.asset_group_id], dat[KeyType.source_user_id], dat[KeyType.query_id])
+            self.error_reply(msg=retmsg, err_code=EINVALID_COMMAND, txt="Fail to forward transaction")
+
+    def process_REQUEST_INSERT(self, socket, dat):
+        transaction_data = dat[KeyType.transaction_data]
+        asset_files = dat[KeyType.all_asset_files]
+        retmsg = make_message_structure(MsgType.RESPONSE_INSERT,
+                                        dat[KeyType.asset_group_id], dat[KeyType.source_user_id], dat[KeyType.query_id])
+        ret = self.insert_transaction(dat[KeyType.asset_group_id], transaction_data, asset_files)
+        if isinstance(ret, str):
+            self.error_reply(msg=retmsg, err_code=EINVALID_COMMAND, txt=ret)
+        else:
+            retmsg.update(ret)
             self.send_message(retmsg)
 
-        elif cmd == MsgType.REQUEST_VERIFY_HASH_IN_SUBSYS:
-            if not self.param_check([KeyType.asset_group_id, KeyType.transaction_id], dat):
-                self.logger.debug("REQUEST_REGISTER_HASH_IN_SUBSYS: bad format")
-                return False, None
-            asset_group_id = dat[KeyType.asset_group_id]
-            transaction_id = dat[KeyType.transaction_id]
-            retmsg = make_message_structure(MsgType.RESPONSE_VERIFY_HASH_IN_SUBSYS,
-                                            dat[KeyType.asset_group_id], dat[KeyType.source_user_id], dat[KeyType.query_id])
-            result = self.ledger_subsystem.verify_transaction(asset_group_id=asset_group_id,
-                                                              transaction_id=transaction_id)
-            retmsg[KeyType.markle_tree] = result
-            self.send_message(retmsg)
-
-        elif cmd == MsgType.REGISTER:
-            if not self.param_check([KeyType.asset_group_id, KeyType.source_user_id], dat):
-                self.logger.debug("REGISTER: bad format")
-                return False, None
-            user_id = dat[KeyType.source_user_id]
-            asset_group_id = dat[KeyType.asset_group_id]
-            if asset_group_id in self.asset_group_domain_mapping:
-                domain_id = self.asset_group_domain_mapping[asset_group_id]
-                self.logger.debug("[%s] register_user: %s" % (binascii.b2a_hex(domain_id[:2]),
-                                                              binascii.b2a_hex(user_id[:4])))
-                self.networking.register_user_id(domain_id, asset_group_id, user_id)
-                self.user_id_sock_mapping.setdefault(asset_group_id, {})[user_id] = socket
-                return False, (asset_group_id, user_id)
-            return False, None
+    def process_RESPONSE_SIGNATURE(self, socket, dat):
+        retmsg = make_message_structure(MsgType.RESPONSE_GATHER_SIGNATURE, dat[KeyType.asset_group_id],
+                                        dat[KeyType.destination_user_id], self.get_sign_request_query_id(dat))
+        if KeyType.signature in dat:
+            retmsg[KeyType.signature] = dat[KeyType.signature]
+            retmsg[KeyType.ref_index] = dat[KeyType.ref_index]
+        elif KeyType.status not in dat:
+            retmsg[KeyType.status] = EOTHER
+            retmsg[KeyType.reason] = dat[KeyType.reason]
+        elif dat[KeyType.status] < ESUCCESS:
+            retmsg[KeyType.status] = dat[KeyType.status]
+            retmsg[KeyType.reason] = dat[KeyType.reason]
+        retmsg[KeyType.source_user_id] = dat[KeyType.source_user_id]
+        self.send_to_other_user(dat[KeyType.asset_group_id],
+                                dat[KeyType.destination_user_id],
+                                dat[KeyType.source_user_id],
+                                retmsg)
+
+    def process_REQUEST_CROSS_REF(self, socket, dat):
+        if KeyType.count in dat:
+            num = dat[KeyType.count]
+        else:
+            num = 1
+        retmsg = make_message_structure(MsgType.RESPONSE_CROSS_REF,
+                                        dat[KeyType.asset_group_id], dat[KeyType.source_user_id], dat[KeyType.query_id])
+        retmsg[KeyType.cross_refs] = self.pop_cross_refs(num=num)
+        self.send_message(retmsg)
+
+    def process_MESSAGE(self, socket, dat):
+        domain_id = self.asset_group_domain_mapping[dat[KeyType.asset_group_id]]
+        self.networking.route_message(domain_id, dat[KeyType.asset_group_id],
+                                      dat[KeyType.destination_user_id],
+                                      dat[KeyType.source_user_id], dat)
+
+    def process_REQUEST_REGISTER_HASH_IN_SUBSYS(self, socket, dat):
+        asset_group_id = dat[KeyType.asset_group_id]
+        transaction_id = dat[KeyType.transaction_id]
+        self.ledger_subsystem.register_transaction(asset_group_id=asset_group_id, transaction_id=transaction_id)
+        retmsg = make_message_structure(MsgType.RESPONSE_REGISTER_HASH_IN_SUBSYS,
+                                        dat[KeyType.asset_group_id], dat[KeyType.source_user_id], dat[KeyType.query_id])
+        self.send_message(retmsg)
+
+    def process_REQUEST_VERIFY_HASH_IN_SUBSYS(self, socket, dat):
+        asset_group_id = dat[KeyType.asset_group_id]
+        transaction_id = dat[KeyType.transaction_id]
+        retmsg = make_message_structure(MsgType.RESPONSE_VERIFY_HASH_IN_SUBSYS,
+                                        dat[KeyType.asset_group_id], dat[KeyType.source_user_id], dat[KeyType.query_id])
+        result = self.ledger_subsystem.verify_transaction(asset_group_id=asset_group_id,
+                                                          transaction_id=transaction_id)
+        retmsg[KeyType.markle_tree] = result
+        self.send_message(retmsg)
+
+    def process_REGISTER(self, socket, dat):
+        user_id = dat[KeyType.source_user_id]
+        asset_group_id = dat[KeyType.asset_group_id]
+        if asset_group_id in self.asset_group_domain_mapping:
+            domain_id = self.asset_group_domain_mapping[asset_group_id]
+            self.logger.debug("[%s] register_user: %s" % (binascii.b2a_hex(domain_id[:2]),
+                                                          binascii.b2a_hex(user_id[:4])))
+            self.networking.register_user_id(domain_id, asset_group_id, user_id)
+            self.user_id_sock_mapping.setdefault(asset_group_id, {})[user_id] = socket
+            return False, (asset_group_id, user_id)
+        return False, None
 
-        elif cmd == MsgType.UNREGISTER:
-            return True, None
-
-        elif cmd == MsgType.REQUEST_SETUP_ASSET_GROUP:
-            domain_id = dat.get(KeyType.domain_id, None)
-            asset_group_id = dat.get(KeyType.asset_group_id, None)
-            if domain_id is None or asset_group_id is None:
-                return False, None
-            if domain_id not in self.networking.domains:
-                return False, None
-            self.asset_group_setup(domain_id, asset_group_id, dat.get(KeyType.storage_type, StorageType.FILESYSTEM),
-                                   dat.get(KeyType.storage_path,None), dat.get(KeyType.advertise_in_domain0, False),
-                                   config_update=True)
-            retmsg = make_message_structure(MsgType.RESPONSE_SETUP_ASSET_GROUP,
-                                            dat[KeyType.asset_group_id], dat[KeyType.source_user_id], dat[KeyType.query_id])
-            self.send_raw_message(socket, retmsg)
-
-        elif cmd == MsgType.REQUEST_SETUP_DOMAIN:
-            retmsg = make_message_structure(MsgType.RESPONSE_SETUP_DOMAIN,
-                                            None, dat[KeyType.source_user_id], dat[KeyType.query_id])
-            domain_id = dat.get(KeyType.domain_id, None)
-            if domain_id is None:
-                retmsg[KeyType.result] = False
-            else:
-                self.networking.create_domain(domain_id=domain_id,
-                                              network_module=dat.get(KeyType.network_module, "simple_cluster"))
-                retmsg[KeyType.domain_id] = domain_id
-                retmsg[KeyType.result] = True
-                retmsg[KeyType.network_module] = self.networking.domains[domain_id].module_name
-            self.send_raw_message(socket, retmsg)
-
-        elif cmd == MsgType.REQUEST_GET_PEERLIST:
-            domain_id = dat[KeyType.domain_id]
-            retmsg = make_message_structure(MsgType.RESPONSE_GET_PEERLIST,
-                                            None, dat[KeyType.source_user_id], dat[KeyType.query_id])
-            if domain_id in self.networking.domains:
-                retmsg[KeyType.domain_id] = domain_id
-                retmsg[KeyType.peer_list] = self.networking.domains[domain_id].make_peer_list()
-            self.send_raw_message(socket, retmsg)
-
-        elif cmd == MsgType.REQUEST_SET_STATIC_NODE:
-            retmsg = make_message_structure(MsgType.RESPONSE_SET_STATIC_NODE,
-                                            None, dat[KeyType.source_user_id], dat[KeyType.query_id])
-            domain_id = dat[KeyType.domain_id]
-            node_info = dat.get(KeyType.peer_info, None)
-            if node_info is None:
-                retmsg[KeyType.domain_id] = domain_id
-                retmsg[KeyType.result] = False
-            else:
-                self.networking.add_static_node_to_domain(domain_id, *node_info)
-                self.config.update_config()
-                retmsg[KeyType.domain_id] = domain_id
-                retmsg[KeyType.result] = True
-            self.send_raw_message(socket, retmsg)
-
-        elif cmd == MsgType.REQUEST_GET_CONFIG:
-            retmsg = make_message_structure(MsgType.RESPONSE_GET_CONFIG,
-                                            None, dat[KeyType.source_user_id], dat[KeyType.query_id])
-            jsondat = self.config.get_json_config()
-            retmsg[KeyType.bbc_configuration] = jsondat
-            self.send_raw_message(socket, retmsg)
-
-        elif cmd == MsgType.REQUEST_GET_PEERLIST:
-            domain_id = dat[KeyType.domain_id]
-            retmsg = make_message_structure(MsgType.RESPONSE_GET_PEERLIST,
-                                            None, dat[KeyType.source_user_id], dat[KeyType.query_id])
-            if domain_id in self.networking.domains:
-                retmsg[KeyType.domain_id] = domain_id
-                retmsg[KeyType.peer_list] = self.networking.domains[domain_id].make_peer_list()
-            self.send_raw_message(socket, retmsg)
-
-        elif cmd == MsgType.REQUEST_GET_DOMAINLIST:
-            retmsg = make_message_structure(MsgType.RESPONSE_GET_DOMAINLIST,
-                                            None, dat[KeyType.source_user_id], dat[KeyType.query_id])
-            data = bytearray()
-            data.extend(to_2byte(len(self.networking.domains)))
-            for domain_id in self.networking.domains:
-                data.extend(domain_id)
-            retmsg[KeyType.domain_list] = bytes(data)
-            self.send_raw_message(socket, retmsg)
-
-        elif cmd == MsgType.DOMAIN_PING:
-            if not self.param_check([KeyType.domain_id, KeyType.source_user_id, KeyType.ipv4_address,
-                                     KeyType.ipv6_address, KeyType.port_number], dat):
-                return False, None
-            domain_id = dat[KeyType.domain_id]
-            ipv4 = dat[KeyType.ipv4_address]
-            ipv6 = dat[KeyType.ipv6_address]
-            port = dat[KeyType.port_number]
-            self.networking.send_raw_message(domain_id, ipv4, ipv6, port)
-
-        elif cmd == MsgType.REQUEST_MANIP_LEDGER_SUBSYS:
-            retmsg = make_message_structure(MsgType.RESPONSE_MANIP_LEDGER_SUBSYS,
-                                            None, dat[KeyType.source_user_id], dat[KeyType.query_id])
-            if dat[KeyType.ledger_subsys_manip]:
-                self.ledger_subsystem.enable()
-            else:
-                self.ledger_subsystem.disable()
-            self.send_raw_message(socket, retmsg)
+    def process_UNREGISTER(self, socket, dat):
+        return True, None
 
+    def process_REQUEST_SETUP_ASSET_GROUP(self, socket, dat):
+        domain_id = dat.get(KeyType.domain_id, None)
+        asset_group_id = dat.get(KeyType.asset_group_id, None)
+        if domain_id is None or asset_group_id is None:
+            return
+        if domain_id not in self.networking.domains:
+            return
+        self.asset_group_setup(domain_id, asset_group_id, dat.get(KeyType.storage_type, StorageType.FILESYSTEM),
+                               dat.get(KeyType.storage_path,None), dat.get(KeyType.advertise_in_domain0, False),
+                               config_update=True)
+        retmsg = make_message_structure(MsgType.RESPONSE_SETUP_ASSET_GROUP,
+                                        dat[KeyType.asset_group_id], dat[KeyType.source_user_id], dat[KeyType.query_id])
+        self.send_raw_message(socket, retmsg)
+
+    def process_REQUEST_SETUP_DOMAIN(self, socket, dat):
+        retmsg = make_message_structure(MsgType.RESPONSE_SETUP_DOMAIN,
+                                        None, dat[KeyType.source_user_id], dat[KeyType.query_id])
+        domain_id = dat.get(KeyType.domain_id, None)
+        if domain_id is None:
+            retmsg[KeyType.result] = False
         else:
-            self.logger.error("Bad command/response: %s" % cmd)
-        return False, None
+            self.networking.create_domain(domain_id=domain_id,
+                                          network_module=dat.get(KeyType.network_module, "simple_cluster"))
+            retmsg[KeyType.domain_id] = domain_id
+            retmsg[KeyType.result] = True
+            retmsg[KeyType.network_module] = self.networking.domains[domain_id].module_name
+        self.send_raw_message(socket, retmsg)
+
+    def process_REQUEST_GET_PEERLIST(self, socket, dat):
+        domain_id = dat[KeyType.domain_id]
+        retmsg = make_message_structure(MsgType.RESPONSE_GET_PEERLIST,
+                                        None, dat[KeyType.source_user_id], dat[KeyType.query_id])
+        if domain_id in self.networking.domains:
+            retmsg[KeyType.domain_id] = domain_id
+            retmsg[KeyType.peer_list] = self.networking.domains[domain_id].make_peer_list()
+            retmsg[KeyType.peer_stats] = self.networking.domains[domain_id].get_peer_stats()
+        self.send_raw_message(socket, retmsg)
+
+    def process_REQUEST_SET_STATIC_NODE(self, socket, dat):
+        retmsg = make_message_structure(MsgType.RESPONSE_SET_STATIC_NODE,
+                                        None, dat[KeyType.source_user_id], dat[KeyType.query_id])
+        domain_id = dat[KeyType.domain_id]
+        node_info = dat.get(KeyType.peer_info, None)
+        if node_info is None:
+            retmsg[KeyType.domain_id] = domain_id
+            retmsg[KeyType.result] = False
+        else:
+            self.networking.add_static_node_to_domain(domain_id, *node_info)
+            self.config.update_config()
+            retmsg[KeyType.domain_id] = domain_id
+            retmsg[KeyType.result] = True
+        self.send_raw_message(socket, retmsg)
+
+    def process_REQUEST_GET_CONFIG(self, socket, dat):
+        retmsg = make_message_structure(MsgType.RESPONSE_GET_CONFIG,
+                                        None, dat[KeyType.source_user_id], dat[KeyType.query_id])
+        jsondat = self.config.get_json_config()
+        retmsg[KeyType.bbc_configuration] = jsondat
+        self.send_raw_message(socket, retmsg)
+
+    def process_REQUEST_GET_DOMAINLIST(self, socket, dat):
+        retmsg = make_message_structure(MsgType.RESPONSE_GET_DOMAINLIST,
+                                        None, dat[KeyType.source_user_id], dat[KeyType.query_id])
+        data = bytearray()
+        data.extend(to_2byte(len(self.networking.domains)))
+        for domain_id in self.networking.domains:
+            data.extend(domain_id)
+        retmsg[KeyType.domain_list] = bytes(data)
+        self.send_raw_message(socket, retmsg)
+
+    def process_DOMAIN_PING(self, socket, dat):
+        domain_id = dat[KeyType.domain_id]
+        ipv4 = dat[KeyType.ipv4_address]
+        ipv6 = dat[KeyType.ipv6_address]
+        port = dat[KeyType.port_number]
+        self.networking.send_raw_message(domain_id, ipv4, ipv6, port)
+
+    def process_REQUEST_GET_STATS(self, socket, dat):
+        retmsg = make_message_structure(MsgType.RESPONSE_GET_STATS,
+                                        None, dat[KeyType.source_user_id], dat[KeyType.query_id])
+        retmsg[KeyType.core_stats] = json.dumps(self.stats.get_stats())
+        self.send_raw_message(socket, retmsg)
+
+    def process_REQUEST_MANIP_PROFILER(self, socket, dat):
+        retmsg = make_message_structure(MsgType.RESPONSE_MANIP_PROFILER,
+                                        None, dat[KeyType.source_user_id], dat[KeyType.query_id])
+        if dat.get(KeyType.profiler_manip, False):
+            self.stats.start_profile(dat.get(KeyType.profile_sample_rate, None))
+            retmsg[KeyType.result] = True
+        else:
+            path = self.stats.stop_profile()
+            retmsg[KeyType.result] = path is not None
+            if path is not None:
+                retmsg[KeyType.profile_file] = path
+        self.send_raw_message(socket, retmsg)
+
+    def process_REQUEST_MANIP_LEDGER_SUBSYS(self, socket, dat):
+        retmsg = make_message_structure(MsgType.RESPONSE_MANIP_LEDGER_SUBSYS,
+                                        None, dat[KeyType.source_user_id], dat[KeyType.query_id])
+        if dat[KeyType.ledger_subsys_manip]:
+            self.ledger_subsystem.enable()
+        else:
+            self.ledger_subsystem.disable()
+        self.send_raw_message(socket, retmsg)
 
     def asset_group_setup(self, domain_id, asset_group_id, storage_type=StorageType.FILESYSTEM,
                           storage_path=None, advertise_in_domain0=False, config_update=False):
@@ -526,11 +664,8 @@ class BBcCoreService:
         :return:
         """
         refs = []
-        for i in range(num):
-            if len(self.cross_ref_list) > 0:
-                refs.append(self.cross_ref_list.pop(0))
-            else:
-                break
+        for i in range(min(num, len(self.cross_ref_list))):
+            refs.append(self.cross_ref_list.popleft())
         return refs
 
     def validate_transaction(self, txid, txdata, asset_files):
@@ -605,7 +740,8 @@ class BBcCoreService:
         if domain_id == bbclib.domain_global_0:
             self.logger.error("Insert is not allowed in domain_global_0")
             return "Insert is not allowed in domain_global_0"
-        txobj = self.validate_transaction(None, txdata, asset_files)
+        with self.stats.span("insert.validate"):
+            txobj = self.validate_transaction(None, txdata, asset_files)
         if txobj is None:
             self.logger.error("Bad transaction format")
             return "Bad transaction format"
@@ -613,8 +749,9 @@ class BBcCoreService:
                           (binascii.b2a_hex(self.networking.domains[domain_id].node_id[:4]),
                            binascii.b2a_hex(txobj.transaction_id[:4])))
 
-        ret = self.ledger_manager.insert_locally(domain_id, asset_group_id, txobj.transaction_id,
-                                                 ResourceType.Transaction_data, txdata)
+        with self.stats.span("insert.ledger"):
+            ret = self.ledger_manager.insert_locally(domain_id, asset_group_id, txobj.transaction_id,
+                                                     ResourceType.Transaction_data, txdata)
         if not ret:
             self.logger.error("[%s] Fail to insert a transaction into the ledger"%
                               binascii.b2a_hex(self.networking.domains[domain_id].node_id[:4]))
@@ -623,32 +760,35 @@ class BBcCoreService:
         rollback_flag = False
         registered_asset_ids = []
         registered_asset_ids_in_storage = []
-        for idx, evt in enumerate(txobj.events):
-            if evt.asset is None:
-                continue
-            asid = evt.asset.asset_id
-            if asset_files is not None and asid in asset_files.keys():
-                if not self.storage_manager.store_locally(domain_id, asset_group_id, asid, asset_files[asid]):
+        with self.stats.span("insert.assets"):
+            for idx, evt in enumerate(txobj.events):
+                if evt.asset is None:
+                    continue
+                asid = evt.asset.asset_id
+                if asset_files is not None and asid in asset_files.keys():
+                    with self.stats.span("insert.storage"):
+                        stored = self.storage_manager.store_locally(domain_id, asset_group_id, asid, asset_files[asid])
+                    if not stored:
+                        rollback_flag = True
+                        break
+                    registered_asset_ids_in_storage.append(asid)
+                if not self.ledger_manager.insert_locally(domain_id, asset_group_id, asid,
+                                                          ResourceType.Asset_ID, txobj.transaction_id):
                     rollback_flag = True
                     break
-                registered_asset_ids_in_storage.append(asid)
-            if not self.ledger_manager.insert_locally(domain_id, asset_group_id, asid,
-                                                      ResourceType.Asset_ID, txobj.transaction_id):
-                rollback_flag = True
-                break
-            user_id = evt.asset.user_id
-            if not self.ledger_manager.insert_locally(domain_id, asset_group_id, user_id,
-                                                      ResourceType.Owner_asset, asid,
-                                                      require_uniqueness=False):
-                rollback_flag = True
-                break
-            registered_asset_ids.append(asid)
-
-        for reference in txobj.references:
-            self.ledger_manager.insert_locally(domain_id, asset_group_id, txobj.transaction_id,
-                                               ResourceType.Edge_outgoing, reference.transaction_id)
-            self.ledger_manager.insert_locally(domain_id, asset_group_id, reference.transaction_id,
-                                               ResourceType.Edge_incoming, txobj.transaction_id)
+                user_id = evt.asset.user_id
+                if not self.ledger_manager.insert_locally(domain_id, asset_group_id, user_id,
+                                                          ResourceType.Owner_asset, asid,
+                                                          require_uniqueness=False):
+                    rollback_flag = True
+                    break
+                registered_asset_ids.append(asid)
+
+            for reference in txobj.references:
+                self.ledger_manager.insert_locally(domain_id, asset_group_id, txobj.transaction_id,
+                                                   ResourceType.Edge_outgoing, reference.transaction_id)
+                self.ledger_manager.insert_locally(domain_id, asset_group_id, reference.transaction_id,
+                                                   ResourceType.Edge_incoming, txobj.transaction_id)
 
         if rollback_flag:
             self.ledger_manager.remove(domain_id, asset_group_id, txobj.transaction_id)
@@ -661,15 +801,17 @@ class BBcCoreService:
         if no_network_put:
             return None
 
-        if len(txobj.cross_refs) > 0 or len(self.cross_ref_list) < 3:
-            self.networking.disseminate_cross_ref(asset_group_id, txobj.transaction_id)
-
-        self.networking.put(domain_id=domain_id, asset_group_id=asset_group_id, resource_id=txobj.transaction_id,
-                            resource_type=ResourceType.Transaction_data, resource=txdata)
-        if self.storage_manager.get_storage_type(domain_id, asset_group_id) != "NONE":
-            for asid in registered_asset_ids_in_storage:
-                self.networking.put(domain_id=domain_id, asset_group_id=asset_group_id, resource_id=asid,
-                                    resource_type=ResourceType.Asset_file, resource=asset_files[asid])
+        with self.stats.span("insert.network"):
+            if len(txobj.cross_refs) > 0 or len(self.cross_ref_list) < 3:
+                self.networking.disseminate_cross_ref(txobj.transaction_id, asset_group_id)
+
+            self.networking.put(domain_id=domain_id, asset_group_id=asset_group_id,
+                                resource_id=txobj.transaction_id,
+                                resource_type=ResourceType.Transaction_data, resource=txdata)
+            if self.storage_manager.get_storage_type(domain_id, asset_group_id) != "NONE":
+                for asid in registered_asset_ids_in_storage:
+                    self.networking.put(domain_id=domain_id, asset_group_id=asset_group_id, resource_id=asid,
+                                        resource_type=ResourceType.Asset_file, resource=asset_files[asid])
         return {KeyType.transaction_id: txobj.transaction_id}
 
     def distribute_transaction_to_gather_signatures(self, asset_group_id, dat):
@@ -695,7 +837,7 @@ class BBcCoreService:
                 return False
         return True
 
-    def search_asset_by_asid(self, asset_group_id, asid, source_id, query_id):
+    def search_asset_by_asid(self, asset_group_id, asid, source_id, query_id, sock=None):
         """
         Search asset in the storage by asset_id. If not found, search it in the network
 
@@ -703,17 +845,18 @@ class BBcCoreService:
         :param asid:        asset_id in byte format
         :param source_id: the user_id of the sender
         :param query_id:
+        :param sock: socket of the client (to reply to a search of an asset_group not set up in this node)
         :return: dictionary data of transaction_data, asset_file (if exists)
         """
         response_info = make_message_structure(MsgType.RESPONSE_SEARCH_ASSET,
                                                asset_group_id, source_id, query_id)
+        response_info[KeyType.asset_id] = asid
         domain_id = self.asset_group_domain_mapping.get(asset_group_id, None)
         if domain_id is None:
-            self.logger.error("No such asset_group_id is set up in any domain")
-            return None
-        response_info[KeyType.asset_id] = asid
+            return self.search_via_domain_global(asset_group_id, asid, ResourceType.Asset_ID, response_info, sock)
 
-        txid = self.ledger_manager.find_locally(domain_id, asset_group_id, asid, ResourceType.Asset_ID)
+        with self.stats.span("search.ledger"):
+            txid = self.ledger_manager.find_locally(domain_id, asset_group_id, asid, ResourceType.Asset_ID)
         if txid is None:
             query_entry = query_management.QueryEntry(expire_after=DURATION_GIVEUP_GET,
                                                       callback_expire=self.failure_response,
@@ -728,12 +871,14 @@ class BBcCoreService:
             self.networking.get(query_entry)
             return None
 
-        txdata = self.ledger_manager.find_locally(domain_id, asset_group_id, txid, ResourceType.Transaction_data)
-        if txdata is not None:
-            txobj = self.validate_transaction(txid, txdata, None)
-            if txobj is None:
-                txdata = None
-                self.ledger_manager.remove(domain_id, asset_group_id, txid)
+        with self.stats.span("search.ledger"):
+            txdata = self.ledger_manager.find_locally(domain_id, asset_group_id, txid,
+                                                      ResourceType.Transaction_data)
+            if txdata is not None:
+                txobj = self.validate_transaction(txid, txdata, None)
+                if txobj is None:
+                    txdata = None
+                    self.ledger_manager.remove(domain_id, asset_group_id, txid)
 
         if txdata is None:
             query_entry = query_management.QueryEntry(expire_after=DURATION_GIVEUP_GET,
@@ -751,11 +896,12 @@ class BBcCoreService:
 
         response_info[KeyType.transaction_data] = txdata
         if check_transaction_if_having_asset_file(txdata, asid):
-            asset_file = self.storage_manager.get_locally(domain_id, asset_group_id, asid)  # FIXME: to support storage_type=NONE
-            if asset_file is not None:
-                if not self.validate_asset_file(txobj, asid, asset_file):
-                    asset_file = None
-                    self.storage_manager.remove(domain_id, asset_group_id, asid)
+            with self.stats.span("search.storage"):
+                asset_file = self.storage_manager.get_locally(domain_id, asset_group_id, asid)  # FIXME: to support storage_type=NONE
+                if asset_file is not None:
+                    if not self.validate_asset_file(txobj, asid, asset_file):
+                        asset_file = None
+                        self.storage_manager.remove(domain_id, asset_group_id, asid)
             if asset_file is None:
                 query_entry = query_management.QueryEntry(expire_after=DURATION_GIVEUP_GET,
                                                           callback_expire=self.failure_response,
@@ -856,7 +1002,7 @@ class BBcCoreService:
                                                query_entry.data[KeyType.resource])
         self.send_message(query_entry.data['response_info'])
 
-    def search_transaction_by_txid(self, asset_group_id, txid, source_id, query_id):
+    def search_transaction_by_txid(self, asset_group_id, txid, source_id, query_id, sock=None):
         """
         Search transaction_data by transaction_id
 
@@ -864,19 +1010,22 @@ class BBcCoreService:
         :param txid:  transaction_id
         :param source_id: the user_id of the sender
         :param query_id:
+        :param sock: socket of the client (to reply to a search of an asset_group not set up in this node)
         :return: dictionary data of transaction_data
         """
+        response_info = make_message_structure(MsgType.RESPONSE_SEARCH_TRANSACTION,
+                                               asset_group_id, source_id, query_id)
         domain_id = self.asset_group_domain_mapping.get(asset_group_id, None)
         if domain_id is None:
-            self.logger.error("No such asset_group_id is set up in any domain")
-            return None
+            return self.search_via_domain_global(asset_group_id, txid, ResourceType.Transaction_data, response_info,
+                                                 sock)
 
-        txdata = self.ledger_manager.find_locally(domain_id, asset_group_id, txid, ResourceType.Transaction_data)
-        if txdata is not None and self.validate_transaction(txid, txdata, None) is None:
-            txdata = None
-            self.ledger_manager.remove(domain_id, asset_group_id, txid)
-        response_info = make_message_structure(MsgType.RESPONSE_SEARCH_TRANSACTION,
-                                               asset_group_id, source_id, query_id)
+        with self.stats.span("search.ledger"):
+            txdata = self.ledger_manager.find_locally(domain_id, asset_group_id, txid,
+                                                      ResourceType.Transaction_data)
+            if txdata is not None and self.validate_transaction(txid, txdata, None) is None:
+                txdata = None
+                self.ledger_manager.remove(domain_id, asset_group_id, txid)
         if txdata is None:
             query_entry = query_management.QueryEntry(expire_after=DURATION_GIVEUP_GET,
                                                       callback_expire=self.failure_response,
@@ -892,6 +1041,107 @@ class BBcCoreService:
         response_info[KeyType.transaction_data] = txdata
         return response_info
 
+    def search_via_domain_global(self, asset_group_id, resource_id, resource_type, response_info, sock):
+        """
+        Search the transaction/asset of an asset_group that is not set up in this node.
+        The query is forwarded to the nodes advertising the asset_group in domain_global_0,
+        and the results are cached for a while.
+        The response is sent through the socket of the request, because the client is not registered
+        to the asset_group in user_id_sock_mapping.
+
+        :param asset_group_id:
+        :param resource_id: transaction_id or asset_id
+        :param resource_type: ResourceType.Transaction_data or ResourceType.Asset_ID
+        :param response_info: response message to fill
+        :param sock: socket of the client
+        :return: response message if found in the cache, otherwise None (sent later)
+        """
+        if bbclib.domain_global_0 not in self.networking.domains:
+            self.logger.error("No such asset_group_id is set up in any domain")
+            return None
+        if self.fill_response_from_proxy_cache(asset_group_id, resource_id, resource_type, response_info):
+            return response_info
+        data = {'response_info': response_info,
+                KeyType.domain_id: bbclib.domain_global_0,
+                KeyType.asset_group_id: asset_group_id,
+                KeyType.resource_id: resource_id,
+                KeyType.resource_type: resource_type}
+        if resource_type == ResourceType.Asset_ID:
+            data[KeyType.asset_id] = resource_id
+        query_entry = query_management.QueryEntry(expire_after=DURATION_GIVEUP_GET,
+                                                  callback_expire=self.failure_response,
+                                                  data=data,
+                                                  retry_count=GET_RETRY_COUNT)
+        query_entry.data['socket'] = sock  # not in data given above, because QueryEntry deep-copies it
+        query_entry.update(fire_after=INTERVAL_RETRY, callback=self.succeed_to_search_via_domain_global)
+        self.networking.get(query_entry)
+        return None
+
+    def fill_response_from_proxy_cache(self, asset_group_id, resource_id, resource_type, response_info):
+        """
+        (internal use) make the response of search_via_domain_global from the cache
+
+        :param asset_group_id:
+        :param resource_id:
+        :param resource_type:
+        :param response_info:
+        :return: True if all data are in the cache
+        """
+        txid = resource_id
+        if resource_type == ResourceType.Asset_ID:
+            txid = self.proxy_cache.get((asset_group_id, ResourceType.Asset_ID, resource_id))
+        txdata = self.proxy_cache.get((asset_group_id, ResourceType.Transaction_data, txid))
+        if txdata is None:
+            return False
+        if resource_type == ResourceType.Asset_ID and check_transaction_if_having_asset_file(txdata, resource_id):
+            asset_file = self.proxy_cache.get((asset_group_id, ResourceType.Asset_file, resource_id))
+            if asset_file is None:
+                return False
+            response_info[KeyType.asset_file] = asset_file
+        response_info[KeyType.transaction_data] = txdata
+        return True
+
+    def succeed_to_search_via_domain_global(self, query_entry):
+        """
+        (internal use) validate and cache the result of search_via_domain_global, and search the asset file if needed
+
+        :param query_entry:
+        :return:
+        """
+        asset_group_id = query_entry.data[KeyType.asset_group_id]
+        response_info = query_entry.data['response_info']
+        if query_entry.data[KeyType.resource_type] == ResourceType.Transaction_data:
+            txid = query_entry.data[KeyType.resource_id]
+            txdata = query_entry.data[KeyType.resource]
+            txobj = self.validate_transaction(txid, txdata, None)
+            asid = query_entry.data.get(KeyType.asset_id)
+            if txobj is None or (asid is not None and
+                                 not any(evt.asset is not None and evt.asset.asset_id == asid for evt in txobj.events)):
+                self.failure_response(query_entry)
+                return
+            self.proxy_cache.put((asset_group_id, ResourceType.Transaction_data, txid), txdata)
+            response_info[KeyType.transaction_data] = txdata
+            if asid is not None:
+                self.proxy_cache.put((asset_group_id, ResourceType.Asset_ID, asid), txid)
+                if check_transaction_if_having_asset_file(txdata, asid):
+                    del query_entry.data[KeyType.resource]
+                    query_entry.data.update({KeyType.resource_id: asid, KeyType.resource_type: ResourceType.Asset_file})
+                    query_entry.retry_count = GET_RETRY_COUNT
+                    query_entry.update(fire_after=INTERVAL_RETRY, callback=self.succeed_to_search_via_domain_global)
+                    self.networking.get(query_entry)
+                    return
+        else:
+            asid = query_entry.data[KeyType.asset_id]
+            asset_file = query_entry.data[KeyType.resource]
+            txobj = BBcTransaction()
+            txobj.deserialize(response_info[KeyType.transaction_data])
+            if not self.validate_asset_file(txobj, asid, asset_file):
+                self.failure_response(query_entry)
+                return
+            self.proxy_cache.put((asset_group_id, ResourceType.Asset_file, asid), asset_file)
+            response_info[KeyType.asset_file] = asset_file
+        self.send_message(response_info, query_entry.data['socket'])
+
     def add_cross_ref_into_list(self, asset_group_id, txid):
         """
         (internal use) register cross_ref info in the list
@@ -947,12 +1197,13 @@ class BBcCoreService:
         :return:
         """
         response_info = query_entry.data['response_info']
+        sock = query_entry.data.get('socket')
         if query_entry.data[KeyType.resource_type] == ResourceType.Transaction_data:
-            self.error_reply(msg=response_info, err_code=ENOTRANSACTION, txt="Cannot find transaction")
+            self.error_reply(msg=response_info, err_code=ENOTRANSACTION, txt="Cannot find transaction", sock=sock)
         elif query_entry.data[KeyType.resource_type] == ResourceType.Asset_ID:
-            self.error_reply(msg=response_info, err_code=ENOASSET, txt="Cannot find asset")
+            self.error_reply(msg=response_info, err_code=ENOASSET, txt="Cannot find asset", sock=sock)
         elif query_entry.data[KeyType.resource_type] == ResourceType.Asset_file:
-            self.error_reply(msg=response_info, err_code=ENOTINSTORAGE, txt="Cannot find asset file")
+            self.error_reply(msg=response_info, err_code=ENOTINSTORAGE, txt="Cannot find asset file", sock=sock)
 
 
 def daemonize(pidfile=PID_FILE):
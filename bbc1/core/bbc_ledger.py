@@ -7,6 +7,7 @@ sys.path.extend(["../../"])
 from bbc1.common import logger
 
 import binascii
+import hashlib
 
 transaction_db_definition = [
     ["transaction_id", "BLOB"], ["asset_group_id", "BLOB"], ["transaction_data", "BLOB"],
@@ -17,6 +18,25 @@ auxiliary_db_definition = [
     ["resource_type", "INTEGER"], ["data", "BLOB"],
 ]
 
+RANGE_DIGEST_PREFIX_LEN = 2     # the digests of transaction_ids are kept for each prefix of 1 and 2 bytes
+BUCKET_NUM = 1 << (8 * RANGE_DIGEST_PREFIX_LEN)
+
+
+def get_id_digest(transaction_id):
+    return int.from_bytes(hashlib.sha256(transaction_id).digest(), 'big')
+
+
+def get_bucket_start(prefix):
+    """
+    Return the smallest transaction_id with the prefix (None for the end of the space)
+
+    :param prefix: int value of the prefix of RANGE_DIGEST_PREFIX_LEN bytes
+    :return: 32-byte transaction_id or None
+    """
+    if prefix >= BUCKET_NUM:
+        return None
+    return prefix.to_bytes(RANGE_DIGEST_PREFIX_LEN, 'big') + bytes(32 - RANGE_DIGEST_PREFIX_LEN)
+
 
 class ResourceType:
     Transaction_data = 0
@@ -54,6 +74,7 @@ class BBcLedger:
         self.db_name = dict()
         self.db = dict()
         self.db_cur = dict()
+        self.range_digests = dict()
 
     def add_domain(self, domain_id):
         """
@@ -178,6 +199,30 @@ class BBcLedger:
             ret = list(ret)
         return ret
 
+    def exec_sql_many(self, domain_id, dbname, sql, rows):
+        """
+        (internal use) Exec SQL for each record in a single DB transaction
+
+        :param domain_id:
+        :param dbname:
+        :param sql:
+        :param rows: list of parameters
+        :return: True if executed
+        """
+        if domain_id not in self.db or domain_id not in self.db_cur or domain_id not in self.db_name:
+            return False
+        if dbname not in self.db[domain_id]:
+            self.open_db(domain_id, dbname)
+        cur = self.db_cur[domain_id][dbname]
+        cur.execute("begin")
+        try:
+            cur.executemany(sql, rows)
+        except sqlite3.Error:
+            cur.execute("rollback")
+            raise
+        cur.execute("commit")
+        return True
+
     def check_table_existence(self, domain_id, dbname, name):
         """
         (internal use) checking table existence
@@ -235,6 +280,7 @@ class BBcLedger:
                 return False
             sql = "insert into transaction_table values (?, ?, ?)"
             self.exec_sql(domain_id, "transaction_db", sql, resource_id, asset_group_id, data)
+            self.update_range_digests(domain_id, asset_group_id, resource_id, 1)
 
         else:
             if require_uniqueness and self.exec_sql_fetchone(domain_id, "auxiliary_db",
@@ -248,6 +294,200 @@ class BBcLedger:
 
         return True
 
+    def get_transaction_ids(self, domain_id, asset_group_id, start, end=None):
+        """
+        Get transaction_ids in the range [start, end)
+
+        :param domain_id:
+        :param asset_group_id:
+        :param start:   the lower bound of transaction_id
+        :param end:     the upper bound of transaction_id (None means no upper bound)
+        :return: list of transaction_ids in ascending order
+        """
+        if end is None:
+            rows = self.exec_sql(domain_id, "transaction_db",
+                                 "select transaction_id from transaction_table where asset_group_id = ? AND "
+                                 "transaction_id >= ? order by transaction_id", asset_group_id, start)
+        else:
+            rows = self.exec_sql(domain_id, "transaction_db",
+                                 "select transaction_id from transaction_table where asset_group_id = ? AND "
+                                 "transaction_id >= ? AND transaction_id < ? order by transaction_id",
+                                 asset_group_id, start, end)
+        if rows is None:
+            return []
+        return [bytes(row[0]) for row in rows]
+
+    def get_range_digest(self, domain_id, asset_group_id, start, end=None):
+        """
+        Get the digest of transaction_ids in the range [start, end) (for comparing ledgers between nodes)
+        The digest is the XOR of SHA256 of the transaction_ids, which is summed up from the digests kept for
+        each prefix of transaction_id, so only the transactions at the edges of the range not aligned to
+        a prefix are read from the DB.
+
+        :param domain_id:
+        :param asset_group_id:
+        :param start:   the lower bound of transaction_id
+        :param end:     the upper bound of transaction_id (None means no upper bound)
+        :return: the number of transactions and the digest of the transaction_ids (32 bytes)
+        """
+        buckets = self.load_range_digests(domain_id, asset_group_id)
+        lower = int.from_bytes(start[:RANGE_DIGEST_PREFIX_LEN], 'big')
+        upper = BUCKET_NUM if end is None else int.from_bytes(end[:RANGE_DIGEST_PREFIX_LEN], 'big')
+        count, digest = 0, 0
+        if any(start[RANGE_DIGEST_PREFIX_LEN:]):
+            lower += 1
+            if lower > upper:
+                return self.get_range_digest_from_db(domain_id, asset_group_id, start, end)
+            count, digest = self.get_range_digest_from_db(domain_id, asset_group_id, start, get_bucket_start(lower),
+                                                          as_int=True)
+        if end is not None and any(end[RANGE_DIGEST_PREFIX_LEN:]):
+            cnt, dgst = self.get_range_digest_from_db(domain_id, asset_group_id, get_bucket_start(upper), end,
+                                                      as_int=True)
+            count, digest = count + cnt, digest ^ dgst
+        while lower < upper:
+            if lower % 256 == 0 and lower + 256 <= upper:
+                cnt, dgst = buckets[0].get(lower >> 8, (0, 0))
+                lower += 256
+            else:
+                cnt, dgst = buckets[1].get(lower, (0, 0))
+                lower += 1
+            count, digest = count + cnt, digest ^ dgst
+        return count, digest.to_bytes(32, 'big')
+
+    def get_range_digest_from_db(self, domain_id, asset_group_id, start, end, as_int=False):
+        """
+        (internal use) calculate the digest of transaction_ids in the range [start, end) from the DB
+
+        :param domain_id:
+        :param asset_group_id:
+        :param start:   the lower bound of transaction_id
+        :param end:     the upper bound of transaction_id (None means no upper bound)
+        :param as_int:  return the digest as int
+        :return: the number of transactions and the digest of the transaction_ids
+        """
+        txids = self.get_transaction_ids(domain_id, asset_group_id, start, end)
+        digest = 0
+        for txid in txids:
+            digest ^= get_id_digest(txid)
+        return len(txids), digest if as_int else digest.to_bytes(32, 'big')
+
+    def load_range_digests(self, domain_id, asset_group_id):
+        """
+        (internal use) get the digests for each prefix of transaction_id (made from the DB at the first call)
+
+        :param domain_id:
+        :param asset_group_id:
+        :return: list of dictionaries of prefix:[count, digest] for 1-byte and 2-byte prefixes
+        """
+        key = (domain_id, asset_group_id)
+        if key not in self.range_digests:
+            self.range_digests[key] = [dict(), dict()]
+            for txid in self.get_transaction_ids(domain_id, asset_group_id, bytes(32)):
+                self.update_range_digests(domain_id, asset_group_id, txid, 1)
+        return self.range_digests[key]
+
+    def update_range_digests(self, domain_id, asset_group_id, transaction_id, diff):
+        """
+        (internal use) reflect an inserted/removed transaction in the digests of the prefixes
+
+        :param domain_id:
+        :param asset_group_id:
+        :param transaction_id:
+        :param diff:    1 (inserted) or -1 (removed)
+        :return:
+        """
+        buckets = self.range_digests.get((domain_id, asset_group_id))
+        if buckets is None:
+            return
+        prefix = int.from_bytes(transaction_id[:RANGE_DIGEST_PREFIX_LEN], 'big')
+        id_digest = get_id_digest(transaction_id)
+        for bucket, idx in ((buckets[0], prefix >> 8), (buckets[1], prefix)):
+            count, digest = bucket.get(idx, (0, 0))
+            if count + diff == 0:
+                bucket.pop(idx, None)
+            else:
+                bucket[idx] = (count + diff, digest ^ id_digest)
+
+    def count_transactions(self, domain_id, asset_group_id):
+        """
+        Count transactions of the asset_group
+
+        :param domain_id:
+        :param asset_group_id:
+        :return: the number of transactions
+        """
+        row = self.exec_sql_fetchone(domain_id, "transaction_db",
+                                     "select count(*) from transaction_table where asset_group_id = ?", asset_group_id)
+        return 0 if row is None else row[0]
+
+    def get_max_row_id(self, domain_id):
+        """
+        Get the largest rowid of transaction_table (the upper bound of a snapshot)
+
+        :param domain_id:
+        :return: the max rowid of transaction_table
+        """
+        row = self.exec_sql_fetchone(domain_id, "transaction_db", "select max(rowid) from transaction_table")
+        return (row or [0])[0] or 0
+
+    def export_transactions(self, domain_id, asset_group_id, after, upper, limit):
+        """
+        Get records of transaction_table in the order of insertion (for a snapshot)
+
+        :param domain_id:
+        :param asset_group_id:
+        :param after:   rowid of the last record already exported
+        :param upper:   the max rowid to export
+        :param limit:   max number of records
+        :return: list of [rowid, transaction_id, transaction_data]
+        """
+        rows = self.exec_sql(domain_id, "transaction_db",
+                             "select rowid, transaction_id, transaction_data from transaction_table where "
+                             "asset_group_id = ? AND rowid > ? AND rowid <= ? order by rowid limit ?",
+                             asset_group_id, after, upper, limit)
+        return [] if rows is None else rows
+
+    def import_transactions(self, domain_id, asset_group_id, transactions):
+        """
+        Insert validated transactions received from another node and the records of auxiliary_table made from them
+        in the same way as insert_transaction() of bbc_core (existing records are skipped)
+
+        :param domain_id:
+        :param asset_group_id:
+        :param transactions:    list of [BBcTransaction object, transaction_data]
+        :return: True if inserted
+        """
+        self.range_digests.pop((domain_id, asset_group_id), None)
+        if not self.exec_sql_many(domain_id, "transaction_db",
+                                  "insert or ignore into transaction_table values (?, ?, ?)",
+                                  [(txobj.transaction_id, asset_group_id, txdata) for txobj, txdata in transactions]):
+            return False
+        unique_records = []
+        owner_records = []
+        for txobj, txdata in transactions:
+            for evt in txobj.events:
+                if evt.asset is None:
+                    continue
+                unique_records.append((evt.asset.asset_id, ResourceType.Asset_ID, txobj.transaction_id))
+                owner_records.append((evt.asset.user_id, ResourceType.Owner_asset, evt.asset.asset_id))
+            for reference in txobj.references:
+                unique_records.append((txobj.transaction_id, ResourceType.Edge_outgoing, reference.transaction_id))
+                unique_records.append((reference.transaction_id, ResourceType.Edge_incoming, txobj.transaction_id))
+        sql = "insert into auxiliary_table(resource_id, asset_group_id, resource_type, data) " \
+              "select ?, ?, ?, ? where not exists (select 1 from auxiliary_table where resource_id = ? AND " \
+              "asset_group_id = ? AND resource_type = ?%s)"
+        params = []
+        for resource_id, resource_type, data in unique_records:
+            params.append((resource_id, asset_group_id, resource_type, data, resource_id, asset_group_id,
+                           resource_type))
+        if not self.exec_sql_many(domain_id, "auxiliary_db", sql % "", params):
+            return False
+        params = []
+        for resource_id, resource_type, data in owner_records:
+            record = (resource_id, asset_group_id, resource_type, data)
+            params.append(record + record)
+        return self.exec_sql_many(domain_id, "auxiliary_db", sql % " AND data = ?", params)
+
     def remove(self, domain_id, asset_group_id, resource_id):
         """
         Remove data
@@ -263,6 +503,7 @@ class BBcLedger:
             self.exec_sql(domain_id, "transaction_db",
                           "delete from transaction_table where asset_group_id = ? and transaction_id = ?",
                           asset_group_id, resource_id)
+            self.update_range_digests(domain_id, asset_group_id, resource_id, -1)
         if self.exec_sql_fetchone(domain_id, "auxiliary_db",
                                   "select * from auxiliary_table where resource_id = ? AND asset_group_id = ?",
                                   resource_id, asset_group_id) is not None:
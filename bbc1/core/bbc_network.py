@@ -18,12 +18,16 @@ limitations under the License.
 from gevent import monkey
 monkey.patch_all()
 import gevent
+from gevent.pool import Pool
+from gevent.server import StreamServer
 import socket
 import select
 
 import threading
 import random
 import binascii
+import collections
+import hashlib
 import struct
 import time
 
@@ -34,15 +38,18 @@ from bbc1.core import bbc_core
 from bbc1.core.bbc_config import DEFAULT_P2P_PORT
 from bbc1.core.bbc_ledger import ResourceType
 from bbc1.common.bbclib import NodeInfo, StorageType
-from bbc1.common import bbclib, message_key_types
-from bbc1.common.message_key_types import to_2byte, PayloadType, KeyType
+from bbc1.common import bbclib, message_key_types, lru_cache
+from bbc1.common.message_key_types import to_2byte, PayloadType, KeyType, CompressionType
 from bbc1.common import logger
 from bbc1.common.bbc_error import *
-from bbc1.core import query_management
+from bbc1.core import query_management, connection_pool, anti_entropy, snapshot
 
 TCP_THRESHOLD_SIZE = 1300
 ZEROS = bytes([0] * 32)
 NUM_CROSS_REF_COPY = 2
+CROSS_REF_BATCH_SIZE = 32       # max number of cross_refs in a NOTIFY_CROSS_REF message
+CROSS_REF_BATCH_DELAY = 1       # buffered cross_refs are sent after this period (sec) even if the batch is not full
+MAX_CROSS_REF_BUFFER = 10000
 
 DURATION_GIVEUP_PUT = 30
 INTERVAL_RETRY = 3
@@ -50,6 +57,11 @@ GET_RETRY_COUNT = 5
 ROUTE_RETRY_COUNT = 1
 REFRESH_INTERVAL = 1800  # not sure whether it's appropriate
 ALIVE_CHECK_PING_WAIT = 2
+PEER_COST_BASE = 0.001  # sec, added to RTT so that the number of inflight requests matters for unmeasured peers
+MIN_DELIVERY_RATE = 0.05
+USER_DIRECTORY_TOMBSTONE_TTL = 3600     # removed entries of the user directory are kept for this period (sec)
+                                        # (and the entries of a node missing from the peer list as well)
+MAX_DIRECTORY_ENTRIES_PER_MESSAGE = 1000
 
 ticker = query_management.get_ticker()
 
@@ -75,17 +87,6 @@ def check_my_IPaddresses(target4='8.8.8.8', target6='2001:4860:4860::8888', port
     return ip4, ip6
 
 
-def send_data_by_tcp(ipv4="", ipv6="", port=DEFAULT_P2P_PORT, msg=None):
-    def worker():
-        if ipv4 != "":
-            conn = socket.create_connection((ipv4, port))
-        elif ipv6 != "":
-            conn = socket.create_connection((ipv6, port))
-        conn.send(msg)
-        conn.close()
-    gevent.spawn(worker)
-
-
 class BBcNetwork:
     """
     Socket and thread management for infrastructure layers
@@ -113,6 +114,23 @@ class BBcNetwork:
         self.listen_socket = None
         self.listen_socket6 = None
         self.max_connections = conf['network']['max_connections']
+        pool_conf = conf['network'].get('connection_pool', dict())
+        self.connection_pool = connection_pool.ConnectionPool(
+            self.receive_message_by_tcp,
+            idle_timeout=pool_conf.get('idle_timeout', connection_pool.IDLE_TIMEOUT),
+            max_connections_per_peer=pool_conf.get('max_connections_per_peer',
+                                                   connection_pool.MAX_CONNECTIONS_PER_PEER),
+            write_queue_size=pool_conf.get('write_queue_size', connection_pool.WRITE_QUEUE_SIZE),
+            max_message_size=pool_conf.get('max_message_size', connection_pool.MAX_MESSAGE_SIZE),
+            callback_dropped=self.record_dropped_messages, loglevel=loglevel, logname=logname)
+        cross_ref_conf = conf['network'].get('cross_ref', dict())
+        self.cross_ref_batch_size = min(cross_ref_conf.get('batch_size', CROSS_REF_BATCH_SIZE), 0xFFFF)
+        self.cross_ref_batch_delay = cross_ref_conf.get('batch_delay', CROSS_REF_BATCH_DELAY)
+        self.cross_ref_buffer = collections.deque(maxlen=cross_ref_conf.get('max_buffer_size', MAX_CROSS_REF_BUFFER))
+        self.cross_ref_flush_entry = None
+        compression_conf = conf['network'].get('compression', dict())
+        self.compression_enabled = compression_conf.get('enabled', True)
+        self.compression_threshold = compression_conf.get('threshold', message_key_types.COMPRESSION_THRESHOLD)
         if not self.setup_tcp_server():
             self.logger.error("** Fail to setup TCP server **")
             return
@@ -225,6 +243,7 @@ class BBcNetwork:
         if domain_id not in self.domains:
             return
         self.domains[domain_id].add_peer_node_ip46(node_id, ipv4, ipv6, port)
+        self.domains[domain_id].start_snapshot(node_id)
         conf = self.config.get_domain_config(domain_id)
         if node_id not in conf['static_nodes']:
             if not isinstance(ipv4, str):
@@ -454,23 +473,47 @@ class BBcNetwork:
 
     def disseminate_cross_ref(self, transaction_id, asset_group_id):
         """
-        disseminate transaction_id in the network (domain_global_0)
+        disseminate transaction_id in the network (domain_global_0).
+        The cross_refs are buffered and sent in a batch when cross_ref_batch_size of them are collected
+        or cross_ref_batch_delay has passed.
 
         :param transaction_id:
         :param asset_group_id:
         :return:
         """
-        if self.use_global:
-            msg = self.domains[bbclib.domain_global_0].make_message(dst_node_id=None,
-                                                                    msg_type=InfraMessageTypeBase.NOTIFY_CROSS_REF)
-            data = bytearray()
-            data.extend(to_2byte(1))
-            data.extend(asset_group_id)
-            data.extend(transaction_id)
-            msg[KeyType.cross_refs] = bytes(data)
-            self.domains[bbclib.domain_global_0].random_send(msg, NUM_CROSS_REF_COPY)
-        else:
+        if not self.use_global:
             self.core.add_cross_ref_into_list(asset_group_id, transaction_id)
+            return
+        self.cross_ref_buffer.append((asset_group_id, transaction_id))
+        if len(self.cross_ref_buffer) >= self.cross_ref_batch_size:
+            self.flush_cross_refs()
+        elif self.cross_ref_flush_entry is None:
+            self.cross_ref_flush_entry = query_management.exec_func_after(self.flush_cross_refs,
+                                                                          self.cross_ref_batch_delay)
+
+    def flush_cross_refs(self, query_entry=None):
+        """
+        (internal use) send the buffered cross_refs in NOTIFY_CROSS_REF messages
+
+        :param query_entry:
+        :return:
+        """
+        if self.cross_ref_flush_entry is not None:
+            self.cross_ref_flush_entry.deactivate()
+            self.cross_ref_flush_entry = None
+        if bbclib.domain_global_0 not in self.domains:
+            return
+        domain = self.domains[bbclib.domain_global_0]
+        while len(self.cross_ref_buffer) > 0:
+            count = min(len(self.cross_ref_buffer), self.cross_ref_batch_size)
+            data = bytearray(to_2byte(count))
+            for i in range(count):
+                asset_group_id, transaction_id = self.cross_ref_buffer.popleft()
+                data.extend(asset_group_id)
+                data.extend(transaction_id)
+            msg = domain.make_message(dst_node_id=None, msg_type=InfraMessageTypeBase.NOTIFY_CROSS_REF)
+            msg[KeyType.cross_refs] = bytes(data)
+            domain.random_send(msg, NUM_CROSS_REF_COPY)
 
     def send_message_in_network(self, nodeinfo, payload_type, msg):
         """
@@ -479,17 +522,36 @@ class BBcNetwork:
         :param nodeinfo: NodeInfo object
         :param payload_type: PayloadType value
         :param msg:  data body
-        :return:
-        """
-        data_to_send = message_key_types.make_message(payload_type, msg)
-        if len(data_to_send) > TCP_THRESHOLD_SIZE:
-            send_data_by_tcp(ipv4=nodeinfo.ipv4, ipv6=nodeinfo.ipv6, port=nodeinfo.port, msg=data_to_send)
-            return
+        :return: False if the message could not be queued in the TCP connection to the peer
+        """
+        compression_type = CompressionType.Type_none
+        if self.compression_enabled:
+            compression_type = message_key_types.select_compression_type(nodeinfo.accepted_compression)
+        parts = message_key_types.make_message_parts(payload_type, msg, compression_type=compression_type,
+                                                     compression_threshold=self.compression_threshold)
+        if len(parts[0]) + len(parts[1]) > TCP_THRESHOLD_SIZE:
+            return self.connection_pool.send(nodeinfo, parts)
+        data_to_send = b"".join(parts)
         if nodeinfo.ipv4 != "":
             self.socket_udp.sendto(data_to_send, (nodeinfo.ipv4, nodeinfo.port))
-            return
+            return True
         if nodeinfo.ipv6 != "":
             self.socket_udp6.sendto(data_to_send, (nodeinfo.ipv6, nodeinfo.port))
+        return True
+
+    def record_dropped_messages(self, node_id, count):
+        """
+        (internal use) record the messages dropped by a failed TCP connection as losses of the peer
+        (in the same way as the requests over UDP that are not responded)
+
+        :param node_id: node_id of the peer
+        :param count:   the number of the dropped messages
+        :return:
+        """
+        for domain in self.domains.values():
+            if node_id in domain.id_ip_mapping:
+                for i in range(count):
+                    domain.record_loss(node_id)
 
     def setup_udp_socket(self):
         """
@@ -552,6 +614,8 @@ class BBcNetwork:
                             if KeyType.destination_node_id not in msg or KeyType.domain_id not in msg:
                                 continue
                             if msg[KeyType.domain_id] in self.domains:
+                                self.update_accepted_compression(msg, message_key_types.get_accepted_compression(
+                                    msg_parser.format_version))
                                 self.domains[msg[KeyType.domain_id]].process_message_base(ip4, addr, msg, msg_parser.payload_type)
         finally:
             for sock in readfds:
@@ -561,81 +625,104 @@ class BBcNetwork:
 
     def setup_tcp_server(self):
         """
-        (internal use) start tcp server
+        (internal use) start tcp server (gevent StreamServer sharing a greenlet pool of max_connections).
+        SO_REUSEADDR is set because pooled connections closed by this side leave TIME_WAIT on the port.
 
         :return:
         """
         try:
             self.listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.listen_socket.bind(("0.0.0.0", self.port))
             self.listen_socket.listen(self.max_connections)
-            self.port = self.port
         except OSError:
             self.listen_socket = None
             self.logger.error("Socket error for IPv4")
         try:
             self.listen_socket6 = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+            self.listen_socket6.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.listen_socket6.bind(("::", self.port))
             self.listen_socket6.listen(self.max_connections)
-            self.port = self.port
         except OSError:
             self.listen_socket6 = None
             self.logger.error("Socket error for IPv6")
         if self.listen_socket is None and self.listen_socket6 is None:
             return False
-        th_tcp_loop = threading.Thread(target=self.tcpserver_loop)
-        th_tcp_loop.setDaemon(True)
-        th_tcp_loop.start()
+        self.tcp_handler_pool = Pool(self.max_connections)
+        self.tcp_servers = []
+        for sock in (self.listen_socket, self.listen_socket6):
+            if sock is None:
+                continue
+            server = StreamServer(sock, self.tcp_handler, spawn=self.tcp_handler_pool)
+            server.start()
+            self.tcp_servers.append(server)
         return True
 
-    def tcpserver_loop(self):
+    def tcp_handler(self, sock, address):
         """
-        (internal use) message loop for TCP socket
+        (internal use) per-connection handler for TCP socket. The connection is kept in the connection pool for reuse
 
+        :param sock:
+        :param address:
         :return:
         """
-        self.logger.debug("Start tcpserver_loop")
-        msg_parsers = dict()
-        readfds = set()
-        if self.listen_socket:
-            readfds.add(self.listen_socket)
-        if self.listen_socket6:
-            readfds.add(self.listen_socket6)
-        try:
-            while True:
-                rready, wready, xready = select.select(readfds, [], [])
-                for sock in rready:
-                    if sock is self.listen_socket:
-                        conn, address = self.listen_socket.accept()
-                        readfds.add(conn)
-                        msg_parsers[conn] = message_key_types.Message()
-                    elif sock is self.listen_socket6:
-                        conn, address = self.listen_socket6.accept()
-                        readfds.add(conn)
-                        msg_parsers[conn] = message_key_types.Message()
-                    else:
-                        buf = sock.recv(8192)
-                        if len(buf) == 0:
-                            del msg_parsers[sock]
-                            sock.close()
-                            readfds.remove(sock)
-                        else:
-                            msg_parsers[sock].recv(buf)
-                            while True:
-                                msg = msg_parsers[sock].parse()
-                                if msg is None:
-                                    break
-                                #self.logger.debug("Recv_TCP at %s: data=%s" % (sock.getsockname(), msg))
-                                if msg_parsers[sock].payload_type == PayloadType.Type_msgpack:
-                                    if KeyType.destination_node_id not in msg or KeyType.domain_id not in msg:
-                                        continue
-                                self.domains[msg[KeyType.domain_id]].process_message_base(True, None, msg,
-                                                                                          msg_parsers[sock].payload_type)
-        finally:
-            for sock in readfds:
-                sock.close()
-            self.listen_socket = None
-            self.listen_socket6 = None
+        self.logger.debug("TCP connection from %s:%d" % (address[0], address[1]))
+        conn = self.connection_pool.add_accepted(sock)
+        conn.reader_loop()
+
+    def update_accepted_compression(self, msg, accepted):
+        """
+        (internal use) record the compression types that the sender of the message can decode
+
+        :param msg:      received message
+        :param accepted: bitmask in the header (see message_key_types.get_accepted_compression)
+        :return:
+        """
+        nodeinfo = self.domains[msg[KeyType.domain_id]].id_ip_mapping.get(msg.get(KeyType.source_node_id))
+        if nodeinfo is not None:
+            nodeinfo.accepted_compression = accepted
+
+    def receive_message_by_tcp(self, conn, msg, payload_type):
+        """
+        (internal use) process a message received over a pooled TCP connection
+
+        :param conn:         PeerConnection object
+        :param msg:          the message body (already deserialized)
+        :param payload_type: PayloadType value of msg
+        :return:             False if the message is malformed (the connection will be closed)
+        """
+        if not isinstance(msg, dict) or KeyType.domain_id not in msg:
+            return False
+        if payload_type == PayloadType.Type_msgpack and KeyType.destination_node_id not in msg:
+            return False
+        domain_id = msg[KeyType.domain_id]
+        if domain_id not in self.domains:
+            return True
+        self.update_accepted_compression(msg, conn.codec.accepted_compression)
+        if conn.key is None and KeyType.source_node_id in msg:
+            nodeinfo = self.domains[domain_id].id_ip_mapping.get(msg[KeyType.source_node_id])
+            if nodeinfo is not None:
+                self.connection_pool.bind(conn, nodeinfo)
+        self.domains[domain_id].process_message_base(True, None, msg, payload_type)
+        return True
+
+
+def parse_peer_list(peerlist):
+    """
+    Parse binary peer_list made by make_peer_list
+
+    :param peerlist:
+    :return: list of NodeInfo
+    """
+    nodes = []
+    count = int.from_bytes(peerlist[:4], 'little')
+    for i in range(count):
+        base = 4 + i*(32+4+16+2)
+        nodeinfo = NodeInfo()
+        nodeinfo.recover_nodeinfo(bytes(peerlist[base:base+32]), peerlist[base+32:base+36],
+                                  peerlist[base+36:base+52], peerlist[base+52:base+54])
+        nodes.append(nodeinfo)
+    return nodes
 
 
 class InfraMessageTypeBase:
@@ -648,6 +735,7 @@ class InfraMessageTypeBase:
 
     NOTIFY_CROSS_REF = to_2byte(0, 0x10)        # only used in domain_global_0
     ADVERTISE_ASSET_GROUP = to_2byte(1, 0x10)   # only used in domain_global_0
+    REQUEST_ASSET_GROUP = to_2byte(2, 0x10)     # only used in domain_global_0
 
     REQUEST_STORE = to_2byte(0, 0x40)
     RESPONSE_STORE = to_2byte(1, 0x40)
@@ -657,6 +745,19 @@ class InfraMessageTypeBase:
     REQUEST_FIND_VALUE = to_2byte(5, 0x40)
     RESPONSE_FIND_VALUE = to_2byte(6, 0x40)
     MESSAGE_TO_USER = to_2byte(7, 0x40)
+    REQUEST_FIND_NODE = to_2byte(8, 0x40)       # only used in p2p_kademlia
+    RESPONSE_FIND_NODE = to_2byte(9, 0x40)      # only used in p2p_kademlia
+    REQUEST_RANGE_DIGEST = to_2byte(10, 0x40)   # anti-entropy
+    RESPONSE_RANGE_DIGEST = to_2byte(11, 0x40)  # anti-entropy
+    REQUEST_TRANSACTIONS = to_2byte(12, 0x40)   # anti-entropy
+    RESPONSE_TRANSACTIONS = to_2byte(13, 0x40)  # anti-entropy
+    REQUEST_SNAPSHOT = to_2byte(14, 0x40)
+    RESPONSE_SNAPSHOT = to_2byte(15, 0x40)
+    NOTIFY_USER_DIRECTORY = to_2byte(16, 0x40)
+    REQUEST_PEERLIST = to_2byte(17, 0x40)
+    NOTIFY_PEERLIST_DELTA = to_2byte(18, 0x40)
+    REQUEST_INDIRECT_PING = to_2byte(19, 0x40)  # failure detector
+    RESPONSE_INDIRECT_PING = to_2byte(20, 0x40)  # failure detector
 
 
 class DomainBase:
@@ -677,9 +778,27 @@ class DomainBase:
         self.default_payload_type = PayloadType.Type_msgpack
         self.id_ip_mapping = dict()
         self.registered_user_id = dict()
-        self.user_id_forward_cache = dict()
+        self.user_id_forward_cache = lru_cache.LRUCache()
+        self.user_directory = dict()
+        self.user_directory_clock = 0
+        self.user_directory_synced = set()
+        self.user_directory_missing = dict()    # node_id: time when found missing from the peer list
         self.refresh_entry = None
         self.set_refresh_timer()
+        self.anti_entropy = None
+        if network is not None and config is not None:
+            conf = config.get_config()['network'].get('anti_entropy', dict())
+            if conf.get('enabled', False):
+                self.anti_entropy = anti_entropy.AntiEntropy(
+                    self, interval=conf.get('interval', anti_entropy.INTERVAL),
+                    max_bytes_per_session=conf.get('max_bytes_per_session', anti_entropy.MAX_BYTES_PER_SESSION),
+                    max_bytes_per_message=conf.get('max_bytes_per_message', anti_entropy.MAX_BYTES_PER_MESSAGE))
+        self.snapshot = None
+        if network is not None and config is not None:
+            conf = config.get_config()['network'].get('snapshot', dict())
+            if conf.get('enabled', False):
+                self.snapshot = snapshot.Snapshot(
+                    self, max_bytes_per_message=conf.get('max_bytes_per_message', snapshot.MAX_BYTES_PER_MESSAGE))
 
     def set_refresh_timer(self, interval=REFRESH_INTERVAL):
         """
@@ -703,6 +822,7 @@ class DomainBase:
         for nd in self.id_ip_mapping.keys():
             self.send_start_refresh(nd)
         self.alive_check()
+        self.purge_user_directory()
         self.set_refresh_timer()
 
     def start_domain_manager(self):
@@ -736,6 +856,16 @@ class DomainBase:
         if node_id in self.id_ip_mapping and not self.id_ip_mapping[node_id].is_alive:
             del self.id_ip_mapping[node_id]
 
+    def ping_timeout(self, query_entry):
+        """
+        (internal use) record the loss of the last ping
+
+        :param query_entry:
+        :return:
+        """
+        if 'sent_at' in query_entry.data:
+            self.record_loss(query_entry.data[KeyType.node_id])
+
     def ping_with_retry(self, query_entry=None, node_id=None, retry_count=3):
         """
         Retry ping if response is not received within a given time
@@ -747,15 +877,141 @@ class DomainBase:
         """
         if node_id is not None:
             query_entry = query_management.QueryEntry(expire_after=ALIVE_CHECK_PING_WAIT,
+                                                      callback_expire=self.ping_timeout,
                                                       callback_error=self.ping_with_retry,
                                                       interval=1,
                                                       data={KeyType.node_id: node_id},
                                                       retry_count=retry_count)
         else:
             node_id = query_entry.data[KeyType.node_id]
+            if 'sent_at' in query_entry.data:
+                self.record_loss(node_id)
         query_entry.update()
+        query_entry.data['sent_at'] = time.time()
+        self.record_request(node_id)
         self.send_ping(node_id, nonce=query_entry.nonce)
 
+    def record_request(self, node_id):
+        """
+        Record a request sent to the peer (for the statistics in NodeInfo)
+
+        :param node_id:
+        :return:
+        """
+        if node_id in self.id_ip_mapping:
+            self.id_ip_mapping[node_id].record_request()
+
+    def record_response(self, node_id, sent_at):
+        """
+        Record the response from the peer
+
+        :param node_id:
+        :param sent_at: the time when the request was sent
+        :return:
+        """
+        if node_id in self.id_ip_mapping:
+            self.id_ip_mapping[node_id].record_response(time.time() - sent_at)
+
+    def record_loss(self, node_id):
+        if node_id in self.id_ip_mapping:
+            self.id_ip_mapping[node_id].record_loss()
+
+    def record_cancel(self, node_id):
+        if node_id in self.id_ip_mapping:
+            self.id_ip_mapping[node_id].record_cancel()
+
+    def get_peer_cost(self, nodeinfo, default_rtt):
+        """
+        Estimate the time to get a response from the peer (RTT weighted by inflight requests and loss rate)
+
+        :param nodeinfo: NodeInfo object
+        :param default_rtt: RTT used for the peer that has not been measured yet
+        :return: cost (the smaller, the better)
+        """
+        rtt = nodeinfo.rtt if nodeinfo.rtt is not None else default_rtt
+        return (rtt + PEER_COST_BASE) * (1 + nodeinfo.inflight) / max(MIN_DELIVERY_RATE, 1.0 - nodeinfo.loss_rate)
+
+    def select_peers(self, count, candidates=None, excludes=()):
+        """
+        Choose peers that are expected to respond quickly (i.e., fast, healthy and not busy).
+        Peers that have not been measured yet are regarded as fast as the fastest one so that they are tried.
+
+        :param count: max number of peers
+        :param candidates: node_ids to choose from (all peers if None)
+        :param excludes: node_ids not to choose
+        :return: list of node_ids in ascending order of the cost
+        """
+        if candidates is None:
+            candidates = self.id_ip_mapping.keys()
+        nodes = [nd for nd in candidates if nd in self.id_ip_mapping and nd not in excludes and nd != self.node_id]
+        rtts = [self.id_ip_mapping[nd].rtt for nd in nodes if self.id_ip_mapping[nd].rtt is not None]
+        default_rtt = min(rtts) if len(rtts) > 0 else 0
+        nodes.sort(key=lambda nd: self.get_peer_cost(self.id_ip_mapping[nd], default_rtt))
+        return nodes[:count]
+
+    def get_asset_group_ids(self):
+        """
+        Return asset_group_ids set up in the domain
+
+        :return: list of asset_group_id
+        """
+        mapping = self.network.core.asset_group_domain_mapping
+        return [asset_group_id for asset_group_id, domain_id in mapping.items() if domain_id == self.domain_id]
+
+    def start_snapshot(self, node_id):
+        """
+        Pull the snapshots of the asset_groups whose ledger is empty from the peer (for a node joining the domain)
+
+        :param node_id: the peer to export the snapshot
+        :return:
+        """
+        if self.snapshot is None:
+            return
+        for asset_group_id in self.get_asset_group_ids():
+            if self.network.core.ledger_manager.count_transactions(self.domain_id, asset_group_id) == 0:
+                self.snapshot.start(node_id, asset_group_id)
+
+    def get_replication_factor(self, asset_group_id):
+        """
+        Return the number of nodes that should keep a resource of the asset_group.
+        'replication_factor' in the asset_group config precedes that in the config of the network module.
+
+        :param asset_group_id:
+        :return: the number of nodes (0 means all nodes)
+        """
+        if self.config is None:
+            return 0
+        conf = self.config.get_config()['network'].get('modules', dict()).get(self.module_name, dict())
+        factor = conf.get('replication_factor', 0)
+        dc = self.config.get_domain_config(self.domain_id)
+        if dc is not None and asset_group_id is not None:
+            ac = dc.get('asset_group_ids', dict()).get(bbclib.convert_id_to_string(asset_group_id), dict())
+            if ac.get('replication_factor') is not None:
+                factor = ac['replication_factor']
+        return factor
+
+    def get_placement(self, resource_id, count):
+        """
+        Decide the nodes that keep the resource by rendezvous hashing of resource_id over node_ids
+        (the node itself is included in the candidates, and a change of peers moves only the affected resources)
+
+        :param resource_id:
+        :param count: the number of nodes
+        :return: list of node_ids
+        """
+        nodes = [self.node_id]
+        nodes.extend(nd for nd in self.id_ip_mapping.keys() if nd != self.node_id)
+        nodes.sort(key=lambda nd: hashlib.sha256(bytes(resource_id) + nd).digest(), reverse=True)
+        return nodes[:count]
+
+    def get_peer_stats(self):
+        """
+        Return statistics of the peers
+
+        :return: list of [node_id, rtt, loss_rate, inflight, is_alive] (see NodeInfo.get_stats())
+        """
+        return [nodeinfo.get_stats() for nodeinfo in self.id_ip_mapping.values()]
+
     def add_peer_node_ip46(self, node_id, ipv4, ipv6, port):
         """
         Add as a peer node (with ipv4 and ipv6 address)
@@ -782,10 +1038,10 @@ class DomainBase:
         :param node_id:
         :param ip4: True (IPv4)/False (IPv6)
         :param addr_info: tuple of (address, port)
-        :return:
+        :return: True if new
         """
-        if addr_info is None:
-            return True
+        if addr_info is None:  # received by TCP, so that the address of the node is unknown
+            return False
         port = addr_info[1]
         if node_id in self.id_ip_mapping:
             if ip4:
@@ -805,8 +1061,6 @@ class DomainBase:
                 self.id_ip_mapping[node_id] = NodeInfo(node_id=node_id, ipv4=addr_info[0], ipv6=None, port=port)
             else:
                 self.id_ip_mapping[node_id] = NodeInfo(node_id=node_id, ipv4=None, ipv6=addr_info[0], port=port)
-            if self.refresh_entry.rest_of_time_to_expire() > 10:
-                self.refresh_entry.update_expiration_time(5)
             return True
 
     def remove_peer_node(self, node_id=ZEROS):
@@ -817,6 +1071,16 @@ class DomainBase:
         :return:
         """
         self.id_ip_mapping.pop(node_id, None)
+        self.user_directory_synced.discard(node_id)
+
+    def peer_failed(self, node_id):
+        """
+        (internal use) called when the failure detector regards the peer as failed
+
+        :param node_id:
+        :return:
+        """
+        self.remove_peer_node(node_id)
 
     def make_peer_list(self):
         """
@@ -869,6 +1133,7 @@ class DomainBase:
         #self.logger.debug("[%s] register_user_id: %s" % (self.shortname,binascii.b2a_hex(user_id[:4])))
         self.registered_user_id.setdefault(asset_group_id, dict())
         self.registered_user_id[asset_group_id][user_id] = time.time()
+        self.update_user_directory(asset_group_id, user_id, removed=False)
 
     def unregister_user_id(self, asset_group_id, user_id):
         """
@@ -878,10 +1143,158 @@ class DomainBase:
         :param user_id:
         :return:
         """
-        if asset_group_id in self.registered_user_id:
-            self.registered_user_id[asset_group_id].pop(user_id, None)
+        if asset_group_id not in self.registered_user_id or user_id not in self.registered_user_id[asset_group_id]:
+            return
+        self.registered_user_id[asset_group_id].pop(user_id, None)
         if len(self.registered_user_id[asset_group_id]) == 0:
             self.registered_user_id.pop(asset_group_id, None)
+        self.update_user_directory(asset_group_id, user_id, removed=True)
+
+    def update_user_directory(self, asset_group_id, user_id, removed):
+        """
+        (internal use) update the entry of the user connecting to this node and push it to the neighbors
+
+        :param asset_group_id:
+        :param user_id:
+        :param removed: True if the user has left this node
+        :return:
+        """
+        entries = self.user_directory.get(asset_group_id, dict()).get(user_id, dict())
+        if removed and self.node_id not in entries:
+            return
+        version = max(self.user_directory_clock + 1, int(time.time() * 1000))
+        if len(entries) > 0:
+            version = max(version, max(e[0] for e in entries.values()) + 1)
+        self.user_directory_clock = version
+        item = [asset_group_id, user_id, self.node_id, version, removed]
+        self.apply_user_directory(item)
+        self.send_user_directory([item])
+
+    def apply_user_directory(self, item):
+        """
+        (internal use) apply an entry of the user directory if it is newer than the current one.
+        The directory keeps an entry for each pair of user and node, which is updated only by the node itself,
+        so that the removal of the user from a node never hides the registration of the user on another node.
+        version is a Lamport clock started from the time in msec (so that the entries made after restarting
+        the node are newer), and the newest registration is used by lookup_user_directory().
+
+        :param item: [asset_group_id, user_id, node_id, version, removed]
+        :return: True if applied
+        """
+        asset_group_id, user_id, node_id, version, removed = item
+        self.user_directory_clock = max(self.user_directory_clock, version)
+        entries = self.user_directory.setdefault(asset_group_id, dict()).setdefault(user_id, dict())
+        entry = entries.get(node_id)
+        if entry is not None and entry[0] >= version:
+            return False
+        entries[node_id] = [version, removed, time.time()]
+        return True
+
+    def lookup_user_directory(self, asset_group_id, user_id):
+        """
+        Return the node that the user connects to
+
+        :param asset_group_id:
+        :param user_id:
+        :return: node_id (None if not known)
+        """
+        entries = self.user_directory.get(asset_group_id, dict()).get(user_id)
+        if entries is None:
+            return None
+        found = None
+        for node_id, entry in entries.items():
+            if entry[1] or (node_id != self.node_id and node_id not in self.id_ip_mapping):
+                continue
+            if found is None or (entry[0], node_id) > (entries[found][0], found):
+                found = node_id
+        return found
+
+    def send_user_directory(self, items, excludes=(), target_ids=None):
+        """
+        (internal use) push entries of the user directory to the neighbors
+
+        :param items: list of [asset_group_id, user_id, node_id, version, removed]
+        :param excludes: node_ids not to send to
+        :param target_ids: node_ids to send to (None means all neighbors)
+        :return:
+        """
+        if target_ids is None:
+            target_ids = self.get_neighbor_nodes() or []
+        msg = self.make_message(dst_node_id=ZEROS, nonce=None, msg_type=InfraMessageTypeBase.NOTIFY_USER_DIRECTORY)
+        for nd in list(target_ids):
+            if nd in excludes:
+                continue
+            msg[KeyType.destination_node_id] = nd
+            for i in range(0, len(items), MAX_DIRECTORY_ENTRIES_PER_MESSAGE):
+                msg[KeyType.user_directory] = items[i:i+MAX_DIRECTORY_ENTRIES_PER_MESSAGE]
+                self.send_message_to_peer(msg, self.default_payload_type)
+
+    def sync_user_directory(self, node_id):
+        """
+        (internal use) send the entries of the users connecting to this node to the peer (once per peer)
+
+        :param node_id:
+        :return:
+        """
+        if node_id in self.user_directory_synced or node_id not in self.id_ip_mapping:
+            return
+        self.user_directory_synced.add(node_id)
+        items = []
+        for asset_group_id, users in self.user_directory.items():
+            for user_id, entries in users.items():
+                if self.node_id in entries:
+                    entry = entries[self.node_id]
+                    items.append([asset_group_id, user_id, self.node_id, entry[0], entry[1]])
+        if len(items) > 0:
+            self.send_user_directory(items, target_ids=[node_id])
+
+    def process_NOTIFY_USER_DIRECTORY(self, msg):
+        """
+        Apply the received entries and gossip those updated to the other neighbors
+
+        :param msg:
+        :return:
+        """
+        updated = []
+        for asset_group_id, user_id, node_id, version, removed in msg[KeyType.user_directory]:
+            item = [bytes(asset_group_id), bytes(user_id), bytes(node_id), version, removed]
+            if item[2] == self.node_id:
+                continue  # entries of this node are maintained only by itself
+            if self.apply_user_directory(item):
+                updated.append(item)
+        if len(updated) > 0:
+            self.send_user_directory(updated, excludes=(msg[KeyType.source_node_id],))
+
+    def purge_user_directory(self):
+        """
+        (internal use) remove expired tombstones in the user directory, and the entries of the nodes
+        missing from the peer list for USER_DIRECTORY_TOMBSTONE_TTL
+
+        :return:
+        """
+        self.user_directory_synced.intersection_update(self.id_ip_mapping.keys())
+        now = time.time()
+        deadline = now - USER_DIRECTORY_TOMBSTONE_TTL
+        missing = set()
+        for users in self.user_directory.values():
+            for entries in users.values():
+                missing.update(nid for nid in entries.keys()
+                               if nid != self.node_id and nid not in self.id_ip_mapping)
+        self.user_directory_missing = {nid: self.user_directory_missing.get(nid, now) for nid in missing}
+        expired = set(nid for nid, since in self.user_directory_missing.items() if since < deadline)
+        for nid in expired:
+            del self.user_directory_missing[nid]
+        for asset_group_id in list(self.user_directory.keys()):
+            users = self.user_directory[asset_group_id]
+            for user_id in list(users.keys()):
+                entries = users[user_id]
+                for node_id in [nid for nid, entry in entries.items()
+                                if nid in expired or (entry[1] and entry[2] < deadline)]:
+                    del entries[node_id]
+                if len(entries) == 0:
+                    del users[user_id]
+            if len(users) == 0:
+                del self.user_directory[asset_group_id]
 
     def is_registered_user(self, asset_group_id, user_id):
         """
@@ -920,11 +1333,12 @@ class DomainBase:
 
     def send_message_to_peer(self, msg, payload_type=PayloadType.Type_msgpack):
         """
-        Resolve socket for the target_id and call message send method in BBcNetwork
+        Resolve socket for the target_id and call message send method in BBcNetwork.
+        A message that cannot be queued in the TCP connection is recorded as a loss of the peer.
 
         :param msg:
         :param payload_type: PayloadType value
-        :return:
+        :return: True if sent (or queued)
         """
         target_id = msg[KeyType.destination_node_id]
         if target_id not in self.id_ip_mapping:
@@ -937,7 +1351,9 @@ class DomainBase:
                            binascii.b2a_hex(target_id[:2]),
                            int.from_bytes(msg[KeyType.p2p_msg_type],'big'), nodeinfo.port))
 
-        self.network.send_message_in_network(nodeinfo, payload_type, msg=msg)
+        if not self.network.send_message_in_network(nodeinfo, payload_type, msg=msg):
+            self.record_loss(target_id)
+            return False
         return True
 
     def process_message_base(self, ip4, from_addr, msg, payload_type):
@@ -965,12 +1381,16 @@ class DomainBase:
         elif msg[KeyType.p2p_msg_type] == InfraMessageTypeBase.REQUEST_PING:
             self.add_peer_node(msg[KeyType.source_node_id], ip4, from_addr)
             self.respond_ping(msg[KeyType.source_node_id], msg.get(KeyType.nonce))
+            self.sync_user_directory(msg[KeyType.source_node_id])
 
         elif msg[KeyType.p2p_msg_type] == InfraMessageTypeBase.RESPONSE_PING:
             self.add_peer_node(msg[KeyType.source_node_id], ip4, from_addr)
+            self.sync_user_directory(msg[KeyType.source_node_id])
             if KeyType.nonce in msg:
                 query_entry = ticker.get_entry(msg[KeyType.nonce])
                 if query_entry is not None:
+                    if query_entry.active and 'sent_at' in query_entry.data:
+                        self.record_response(msg[KeyType.source_node_id], query_entry.data['sent_at'])
                     query_entry.callback()
 
         elif msg[KeyType.p2p_msg_type] == InfraMessageTypeBase.RESPONSE_STORE:
@@ -1003,6 +1423,44 @@ class DomainBase:
         elif msg[KeyType.p2p_msg_type] == InfraMessageTypeBase.NOTIFY_LEAVE:
             self.remove_peer_node(msg[KeyType.source_node_id])
 
+        elif msg[KeyType.p2p_msg_type] == InfraMessageTypeBase.NOTIFY_USER_DIRECTORY:
+            if KeyType.user_directory not in msg:
+                return
+            self.add_peer_node(msg[KeyType.source_node_id], ip4, from_addr)
+            self.process_NOTIFY_USER_DIRECTORY(msg)
+
+        elif msg[KeyType.p2p_msg_type] in (InfraMessageTypeBase.REQUEST_RANGE_DIGEST,
+                                           InfraMessageTypeBase.RESPONSE_RANGE_DIGEST):
+            if self.anti_entropy is None or KeyType.range_digests not in msg or KeyType.nonce not in msg:
+                return
+            self.add_peer_node(msg[KeyType.source_node_id], ip4, from_addr)
+            if msg[KeyType.p2p_msg_type] == InfraMessageTypeBase.REQUEST_RANGE_DIGEST:
+                self.anti_entropy.process_REQUEST_RANGE_DIGEST(msg)
+            else:
+                self.anti_entropy.process_RESPONSE_RANGE_DIGEST(msg)
+
+        elif msg[KeyType.p2p_msg_type] == InfraMessageTypeBase.REQUEST_TRANSACTIONS:
+            if self.anti_entropy is None or KeyType.transaction_ids not in msg or KeyType.nonce not in msg:
+                return
+            self.add_peer_node(msg[KeyType.source_node_id], ip4, from_addr)
+            self.anti_entropy.process_REQUEST_TRANSACTIONS(msg)
+
+        elif msg[KeyType.p2p_msg_type] == InfraMessageTypeBase.RESPONSE_TRANSACTIONS:
+            if self.anti_entropy is None or KeyType.transactions not in msg or KeyType.nonce not in msg:
+                return
+            self.add_peer_node(msg[KeyType.source_node_id], ip4, from_addr)
+            self.anti_entropy.process_RESPONSE_TRANSACTIONS(msg)
+
+        elif msg[KeyType.p2p_msg_type] in (InfraMessageTypeBase.REQUEST_SNAPSHOT,
+                                           InfraMessageTypeBase.RESPONSE_SNAPSHOT):
+            if self.snapshot is None or KeyType.snapshot_cursor not in msg or KeyType.nonce not in msg:
+                return
+            self.add_peer_node(msg[KeyType.source_node_id], ip4, from_addr)
+            if msg[KeyType.p2p_msg_type] == InfraMessageTypeBase.REQUEST_SNAPSHOT:
+                self.snapshot.process_REQUEST_SNAPSHOT(msg)
+            elif KeyType.snapshot_rows in msg and KeyType.snapshot_next_cursor in msg:
+                self.snapshot.process_RESPONSE_SNAPSHOT(msg)
+
         else:
             self.process_message(ip4, from_addr, msg)
 
@@ -1019,29 +1477,71 @@ class DomainBase:
 
     def renew_peerlist(self, peerlist):
         """
-        (internal use) send peer_list to renew those of others
+        (internal use) add the nodes in the received peer_list (the nodes not in the list are kept)
 
         :param peerlist:
-        :return:
+        :return: list of node_ids newly added
         """
-        need_update = True
-        mapping = dict()
-        count = int.from_bytes(peerlist[:4], 'little')
-        for i in range(count-1):
-            base = 4 + i*(32+4+16+2)
-            node_id = peerlist[base:base+32]
-            if node_id == self.node_id:
-                need_update = False
+        added = []
+        for nodeinfo in parse_peer_list(peerlist):
+            if nodeinfo.node_id == self.node_id or nodeinfo.node_id in self.id_ip_mapping:
                 continue
-            ipv4 = peerlist[base+32:base+36]
-            ipv6 = peerlist[base+36:base+52]
-            port = peerlist[base+52:base+54]
-            mapping[node_id] = NodeInfo()
-            mapping[node_id].recover_nodeinfo(node_id, ipv4, ipv6, port)
-        self.id_ip_mapping = mapping
-        if need_update:
-            for nd in self.id_ip_mapping.keys():
-                self.send_ping(nd, None)
+            self.id_ip_mapping[nodeinfo.node_id] = nodeinfo
+            added.append(nodeinfo.node_id)
+        return added
+
+    def get_peer_list_digest(self):
+        """
+        Return the digest of the peer list (including the node itself) to check if two nodes have the same list
+
+        :return: SHA256 digest
+        """
+        return hashlib.sha256(b''.join(sorted(set(self.id_ip_mapping.keys()) | {self.node_id}))).digest()
+
+    def store_resource_locally(self, asset_group_id, resource_id, resource_type, resource):
+        """
+        (internal use) store the resource received by REQUEST_STORE
+
+        :param asset_group_id:
+        :param resource_id:
+        :param resource_type: ResourceType value
+        :param resource:
+        :return:
+        """
+        if resource_type == ResourceType.Transaction_data:
+            self.network.core.insert_transaction(asset_group_id, resource, None, no_network_put=True)
+        elif resource_type == ResourceType.Asset_file:
+            # TODO: need to check validity of the file
+            self.network.core.storage_manager.store_locally(self.domain_id, asset_group_id, resource_id, resource)
+
+    def find_resource_locally(self, asset_group_id, resource_id, resource_type):
+        """
+        (internal use) search for the resource in the ledger/storage of this node.
+        For Asset_ID, the transaction including the asset is returned.
+
+        :param asset_group_id:
+        :param resource_id:
+        :param resource_type: ResourceType value
+        :return: resource_id, resource_type and the resource (None if not found)
+        """
+        result = None
+        if resource_type == ResourceType.Asset_file:
+            # resource_id is asset_id
+            result = self.network.core.storage_manager.get_locally(self.domain_id, asset_group_id, resource_id)
+        elif resource_type == ResourceType.Transaction_data:
+            # resource_id is txid
+            result = self.network.core.ledger_manager.find_locally(self.domain_id, asset_group_id,
+                                                                   resource_id, resource_type)
+        elif resource_type == ResourceType.Asset_ID:
+            # resource_id at this point is asset_id
+            res = self.network.core.ledger_manager.find_locally(self.domain_id, asset_group_id,
+                                                                resource_id, resource_type)  # res=txid
+            if res is not None:
+                resource_id = res
+                resource_type = ResourceType.Transaction_data
+                result = self.network.core.ledger_manager.find_locally(self.domain_id, asset_group_id,
+                                                                       resource_id, resource_type)
+        return resource_id, resource_type, result
 
     def send_ping(self, target_id, nonce=None):
         msg = self.make_message(dst_node_id=target_id, nonce=nonce, msg_type=InfraMessageTypeBase.REQUEST_PING)
@@ -1069,6 +1569,8 @@ class DomainBase:
         return self.send_message_to_peer(msg, self.default_payload_type)
 
     def leave_domain(self):
+        if self.anti_entropy is not None:
+            self.anti_entropy.stop()
         msg = self.make_message(dst_node_id=ZEROS, nonce=None, msg_type=InfraMessageTypeBase.NOTIFY_LEAVE)
         nodelist = list(self.id_ip_mapping.keys())
         for nd in nodelist:
@@ -165,6 +165,19 @@ class BBcStorage:
                 pass
         return None
 
+    def get_asset_ids(self, domain_id, asset_group_id):
+        """
+        List asset_ids of the files in local storage in ascending order (for a snapshot)
+
+        :param domain_id:
+        :param asset_group_id
+        :return:       list of asset_ids
+        """
+        if domain_id not in self.storage_type or asset_group_id not in self.storage_type[domain_id] or \
+                self.storage_type[domain_id][asset_group_id] != StorageType.FILESYSTEM:
+            return []
+        return [binascii.a2b_hex(name) for name in sorted(os.listdir(self.storage_path[domain_id][asset_group_id]))]
+
     def remove(self, domain_id, asset_group_id, asid):
         """
         Remove the file with the asset_id
@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2017 beyond-blockchain.org.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from gevent import monkey
+monkey.patch_all()
+import gevent
+import gevent.event
+import gevent.queue
+import socket
+import time
+import binascii
+
+import sys
+sys.path.extend(["../../"])
+from bbc1.common import logger, message_key_types
+from bbc1.core import query_management
+
+
+IDLE_TIMEOUT = 300
+SWEEP_INTERVAL = 60
+MAX_CONNECTIONS_PER_PEER = 2
+WRITE_QUEUE_SIZE = 256
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+CONNECT_TIMEOUT = 5
+RECV_BUFFER_SIZE = 8192
+
+ticker = query_management.get_ticker()
+
+
+def get_address(nodeinfo):
+    """
+    Choose the address to connect to from NodeInfo (IPv4 is preferred)
+
+    :param nodeinfo: NodeInfo object
+    :return: address string
+    """
+    if nodeinfo.ipv4 not in ("", "0.0.0.0") or nodeinfo.ipv6 in ("", "::"):
+        return nodeinfo.ipv4
+    return nodeinfo.ipv6
+
+
+def get_pool_key(nodeinfo):
+    """
+    Make the key of a connection in the pool (node_id, address, port)
+
+    :param nodeinfo: NodeInfo object
+    :return: tuple
+    """
+    return nodeinfo.node_id, get_address(nodeinfo), nodeinfo.port
+
+
+def set_keepalive(sock):
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except (OSError, AttributeError):
+        pass
+
+
+class PeerConnection:
+    """
+    TCP connection to/from a peer core node, which is kept open for reuse
+    """
+    def __init__(self, pool, sock=None, key=None):
+        """
+        Create connection object. If sock is None, the connection is established by the writer greenlet.
+        For an accepted socket, the caller runs reader_loop() in its own greenlet.
+
+        :param pool:  ConnectionPool object
+        :param sock:  accepted socket (None for outgoing connection)
+        :param key:   pool key (node_id, address, port), None if not known yet
+        """
+        self.pool = pool
+        self.sock = sock
+        self.key = key
+        self.inbound = sock is not None
+        self.write_queue = gevent.queue.Queue(maxsize=pool.write_queue_size)
+        self.high_water = max(1, pool.write_queue_size * 3 // 4)
+        self.writable = gevent.event.Event()
+        self.writable.set()
+        self.last_used = time.time()
+        self.closed = False
+        self.reader = None
+        self.sending = None
+        self.codec = message_key_types.MessageCodec(max_message_size=pool.max_message_size)
+        if sock is not None:
+            set_keepalive(sock)
+        self.writer = gevent.spawn(self.writer_loop)
+
+    def send(self, data):
+        """
+        Put data in the write queue
+
+        :param data: serialized message or list of [header, body] (see message_key_types.make_message_parts)
+        :return: True if queued
+        """
+        if self.closed:
+            return False
+        try:
+            self.write_queue.put_nowait(data)
+        except gevent.queue.Full:
+            return False
+        if self.pending() >= self.high_water:
+            self.writable.clear()
+        self.last_used = time.time()
+        return True
+
+    def pending(self):
+        """
+        Return the number of messages waiting to be written
+
+        :return:
+        """
+        return self.write_queue.qsize()
+
+    def connect(self):
+        """
+        (internal use) establish the outgoing connection
+
+        :return: True if connected
+        """
+        try:
+            self.sock = socket.create_connection((self.key[1], self.key[2]), timeout=CONNECT_TIMEOUT)
+            self.sock.settimeout(None)
+        except OSError as e:
+            self.pool.logger.info("Fail to connect to %s:%d (%s)" % (self.key[1], self.key[2], e))
+            return False
+        set_keepalive(self.sock)
+        gevent.spawn(self.reader_loop)
+        return True
+
+    def writer_loop(self):
+        """
+        (internal use) send queued data over the connection
+
+        :return:
+        """
+        if self.sock is None and not self.connect():
+            self.close()
+            return
+        try:
+            while True:
+                self.sending = self.write_queue.get()
+                if isinstance(self.sending, list):
+                    message_key_types.sendall_message_parts(self.sock, self.sending)
+                else:
+                    self.sock.sendall(self.sending)
+                self.sending = None
+                self.last_used = time.time()
+                if not self.writable.is_set() and self.pending() <= self.high_water // 2:
+                    self.writable.set()
+        except OSError as e:
+            self.pool.logger.debug("TCP send error: %s" % e)
+        self.close()
+
+    def reader_loop(self):
+        """
+        Receive messages from the connection (the peer can reuse it to send messages back).
+        Reading is paused while the write queue is congested, and the connection is closed if the peer misbehaves.
+
+        :return:
+        """
+        self.reader = gevent.getcurrent()
+        try:
+            while not self.closed:
+                self.writable.wait()
+                buf = self.sock.recv(RECV_BUFFER_SIZE)
+                if len(buf) == 0:
+                    break
+                self.last_used = time.time()
+                if not self.process_received_messages(buf):
+                    break
+        except OSError as e:
+            self.pool.logger.debug("TCP recv error: %s" % e)
+        self.close()
+
+    def process_received_messages(self, buf):
+        """
+        (internal use) decode received data and pass the messages to the callback
+
+        :param buf: received data
+        :return: False if the peer sent an invalid message
+        """
+        try:
+            messages = self.codec.feed(buf)
+        except Exception as e:
+            self.pool.logger.info("Close TCP connection: bad message (%s)" % e)
+            return False
+        for payload_type, msg in messages:
+            if self.pool.callback(self, msg, payload_type) is False:
+                self.pool.logger.info("Close TCP connection: invalid message")
+                return False
+        return True
+
+    def close(self):
+        """
+        Close the connection and remove it from the pool.
+        The messages not sent yet are dropped and reported to the pool.
+
+        :return:
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.pool.remove(self)
+        dropped = self.pending() + (0 if self.sending is None else 1)
+        if dropped > 0:
+            self.pool.report_dropped(self, dropped)
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+        current = gevent.getcurrent()
+        for g in (self.reader, self.writer):
+            if g is not None and g is not current:
+                g.kill(block=False)
+
+
+class ConnectionPool:
+    """
+    Pool of TCP connections to peer core nodes keyed by (node_id, address, port)
+    """
+    def __init__(self, callback, idle_timeout=IDLE_TIMEOUT, max_connections_per_peer=MAX_CONNECTIONS_PER_PEER,
+                 write_queue_size=WRITE_QUEUE_SIZE, max_message_size=MAX_MESSAGE_SIZE, callback_dropped=None,
+                 loglevel="all", logname=None):
+        """
+        Create the pool
+
+        :param callback: function(connection, msg, payload_type) called for every received message.
+                         If it returns False, the connection is closed.
+        :param callback_dropped: function(node_id, count) called when messages to the peer are dropped
+                                 (the connection failed or was closed before they were sent)
+        :param idle_timeout: idle connections are closed after this period (sec)
+        :param max_connections_per_peer: max number of concurrent connections to a peer
+        :param write_queue_size: max number of messages waiting in a connection
+        :param max_message_size: connections sending a larger message are closed
+        """
+        self.logger = logger.get_logger(key="connection_pool", level=loglevel, logname=logname)
+        self.callback = callback
+        self.callback_dropped = callback_dropped
+        self.idle_timeout = idle_timeout
+        self.max_connections_per_peer = max_connections_per_peer
+        self.write_queue_size = write_queue_size
+        self.max_message_size = max_message_size
+        self.connections = dict()
+        self.anonymous = set()
+        self.set_sweep_timer()
+
+    def set_sweep_timer(self):
+        query_management.exec_func_after(self.sweep_idle_connections, min(SWEEP_INTERVAL, self.idle_timeout))
+
+    def sweep_idle_connections(self, query_entry=None):
+        """
+        (internal use) close connections that have not been used for idle_timeout
+
+        :param query_entry:
+        :return:
+        """
+        deadline = time.time() - self.idle_timeout
+        conns = list(self.anonymous)
+        for lst in self.connections.values():
+            conns.extend(lst)
+        for conn in conns:
+            if conn.last_used < deadline and conn.pending() == 0:
+                conn.close()
+        self.set_sweep_timer()
+
+    def add_accepted(self, sock):
+        """
+        Keep an accepted connection in the pool. It is bound to a peer when the first message arrives.
+        The caller must run reader_loop() of the returned object.
+
+        :param sock:
+        :return: PeerConnection object
+        """
+        conn = PeerConnection(self, sock=sock)
+        self.anonymous.add(conn)
+        return conn
+
+    def bind(self, conn, nodeinfo):
+        """
+        Associate an accepted connection with the peer so that it can be reused for sending
+
+        :param conn: PeerConnection object
+        :param nodeinfo: NodeInfo object of the peer
+        :return:
+        """
+        if conn.key is not None or conn.closed:
+            return
+        key = get_pool_key(nodeinfo)
+        conns = self.connections.setdefault(key, [])
+        if len(conns) >= self.max_connections_per_peer:
+            return
+        self.anonymous.discard(conn)
+        conn.key = key
+        conns.append(conn)
+        self.logger.debug("bind TCP connection to %s" % binascii.b2a_hex(nodeinfo.node_id[:4]))
+
+    def remove(self, conn):
+        """
+        (internal use) remove the connection from the pool
+
+        :param conn:
+        :return:
+        """
+        self.anonymous.discard(conn)
+        if conn.key is None or conn.key not in self.connections:
+            return
+        conns = self.connections[conn.key]
+        if conn in conns:
+            conns.remove(conn)
+        if len(conns) == 0:
+            del self.connections[conn.key]
+
+    def report_dropped(self, conn, count):
+        """
+        (internal use) log the messages dropped by the connection and tell it to the owner of the pool
+
+        :param conn: PeerConnection object
+        :param count: the number of the dropped messages
+        :return:
+        """
+        if conn.key is None:
+            self.logger.warning("drop %d messages on an unbound TCP connection" % count)
+            return
+        self.logger.warning("drop %d messages to %s:%d" % (count, conn.key[1], conn.key[2]))
+        if self.callback_dropped is not None:
+            self.callback_dropped(conn.key[0], count)
+
+    def get_connection(self, nodeinfo):
+        """
+        Get the least loaded connection to the peer. A new connection is opened if all are busy
+
+        :param nodeinfo: NodeInfo object
+        :return: PeerConnection object
+        """
+        key = get_pool_key(nodeinfo)
+        conns = self.connections.setdefault(key, [])
+        conn = min(conns, key=lambda c: c.pending()) if len(conns) > 0 else None
+        if conn is None or (conn.pending() > 0 and len(conns) < self.max_connections_per_peer):
+            conn = PeerConnection(self, key=key)
+            conns.append(conn)
+        return conn
+
+    def send(self, nodeinfo, data):
+        """
+        Send data to the peer over a pooled connection
+
+        :param nodeinfo: NodeInfo object
+        :param data: serialized message
+        :return: True if queued
+        """
+        if not self.get_connection(nodeinfo).send(data):
+            self.logger.warning("write queue to %s:%d is full" % (get_address(nodeinfo), nodeinfo.port))
+            return False
+        return True
+
+    def close_all(self):
+        """
+        Close all connections in the pool
+
+        :return:
+        """
+        conns = list(self.anonymous)
+        for lst in self.connections.values():
+            conns.extend(lst)
+        for conn in conns:
+            conn.close()
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2017 beyond-blockchain.org.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import binascii
+import random
+import time
+
+import sys
+sys.path.extend(["../../"])
+from bbc1.common.message_key_types import KeyType
+from bbc1.core import bbc_network, query_management
+
+
+PROTOCOL_PERIOD = 5         # one peer is probed in a period
+PING_TIMEOUT = 1            # indirect pings are requested if the peer does not respond within this period
+INDIRECT_PING_NUM = 3
+SUSPECT_TIMEOUT = 15        # a suspected peer is regarded as failed if nothing is received in this period
+
+ticker = query_management.get_ticker()
+
+
+class FailureDetector:
+    """
+    SWIM-style failure detector. A peer is probed in each protocol period (in round-robin order of a shuffled list),
+    and if it does not respond, other peers are asked to ping it. A peer that does not respond to both is suspected,
+    and regarded as failed if nothing is received from it for SUSPECT_TIMEOUT.
+    The number of pings does not depend on the number of peers.
+    """
+    def __init__(self, domain, protocol_period=PROTOCOL_PERIOD, ping_timeout=PING_TIMEOUT,
+                 indirect_ping_num=INDIRECT_PING_NUM, suspect_timeout=SUSPECT_TIMEOUT):
+        """
+        Start probing
+
+        :param domain: DomainBase object
+        :param protocol_period: interval of probes (sec)
+        :param ping_timeout: time to wait for the response of a direct ping (sec)
+        :param indirect_ping_num: number of peers to ask for indirect pings
+        :param suspect_timeout: time to wait before regarding a suspected peer as failed (sec)
+        """
+        self.domain = domain
+        self.protocol_period = protocol_period
+        self.ping_timeout = ping_timeout
+        self.indirect_ping_num = indirect_ping_num
+        self.suspect_timeout = suspect_timeout
+        self.probe_list = []
+        self.suspects = dict()
+        self.timer = None
+        self.set_timer()
+
+    def set_timer(self):
+        self.timer = query_management.exec_func_after(self.probe, self.protocol_period)
+
+    def stop(self):
+        self.timer.deactivate()
+
+    def next_target(self):
+        """
+        (internal use) choose the peer to probe (every peer is probed once in a round)
+
+        :return: node_id (None if no peer)
+        """
+        while len(self.probe_list) > 0:
+            node_id = self.probe_list.pop()
+            if node_id in self.domain.id_ip_mapping:
+                return node_id
+        self.probe_list = list(self.domain.id_ip_mapping.keys())
+        random.shuffle(self.probe_list)
+        if len(self.probe_list) == 0:
+            return None
+        return self.probe_list.pop()
+
+    def probe(self, query_entry=None):
+        """
+        (internal use) check the suspected peers and probe the next peer
+
+        :param query_entry:
+        :return:
+        """
+        self.set_timer()
+        self.check_suspects()
+        node_id = self.next_target()
+        if node_id is None:
+            return
+        entry = query_management.QueryEntry(expire_after=self.protocol_period * 0.8,
+                                            callback_expire=self.probe_failed,
+                                            callback=self.probe_succeeded,
+                                            callback_error=self.send_indirect_pings,
+                                            data={KeyType.node_id: node_id, 'sent_at': time.time()},
+                                            retry_count=1)
+        entry.update(fire_after=self.ping_timeout)
+        self.domain.record_request(node_id)
+        self.domain.send_ping(node_id, nonce=entry.nonce)
+
+    def send_indirect_pings(self, entry):
+        """
+        (internal use) ask other peers to ping the target
+
+        :param entry: QueryEntry of the probe
+        :return:
+        """
+        target_id = entry.data[KeyType.node_id]
+        peers = [nd for nd in self.domain.id_ip_mapping.keys() if nd != target_id and nd not in self.suspects]
+        for nd in random.sample(peers, min(self.indirect_ping_num, len(peers))):
+            msg = self.domain.make_message(dst_node_id=nd, nonce=entry.nonce,
+                                           msg_type=bbc_network.InfraMessageTypeBase.REQUEST_INDIRECT_PING)
+            msg[KeyType.node_id] = target_id
+            self.domain.send_message_to_peer(msg, self.domain.default_payload_type)
+
+    def probe_succeeded(self, entry):
+        self.suspects.pop(entry.data[KeyType.node_id], None)
+
+    def probe_failed(self, entry):
+        node_id = entry.data[KeyType.node_id]
+        self.domain.record_loss(node_id)
+        if node_id in self.domain.id_ip_mapping and node_id not in self.suspects:
+            self.domain.logger.debug("[%s] suspect %s" % (self.domain.shortname, binascii.b2a_hex(node_id[:4])))
+            self.suspects[node_id] = time.time()
+
+    def check_suspects(self):
+        """
+        (internal use) clear the suspicion of the peers heard from, and remove the peers failed
+
+        :return:
+        """
+        now = time.time()
+        for node_id, suspected_at in list(self.suspects.items()):
+            nodeinfo = self.domain.id_ip_mapping.get(node_id)
+            if nodeinfo is None or nodeinfo.updated_at > suspected_at:
+                del self.suspects[node_id]
+            elif now - suspected_at > self.suspect_timeout:
+                del self.suspects[node_id]
+                self.domain.logger.info("[%s] %s failed" % (self.domain.shortname, binascii.b2a_hex(node_id[:4])))
+                self.domain.peer_failed(node_id)
+
+    def process_REQUEST_INDIRECT_PING(self, msg):
+        """
+        Ping the target on behalf of the requester
+
+        :param msg:
+        :return:
+        """
+        target_id = msg[KeyType.node_id]
+        if target_id not in self.domain.id_ip_mapping:
+            return
+        entry = query_management.QueryEntry(expire_after=self.ping_timeout * 2,
+                                            callback=self.respond_indirect_ping,
+                                            data={KeyType.node_id: target_id,
+                                                  KeyType.source_node_id: msg[KeyType.source_node_id],
+                                                  KeyType.nonce: msg[KeyType.nonce]},
+                                            retry_count=0)
+        self.domain.send_ping(target_id, nonce=entry.nonce)
+
+    def respond_indirect_ping(self, entry):
+        msg = self.domain.make_message(dst_node_id=entry.data[KeyType.source_node_id], nonce=entry.data[KeyType.nonce],
+                                       msg_type=bbc_network.InfraMessageTypeBase.RESPONSE_INDIRECT_PING)
+        msg[KeyType.node_id] = entry.data[KeyType.node_id]
+        self.domain.send_message_to_peer(msg, self.domain.default_payload_type)
+
+    def process_RESPONSE_INDIRECT_PING(self, msg):
+        """
+        The target responded to the ping of another peer
+
+        :param msg:
+        :return:
+        """
+        entry = ticker.get_entry(msg[KeyType.nonce])
+        if entry is None or not entry.active or entry.data[KeyType.node_id] != msg[KeyType.node_id]:
+            return
+        self.domain.record_cancel(entry.data[KeyType.node_id])
+        entry.callback()
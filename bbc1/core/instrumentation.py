@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2017 beyond-blockchain.org.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import bisect
+import cProfile
+import os
+import random
+import time
+
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+PROFILE_SAMPLE_RATE = 0.01
+
+
+class LatencyHistogram:
+    """
+    Histogram of latencies with fixed bucket boundaries (upper bounds in sec, the last bucket has no upper bound)
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def clear(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, elapsed, error=False):
+        self.counts[bisect.bisect_left(self.buckets, elapsed)] += 1
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        if error:
+            self.errors += 1
+
+    def percentile(self, p):
+        """
+        Estimate the percentile by the upper bound of the bucket (max if it falls in the last bucket)
+
+        :param p: 0-100
+        :return: latency (sec)
+        """
+        if self.count == 0:
+            return 0.0
+        rank = self.count * p / 100
+        accumulated = 0
+        for i, num in enumerate(self.counts):
+            accumulated += num
+            if accumulated >= rank and num > 0:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def get_stats(self):
+        """
+        :return: dictionary of count, errors, mean/max/percentiles (msec) and counts of the buckets
+        """
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean': self.total / self.count * 1000 if self.count > 0 else 0.0,
+            'max': self.max * 1000,
+            'p50': self.percentile(50) * 1000,
+            'p90': self.percentile(90) * 1000,
+            'p99': self.percentile(99) * 1000,
+            'buckets': dict(zip(["<=%g" % (b * 1000) for b in self.buckets] + ["inf"], self.counts)),
+        }
+
+
+class Span:
+    """
+    Context manager to measure a section of code
+    """
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.histogram.record(time.perf_counter() - self.start, exc_type is not None)
+        return False
+
+
+class NullSpan:
+    """
+    Span that does nothing (used when spans are disabled)
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Instrumentation:
+    """
+    Counters and latency histograms of commands and spans, and a sampling profiler.
+    Commands are measured by the functions made by wrap() (or by run()),
+    spans (sections of code inside commands) by "with span(name):".
+    While profiling is on, a command is run under cProfile with the probability of sample_rate,
+    and the accumulated statistics are written into the working directory when profiling is stopped.
+    """
+    def __init__(self, workingdir=".", enabled=True, spans_enabled=False):
+        """
+        Create object
+
+        :param workingdir: directory to write the profile data
+        :param enabled: measure commands
+        :param spans_enabled: measure spans
+        """
+        self.workingdir = workingdir
+        self.enabled = enabled
+        self.spans_enabled = spans_enabled
+        self.commands = dict()
+        self.spans = dict()
+        self.started_at = time.time()
+        self.profile = None
+        self.profile_sample_rate = PROFILE_SAMPLE_RATE
+        self.profile_started_at = None
+        self.profiling = False
+        self.profiled_count = 0
+
+    def wrap(self, name, func):
+        """
+        Make the function that calls func and records the latency under the name
+        (error is recorded if an exception is raised)
+
+        :param name: command name
+        :param func:
+        :return: function taking the same arguments as func (func itself if not enabled)
+        """
+        if not self.enabled:
+            return func
+        histogram = self.commands.get(name)
+        if histogram is None:
+            histogram = self.commands.setdefault(name, LatencyHistogram())
+
+        def measured(*args):
+            error = True
+            start = time.perf_counter()
+            try:
+                if self.profile is not None and not self.profiling and random.random() < self.profile_sample_rate:
+                    result = self.run_with_profile(func, *args)
+                else:
+                    result = func(*args)
+                error = False
+                return result
+            finally:
+                histogram.record(time.perf_counter() - start, error)
+        return measured
+
+    def run(self, name, func, *args):
+        """
+        Call func(*args) and record the latency under the name
+
+        :param name: command name
+        :param func:
+        :param args:
+        :return: return value of func
+        """
+        return self.wrap(name, func)(*args)
+
+    def run_with_profile(self, func, *args):
+        """
+        (internal use) call func under cProfile (only one call is profiled at a time, as a call may yield to
+        another greenlet in it)
+        """
+        self.profiling = True
+        self.profiled_count += 1
+        try:
+            return self.profile.runcall(func, *args)
+        finally:
+            self.profiling = False
+
+    def span(self, name):
+        """
+        Return the context manager to measure the section
+
+        :param name: span name
+        :return: Span (or NullSpan if spans are disabled)
+        """
+        if not self.spans_enabled:
+            return NULL_SPAN
+        histogram = self.spans.get(name)
+        if histogram is None:
+            histogram = self.spans.setdefault(name, LatencyHistogram())
+        return Span(histogram)
+
+    def get_stats(self):
+        """
+        :return: dictionary of the statistics of commands and spans
+        """
+        return {
+            'uptime': time.time() - self.started_at,
+            'commands': {name: h.get_stats() for name, h in self.commands.items() if h.count > 0},
+            'spans': {name: h.get_stats() for name, h in self.spans.items() if h.count > 0},
+            'profiling': self.profile is not None,
+        }
+
+    def reset(self):
+        for histogram in list(self.commands.values()) + list(self.spans.values()):
+            histogram.clear()
+        self.started_at = time.time()
+
+    def start_profile(self, sample_rate=None):
+        """
+        Start profiling (the statistics of the previous profiling are discarded if not stopped)
+
+        :param sample_rate: probability that a command is profiled (0-1)
+        :return:
+        """
+        if sample_rate is not None:
+            self.profile_sample_rate = sample_rate
+        self.profile = cProfile.Profile()
+        self.profile_started_at = time.time()
+        self.profiled_count = 0
+
+    def stop_profile(self):
+        """
+        Stop profiling and write the statistics (readable with pstats) into the working directory
+
+        :return: path of the written file (None if not profiling)
+        """
+        if self.profile is None:
+            return None
+        profile = self.profile
+        self.profile = None
+        path = os.path.join(self.workingdir, "profile-%s.prof" % time.strftime("%Y%m%d-%H%M%S",
+                                                                               time.localtime(self.profile_started_at)))
+        profile.dump_stats(path)
+        return path
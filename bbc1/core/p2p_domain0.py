@@ -15,6 +15,7 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import binascii
+import hashlib
 import time
 import random
 import struct
@@ -31,31 +32,166 @@ FORWARD_CACHE_SIZE = 1000
 ZEROS = bytes([0] * 32)
 
 ASSET_GROUP_INFO_LIFETIME = 1800
+GENERATIONS = 4             # the entries are swept every ASSET_GROUP_INFO_LIFETIME/GENERATIONS
+FULL_ADVERTISE_ROUNDS = 8   # the full list is advertised once in this number of rounds (deltas otherwise)
+MAX_ASSET_GROUPS_PER_MESSAGE = 0xFFFF
+LIST_REQUEST_INTERVAL = 10  # min interval (sec) of requesting the full list to the same node
 
 ticker = query_management.get_ticker()
 
 
-class AssetGroupInfo:
-    def __init__(self, asset_group_id, del_func):
-        self.asset_group_id = asset_group_id
-        self.asset_groups = dict()
-        self.del_func = del_func
+def make_asset_group_list(asset_group_ids):
+    """
+    (internal use) make binary asset_group_list
 
-    def get_nodes(self):
-        return self.asset_groups.keys()
+    :param asset_group_ids:
+    :return: binary data of count,asset_group_id,asset_group_id,,,
+    """
+    data = bytearray(to_2byte(len(asset_group_ids)))
+    for asset_group_id in asset_group_ids:
+        data.extend(asset_group_id)
+    return bytes(data)
 
-    def add_node(self, node_id):
-        if node_id not in self.asset_groups:
-            self.asset_groups[node_id] = query_management.QueryEntry(expire_after=ASSET_GROUP_INFO_LIFETIME,
-                                                                     callback_expire=self.remove_entry,
-                                                                     data={KeyType.node_id: node_id},
-                                                                     retry_count=0)
-        else:
-            self.asset_groups[node_id].update_expiration_time(ASSET_GROUP_INFO_LIFETIME)
 
-    def remove_entry(self, query_entry):
-        self.asset_groups.pop(query_entry.data[KeyType.node_id], None)
-        self.del_func(self.asset_group_id)
+def parse_asset_group_list(data):
+    """
+    (internal use) parse binary asset_group_list
+
+    :param data:
+    :return: list of asset_group_id
+    """
+    count = struct.unpack(">H", data[:2])[0]
+    return [bytes(data[2+i*32:2+(i+1)*32]) for i in range(count)]
+
+
+def get_asset_group_digest(asset_group_ids):
+    """
+    (internal use) digest of the set of asset_group_ids to check if two nodes have the same list
+
+    :param asset_group_ids:
+    :return: SHA256 digest
+    """
+    return hashlib.sha256(b''.join(sorted(asset_group_ids))).digest()
+
+
+class AssetGroupDirectory:
+    """
+    Index of the asset_groups advertised by the nodes in domain_global_0 (asset_group -> nodes and node -> asset_groups).
+    The entries of a node are refreshed together whenever the node advertises, and expire by a sweep per generation.
+    The version of the list advertised last by each node is kept to detect lost deltas.
+    """
+    def __init__(self, lifetime=ASSET_GROUP_INFO_LIFETIME, generations=GENERATIONS):
+        self.generations = generations
+        self.generation = 0
+        self.nodes_of = dict()          # asset_group_id: set of node_id
+        self.asset_groups_of = dict()   # node_id: set of asset_group_id
+        self.generation_of = dict()     # node_id: generation
+        self.version_of = dict()        # node_id: version of the advertised list
+        self.refreshed = dict()         # generation: set of node_id
+        self.sweep_entry = None
+        if lifetime is not None:
+            self.sweep_interval = lifetime / generations
+            self.set_sweep_timer()
+
+    def __len__(self):
+        return len(self.nodes_of)
+
+    def set_sweep_timer(self):
+        self.sweep_entry = query_management.exec_func_after(self.sweep, self.sweep_interval)
+
+    def stop(self):
+        if self.sweep_entry is not None:
+            self.sweep_entry.deactivate()
+
+    def sweep(self, query_entry=None):
+        """
+        (internal use) advance the generation and remove the nodes not refreshed in the last generations
+
+        :param query_entry:
+        :return:
+        """
+        self.generation += 1
+        for gen in [g for g in self.refreshed.keys() if g <= self.generation - self.generations]:
+            for node_id in self.refreshed.pop(gen):
+                self.remove_node(node_id)
+        if query_entry is not None:
+            self.set_sweep_timer()
+
+    def refresh(self, node_id):
+        """
+        Mark the entries of the node as alive in the current generation
+
+        :param node_id:
+        :return:
+        """
+        gen = self.generation_of.get(node_id)
+        if gen == self.generation:
+            return
+        if gen is not None:
+            self.refreshed[gen].discard(node_id)
+        self.generation_of[node_id] = self.generation
+        self.refreshed.setdefault(self.generation, set()).add(node_id)
+
+    def update(self, node_id, added=(), withdrawn=(), replace=False, version=None):
+        """
+        Apply the asset_groups advertised by the node
+
+        :param node_id:
+        :param added: asset_group_ids newly advertised
+        :param withdrawn: asset_group_ids no longer advertised
+        :param replace: True if added is the full list of the node
+        :param version: version of the list advertised by the node (None if not given)
+        :return:
+        """
+        if version is not None:
+            self.version_of[node_id] = version
+        current = self.asset_groups_of.setdefault(node_id, set())
+        if replace:
+            withdrawn = current.difference(added)
+        for asset_group_id in withdrawn:
+            self.remove(asset_group_id, node_id)
+        for asset_group_id in added:
+            self.nodes_of.setdefault(asset_group_id, set()).add(node_id)
+            current.add(asset_group_id)
+        self.refresh(node_id)
+
+    def remove(self, asset_group_id, node_id):
+        self.asset_groups_of.get(node_id, set()).discard(asset_group_id)
+        nodes = self.nodes_of.get(asset_group_id)
+        if nodes is None:
+            return
+        nodes.discard(node_id)
+        if len(nodes) == 0:
+            del self.nodes_of[asset_group_id]
+
+    def remove_node(self, node_id):
+        """
+        Remove all entries of the node
+
+        :param node_id:
+        :return:
+        """
+        for asset_group_id in self.asset_groups_of.pop(node_id, set()):
+            self.remove(asset_group_id, node_id)
+        self.version_of.pop(node_id, None)
+        gen = self.generation_of.pop(node_id, None)
+        if gen is not None and gen in self.refreshed:
+            self.refreshed[gen].discard(node_id)
+
+    def get_nodes(self, asset_group_id):
+        return self.nodes_of.get(asset_group_id, set())
+
+    def get_asset_groups(self, node_id):
+        return self.asset_groups_of.get(node_id, set())
+
+    def get_version(self, node_id):
+        return self.version_of.get(node_id)
+
+    def get_digest(self, node_id):
+        return get_asset_group_digest(self.get_asset_groups(node_id))
+
+    def get_asset_group_ids(self):
+        return self.nodes_of.keys()
 
 
 class NetworkDomain(simple_cluster.NetworkDomain):
@@ -65,7 +201,12 @@ class NetworkDomain(simple_cluster.NetworkDomain):
     def __init__(self, network=None, config=None, domain_id=None, node_id=None, loglevel="all", logname=None):
         super(NetworkDomain, self).__init__(network, config, domain_id, node_id, loglevel, logname)
         self.module_name = "simple_cluster"  # TODO: this is temporary module
-        self.asset_group_list = dict()
+        self.asset_group_directory = AssetGroupDirectory()
+        self.advertised_asset_groups = set()
+        self.advertised_peers = set()
+        self.advertise_round = 0
+        self.advertise_version = 0
+        self.list_requested_at = dict()
         self.periodic_advertising_asset_group_info()
 
     def domain_manager_loop(self):
@@ -84,51 +225,114 @@ class NetworkDomain(simple_cluster.NetworkDomain):
 
     def advertise_asset_group_info(self):
         """
-        Advertise domain information in domain_global_0
+        Advertise domain information in domain_global_0.
+        The full list is sent to new peers and once in FULL_ADVERTISE_ROUNDS, and the others receive only the changes
+        since the last advertisement (an empty one still refreshes the entries of this node in the peers).
+        The version of the list (incremented on each change) and its digest are attached, so that a peer missing
+        some changes requests the full list.
 
         :return:
         """
-        data = bytearray()
-        count = len(self.network.asset_groups_to_advertise)
-        data.extend(to_2byte(count))
-        for asset_group_id in self.network.asset_groups_to_advertise:
-            data.extend(asset_group_id)
-
-        msg = self.make_message(dst_node_id=None, msg_type=InfraMessageTypeBase.ADVERTISE_ASSET_GROUP)
-        msg[KeyType.asset_group_list] = bytes(data)
-        for nd in self.id_ip_mapping.keys():
+        current = set(sorted(self.network.asset_groups_to_advertise)[:MAX_ASSET_GROUPS_PER_MESSAGE])
+        full = self.advertise_round % FULL_ADVERTISE_ROUNDS == 0
+        self.advertise_round += 1
+        if current != self.advertised_asset_groups:
+            self.advertise_version += 1
+        full_msg = self.make_advertisement(current)
+        delta_msg = self.make_advertisement(current - self.advertised_asset_groups,
+                                            withdrawn=self.advertised_asset_groups - current,
+                                            digest=get_asset_group_digest(current))
+        peers = list(self.id_ip_mapping.keys())
+        for nd in peers:
+            msg = full_msg if full or nd not in self.advertised_peers else delta_msg
             msg[KeyType.destination_node_id] = nd
             self.send_message_to_peer(msg)
+        self.advertised_asset_groups = current
+        self.advertised_peers = set(peers)
 
-    def update_asset_group_info(self, source_node_id, asset_group_id):
+    def make_advertisement(self, asset_group_ids, withdrawn=None, digest=None):
         """
-        (internal use) update asset_group info (self.asset_group_list)
+        (internal use) make ADVERTISE_ASSET_GROUP message with the current version
 
-        :param source_node_id:
-        :param asset_group_id:
+        :param asset_group_ids: the full list, or asset_group_ids newly advertised if withdrawn is given
+        :param withdrawn: asset_group_ids no longer advertised (None for the full list)
+        :param digest: digest of the full list (calculated from asset_group_ids if None)
+        :return: message
+        """
+        msg = self.make_message(dst_node_id=None, msg_type=InfraMessageTypeBase.ADVERTISE_ASSET_GROUP)
+        msg[KeyType.asset_group_list] = make_asset_group_list(asset_group_ids)
+        if withdrawn is not None:
+            msg[KeyType.asset_group_withdrawn] = make_asset_group_list(withdrawn)
+        msg[KeyType.asset_group_version] = self.advertise_version
+        msg[KeyType.asset_group_digest] = digest if digest is not None else get_asset_group_digest(asset_group_ids)
+        return msg
+
+    def send_asset_group_list(self, node_id):
+        """
+        (internal use) send the full list advertised last to the node
+
+        :param node_id:
         :return:
         """
-        if asset_group_id not in self.asset_group_list:
-            self.asset_group_list[asset_group_id] = AssetGroupInfo(asset_group_id, self.delete_asset_group_from_info)
-        self.asset_group_list[asset_group_id].add_node(source_node_id)
+        msg = self.make_advertisement(self.advertised_asset_groups)
+        msg[KeyType.destination_node_id] = node_id
+        self.send_message_to_peer(msg)
+
+    def request_asset_group_list(self, node_id):
+        if self.list_requested_at.get(node_id, 0) + LIST_REQUEST_INTERVAL > time.time():
+            return
+        self.list_requested_at[node_id] = time.time()
+        msg = self.make_message(dst_node_id=node_id, msg_type=InfraMessageTypeBase.REQUEST_ASSET_GROUP)
+        self.send_message_to_peer(msg)
+
+    def remove_peer_node(self, node_id=ZEROS):
+        super(NetworkDomain, self).remove_peer_node(node_id)
+        self.asset_group_directory.remove_node(node_id)
+        self.advertised_peers.discard(node_id)
+        self.list_requested_at.pop(node_id, None)
+
+    def leave_domain(self):
+        super(NetworkDomain, self).leave_domain()
+        self.asset_group_directory.stop()
+
+    def select_lookup_targets(self, query_entry):
+        """
+        (internal use) choose the nodes advertising the asset_group to ask in get_resource
+
+        :param query_entry:
+        :return: list of node_ids
+        """
+        asked = query_entry.data.setdefault('asked', [])
+        candidates = self.asset_group_directory.get_nodes(query_entry.data[KeyType.asset_group_id])
+        targets = self.select_peers(self.hedged_lookup_num, candidates=candidates, excludes=asked)
+        if len(targets) == 0:
+            asked.clear()
+            targets = self.select_peers(self.hedged_lookup_num, candidates=candidates)
+        asked.extend(targets)
+        return targets
 
-    def delete_asset_group_from_info(self, asset_group_id):
+    def find_resource_locally(self, asset_group_id, resource_id, resource_type):
         """
-        (internal use) delete asset_group_id
+        (internal use) search for the resource in the domain hosting the asset_group
+        (only the asset_groups advertised in domain_global_0 are searched)
 
         :param asset_group_id:
-        :return:
+        :param resource_id:
+        :param resource_type: ResourceType value
+        :return: resource_id, resource_type and the resource (None if not found)
         """
-        if len(self.asset_group_list[asset_group_id].get_nodes()) == 0:
-            self.asset_group_list.pop(asset_group_id, None)
+        domain_id = self.network.core.asset_group_domain_mapping.get(asset_group_id)
+        if asset_group_id not in self.network.asset_groups_to_advertise or domain_id not in self.network.domains:
+            return resource_id, resource_type, None
+        return self.network.domains[domain_id].find_resource_locally(asset_group_id, resource_id, resource_type)
 
     def print_asset_group_info(self):
-        if self.asset_group_list is None:
+        if len(self.asset_group_directory) == 0:
             self.logger.info("** No asset_group_id..")
         self.logger.info("========================")
-        for asset_group_id in self.asset_group_list.keys():
+        for asset_group_id in self.asset_group_directory.get_asset_group_ids():
             self.logger.info("AssetGroup: %s" % binascii.b2a_hex(asset_group_id[:4]))
-            for nd in self.asset_group_list[asset_group_id].get_nodes():
+            for nd in self.asset_group_directory.get_nodes(asset_group_id):
                 self.logger.info("  * node_id: %s" % binascii.b2a_hex(nd[:4]))
         self.logger.info("========================")
 
@@ -149,11 +353,30 @@ class NetworkDomain(simple_cluster.NetworkDomain):
             self.add_peer_node(msg[KeyType.source_node_id], ip4, from_addr)
             self.process_ADVERTISE_ASSET_GROUP(msg)
 
+        elif msg[KeyType.p2p_msg_type] == InfraMessageTypeBase.REQUEST_ASSET_GROUP:
+            self.add_peer_node(msg[KeyType.source_node_id], ip4, from_addr)
+            self.send_asset_group_list(msg[KeyType.source_node_id])
+
     def process_ADVERTISE_ASSET_GROUP(self, msg):
-        source_node_id = msg[KeyType.source_node_id]
-        data = msg[KeyType.asset_group_list]
-        count = struct.unpack(">H", data[:2])[0]
-        ptr = 2
-        for i in range(count):
-            asset_group_id = data[ptr:ptr+32]
-            self.update_asset_group_info(source_node_id, asset_group_id)
+        """
+        Update the asset_group directory (a message without the withdrawn list has the full list of the node).
+        The full list is requested if the delta is for a node without entries, some versions were missed,
+        or the list after applying the delta is different from that of the node.
+
+        :param msg:
+        :return:
+        """
+        node_id = msg[KeyType.source_node_id]
+        added = parse_asset_group_list(msg[KeyType.asset_group_list])
+        version = msg.get(KeyType.asset_group_version)
+        if KeyType.asset_group_withdrawn not in msg:
+            self.asset_group_directory.update(node_id, added, replace=True, version=version)
+            return
+        last_version = self.asset_group_directory.get_version(node_id)
+        withdrawn = parse_asset_group_list(msg[KeyType.asset_group_withdrawn])
+        self.asset_group_directory.update(node_id, added, withdrawn, version=version)
+        if version is None:
+            return
+        if last_version is None or version > last_version + 1 or \
+                msg.get(KeyType.asset_group_digest) != self.asset_group_directory.get_digest(node_id):
+            self.request_asset_group_list(node_id)
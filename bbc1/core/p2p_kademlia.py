@@ -0,0 +1,667 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2017 beyond-blockchain.org.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import binascii
+import time
+
+import sys
+sys.path.extend(["../../"])
+from bbc1.common import bbclib
+from bbc1.common.bbclib import NodeInfo, BBcTransaction
+from bbc1.common.message_key_types import KeyType, PayloadType
+from bbc1.common.lru_cache import LRUCache
+from bbc1.core.bbc_ledger import ResourceType
+from bbc1.core.bbc_network import InfraMessageTypeBase, DomainBase
+from bbc1.core import query_management
+
+
+K_VALUE = 10
+CONCURRENT_LOOKUP_NUM = 3   # alpha
+REDUNDANCY = 3
+ID_BITS = 256
+
+RPC_TIMEOUT = 2
+LOOKUP_TIMEOUT = 8
+INTERVAL_RETRY = 3
+FORWARD_CACHE_SIZE = 1000
+USER_LOCATION_LIFETIME = 3600
+NODE_ENTRY_SIZE = 32 + 4 + 16 + 2   # node_id, ipv4, ipv6, port
+ZEROS = bytes([0] * 32)
+
+RESOURCE_TYPE_USER_LOCATION = 0x80  # value is the node entry of the core node that the user connects to
+
+LOOKUP_WAITING = 0
+LOOKUP_RESPONDED = 1
+LOOKUP_FAILED = 2
+
+ticker = query_management.get_ticker()
+
+
+def xor_distance(id1, id2):
+    return int.from_bytes(id1, 'big') ^ int.from_bytes(id2, 'big')
+
+
+def make_node_entry(node_id, ipv4, ipv6, port):
+    """
+    Make binary node entry (the same format as an entry in DomainBase.make_peer_list())
+
+    :return: bytes of node_id, ipv4, ipv6, port
+    """
+    return bytes(node_id) + bytes(ipv4) + bytes(ipv6) + bytes(port)
+
+
+def parse_node_list(dat):
+    """
+    Parse binary node list made by NetworkDomain.make_node_list()
+
+    :param dat: count (4-byte little endian) and node entries
+    :return: list of NodeInfo
+    """
+    nodes = []
+    count = int.from_bytes(dat[:4], 'little')
+    for i in range(count):
+        base = 4 + i * NODE_ENTRY_SIZE
+        if base + NODE_ENTRY_SIZE > len(dat):
+            break
+        nodeinfo = NodeInfo()
+        nodeinfo.recover_nodeinfo(bytes(dat[base:base+32]), dat[base+32:base+36], dat[base+36:base+52],
+                                  dat[base+52:base+54])
+        nodes.append(nodeinfo)
+    return nodes
+
+
+class RoutingTable:
+    """
+    k-buckets indexed by the bit length of XOR distance from the node itself.
+    Node_ids in a bucket are ordered from the least recently seen.
+    """
+    def __init__(self, node_id, k_value=K_VALUE):
+        self.node_id = node_id
+        self.k_value = k_value
+        self.buckets = [list() for i in range(ID_BITS)]
+
+    def __len__(self):
+        return sum(len(b) for b in self.buckets)
+
+    def __contains__(self, node_id):
+        return node_id in self.get_bucket(node_id)
+
+    def get_bucket(self, node_id):
+        return self.buckets[max(0, xor_distance(self.node_id, node_id).bit_length() - 1)]
+
+    def add(self, node_id):
+        """
+        Add node_id or move it to the tail of the bucket
+
+        :param node_id:
+        :return: the least recently seen node_id in the bucket if the bucket is full (node_id is not added)
+        """
+        if node_id == self.node_id:
+            return None
+        bucket = self.get_bucket(node_id)
+        if node_id in bucket:
+            bucket.remove(node_id)
+            bucket.append(node_id)
+            return None
+        if len(bucket) < self.k_value:
+            bucket.append(node_id)
+            return None
+        return bucket[0]
+
+    def remove(self, node_id):
+        bucket = self.get_bucket(node_id)
+        if node_id in bucket:
+            bucket.remove(node_id)
+
+    def get_all_nodes(self):
+        nodes = []
+        for b in self.buckets:
+            nodes.extend(b)
+        return nodes
+
+    def find_closest(self, target_id, count, exclude=None):
+        """
+        Return node_ids closest to target_id
+
+        :param target_id:
+        :param count: max number of node_ids to return
+        :param exclude: node_id not to include
+        :return: list of node_ids sorted by XOR distance
+        """
+        target = int.from_bytes(target_id, 'big')
+        nodes = [nd for nd in self.get_all_nodes() if nd != exclude]
+        nodes.sort(key=lambda nd: target ^ int.from_bytes(nd, 'big'))
+        return nodes[:count]
+
+
+class IterativeLookup:
+    """
+    Iterative lookup of the k closest nodes to target_id (FIND_NODE) or of the value (FIND_VALUE).
+    At most alpha requests are in flight, and every response adds closer candidates.
+    """
+    def __init__(self, domain, target_id, callback, asset_group_id=None, resource_type=None):
+        """
+        Create lookup
+
+        :param domain: NetworkDomain object
+        :param target_id: node_id or resource_id to look up
+        :param callback: function(lookup) called once when the lookup finishes
+        :param asset_group_id: asset_group_id for FIND_VALUE
+        :param resource_type: ResourceType value for FIND_VALUE (None means FIND_NODE)
+        """
+        self.domain = domain
+        self.target_id = target_id
+        self.target = int.from_bytes(target_id, 'big')
+        self.callback = callback
+        self.asset_group_id = asset_group_id
+        self.resource_type = resource_type
+        self.candidates = dict()
+        self.state = dict()
+        self.value = None
+        self.finished = False
+
+    def start(self):
+        for nd in self.domain.routing_table.find_closest(self.target_id, self.domain.k_value):
+            if nd in self.domain.id_ip_mapping:
+                self.candidates[nd] = self.domain.id_ip_mapping[nd]
+        self.query_next()
+
+    def get_closest(self, state=None):
+        """
+        Return the k closest candidates (excluding those that did not respond)
+
+        :param state: if specified, only the candidates in the state are returned
+        :return: list of node_ids
+        """
+        nodes = [nd for nd in self.candidates.keys() if self.state.get(nd) != LOOKUP_FAILED]
+        nodes.sort(key=lambda nd: self.target ^ int.from_bytes(nd, 'big'))
+        nodes = nodes[:self.domain.k_value]
+        if state is not None:
+            nodes = [nd for nd in nodes if self.state.get(nd) == state]
+        return nodes
+
+    def query_next(self):
+        """
+        (internal use) send requests to the closest candidates that have not been asked yet
+
+        :return:
+        """
+        if self.finished:
+            return
+        waiting = len([s for s in self.state.values() if s == LOOKUP_WAITING])
+        for nd in self.get_closest():
+            if waiting >= self.domain.alpha:
+                break
+            if nd in self.state:
+                continue
+            self.send_request(nd)
+            waiting += 1
+        if waiting == 0:
+            self.finish()
+
+    def send_request(self, node_id):
+        self.state[node_id] = LOOKUP_WAITING
+        query_entry = query_management.QueryEntry(expire_after=RPC_TIMEOUT,
+                                                  callback_expire=self.request_timeout,
+                                                  callback=self.response_received,
+                                                  data={KeyType.node_id: node_id},
+                                                  retry_count=0)
+        if self.resource_type is None:
+            self.domain.send_find_node(self.candidates[node_id], query_entry.nonce, self.target_id)
+        else:
+            self.domain.send_find_value(self.candidates[node_id], query_entry.nonce, self.asset_group_id,
+                                        self.target_id, self.resource_type)
+
+    def response_received(self, query_entry):
+        """
+        (internal use) process RESPONSE_FIND_NODE/RESPONSE_FIND_VALUE
+
+        :param query_entry:
+        :return:
+        """
+        self.state[query_entry.data[KeyType.node_id]] = LOOKUP_RESPONDED
+        if self.finished:
+            return
+        if KeyType.resource in query_entry.data:
+            self.value = query_entry.data
+            self.finish()
+            return
+        for nodeinfo in query_entry.data.get(KeyType.peer_list, []):
+            if nodeinfo.node_id != self.domain.node_id and nodeinfo.node_id not in self.candidates:
+                self.candidates[nodeinfo.node_id] = nodeinfo
+        self.query_next()
+
+    def request_timeout(self, query_entry):
+        self.state[query_entry.data[KeyType.node_id]] = LOOKUP_FAILED
+        self.query_next()
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        self.callback(self)
+
+
+class NetworkDomain(DomainBase):
+    """
+    Compose a P2P network using Kademlia algorithm. Resources are stored in the nodes closest to the resource_id,
+    and the location (core node) of each user is also stored in the DHT.
+    """
+    def __init__(self, network=None, config=None, domain_id=None, node_id=None, loglevel="all", logname=None):
+        super(NetworkDomain, self).__init__(network, config, domain_id, node_id, loglevel, logname)
+        self.module_name = "p2p_kademlia"
+        self.default_payload_type = PayloadType.Type_msgpack
+        conf = dict()
+        if config is not None:
+            conf = config.get_config().get('network', dict()).get('modules', dict()).get('p2p_kademlia', dict())
+        self.k_value = conf.get('k_value', K_VALUE)
+        self.alpha = conf.get('concurrent_lookup_num', CONCURRENT_LOOKUP_NUM)
+        self.redundancy = conf.get('redundancy', REDUNDANCY)
+        self.routing_table = RoutingTable(node_id, self.k_value)
+        self.checking_contacts = set()
+        self.user_locations = dict()
+        self.user_location_cache = LRUCache(max_size=FORWARD_CACHE_SIZE, ttl=USER_LOCATION_LIFETIME)
+
+    def alive_check(self):
+        """
+        Refresh the routing table by looking up the node itself, and republish the locations of the users
+
+        :return:
+        """
+        IterativeLookup(self, self.node_id, callback=self.lookup_finished).start()
+        for asset_group_id in self.registered_user_id.keys():
+            for user_id in self.registered_user_id[asset_group_id].keys():
+                self.publish_user_location(asset_group_id, user_id)
+
+    def lookup_finished(self, lookup):
+        self.logger.debug("[%s] lookup finished: %d nodes in routing table" % (self.shortname,
+                                                                                len(self.routing_table)))
+
+    def add_peer_node_ip46(self, node_id, ipv4, ipv6, port):
+        super(NetworkDomain, self).add_peer_node_ip46(node_id, ipv4, ipv6, port)
+        self.update_routing_table(node_id)
+
+    def add_peer_node(self, node_id, ip4, addr_info):
+        """
+        (internal use) add node as a peer node and update k-bucket
+
+        :param node_id:
+        :param ip4:
+        :param addr_info:
+        :return:
+        """
+        is_new = super(NetworkDomain, self).add_peer_node(node_id, ip4, addr_info)
+        self.update_routing_table(node_id)
+        return is_new
+
+    def remove_peer_node(self, node_id=ZEROS):
+        super(NetworkDomain, self).remove_peer_node(node_id)
+        self.routing_table.remove(node_id)
+
+    def ping_response_check(self, query_entry):
+        super(NetworkDomain, self).ping_response_check(query_entry)
+        node_id = query_entry.data[KeyType.node_id]
+        if node_id not in self.id_ip_mapping:
+            self.routing_table.remove(node_id)
+
+    def renew_peerlist(self, peerlist):
+        """
+        (internal use) add the nodes in the received peer_list (the routing table is not replaced)
+
+        :param peerlist:
+        :return:
+        """
+        for nodeinfo in parse_node_list(peerlist):
+            if nodeinfo.node_id != self.node_id and nodeinfo.node_id not in self.id_ip_mapping:
+                self.add_peer_node_ip46(nodeinfo.node_id, nodeinfo.ipv4, nodeinfo.ipv6, nodeinfo.port)
+
+    def update_routing_table(self, node_id):
+        """
+        (internal use) add node_id to the k-bucket. If the bucket is full, the least recently seen node is pinged
+        and replaced with node_id only when it does not respond.
+
+        :param node_id:
+        :return:
+        """
+        if node_id == self.node_id or node_id not in self.id_ip_mapping:
+            return
+        oldest = self.routing_table.add(node_id)
+        if oldest is None or oldest in self.checking_contacts:
+            return
+        self.checking_contacts.add(oldest)
+        query_entry = query_management.QueryEntry(expire_after=RPC_TIMEOUT,
+                                                  callback_expire=self.evict_contact,
+                                                  callback=self.keep_contact,
+                                                  data={KeyType.node_id: oldest, 'candidate': node_id},
+                                                  retry_count=0)
+        self.send_ping(oldest, nonce=query_entry.nonce)
+
+    def keep_contact(self, query_entry):
+        oldest = query_entry.data[KeyType.node_id]
+        candidate = query_entry.data['candidate']
+        self.checking_contacts.discard(oldest)
+        self.routing_table.add(oldest)
+        if candidate not in self.routing_table:
+            self.id_ip_mapping.pop(candidate, None)
+
+    def evict_contact(self, query_entry):
+        oldest = query_entry.data[KeyType.node_id]
+        self.checking_contacts.discard(oldest)
+        self.logger.debug("[%s] evict %s from k-bucket" % (self.shortname, binascii.b2a_hex(oldest[:4])))
+        self.id_ip_mapping.pop(oldest, None)
+        self.routing_table.remove(oldest)
+        if query_entry.data['candidate'] in self.id_ip_mapping:
+            self.routing_table.add(query_entry.data['candidate'])
+
+    def get_neighbor_nodes(self):
+        """
+        Return the nodes in the routing table
+
+        :return:
+        """
+        return self.routing_table.get_all_nodes()
+
+    def print_peerlist(self):
+        """
+        Print k-buckets
+
+        :return:
+        """
+        self.logger.info("================ k-buckets [%s] ===============" % self.shortname)
+        for i, bucket in enumerate(self.routing_table.buckets):
+            for nd in bucket:
+                if nd in self.id_ip_mapping:
+                    self.logger.info("%d: %s (%s, %d)" % (i, binascii.b2a_hex(nd[:4]),
+                                                          self.id_ip_mapping[nd].ipv4, self.id_ip_mapping[nd].port))
+        self.logger.info("-----------------------------------------------")
+
+    def make_node_list(self, node_ids):
+        """
+        (internal use) make binary node list
+
+        :param node_ids: list of node_ids in id_ip_mapping
+        :return: binary data of count,[node_id,ipv4,ipv6,port],[node_id,ipv4,ipv6,port],,,,
+        """
+        nodes = bytearray()
+        count = 0
+        for nd in node_ids:
+            if nd not in self.id_ip_mapping:
+                continue
+            nodes.extend(make_node_entry(*self.id_ip_mapping[nd].get_nodeinfo()))
+            count += 1
+        return count.to_bytes(4, 'little') + bytes(nodes)
+
+    def make_my_node_entry(self):
+        ipv4, ipv6, port = self.network.get_my_socket_info()
+        return make_node_entry(self.node_id, ipv4, ipv6, port)
+
+    def send_message_to_nodeinfo(self, nodeinfo, msg):
+        """
+        Send message to the node that may not be in id_ip_mapping (e.g., a candidate in lookup)
+
+        :param nodeinfo: NodeInfo object
+        :param msg:
+        :return:
+        """
+        msg[KeyType.destination_node_id] = nodeinfo.node_id
+        self.network.send_message_in_network(nodeinfo, self.default_payload_type, msg=msg)
+        return True
+
+    def process_message(self, ip4, from_addr, msg):
+        """
+        process received message
+
+        :param ip4:       True (from IPv4) / False (from IPv6)
+        :param from_addr: sender address and port (None if TCP)
+        :param msg:       the message body (already deserialized)
+        :return:
+        """
+        if KeyType.source_node_id not in msg:
+            return
+        self.add_peer_node(msg[KeyType.source_node_id], ip4, from_addr)
+
+        if msg[KeyType.p2p_msg_type] == InfraMessageTypeBase.REQUEST_FIND_NODE:
+            if KeyType.resource_id not in msg or KeyType.nonce not in msg:
+                return
+            nodes = self.routing_table.find_closest(msg[KeyType.resource_id], self.k_value,
+                                                    exclude=msg[KeyType.source_node_id])
+            self.respond_find_node(msg[KeyType.source_node_id], msg[KeyType.nonce], nodes)
+
+        elif msg[KeyType.p2p_msg_type] == InfraMessageTypeBase.REQUEST_FIND_VALUE:
+            if KeyType.resource_id not in msg or KeyType.resource_type not in msg or KeyType.nonce not in msg:
+                return
+            self.process_REQUEST_FIND_VALUE(msg)
+
+        elif msg[KeyType.p2p_msg_type] in (InfraMessageTypeBase.RESPONSE_FIND_NODE,
+                                           InfraMessageTypeBase.RESPONSE_FIND_VALUE):
+            if KeyType.nonce not in msg:
+                return
+            query_entry = ticker.get_entry(msg[KeyType.nonce])
+            if query_entry is None or not query_entry.active or \
+                    query_entry.data.get(KeyType.node_id) != msg[KeyType.source_node_id]:
+                return
+            if KeyType.resource in msg:
+                query_entry.data.update({KeyType.resource_type: msg[KeyType.resource_type],
+                                         KeyType.resource: msg[KeyType.resource],
+                                         KeyType.resource_id: msg[KeyType.resource_id]})
+            if KeyType.peer_list in msg:
+                query_entry.data[KeyType.peer_list] = parse_node_list(msg[KeyType.peer_list])
+            query_entry.callback()
+
+        elif msg[KeyType.p2p_msg_type] == InfraMessageTypeBase.REQUEST_STORE:
+            if KeyType.resource_id not in msg or KeyType.resource not in msg or KeyType.resource_type not in msg:
+                return
+            if msg[KeyType.resource_type] == RESOURCE_TYPE_USER_LOCATION:
+                self.user_locations[msg[KeyType.resource_id]] = (msg[KeyType.resource],
+                                                                 time.time() + USER_LOCATION_LIFETIME)
+            else:
+                self.store_resource_locally(msg[KeyType.asset_group_id], msg[KeyType.resource_id],
+                                            msg[KeyType.resource_type], msg[KeyType.resource])
+            self.respond_store(msg[KeyType.source_node_id], msg[KeyType.nonce])
+
+    def process_REQUEST_FIND_VALUE(self, msg):
+        asset_group_id = msg.get(KeyType.asset_group_id)
+        resource_id = msg[KeyType.resource_id]
+        resource_type = msg[KeyType.resource_type]
+        self.logger.debug("[%s] REQUEST_FIND_VALUE: type:%d, resource_id=%s" %
+                          (self.shortname, resource_type, binascii.b2a_hex(resource_id[:4])))
+        if resource_type == RESOURCE_TYPE_USER_LOCATION:
+            result = None
+            if resource_id in self.user_locations and self.user_locations[resource_id][1] > time.time():
+                result = self.user_locations[resource_id][0]
+        else:
+            resource_id, resource_type, result = self.find_resource_locally(asset_group_id, resource_id,
+                                                                            resource_type)
+        msg_to_send = self.make_message(dst_node_id=msg[KeyType.source_node_id], nonce=msg[KeyType.nonce],
+                                        msg_type=InfraMessageTypeBase.RESPONSE_FIND_VALUE)
+        msg_to_send[KeyType.asset_group_id] = asset_group_id
+        msg_to_send[KeyType.resource_id] = resource_id
+        msg_to_send[KeyType.resource_type] = resource_type
+        if result is not None:
+            msg_to_send[KeyType.resource] = result
+        else:
+            nodes = self.routing_table.find_closest(msg[KeyType.resource_id], self.k_value,
+                                                    exclude=msg[KeyType.source_node_id])
+            msg_to_send[KeyType.peer_list] = self.make_node_list(nodes)
+        self.send_message_to_peer(msg_to_send, self.default_payload_type)
+
+    def send_find_node(self, nodeinfo, nonce, target_id):
+        msg = self.make_message(dst_node_id=nodeinfo.node_id, nonce=nonce,
+                                msg_type=InfraMessageTypeBase.REQUEST_FIND_NODE)
+        msg[KeyType.resource_id] = target_id
+        return self.send_message_to_nodeinfo(nodeinfo, msg)
+
+    def respond_find_node(self, target_id, nonce, nodes):
+        msg = self.make_message(dst_node_id=target_id, nonce=nonce, msg_type=InfraMessageTypeBase.RESPONSE_FIND_NODE)
+        msg[KeyType.peer_list] = self.make_node_list(nodes)
+        return self.send_message_to_peer(msg, self.default_payload_type)
+
+    def send_find_value(self, nodeinfo, nonce, asset_group_id, resource_id, resource_type):
+        self.logger.debug("[%s] send_find_value to %s about %s" % (self.shortname,
+                                                                   binascii.b2a_hex(nodeinfo.node_id[:4]),
+                                                                   binascii.b2a_hex(resource_id[:4])))
+        msg = self.make_message(dst_node_id=nodeinfo.node_id, nonce=nonce,
+                                msg_type=InfraMessageTypeBase.REQUEST_FIND_VALUE)
+        msg[KeyType.asset_group_id] = asset_group_id
+        msg[KeyType.resource_id] = resource_id
+        msg[KeyType.resource_type] = resource_type
+        return self.send_message_to_nodeinfo(nodeinfo, msg)
+
+    def send_store_to_node(self, nodeinfo, nonce, asset_group_id, resource_id, resource, resource_type):
+        msg = self.make_message(dst_node_id=nodeinfo.node_id, nonce=nonce,
+                                msg_type=InfraMessageTypeBase.REQUEST_STORE)
+        msg[KeyType.asset_group_id] = asset_group_id
+        msg[KeyType.resource_id] = resource_id
+        msg[KeyType.resource] = resource
+        msg[KeyType.resource_type] = resource_type
+        return self.send_message_to_nodeinfo(nodeinfo, msg)
+
+    def get_resource(self, query_entry):
+        """
+        Look up the resource by iterative FIND_VALUE. The lookup starts again when query_entry fires.
+
+        :param query_entry:
+        :return:
+        """
+        if len(self.routing_table) == 0:
+            query_entry.force_expire()
+            return
+        query_entry.update(fire_after=LOOKUP_TIMEOUT, callback_error=self.get_resource)
+        IterativeLookup(self, query_entry.data[KeyType.resource_id],
+                        callback=lambda lookup: self.value_found(query_entry, lookup),
+                        asset_group_id=query_entry.data[KeyType.asset_group_id],
+                        resource_type=query_entry.data[KeyType.resource_type]).start()
+
+    def value_found(self, query_entry, lookup):
+        if lookup.value is None or not query_entry.active:
+            return
+        query_entry.data.update({KeyType.resource_type: lookup.value[KeyType.resource_type],
+                                 KeyType.resource: lookup.value[KeyType.resource],
+                                 KeyType.resource_id: lookup.value[KeyType.resource_id]})
+        query_entry.callback()
+
+    def put_resource(self, asset_group_id, resource_id, resource_type, resource):
+        """
+        Store the resource in the nodes closest to resource_id (the number of copies is limited by redundancy,
+        or replication_factor of the asset_group if specified).
+        A transaction is also stored in the nodes closest to each asset_id in it so that Asset_ID search works.
+
+        :param asset_group_id:
+        :param resource_id:
+        :param resource_type:
+        :param resource:
+        :return:
+        """
+        keys = [resource_id]
+        if resource_type == ResourceType.Transaction_data:
+            txobj = BBcTransaction()
+            if txobj.deserialize(resource):
+                keys.extend(evt.asset.asset_id for evt in txobj.events if evt.asset is not None)
+        for key in keys:
+            IterativeLookup(self, key,
+                            callback=lambda lookup: self.store_to_closest_nodes(lookup, asset_group_id, resource_id,
+                                                                                resource_type, resource)).start()
+
+    def store_to_closest_nodes(self, lookup, asset_group_id, resource_id, resource_type, resource):
+        """
+        (internal use) send REQUEST_STORE to the closest nodes found by the lookup (this node counts as a copy)
+
+        :return:
+        """
+        nodes = lookup.get_closest(state=LOOKUP_RESPONDED)
+        nodes.append(self.node_id)
+        nodes.sort(key=lambda nd: lookup.target ^ int.from_bytes(nd, 'big'))
+        redundancy = self.get_replication_factor(asset_group_id) or self.redundancy
+        for nd in nodes[:redundancy]:
+            if nd == self.node_id:
+                continue
+            entry = query_management.QueryEntry(expire_after=30,
+                                                callback_expire=None,
+                                                callback_error=self.resend_resource,
+                                                data={KeyType.peer_info: lookup.candidates[nd],
+                                                      KeyType.asset_group_id: asset_group_id,
+                                                      KeyType.resource_id: resource_id,
+                                                      KeyType.resource: resource,
+                                                      KeyType.resource_type: resource_type},
+                                                retry_count=2)
+            entry.update(INTERVAL_RETRY)
+            self.send_store_to_node(lookup.candidates[nd], entry.nonce, asset_group_id, resource_id,
+                                    resource, resource_type)
+
+    def resend_resource(self, query_entry):
+        query_entry.update(INTERVAL_RETRY)
+        self.send_store_to_node(query_entry.data[KeyType.peer_info], query_entry.nonce,
+                                query_entry.data[KeyType.asset_group_id], query_entry.data[KeyType.resource_id],
+                                query_entry.data[KeyType.resource], query_entry.data[KeyType.resource_type])
+
+    def register_user_id(self, asset_group_id, user_id):
+        """
+        Register user_id and store its location in the DHT
+
+        :param asset_group_id:
+        :param user_id:
+        :return:
+        """
+        super(NetworkDomain, self).register_user_id(asset_group_id, user_id)
+        self.publish_user_location(asset_group_id, user_id)
+
+    def publish_user_location(self, asset_group_id, user_id):
+        if len(self.routing_table) == 0:
+            return
+        self.put_resource(asset_group_id, user_id, RESOURCE_TYPE_USER_LOCATION, self.make_my_node_entry())
+
+    def send_p2p_message(self, query_entry):
+        """
+        Resolve the core node that the user connects to (by FIND_VALUE of the user location)
+
+        :param query_entry:
+        :return:
+        """
+        asset_group_id = query_entry.data[KeyType.asset_group_id]
+        user_id = query_entry.data[KeyType.resource_id]
+        if asset_group_id in self.registered_user_id and user_id in self.registered_user_id[asset_group_id]:
+            query_entry.callback()
+            return
+        nodeinfo = self.user_location_cache.get(user_id)
+        if nodeinfo is not None:
+            query_entry.data[KeyType.peer_info] = nodeinfo
+            query_entry.callback()
+        else:
+            query_entry.update(LOOKUP_TIMEOUT)
+            IterativeLookup(self, user_id, callback=lambda lookup: self.user_location_found(query_entry, lookup),
+                            asset_group_id=asset_group_id, resource_type=RESOURCE_TYPE_USER_LOCATION).start()
+
+    def user_location_found(self, query_entry, lookup):
+        if lookup.value is None or not query_entry.active:
+            return
+        nodes = parse_node_list((1).to_bytes(4, 'little') + lookup.value[KeyType.resource])
+        if len(nodes) == 0:
+            return
+        self.user_location_cache.put(query_entry.data[KeyType.resource_id], nodes[0])
+        query_entry.data[KeyType.peer_info] = nodes[0]
+        query_entry.callback()
+
+    def random_send(self, msg, count):
+        """
+        (internal use) send data to the nodes closest to a random id
+
+        :param msg:
+        :param count: number of nodes to send
+        :return:
+        """
+        for nd in self.routing_table.find_closest(bbclib.get_random_id(), count):
+            msg[KeyType.destination_node_id] = nd
+            self.send_message_to_peer(msg, self.default_payload_type)
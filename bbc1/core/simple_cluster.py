@@ -22,13 +22,19 @@ import socket
 import sys
 sys.path.extend(["../../"])
 from bbc1.common.message_key_types import KeyType, PayloadType, to_2byte
-from bbc1.core.bbc_ledger import ResourceType
+from bbc1.common.lru_cache import LRUCache
 from bbc1.core.bbc_network import InfraMessageTypeBase, DomainBase
-from bbc1.core import query_management
+from bbc1.core import query_management, failure_detector
 
 
 INTERVAL_RETRY = 3
 FORWARD_CACHE_SIZE = 1000
+FORWARD_CACHE_TTL = 86400
+HEDGED_LOOKUP_NUM = 3   # number of neighbors asked concurrently in get_resource (1 means one by one)
+HEDGE_DELAY = 0         # delay (sec) between the requests to the neighbors in a hedged lookup
+UNHEALTHY_LOSS_RATE = 0.5
+PEERLIST_DELTA_DELAY = 1        # changes of the peer list are sent together after this period (sec)
+PEERLIST_REQUEST_INTERVAL = 10  # min interval (sec) of requesting the full peer list to the same peer
 ZEROS = bytes([0] * 32)
 
 ticker = query_management.get_ticker()
@@ -41,9 +47,23 @@ class NetworkDomain(DomainBase):
     def __init__(self, network=None, config=None, domain_id=None, node_id=None, loglevel="all", logname=None):
         super(NetworkDomain, self).__init__(network, config, domain_id, node_id, loglevel, logname)
         self.start_domain_manager()
-        self.node_pointer_index = 0
         self.module_name = "simple_cluster"
         self.default_payload_type = PayloadType.Type_msgpack
+        conf = dict()
+        if config is not None:
+            conf = config.get_config().get('network', dict()).get('modules', dict()).get('simple_cluster', dict())
+        self.hedged_lookup_num = conf.get('hedged_lookup_num', HEDGED_LOOKUP_NUM)
+        self.hedge_delay = conf.get('hedge_delay', HEDGE_DELAY)
+        self.user_id_forward_cache = LRUCache(max_size=FORWARD_CACHE_SIZE, ttl=FORWARD_CACHE_TTL)
+        self.peerlist_version = 0
+        self.peer_versions = dict()
+        self.peerlist_added = set()
+        self.peerlist_removed = set()
+        self.peerlist_delta_entry = None
+        self.peerlist_requested_at = dict()
+        self.failure_detector = failure_detector.FailureDetector(
+            self, protocol_period=conf.get('protocol_period', failure_detector.PROTOCOL_PERIOD),
+            suspect_timeout=conf.get('suspect_timeout', failure_detector.SUSPECT_TIMEOUT))
 
     def domain_manager_loop(self):
         """
@@ -56,63 +76,135 @@ class NetworkDomain(DomainBase):
             time.sleep(30)
 
     def alive_check(self):
-        query_entry = query_management.QueryEntry(expire_after=15,
-                                                  callback_expire=self.broadcast_peerlist,
-                                                  data={KeyType.peer_info: [],
-                                                        'number_of_ping': len(self.id_ip_mapping)},
-                                                  retry_count=0)
-        for nd in self.id_ip_mapping.keys():
-            query_entry2 = query_management.QueryEntry(expire_after=14,
-                                                       callback_expire=None,
-                                                       callback=self.add_advertise_list,
-                                                       callback_error=self.ping_with_retry,
-                                                       interval=3,
-                                                       data={KeyType.node_id: nd,
-                                                             'parent_nonce': query_entry.nonce})
-            self.ping_with_retry(query_entry2)
+        """
+        Send the digest of the peer list to the neighbors. The neighbors having a different list request the full list.
+        (the liveness of the peers is checked by the failure detector)
+
+        :return:
+        """
+        self.send_peerlist_delta(set(), set())
 
     def add_peer_node(self, node_id, ip4, addr_info):
         """
-        (internal use) add node as a peer node
+        Add as a peer node. A new node is notified to the neighbors, and the full peer list is sent to the node.
 
         :param node_id:
-        :param ip4:
-        :param addr_info:
-        :return:
+        :param ip4: True (IPv4)/False (IPv6)
+        :param addr_info: tuple of (address, port)
+        :return: True if new
         """
-        if super(NetworkDomain, self).add_peer_node(node_id, ip4, addr_info):
-            self.node_pointer_index = 0
+        is_new = super(NetworkDomain, self).add_peer_node(node_id, ip4, addr_info)
+        if is_new and node_id in self.id_ip_mapping:
+            self.queue_peerlist_change(added=node_id)
+            self.send_peerlist(node_id)
+        return is_new
 
-    def broadcast_peerlist(self, query_entry):
+    def renew_peerlist(self, peerlist):
         """
-        Broadcast the peer_list to the neighbors
+        (internal use) add the nodes in the received peer_list, and notify the new ones to the neighbors
+
+        :param peerlist:
+        :return: list of node_ids newly added
+        """
+        added = super(NetworkDomain, self).renew_peerlist(peerlist)
+        for node_id in added:
+            self.queue_peerlist_change(added=node_id)
+        return added
+
+    def peer_failed(self, node_id):
+        super(NetworkDomain, self).peer_failed(node_id)
+        self.queue_peerlist_change(removed=node_id)
+
+    def leave_domain(self):
+        super(NetworkDomain, self).leave_domain()
+        self.failure_detector.stop()
+
+    def queue_peerlist_change(self, added=None, removed=None):
+        """
+        (internal use) record a change of the peer list to notify the neighbors
+
+        :param added: node_id added
+        :param removed: node_id removed
+        :return:
+        """
+        if added is not None:
+            self.peerlist_removed.discard(added)
+            self.peerlist_added.add(added)
+        if removed is not None:
+            self.peerlist_added.discard(removed)
+            self.peerlist_removed.add(removed)
+        if self.peerlist_delta_entry is None:
+            self.peerlist_delta_entry = query_management.exec_func_after(self.flush_peerlist_changes,
+                                                                         PEERLIST_DELTA_DELAY)
+
+    def flush_peerlist_changes(self, query_entry=None):
+        """
+        (internal use) send the changes of the peer list to the neighbors
 
         :param query_entry:
         :return:
         """
-        dellist = []
-        peerlist = query_entry.data[KeyType.peer_info]
-        for nd in self.id_ip_mapping.keys():
-            if nd not in peerlist:
-                dellist.append(nd)
-        for nd in dellist:
-            del self.id_ip_mapping[nd]
-        self.send_peerlist()
+        self.peerlist_delta_entry = None
+        added = set(nd for nd in self.peerlist_added if nd in self.id_ip_mapping)
+        removed = set(nd for nd in self.peerlist_removed if nd not in self.id_ip_mapping)
+        self.peerlist_added.clear()
+        self.peerlist_removed.clear()
+        if len(added) == 0 and len(removed) == 0:
+            return
+        self.peerlist_version += 1
+        self.send_peerlist_delta(added, removed)
 
-    def add_advertise_list(self, query_entry):
+    def send_peerlist_delta(self, added, removed):
         """
-        The peer node information will be advertised because ping is successful
+        (internal use) send NOTIFY_PEERLIST_DELTA with the version and the digest of the peer list
 
-        :param query_entry:
+        :param added: set of node_ids
+        :param removed: set of node_ids
+        :return:
+        """
+        data = bytearray(len(added).to_bytes(4, 'little'))
+        for nd in added:
+            for item in self.id_ip_mapping[nd].get_nodeinfo():
+                data.extend(item)
+        msg = self.make_message(dst_node_id=ZEROS, nonce=None, msg_type=InfraMessageTypeBase.NOTIFY_PEERLIST_DELTA)
+        msg[KeyType.peer_list] = bytes(data)
+        msg[KeyType.peer_list_removed] = list(removed)
+        msg[KeyType.peer_list_version] = self.peerlist_version
+        msg[KeyType.peer_list_digest] = self.get_peer_list_digest()
+        for nd in list(self.get_neighbor_nodes()):
+            msg[KeyType.destination_node_id] = nd
+            self.send_message_to_peer(msg, self.default_payload_type)
+
+    def process_NOTIFY_PEERLIST_DELTA(self, msg):
+        """
+        Apply the changes of the peer list of the neighbor. The full list is requested if some changes were missed
+        or the lists are different. A removed node is kept if it has been heard from recently.
+
+        :param msg:
         :return:
         """
-        parent_query_entry = ticker.get_entry(query_entry.data['parent_nonce'])
-        parent_query_entry.data[KeyType.peer_info].append(query_entry.data[KeyType.node_id])
-        parent_query_entry.data['number_of_ping'] -= 1
-        self.logger.debug("add_advertise_list %s (num_ping=%d)" % (
-            binascii.b2a_hex(query_entry.data[KeyType.node_id][:4]), parent_query_entry.data['number_of_ping']))
-        if parent_query_entry.data['number_of_ping'] == 0:
-            parent_query_entry.fire()
+        source_node_id = msg[KeyType.source_node_id]
+        self.renew_peerlist(msg[KeyType.peer_list])
+        deadline = time.time() - self.failure_detector.suspect_timeout
+        for node_id in msg[KeyType.peer_list_removed]:
+            node_id = bytes(node_id)
+            if node_id == self.node_id:
+                self.send_ping(source_node_id)  # refute and the neighbor will add this node again
+            elif node_id in self.id_ip_mapping and self.id_ip_mapping[node_id].updated_at < deadline:
+                self.remove_peer_node(node_id)
+        version = msg[KeyType.peer_list_version]
+        last_version = self.peer_versions.get(source_node_id)
+        self.peer_versions[source_node_id] = version
+        if (last_version is not None and version > last_version + 1) or \
+                msg[KeyType.peer_list_digest] != self.get_peer_list_digest():
+            self.request_peerlist(source_node_id)
+
+    def request_peerlist(self, node_id):
+        if self.peerlist_requested_at.get(node_id, 0) + PEERLIST_REQUEST_INTERVAL > time.time():
+            return
+        self.peerlist_requested_at[node_id] = time.time()
+        msg = self.make_message(dst_node_id=node_id, nonce=None, msg_type=InfraMessageTypeBase.REQUEST_PEERLIST)
+        self.send_message_to_peer(msg, self.default_payload_type)
 
     def print_peerlist(self):
         """
@@ -164,6 +256,29 @@ class NetworkDomain(DomainBase):
             self.add_peer_node(msg[KeyType.source_node_id], ip4, from_addr)
             self.process_RESPONSE_FIND_VALUE(msg)
 
+        elif msg[KeyType.p2p_msg_type] == InfraMessageTypeBase.NOTIFY_PEERLIST_DELTA:
+            if KeyType.peer_list not in msg or KeyType.peer_list_removed not in msg or \
+                    KeyType.peer_list_version not in msg or KeyType.peer_list_digest not in msg:
+                return
+            self.add_peer_node(msg[KeyType.source_node_id], ip4, from_addr)
+            self.process_NOTIFY_PEERLIST_DELTA(msg)
+
+        elif msg[KeyType.p2p_msg_type] == InfraMessageTypeBase.REQUEST_PEERLIST:
+            self.add_peer_node(msg[KeyType.source_node_id], ip4, from_addr)
+            self.send_peerlist(msg[KeyType.source_node_id])
+
+        elif msg[KeyType.p2p_msg_type] == InfraMessageTypeBase.REQUEST_INDIRECT_PING:
+            if KeyType.node_id not in msg or KeyType.nonce not in msg:
+                return
+            self.add_peer_node(msg[KeyType.source_node_id], ip4, from_addr)
+            self.failure_detector.process_REQUEST_INDIRECT_PING(msg)
+
+        elif msg[KeyType.p2p_msg_type] == InfraMessageTypeBase.RESPONSE_INDIRECT_PING:
+            if KeyType.node_id not in msg or KeyType.nonce not in msg:
+                return
+            self.add_peer_node(msg[KeyType.source_node_id], ip4, from_addr)
+            self.failure_detector.process_RESPONSE_INDIRECT_PING(msg)
+
         elif msg[KeyType.p2p_msg_type] == InfraMessageTypeBase.REQUEST_FIND_USER:
             if KeyType.resource_id not in msg or KeyType.asset_group_id not in msg:
                 return
@@ -179,58 +294,32 @@ class NetworkDomain(DomainBase):
             self.add_peer_node(msg[KeyType.source_node_id], ip4, from_addr)
             if KeyType.resource_id not in msg:
                 return
-            self.user_id_forward_cache[msg[KeyType.resource_id]] = [time.time(), msg[KeyType.source_node_id]]
-            if len(self.user_id_forward_cache) > FORWARD_CACHE_SIZE:
-                self.purge_by_LRU()
+            self.user_id_forward_cache.put(msg[KeyType.resource_id], msg[KeyType.source_node_id])
             query_entry = ticker.get_entry(msg[KeyType.nonce])
+            if query_entry is None or not query_entry.active:
+                return
             query_entry.data[KeyType.peer_info] = self.id_ip_mapping[msg[KeyType.source_node_id]]
             query_entry.callback()
 
     def process_REQUEST_STORE(self, msg):
-        domain_id = msg[KeyType.domain_id]
-        asset_group_id = msg[KeyType.asset_group_id]
-        resource_type = msg[KeyType.resource_type]
-        resource_id = msg[KeyType.resource_id]
-        resource = msg[KeyType.resource]
-        if resource_type == ResourceType.Transaction_data:
-            self.network.core.insert_transaction(asset_group_id, resource, None, no_network_put=True)
-        elif resource_type == ResourceType.Asset_file:
-            # TODO: need to check validity of the file
-            self.network.core.storage_manager.store_locally(self.domain_id, asset_group_id, resource_id, resource)
+        self.store_resource_locally(msg[KeyType.asset_group_id], msg[KeyType.resource_id],
+                                    msg[KeyType.resource_type], msg[KeyType.resource])
         self.respond_store(msg[KeyType.source_node_id], msg[KeyType.nonce])
 
     def process_REQUEST_FIND_VALUE(self, msg):
-        domain_id = msg[KeyType.domain_id]
         asset_group_id = msg[KeyType.asset_group_id]
         resource_id = msg[KeyType.resource_id]
         resource_type = msg[KeyType.resource_type]
-        result = None
         self.logger.debug("[%s] REQUEST_FIND_VALUE: type:%d, resource_id=%s" %
                           (self.shortname, resource_type, binascii.b2a_hex(resource_id[:4])))
-        if resource_type == ResourceType.Asset_file:
-            # resource_id is asset_id
-            result = self.network.core.storage_manager.get_locally(domain_id, asset_group_id, resource_id)
-        elif resource_type == ResourceType.Transaction_data:
-            # resource_id is txid
-            result = self.network.core.ledger_manager.find_locally(domain_id, asset_group_id,
-                                                                   resource_id, resource_type)
-        elif resource_type == ResourceType.Asset_ID:
-            # resource_id at this point is asset_id
-            res = self.network.core.ledger_manager.find_locally(domain_id, asset_group_id,
-                                                                resource_id, resource_type)  # res=txid
-            if res is None:
-                result = None
-            else:
-                resource_id = res
-                resource_type = ResourceType.Transaction_data
-                result = self.network.core.ledger_manager.find_locally(domain_id, asset_group_id,
-                                                                       resource_id, resource_type)
-
+        resource_id, resource_type, result = self.find_resource_locally(asset_group_id, resource_id, resource_type)
         self.respond_find_value(msg[KeyType.source_node_id], msg[KeyType.nonce],
                                 resource_id=resource_id, resource=result, resource_type=resource_type)
 
     def process_RESPONSE_FIND_VALUE(self, msg):
         query_entry = ticker.get_entry(msg[KeyType.nonce])
+        if query_entry is None or not query_entry.active:
+            return
         if KeyType.resource in msg:
             self.logger.debug("[%s] RESPONSE_FIND_VALUE: %s" %
                               (self.shortname, binascii.b2a_hex(msg[KeyType.resource][:4])))
@@ -268,28 +357,143 @@ class NetworkDomain(DomainBase):
         msg[KeyType.resource_id] = resource_id
         return self.send_message_to_peer(msg, self.default_payload_type)
 
-    def send_peerlist(self):
-        msg = self.make_message(dst_node_id=ZEROS, nonce=None, msg_type=InfraMessageTypeBase.NOTIFY_PEERLIST)
+    def send_peerlist(self, target_id):
+        msg = self.make_message(dst_node_id=target_id, nonce=None, msg_type=InfraMessageTypeBase.NOTIFY_PEERLIST)
         msg[KeyType.peer_list] = self.make_peer_list()
-        for nd in self.get_neighbor_nodes():
-            msg[KeyType.destination_node_id] = nd
-            self.send_message_to_peer(msg, self.default_payload_type)
+        self.send_message_to_peer(msg, self.default_payload_type)
 
     def get_resource(self, query_entry):
+        """
+        Send REQUEST_FIND_VALUE to hedged_lookup_num neighbors at once. The first response with the resource is
+        taken and the others are cancelled. If all of them miss, the next neighbors are asked.
+        The nodes in the placement of the resource (see put_resource) are asked first.
+
+        :param query_entry:
+        :return:
+        """
         if len(self.get_neighbor_nodes()) == 0:
             query_entry.force_expire()
             return
-        neighbor_list = list(self.get_neighbor_nodes())
-        asset_group_id = query_entry.data[KeyType.asset_group_id]
-        resource_id = query_entry.data[KeyType.resource_id]
-        resource_type = query_entry.data[KeyType.resource_type]
-        target_id = neighbor_list[self.node_pointer_index]
-        self.node_pointer_index = (self.node_pointer_index+1) % len(neighbor_list)
+        self.cancel_hedged_requests(query_entry)
+        targets = self.select_lookup_targets(query_entry)
+        if len(targets) == 0:
+            query_entry.force_expire()
+            return
+        query_entry.data['hedged_nonces'] = []
+        query_entry.data['hedged_waiting'] = len(targets)
         query_entry.update(fire_after=INTERVAL_RETRY, callback_error=self.get_resource)
-        self.send_find_value(target_id, query_entry.nonce, asset_group_id, resource_id, resource_type)
+        for i, nd in enumerate(targets):
+            entry = query_management.QueryEntry(expire_after=INTERVAL_RETRY,
+                                                callback_expire=self.hedged_request_timeout,
+                                                callback=self.hedged_value_found,
+                                                callback_error=self.hedged_value_not_found,
+                                                data={KeyType.node_id: nd,
+                                                      'parent_nonce': query_entry.nonce},
+                                                retry_count=0)
+            query_entry.data['hedged_nonces'].append(entry.nonce)
+            if i == 0 or self.hedge_delay == 0:
+                self.send_hedged_find_value(query_entry, entry)
+            else:
+                query_management.exec_func_after(lambda e, entry=entry: self.send_hedged_find_value(query_entry, entry),
+                                                 i * self.hedge_delay)
+
+    def select_lookup_targets(self, query_entry):
+        """
+        (internal use) choose the neighbors to ask next in get_resource (all neighbors are asked again after a round)
+
+        :param query_entry:
+        :return: list of node_ids
+        """
+        asked = query_entry.data.setdefault('asked', [])
+        factor = self.get_replication_factor(query_entry.data[KeyType.asset_group_id])
+        targets = []
+        if factor > 0:
+            targets = self.select_peers(self.hedged_lookup_num, excludes=asked,
+                                        candidates=self.get_placement(query_entry.data[KeyType.resource_id], factor))
+        if len(targets) == 0:
+            targets = self.select_peers(self.hedged_lookup_num, excludes=asked)
+        if len(targets) == 0:
+            asked.clear()
+            targets = self.select_peers(self.hedged_lookup_num)
+        asked.extend(targets)
+        return targets
+
+    def send_hedged_find_value(self, query_entry, entry):
+        if not query_entry.active or not entry.active:
+            return
+        entry.data['sent_at'] = time.time()
+        self.record_request(entry.data[KeyType.node_id])
+        self.send_find_value(entry.data[KeyType.node_id], entry.nonce, query_entry.data[KeyType.asset_group_id],
+                             query_entry.data[KeyType.resource_id], query_entry.data[KeyType.resource_type])
+
+    def cancel_hedged_requests(self, query_entry):
+        """
+        (internal use) stop waiting for the responses to the requests of the hedged lookup
+
+        :param query_entry:
+        :return:
+        """
+        for nonce in query_entry.data.get('hedged_nonces', []):
+            entry = ticker.get_entry(nonce)
+            if entry is None or not entry.active:
+                continue
+            entry.deactivate()
+            if 'sent_at' in entry.data:
+                self.record_cancel(entry.data[KeyType.node_id])
+
+    def hedged_value_found(self, entry):
+        """
+        (internal use) pass the resource to the original query and cancel the other requests
+
+        :param entry: QueryEntry of the request to a neighbor
+        :return:
+        """
+        self.record_response(entry.data[KeyType.node_id], entry.data['sent_at'])
+        query_entry = ticker.get_entry(entry.data['parent_nonce'])
+        if query_entry is None or not query_entry.active:
+            return
+        self.cancel_hedged_requests(query_entry)
+        query_entry.data.update({KeyType.resource_type: entry.data[KeyType.resource_type],
+                                 KeyType.resource: entry.data[KeyType.resource],
+                                 KeyType.resource_id: entry.data[KeyType.resource_id]})
+        query_entry.callback()
+
+    def hedged_value_not_found(self, entry):
+        """
+        (internal use) the neighbor does not have the resource. If all neighbors missed, try the next ones
+
+        :param entry: QueryEntry of the request to a neighbor
+        :return:
+        """
+        self.record_response(entry.data[KeyType.node_id], entry.data['sent_at'])
+        entry.deactivate()
+        query_entry = ticker.get_entry(entry.data['parent_nonce'])
+        if query_entry is None or not query_entry.active:
+            return
+        query_entry.data['hedged_waiting'] -= 1
+        if query_entry.data['hedged_waiting'] == 0:
+            query_entry.callback_error()
+
+    def hedged_request_timeout(self, entry):
+        if 'sent_at' in entry.data:
+            self.record_loss(entry.data[KeyType.node_id])
 
     def put_resource(self, asset_group_id, resource_id, resource_type, resource):
-        for nd in self.get_neighbor_nodes():
+        """
+        Store the resource in the nodes decided by get_placement() (all neighbors if replication_factor is 0)
+
+        :param asset_group_id:
+        :param resource_id:
+        :param resource_type:
+        :param resource:
+        :return:
+        """
+        factor = self.get_replication_factor(asset_group_id)
+        if factor > 0:
+            targets = [nd for nd in self.get_placement(resource_id, factor) if nd != self.node_id]
+        else:
+            targets = list(self.get_neighbor_nodes())
+        for nd in targets:
             entry = query_management.QueryEntry(expire_after=30,
                                                 callback_expire=None,
                                                 callback_error=self.resend_resource,
@@ -313,7 +517,8 @@ class NetworkDomain(DomainBase):
 
     def send_p2p_message(self, query_entry):
         """
-        Send a message to another node
+        Send a message to another node. The destination is looked up in the user directory pushed by the peers,
+        and REQUEST_FIND_USER is broadcasted only if the user is not found there.
 
         :param query_entry:
         :return:
@@ -323,9 +528,11 @@ class NetworkDomain(DomainBase):
         if asset_group_id in self.registered_user_id and user_id in self.registered_user_id[asset_group_id]:
             # TODO: can remove this condition
             query_entry.callback()
-        elif user_id in self.user_id_forward_cache:
-            target_id = self.user_id_forward_cache[user_id][1]
-            self.user_id_forward_cache[user_id][0] = time.time()
+            return
+        target_id = self.lookup_user_directory(asset_group_id, user_id)
+        if target_id is None:
+            target_id = self.user_id_forward_cache.get(user_id)
+        if target_id in self.id_ip_mapping:
             query_entry.data[KeyType.peer_info] = self.id_ip_mapping[target_id]
             query_entry.callback()
         else:
@@ -345,44 +552,24 @@ class NetworkDomain(DomainBase):
         msg = self.make_message(dst_node_id=ZEROS, nonce=nonce, msg_type=InfraMessageTypeBase.REQUEST_FIND_USER)
         msg[KeyType.resource_id] = user_id
         msg[KeyType.asset_group_id] = asset_group_id
-        for nd in self.get_neighbor_nodes():
-            if nd == self.node_id:
-                continue
+        for nd in self.select_peers(len(self.id_ip_mapping)):
             self.logger.debug("[%s] resolve_accommodating_core_node: send to %s" % (self.shortname,
                                                                                     binascii.b2a_hex(nd[:2])))
             msg[KeyType.destination_node_id] = nd
             self.send_message_to_peer(msg, self.default_payload_type)
 
-    def purge_by_LRU(self):
-        """
-        (internal use) purge cache entry by Least Recently Used algorithm
-
-        :return:
-        """
-        user_ids = sorted(self.user_id_forward_cache.keys(), key=lambda ent: ent[0])
-        delflag = False
-        for id in user_ids:
-            if self.user_id_forward_cache[id][0] + 86400 < time.time():
-                del self.user_id_forward_cache[id]
-                delflag = True
-        if not delflag:
-            del self.user_id_forward_cache[user_ids[0]]
-
     def random_send(self, msg, count):
         """
-        (internal use) send data to randomly selected nodes
+        (internal use) send data to randomly selected nodes (unhealthy nodes are chosen only if not enough)
 
         :param msg:
         :param count: number of nodes to send
         :return:
         """
-        dstlist = random.sample(self.id_ip_mapping.keys(), min(count+1, len(self.id_ip_mapping)))
-        sent_count = 0
+        peers = self.select_peers(len(self.id_ip_mapping))
+        healthy = [nd for nd in peers if self.id_ip_mapping[nd].loss_rate < UNHEALTHY_LOSS_RATE]
+        dstlist = random.sample(healthy, min(count, len(healthy)))
+        dstlist.extend([nd for nd in peers if nd not in healthy][:count - len(dstlist)])
         for dst in dstlist:
-            if sent_count == count:
-                break
-            if dst == self.node_id:
-                continue
             msg[KeyType.destination_node_id] = dst
             self.send_message_to_peer(msg, self.default_payload_type)
-            sent_count += 1
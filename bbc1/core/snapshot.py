@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2017 beyond-blockchain.org.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import binascii
+import bisect
+import itertools
+
+import sys
+sys.path.extend(["../../"])
+from bbc1.common.lru_cache import LRUCache
+from bbc1.common.message_key_types import KeyType
+from bbc1.common.bbclib import BBcTransaction
+from bbc1.core import bbc_network, query_management
+from bbc1.core.bbc_ledger import ResourceType
+
+
+MAX_BYTES_PER_MESSAGE = 1024 * 1024
+MAX_ROWS_PER_MESSAGE = 1000
+CHUNK_TIMEOUT = 10
+CHUNK_RETRY_COUNT = 3
+EXPORT_CACHE_SIZE = 16
+
+STAGE_TRANSACTION = 0
+STAGE_ASSET_FILE = 1
+STAGE_DONE = 2
+
+ticker = query_management.get_ticker()
+
+
+class Snapshot:
+    """
+    Bulk transfer of the ledger and asset files of an asset_group to a node joining the domain.
+    The exporting node fixes the upper bound of the rowid at the first request so that the export is consistent,
+    and the joining node pulls the records in chunks (transaction_table and then asset files).
+    The list of the asset files is read once per session and kept until the session ends.
+    The joining node validates the transactions and makes the records of auxiliary_table from them by itself,
+    and stores only the asset files matching the digests in the transactions.
+    The transactions added after the snapshot are caught up by anti-entropy.
+    """
+    def __init__(self, domain, max_bytes_per_message=MAX_BYTES_PER_MESSAGE):
+        """
+        Create object
+
+        :param domain: DomainBase object
+        :param max_bytes_per_message: max bytes of records in a RESPONSE_SNAPSHOT message
+        """
+        self.domain = domain
+        self.max_bytes_per_message = max_bytes_per_message
+        self.exports = LRUCache(max_size=EXPORT_CACHE_SIZE, ttl=CHUNK_TIMEOUT * (CHUNK_RETRY_COUNT + 1))
+
+    def start(self, node_id, asset_group_id):
+        """
+        Start pulling the snapshot of the asset_group from the peer
+
+        :param node_id: the peer to export the snapshot
+        :param asset_group_id:
+        :return: QueryEntry of the session
+        """
+        self.domain.logger.info("[%s] start snapshot transfer from %s" % (self.domain.shortname,
+                                                                          binascii.b2a_hex(node_id[:4])))
+        session = query_management.QueryEntry(expire_after=CHUNK_TIMEOUT * (CHUNK_RETRY_COUNT + 1),
+                                              callback_expire=self.session_failed,
+                                              callback_error=self.send_request,
+                                              data={KeyType.node_id: node_id,
+                                                    KeyType.asset_group_id: asset_group_id,
+                                                    'cursor': [STAGE_TRANSACTION, 0, None],
+                                                    'count': [0, 0]},
+                                              retry_count=CHUNK_RETRY_COUNT)
+        self.send_request(session)
+        return session
+
+    def session_failed(self, session):
+        self.domain.logger.info("[%s] snapshot transfer from %s stopped" %
+                                (self.domain.shortname, binascii.b2a_hex(session.data[KeyType.node_id][:4])))
+
+    def send_request(self, session):
+        """
+        (internal use) request the next chunk (also used for retransmission)
+
+        :param session: QueryEntry of the session
+        :return:
+        """
+        session.update(fire_after=CHUNK_TIMEOUT)
+        msg = self.domain.make_message(dst_node_id=session.data[KeyType.node_id], nonce=session.nonce,
+                                       msg_type=bbc_network.InfraMessageTypeBase.REQUEST_SNAPSHOT)
+        msg[KeyType.asset_group_id] = session.data[KeyType.asset_group_id]
+        msg[KeyType.snapshot_cursor] = session.data['cursor']
+        self.domain.send_message_to_peer(msg, self.domain.default_payload_type)
+
+    def process_REQUEST_SNAPSHOT(self, msg):
+        """
+        Export the records after the cursor. An empty chunk moves the cursor to the next stage.
+        The response has the requested cursor and the cursor for the next request.
+
+        :param msg:
+        :return:
+        """
+        asset_group_id = msg[KeyType.asset_group_id]
+        cursor = msg[KeyType.snapshot_cursor]
+        stage, position, tx_upper = cursor
+        ledger = self.domain.network.core.ledger_manager
+        domain_id = self.domain.domain_id
+        if tx_upper is None:
+            tx_upper = ledger.get_max_row_id(domain_id)
+        rows = []
+        if stage == STAGE_TRANSACTION:
+            records = ledger.export_transactions(domain_id, asset_group_id, position, tx_upper, MAX_ROWS_PER_MESSAGE)
+            rows, position = self.fill_rows(records, lambda r: [r[1], r[2]], lambda r: len(r[2]), position)
+        elif stage == STAGE_ASSET_FILE:
+            rows, position = self.export_asset_files((msg[KeyType.source_node_id], msg[KeyType.nonce]),
+                                                     asset_group_id, position)
+        if len(rows) == 0 and stage < STAGE_DONE:
+            stage += 1
+            position = None if stage == STAGE_ASSET_FILE else 0
+        reply = self.domain.make_message(dst_node_id=msg[KeyType.source_node_id], nonce=msg[KeyType.nonce],
+                                         msg_type=bbc_network.InfraMessageTypeBase.RESPONSE_SNAPSHOT)
+        reply[KeyType.asset_group_id] = asset_group_id
+        reply[KeyType.snapshot_cursor] = cursor
+        reply[KeyType.snapshot_next_cursor] = [stage, position, tx_upper]
+        reply[KeyType.snapshot_rows] = rows
+        self.domain.send_message_to_peer(reply, self.domain.default_payload_type)
+
+    def process_RESPONSE_SNAPSHOT(self, msg):
+        """
+        Import the received chunk and request the next one
+
+        :param msg:
+        :return:
+        """
+        session = ticker.get_entry(msg[KeyType.nonce])
+        if session is None or not session.active or session.data[KeyType.node_id] != msg[KeyType.source_node_id]:
+            return
+        if msg[KeyType.snapshot_cursor] != session.data['cursor']:
+            return  # response to an old request or duplicated response to a retransmitted request
+        stage = session.data['cursor'][0]
+        rows = msg[KeyType.snapshot_rows]
+        asset_group_id = session.data[KeyType.asset_group_id]
+        domain_id = self.domain.domain_id
+        if len(rows) > 0:
+            if stage == STAGE_TRANSACTION:
+                session.data['count'][stage] += self.import_transactions(asset_group_id, rows)
+            elif stage == STAGE_ASSET_FILE:
+                session.data['count'][stage] += self.import_asset_files(asset_group_id, rows)
+        session.data['cursor'] = msg[KeyType.snapshot_next_cursor]
+        session.retry_count = CHUNK_RETRY_COUNT
+        session.update_expiration_time(CHUNK_TIMEOUT * (CHUNK_RETRY_COUNT + 1))
+        if session.data['cursor'][0] < STAGE_DONE:
+            self.send_request(session)
+            return
+        session.deactivate()
+        self.domain.logger.info("[%s] snapshot transfer finished: %d transactions, %d files" %
+                                (self.domain.shortname, *session.data['count']))
+        if self.domain.anti_entropy is not None:
+            self.domain.anti_entropy.start_session(session.data[KeyType.node_id], asset_group_id)
+
+    def import_transactions(self, asset_group_id, rows):
+        """
+        (internal use) validate the received transactions and insert the valid ones in the ledger
+
+        :param asset_group_id:
+        :param rows: list of [transaction_id, transaction_data]
+        :return: the number of the valid transactions
+        """
+        core = self.domain.network.core
+        transactions = []
+        for txid, txdata in rows:
+            txobj = core.validate_transaction(bytes(txid), bytes(txdata), None)
+            if txobj is None:
+                self.domain.logger.warning("[%s] invalid transaction in snapshot: %s" %
+                                           (self.domain.shortname, binascii.b2a_hex(bytes(txid)[:4])))
+                continue
+            transactions.append([txobj, bytes(txdata)])
+        if len(transactions) > 0:
+            core.ledger_manager.import_transactions(self.domain.domain_id, asset_group_id, transactions)
+        return len(transactions)
+
+    def import_asset_files(self, asset_group_id, rows):
+        """
+        (internal use) store the received asset files whose digests match the imported transactions
+
+        :param asset_group_id:
+        :param rows: list of [asset_id, content]
+        :return: the number of the stored files
+        """
+        core = self.domain.network.core
+        domain_id = self.domain.domain_id
+        count = 0
+        for asid, content in rows:
+            asid = bytes(asid)
+            content = bytes(content)
+            txid = core.ledger_manager.find_locally(domain_id, asset_group_id, asid, ResourceType.Asset_ID)
+            txdata = None
+            if txid is not None:
+                txdata = core.ledger_manager.find_locally(domain_id, asset_group_id, bytes(txid),
+                                                          ResourceType.Transaction_data)
+            txobj = BBcTransaction()
+            if txdata is None or not txobj.deserialize(bytes(txdata)) or \
+                    not core.validate_asset_file(txobj, asid, content):
+                self.domain.logger.warning("[%s] invalid asset file in snapshot: %s" %
+                                           (self.domain.shortname, binascii.b2a_hex(asid[:4])))
+                continue
+            if core.storage_manager.store_locally(domain_id, asset_group_id, asid, content):
+                count += 1
+        return count
+
+    def export_asset_files(self, key, asset_group_id, position):
+        """
+        (internal use) read asset files after position as many as fit in a message.
+        The sorted list of the asset_ids is made at the first chunk and kept for the session.
+
+        :param key: (node_id, nonce) of the session
+        :param asset_group_id:
+        :param position: the last asset_id already exported
+        :return: rows of [asset_id, content] and the asset_id of the last row
+        """
+        storage = self.domain.network.core.storage_manager
+        domain_id = self.domain.domain_id
+        asids = self.exports.get(key)
+        if asids is None:
+            asids = storage.get_asset_ids(domain_id, asset_group_id)
+        self.exports.put(key, asids)
+        start = 0 if position is None else bisect.bisect_right(asids, bytes(position))
+        rows = []
+        size = 0
+        for asid in itertools.islice(asids, start, None):
+            if len(rows) >= MAX_ROWS_PER_MESSAGE:
+                break
+            content = storage.get_locally(domain_id, asset_group_id, asid)
+            if content is None:
+                continue
+            if size > 0 and size + len(content) > self.max_bytes_per_message:
+                break
+            rows.append([asid, content])
+            size += len(content)
+            position = asid
+        if len(rows) == 0:
+            self.exports.pop(key)
+        return rows, position
+
+    def fill_rows(self, records, convert, get_size, position):
+        """
+        (internal use) take records as many as fit in a message
+
+        :param records: records exported from the ledger (the first item of a record is rowid)
+        :param convert: function to make a row to send from a record
+        :param get_size: function to return the size of a record
+        :param position: rowid of the last record already exported
+        :return: rows and the rowid of the last row
+        """
+        rows = []
+        size = 0
+        for record in records:
+            if size > 0 and size + get_size(record) > self.max_bytes_per_message:
+                break
+            rows.append(convert(record))
+            size += get_size(record)
+            position = record[0]
+        return rows, position
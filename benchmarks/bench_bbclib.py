@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2017 beyond-blockchain.org.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import argparse
+import itertools
+import json
+import os
+import timeit
+import tracemalloc
+
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from bbc1.common import bbclib
+
+
+DEFAULT_THRESHOLDS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_bbclib_thresholds.json")
+DEFAULT_TOLERANCE = 1.3     # a result is a regression if it is worse than threshold * tolerance
+
+
+class TransactionCase:
+    """
+    A transaction with the given numbers of events, references and signatures, and assets of body_size bytes
+    (an asset_body longer than 256 bytes is stored as an asset file)
+    """
+    def __init__(self, keypair, events=1, references=0, signatures=1, body_size=32):
+        self.name = "e%d_r%d_s%d_b%d" % (events, references, signatures, body_size)
+        self.keypair = keypair
+        asset_group_id = bbclib.get_new_id("asset_group")
+        user_id = bbclib.get_new_id("user")
+
+        ref_transactions = []
+        for i in range(references):
+            txobj = bbclib.make_transaction_for_base_asset(asset_group_id=asset_group_id, event_num=1)
+            txobj.events[0].asset.add(user_id=user_id, asset_body=b"ref%d" % i)
+            txobj.events[0].add(mandatory_approver=bbclib.get_new_id("approver%d" % i))
+            txobj.digest()
+            ref_transactions.append(txobj)
+
+        self.transaction = bbclib.make_transaction_for_base_asset(asset_group_id=asset_group_id, event_num=events)
+        for evt in self.transaction.events:
+            evt.asset.add(user_id=user_id, asset_body=os.urandom(body_size))
+            evt.add(mandatory_approver=user_id)
+        for txobj in ref_transactions:
+            bbclib.add_reference_to_transaction(asset_group_id, self.transaction, txobj, 0)
+        for i in range(signatures):
+            self.transaction.get_sig_index(bbclib.get_new_id("signer%d" % i))
+        self.signature = self.transaction.sign(keypair=keypair)
+        for uid in self.transaction.userid_sigidx_mapping.keys():
+            self.transaction.add_signature(user_id=uid, signature=self.signature)
+        self.transaction_id = self.transaction.digest()
+        self.data = self.transaction.serialize()
+        self.asset = self.transaction.events[0].asset
+
+    def operations(self):
+        """
+        :return: list of (name, function) to measure
+        """
+        def deserialize():
+            txobj = bbclib.BBcTransaction()
+            txobj.deserialize(self.data)
+            return txobj
+
+        return [
+            ("serialize", self.transaction.serialize),
+            ("deserialize", deserialize),
+            ("digest", self.transaction.digest),
+            ("sign", lambda: self.transaction.sign(keypair=self.keypair)),
+            ("verify", lambda: self.signature.verify(self.transaction_id)),
+            ("asset_digest", self.asset.digest),
+        ]
+
+
+def measure_time(func, number, repeat):
+    """
+    :return: the best time per call in usec among the repeats
+    """
+    return min(timeit.Timer(func).repeat(repeat=repeat, number=number)) / number * 1000000
+
+
+def measure_allocation(func):
+    """
+    :return: peak bytes and number of memory blocks allocated in a call (the blocks still alive after the call)
+    """
+    func()  # warm up caches so that they are not counted
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    base = tracemalloc.get_traced_memory()[0]
+    result = func()
+    peak = tracemalloc.get_traced_memory()[1] - base
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    del result
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0)
+    return peak, blocks
+
+
+def run(cases, number, repeat, trace_allocation):
+    results = dict()
+
+    def record(name, func):
+        entry = {"usec_per_op": measure_time(func, number, repeat)}
+        if trace_allocation:
+            entry["peak_bytes"], entry["blocks"] = measure_allocation(func)
+        results[name] = entry
+        print("%-40s %10.2f usec/op%s" % (name, entry["usec_per_op"],
+                                          "  peak %d bytes, %d blocks" % (entry["peak_bytes"], entry["blocks"])
+                                          if trace_allocation else ""))
+
+    def generate():
+        keypair = bbclib.KeyPair()
+        keypair.generate()
+        return keypair
+
+    record("keypair_generate", generate)
+    for case in cases:
+        for op_name, func in case.operations():
+            record("%s/%s" % (case.name, op_name), func)
+    return results
+
+
+def check_thresholds(results, thresholds, tolerance):
+    """
+    Compare the results with the thresholds
+
+    :return: list of messages of regressions
+    """
+    regressions = []
+    for name, limits in thresholds.items():
+        if name not in results:
+            continue
+        for metric, limit in limits.items():
+            value = results[name].get(metric)
+            if value is not None and value > limit * tolerance:
+                regressions.append("%s %s: %.2f > %.2f (threshold %.2f x %.2f)" %
+                                   (name, metric, value, limit * tolerance, limit, tolerance))
+    return regressions
+
+
+def argument_parser():
+    argparser = argparse.ArgumentParser(description='Measure serialization and crypto operations of bbclib.')
+    argparser.add_argument('-e', '--events', type=int, nargs='+', default=[1, 4], help='numbers of events')
+    argparser.add_argument('-r', '--references', type=int, nargs='+', default=[0, 2], help='numbers of references')
+    argparser.add_argument('-s', '--signatures', type=int, nargs='+', default=[1, 4], help='numbers of signatures')
+    argparser.add_argument('-b', '--body_sizes', type=int, nargs='+', default=[32, 1024],
+                           help='sizes of asset_body in bytes')
+    argparser.add_argument('-n', '--number', type=int, default=200, help='number of calls in a repeat')
+    argparser.add_argument('-R', '--repeat', type=int, default=5, help='number of repeats (the best one is taken)')
+    argparser.add_argument('-m', '--tracemalloc', action='store_true', default=False,
+                           help='measure memory allocation by tracemalloc')
+    argparser.add_argument('-c', '--check', nargs='?', const=DEFAULT_THRESHOLDS, default=None,
+                           help='compare with the threshold file and exit with 1 if there is a regression')
+    argparser.add_argument('-t', '--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                           help='allowed ratio to the thresholds')
+    argparser.add_argument('-u', '--update_thresholds', nargs='?', const=DEFAULT_THRESHOLDS, default=None,
+                           help='write the results as the new thresholds')
+    argparser.add_argument('-o', '--output', action='store', default=None, help='write results in JSON')
+    return argparser.parse_args()
+
+
+if __name__ == '__main__':
+    args = argument_parser()
+    keypair = bbclib.KeyPair()
+    keypair.generate()
+    cases = [TransactionCase(keypair, events=e, references=r, signatures=s, body_size=b)
+             for e, r, s, b in itertools.product(args.events, args.references, args.signatures, args.body_sizes)]
+    results = run(cases, args.number, args.repeat, args.tracemalloc)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.update_thresholds is not None:
+        with open(args.update_thresholds, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.check is not None:
+        with open(args.check) as f:
+            regressions = check_thresholds(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION:", line)
+        if len(regressions) > 0:
+            sys.exit(1)
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2017 beyond-blockchain.org.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import argparse
+import binascii
+import json
+import os
+import threading
+import time
+
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests"))
+from bbc1.common import bbclib
+from bbc1.common.message_key_types import KeyType
+from bbc1.common.bbc_error import *
+from bbc1.app import bbc_app
+from testutils import prepare, get_core_client, start_core_thread, make_client, domain_and_asset_group_setup
+
+
+WORKLOADS = ["insert", "search", "gather_signature"]
+RESPONSE_TIMEOUT = 30
+
+
+class SignProcessor(bbc_app.Callback):
+    """
+    Callback that signs every SIGN_REQUEST for which the client is a mandatory approver
+    """
+    def __init__(self, clients, index, asset_group_id):
+        super(SignProcessor, self).__init__(self)
+        self.clients = clients
+        self.idx = index
+        self.asset_group_id = asset_group_id
+
+    def proc_cmd_sign_request(self, dat):
+        client = self.clients[self.idx]
+        txobj = bbclib.BBcTransaction()
+        txobj.deserialize(dat[KeyType.transaction_data])
+        objs = dict()
+        for txid, txdata in dat[KeyType.transactions].items():
+            txo = bbclib.BBcTransaction()
+            txo.deserialize(txdata)
+            objs[txid] = txo
+        for i, reference in enumerate(txobj.references):
+            event = objs[reference.transaction_id].events[reference.event_index_in_ref]
+            if client['user_id'] in event.mandatory_approvers:
+                signature = txobj.sign(keypair=client['keypair'])
+                client['app'].sendback_signature(self.asset_group_id, dat[KeyType.source_user_id], i, signature)
+                return
+
+
+class Cluster:
+    """
+    Cores and clients on localhost started with the helpers of tests/testutils.py
+    """
+    def __init__(self, core_num, client_num, port_offset, loglevel):
+        self.core_num = core_num
+        self.client_num = client_num
+        self.port_offset = port_offset
+        self.loglevel = loglevel
+        self.domain_id = bbclib.get_new_id("benchmark_domain")
+        self.asset_group_id = bbclib.get_new_id("benchmark_asset_group")
+        self.cores = None
+        self.clients = None
+        self.processors = []
+        self.transactions = [[] for i in range(client_num)]
+
+    def start(self, wait):
+        prepare(core_num=self.core_num, client_num=self.client_num, loglevel=self.loglevel)
+        for i in range(self.core_num):
+            start_core_thread(index=i, core_port_increment=self.port_offset + i,
+                              p2p_port_increment=self.port_offset + i)
+            domain_and_asset_group_setup(self.port_offset + i, self.domain_id, self.asset_group_id)
+        self.cores, self.clients = get_core_client()
+        for i in range(self.client_num):
+            self.processors.append(SignProcessor(self.clients, i, self.asset_group_id))
+            make_client(index=i, core_port_increment=self.port_offset + i % self.core_num,
+                        callback=self.processors[i], asset_group_id=self.asset_group_id)
+        self.connect_cores()
+        for cl in self.clients:
+            cl['app'].register_to_core()
+        time.sleep(wait)
+
+    def connect_cores(self):
+        """
+        Let the cores know the first core (as test_bbc_app_multi_core_many_transactions.py does)
+        """
+        if self.core_num < 2:
+            return
+        self.clients[0]['app'].get_domain_peerlist(domain_id=self.domain_id)
+        node_id, ipv4, ipv6, port = self.processors[0].synchronize(timeout=RESPONSE_TIMEOUT)[0]
+        for i in range(1, min(self.core_num, self.client_num)):
+            self.clients[i]['app'].set_domain_static_node(self.domain_id, node_id, ipv4, ipv6, port)
+            self.processors[i].synchronize(timeout=RESPONSE_TIMEOUT)
+
+    def stop(self):
+        for cl in self.clients:
+            cl['app'].unregister_from_core()
+
+    def insert(self, idx, seq, body_size):
+        client = self.clients[idx]
+        txobj = bbclib.make_transaction_for_base_asset(asset_group_id=self.asset_group_id, event_num=1)
+        txobj.events[0].asset.add(user_id=client['user_id'], asset_body=os.urandom(body_size))
+        txobj.events[0].add(mandatory_approver=self.clients[(idx + 1) % self.client_num]['user_id'])
+        sig = txobj.sign(keypair=client['keypair'])
+        txobj.add_signature(user_id=client['user_id'], signature=sig)
+        txobj.digest()
+        client['app'].insert_transaction(self.asset_group_id, txobj)
+        dat = self.processors[idx].synchronize(timeout=RESPONSE_TIMEOUT)
+        if dat is None or dat.get(KeyType.status, ESUCCESS) < ESUCCESS:
+            return False
+        self.transactions[idx].append(txobj)
+        return True
+
+    def search(self, idx, seq, body_size):
+        """
+        Search a transaction inserted by another client (via another core if there are several)
+        """
+        inserted = self.transactions[(idx + 1) % self.client_num]
+        if len(inserted) == 0:
+            return False
+        self.clients[idx]['app'].search_transaction(self.asset_group_id, inserted[seq % len(inserted)].transaction_id)
+        dat = self.processors[idx].synchronize(timeout=RESPONSE_TIMEOUT)
+        return dat is not None and KeyType.transaction_data in dat
+
+    def gather_signature(self, idx, seq, body_size):
+        """
+        Gather the signature of the next client, which is the mandatory approver of the referred transaction
+        """
+        inserted = self.transactions[idx]
+        if len(inserted) == 0:
+            return False
+        client = self.clients[idx]
+        txobj = bbclib.make_transaction_for_base_asset(asset_group_id=self.asset_group_id, event_num=1)
+        txobj.events[0].asset.add(user_id=client['user_id'], asset_body=os.urandom(body_size))
+        reference = bbclib.add_reference_to_transaction(self.asset_group_id, txobj, inserted[seq % len(inserted)], 0)
+        client['app'].gather_signatures(self.asset_group_id, txobj, reference_obj=reference)
+        dat = self.processors[idx].synchronize(timeout=RESPONSE_TIMEOUT)
+        return dat is not None and dat.get(KeyType.status) == ESUCCESS
+
+
+def summarize_latencies(latencies):
+    """
+    Return min/mean/max and percentiles of latencies in msec
+    """
+    if len(latencies) == 0:
+        return dict()
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000
+
+    return {
+        "min": latencies[0] * 1000,
+        "mean": sum(latencies) / len(latencies) * 1000,
+        "p50": percentile(50),
+        "p90": percentile(90),
+        "p99": percentile(99),
+        "max": latencies[-1] * 1000,
+    }
+
+
+def run_phase(cluster, workload, ops_per_client, body_size):
+    """
+    Run the workload by all clients concurrently (a client has one request in flight)
+
+    :return: dictionary of results of the phase
+    """
+    func = getattr(cluster, workload)
+    latencies = [[] for i in range(cluster.client_num)]
+    errors = [0 for i in range(cluster.client_num)]
+
+    def worker(idx):
+        for seq in range(ops_per_client):
+            start = time.perf_counter()
+            if func(idx, seq, body_size):
+                latencies[idx].append(time.perf_counter() - start)
+            else:
+                errors[idx] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(cluster.client_num)]
+    start = time.perf_counter()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    elapsed = time.perf_counter() - start
+    all_latencies = [lat for lats in latencies for lat in lats]
+    return {
+        "workload": workload,
+        "operations": len(all_latencies),
+        "errors": sum(errors),
+        "elapsed": elapsed,
+        "ops_per_sec": len(all_latencies) / elapsed if elapsed > 0 else 0,
+        "latency_msec": summarize_latencies(all_latencies),
+    }
+
+
+def argument_parser():
+    argparser = argparse.ArgumentParser(description='Run cores and clients on localhost and measure workloads.')
+    argparser.add_argument('-c', '--cores', type=int, default=3, help='number of cores')
+    argparser.add_argument('-m', '--clients', type=int, default=3, help='number of clients')
+    argparser.add_argument('-w', '--workloads', nargs='+', choices=WORKLOADS, default=WORKLOADS,
+                           help='workloads to run in this order')
+    argparser.add_argument('-n', '--ops', type=int, default=100, help='number of operations per client in a workload')
+    argparser.add_argument('-s', '--body_size', type=int, default=128, help='size of asset_body in bytes')
+    argparser.add_argument('-p', '--port_offset', type=int, default=0, help='offset to the default core/p2p ports')
+    argparser.add_argument('--wait', type=float, default=5, help='seconds to wait for the cores to know each other')
+    argparser.add_argument('-l', '--loglevel', default='none', help='log level of the cores and clients')
+    argparser.add_argument('-o', '--output', action='store', default=None, help='write results in JSON')
+    return argparser.parse_args()
+
+
+if __name__ == '__main__':
+    args = argument_parser()
+    cluster = Cluster(args.cores, args.clients, args.port_offset, args.loglevel)
+    start = time.perf_counter()
+    cluster.start(args.wait)
+    setup_time = time.perf_counter() - start
+    print("setup: %d cores, %d clients, domain_id=%s (%.2f sec)" %
+          (args.cores, args.clients, binascii.b2a_hex(cluster.domain_id[:4]).decode(), setup_time))
+
+    phases = []
+    for workload in args.workloads:
+        result = run_phase(cluster, workload, args.ops, args.body_size)
+        phases.append(result)
+        lat = result["latency_msec"]
+        print("%-16s %6d ops %4d errors %8.1f ops/s  p50 %.2f ms  p90 %.2f ms  p99 %.2f ms" %
+              (workload, result["operations"], result["errors"], result["ops_per_sec"],
+               lat.get("p50", 0), lat.get("p90", 0), lat.get("p99", 0)))
+    cluster.stop()
+
+    if args.output is not None:
+        results = {
+            "parameters": {"cores": args.cores, "clients": args.clients, "ops_per_client": args.ops,
+                           "body_size": args.body_size},
+            "setup_time": setup_time,
+            "phases": phases,
+        }
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2017 beyond-blockchain.org.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from bbc1.common.dispatcher import Dispatcher
+from bbc1.common.message_key_types import KeyType
+from bbc1.core import instrumentation
+
+
+# bbclib.ServiceMessageType in the order of the former if/elif chain of BBcCoreService.process
+# (bbclib is not imported to avoid loading libbbcsig)
+COMMANDS = [68, 66, 35, 39, 38, 70, 34, 128, 130, 32, 33, 6, 0, 2, 4, 8, 13, 12, 15, 17, 10]
+
+
+class ChainDispatcher:
+    """
+    Reference: the former dispatch walking the if/elif chain of comparisons
+    """
+    def __init__(self, handler):
+        self.handler = handler
+
+    def process(self, socket, dat):
+        cmd = dat[KeyType.command]
+        h = self.handler
+        if cmd == COMMANDS[0]:
+            return h(socket, dat)
+        elif cmd == COMMANDS[1]:
+            return h(socket, dat)
+        elif cmd == COMMANDS[2]:
+            return h(socket, dat)
+        elif cmd == COMMANDS[3]:
+            return h(socket, dat)
+        elif cmd == COMMANDS[4]:
+            return h(socket, dat)
+        elif cmd == COMMANDS[5]:
+            return h(socket, dat)
+        elif cmd == COMMANDS[6]:
+            return h(socket, dat)
+        elif cmd == COMMANDS[7]:
+            return h(socket, dat)
+        elif cmd == COMMANDS[8]:
+            return h(socket, dat)
+        elif cmd == COMMANDS[9]:
+            return h(socket, dat)
+        elif cmd == COMMANDS[10]:
+            return h(socket, dat)
+        elif cmd == COMMANDS[11]:
+            return h(socket, dat)
+        elif cmd == COMMANDS[12]:
+            return h(socket, dat)
+        elif cmd == COMMANDS[13]:
+            return h(socket, dat)
+        elif cmd == COMMANDS[14]:
+            return h(socket, dat)
+        elif cmd == COMMANDS[15]:
+            return h(socket, dat)
+        elif cmd == COMMANDS[16]:
+            return h(socket, dat)
+        elif cmd == COMMANDS[17]:
+            return h(socket, dat)
+        elif cmd == COMMANDS[18]:
+            return h(socket, dat)
+        elif cmd == COMMANDS[19]:
+            return h(socket, dat)
+        elif cmd == COMMANDS[20]:
+            return h(socket, dat)
+        return None
+
+
+class TableDispatcher:
+    """
+    Dispatch in the same way as BBcCoreService.process
+    """
+    def __init__(self, handler, middlewares=()):
+        self.dispatcher = Dispatcher()
+        for cmd in COMMANDS:
+            self.dispatcher.register(cmd, handler)
+        for middleware in middlewares:
+            self.dispatcher.add_middleware(middleware)
+
+    def process(self, socket, dat):
+        handler = self.dispatcher.get(dat[KeyType.command])
+        if handler is None:
+            return None
+        return handler(socket, dat)
+
+
+def handler(socket, dat):
+    return None
+
+
+def make_messages(count, commands):
+    return [{KeyType.command: random.choice(commands), KeyType.source_user_id: b'\x01' * 32} for i in range(count)]
+
+
+def run(dispatcher, messages):
+    process = dispatcher.process
+    start = time.perf_counter()
+    for dat in messages:
+        process(None, dat)
+    return time.perf_counter() - start
+
+
+def argument_parser():
+    argparser = argparse.ArgumentParser(description='Compare the dispatch by table with the if/elif chain.')
+    argparser.add_argument('-n', '--count', type=int, default=1000000, help='number of messages')
+    argparser.add_argument('-o', '--output', action='store', default=None, help='write results in JSON')
+    return argparser.parse_args()
+
+
+if __name__ == '__main__':
+    args = argument_parser()
+    stats = instrumentation.Instrumentation()
+    dispatchers = [
+        ("if/elif chain", ChainDispatcher(handler)),
+        ("table", TableDispatcher(handler)),
+        ("table+metrics", TableDispatcher(handler, [lambda cmd, h: stats.wrap(str(cmd), h)])),
+    ]
+    workloads = [
+        ("first command", [COMMANDS[0]]),
+        ("last command", [COMMANDS[-1]]),
+        ("uniform", COMMANDS),
+    ]
+    results = []
+    for workload, commands in workloads:
+        messages = make_messages(args.count, commands)
+        for name, dispatcher in dispatchers:
+            elapsed = run(dispatcher, messages)
+            results.append({"workload": workload, "dispatcher": name, "msg_per_sec": args.count / elapsed,
+                            "nsec_per_msg": elapsed / args.count * 1000000000})
+            print("%-14s %-14s %10.0f msg/s  %6.0f ns/msg" %
+                  (workload, name, args.count / elapsed, elapsed / args.count * 1000000000))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2017 beyond-blockchain.org.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import argparse
+import json
+import os
+import struct
+import time
+
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from bbc1.common import message_key_types
+from bbc1.common.message_key_types import KeyType, PayloadType
+
+
+class CopyingMessage:
+    """
+    Reference parser that removes every parsed message from the head of the buffer (the former implementation)
+    """
+    def __init__(self):
+        self.pending_buf = bytearray()
+        self.is_new_chunk = True
+        self.payload_type = 0
+        self.msg_len = 0
+
+    def recv(self, dat):
+        self.pending_buf.extend(dat)
+
+    def parse(self):
+        if self.is_new_chunk:
+            if len(self.pending_buf) < 8:
+                return None
+            self.payload_type, version, self.msg_len = struct.unpack(">HHI", self.pending_buf[:8])
+            self.is_new_chunk = False
+        if len(self.pending_buf) >= self.msg_len + 8:
+            self.is_new_chunk = True
+            body = self.pending_buf[8:(self.msg_len + 8)]
+            self.pending_buf = self.pending_buf[(self.msg_len + 8):]
+            return message_key_types.deserialize_data(self.payload_type, body)
+        return None
+
+
+def make_stream(count, body_size):
+    msg = {
+        KeyType.command: 68,
+        KeyType.query_id: b'\x01\x00',
+        KeyType.source_user_id: b'\x01' * 32,
+        KeyType.asset_group_id: b'\x02' * 32,
+        KeyType.transaction_id: b'\x03' * 32,
+    }
+    if body_size > 0:
+        msg[KeyType.transaction_data] = b'\x04' * body_size
+    return message_key_types.make_message(PayloadType.Type_msgpack, msg) * count
+
+
+def run_parser(parser_class, stream, chunk_size):
+    parser = parser_class()
+    count = 0
+    start = time.perf_counter()
+    for pos in range(0, len(stream), chunk_size):
+        parser.recv(stream[pos:pos + chunk_size])
+        while True:
+            msg = parser.parse()
+            if msg is None:
+                break
+            count += 1
+    return count, time.perf_counter() - start
+
+
+def run_codec(stream, chunk_size):
+    codec = message_key_types.MessageCodec()
+    count = 0
+    start = time.perf_counter()
+    for pos in range(0, len(stream), chunk_size):
+        count += len(codec.feed(stream[pos:pos + chunk_size]))
+    return count, time.perf_counter() - start
+
+
+def argument_parser():
+    argparser = argparse.ArgumentParser(description='Measure throughput of message_key_types.Message parser and MessageCodec.')
+    argparser.add_argument('-n', '--messages', type=int, nargs='+', default=[1000, 10000, 50000],
+                           help='number of messages in a stream')
+    argparser.add_argument('-b', '--body_size', type=int, default=0, help='size of transaction_data in a message')
+    argparser.add_argument('-c', '--chunk_size', type=int, default=1024 * 1024,
+                           help='bytes passed to recv() at once (a large value means many messages in a read)')
+    argparser.add_argument('--no_reference', action='store_true', default=False,
+                           help='skip the reference (copying) parser')
+    argparser.add_argument('-o', '--output', action='store', default=None, help='write results in JSON')
+    return argparser.parse_args()
+
+
+if __name__ == '__main__':
+    args = argument_parser()
+    results = []
+    for count in args.messages:
+        stream = make_stream(count, args.body_size)
+        parsers = [("Message", lambda: run_parser(message_key_types.Message, stream, args.chunk_size)),
+                   ("MessageCodec", lambda: run_codec(stream, args.chunk_size))]
+        if not args.no_reference:
+            parsers.append(("CopyingMessage", lambda: run_parser(CopyingMessage, stream, args.chunk_size)))
+        for name, func in parsers:
+            parsed, elapsed = func()
+            assert parsed == count
+            results.append({"parser": name, "messages": count, "bytes": len(stream),
+                            "seconds": elapsed, "messages_per_sec": count / elapsed})
+            print("%-15s messages=%-7d bytes=%-10d %.4f sec  %.0f msg/s" %
+                  (name, count, len(stream), elapsed, count / elapsed))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2017 beyond-blockchain.org.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import argparse
+import json
+import os
+import time
+
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from bbc1.common import message_key_types
+from bbc1.common.message_key_types import KeyType, PayloadType
+
+
+REQUEST_INSERT = 39  # bbclib.ServiceMessageType.REQUEST_INSERT (bbclib is not imported to avoid loading libbbcsig)
+
+
+def make_transaction_message(tx_size):
+    """
+    Make a message like REQUEST_INSERT (a transaction of tx_size bytes and an asset file of the same size)
+    """
+    return {
+        KeyType.command: REQUEST_INSERT,
+        KeyType.query_id: b'\x01\x00',
+        KeyType.source_user_id: os.urandom(32),
+        KeyType.asset_group_id: os.urandom(32),
+        KeyType.transaction_id: os.urandom(32),
+        KeyType.transaction_data: os.urandom(tx_size),
+        KeyType.all_asset_files: {os.urandom(32): os.urandom(tx_size)},
+    }
+
+
+def run(payload_type, msg, count):
+    start = time.perf_counter()
+    for i in range(count):
+        dat = message_key_types.make_message(payload_type, msg)
+    encode_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(count):
+        decoded = message_key_types.deserialize_data(payload_type, memoryview(dat)[8:])
+    decode_time = time.perf_counter() - start
+    assert decoded == msg
+    return len(dat), encode_time, decode_time
+
+
+def argument_parser():
+    argparser = argparse.ArgumentParser(description='Compare binary (TLV) and msgpack payload types.')
+    argparser.add_argument('-s', '--tx_sizes', type=int, nargs='+', default=[256, 1024, 8192, 65536],
+                           help='size of transaction_data in bytes')
+    argparser.add_argument('-n', '--count', type=int, default=20000, help='number of encode/decode operations')
+    argparser.add_argument('-o', '--output', action='store', default=None, help='write results in JSON')
+    return argparser.parse_args()
+
+
+if __name__ == '__main__':
+    args = argument_parser()
+    results = []
+    for tx_size in args.tx_sizes:
+        msg = make_transaction_message(tx_size)
+        for name, payload_type in (("msgpack", PayloadType.Type_msgpack), ("binary", PayloadType.Type_binary)):
+            size, encode_time, decode_time = run(payload_type, msg, args.count)
+            results.append({"payload_type": name, "tx_size": tx_size, "message_size": size,
+                            "encode_per_sec": args.count / encode_time, "decode_per_sec": args.count / decode_time})
+            print("%-8s tx_size=%-7d message=%-7d encode %.0f msg/s  decode %.0f msg/s" %
+                  (name, tx_size, size, args.count / encode_time, args.count / decode_time))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
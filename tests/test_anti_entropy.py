@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import time
+
+import sys
+sys.path.extend(["../"])
+from bbc1.common import bbclib
+from bbc1.common.message_key_types import KeyType
+from bbc1.core import anti_entropy
+from testutils import prepare, get_core_client, start_core_thread, make_client, domain_and_asset_group_setup
+
+
+LOGLEVEL = 'debug'
+LOGLEVEL = 'info'
+
+core_num = 2
+client_num = 2
+transaction_num = 20
+cores = None
+clients = None
+domain_id = bbclib.get_new_id("testdomain")
+asset_group_id = bbclib.get_new_id("asset_group_1")
+range_responses = list()
+transaction_responses = list()
+
+
+def insert_transactions_only_in_core0(num):
+    user_id = clients[0]['user_id']
+    for i in range(num):
+        txobj = bbclib.make_transaction_for_base_asset(asset_group_id=asset_group_id, event_num=1)
+        txobj.events[0].asset.add(user_id=user_id, asset_body=b'anti-entropy %d' % i)
+        txobj.digest()
+        sig = txobj.sign(keypair=clients[0]['keypair'])
+        txobj.add_signature(user_id=user_id, signature=sig)
+        assert cores[0].insert_transaction(asset_group_id, txobj.serialize(), None, no_network_put=True) is None
+
+
+def wait_for_session(session):
+    for i in range(50):
+        if not session.active:
+            break
+        time.sleep(0.2)
+    assert not session.active
+
+
+def record_responses(ae):
+    process_RESPONSE_RANGE_DIGEST = ae.process_RESPONSE_RANGE_DIGEST
+    process_RESPONSE_TRANSACTIONS = ae.process_RESPONSE_TRANSACTIONS
+
+    def range_wrapper(msg):
+        range_responses.append(msg[KeyType.range_digests])
+        process_RESPONSE_RANGE_DIGEST(msg)
+
+    def transaction_wrapper(msg):
+        transaction_responses.append(len(msg[KeyType.transactions]))
+        process_RESPONSE_TRANSACTIONS(msg)
+    ae.process_RESPONSE_RANGE_DIGEST = range_wrapper
+    ae.process_RESPONSE_TRANSACTIONS = transaction_wrapper
+
+
+class TestAntiEntropy(object):
+
+    def test_00_setup(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        prepare(core_num=core_num, client_num=client_num, loglevel=LOGLEVEL)
+        for i in range(core_num):
+            start_core_thread(index=i, core_port_increment=i, p2p_port_increment=i)
+        time.sleep(1)
+        for i in range(client_num):
+            domain_and_asset_group_setup(i, domain_id, asset_group_id)
+            make_client(index=i, core_port_increment=i, asset_group_id=asset_group_id)
+        time.sleep(1)
+
+        global cores, clients
+        cores, clients = get_core_client()
+        for cl in clients:
+            assert cl['app'].register_to_core()
+        time.sleep(1)
+
+    def test_01_setup_network(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        clients[0]['app'].get_domain_peerlist(domain_id=domain_id)
+        node_id, ipv4, ipv6, port = clients[0]['app'].callback.synchronize()[0]
+        clients[1]['app'].set_domain_static_node(domain_id, node_id, ipv4, ipv6, port)
+        clients[1]['app'].callback.synchronize()
+        time.sleep(1)
+        assert node_id in cores[1].networking.domains[domain_id].id_ip_mapping
+
+    def test_02_sync(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        # the differing ranges are split, and one transaction is sent in a message
+        anti_entropy.LEAF_SIZE = 4
+        domain = cores[1].networking.domains[domain_id]
+        cores[0].networking.domains[domain_id].anti_entropy.max_bytes_per_message = 1
+        record_responses(domain.anti_entropy)
+        insert_transactions_only_in_core0(transaction_num)
+        ledger = cores[1].ledger_manager
+        assert ledger.count_transactions(domain_id, asset_group_id) == 0
+
+        session = domain.anti_entropy.start_session(cores[0].networking.domains[domain_id].node_id, asset_group_id)
+        wait_for_session(session)
+        assert session.data['stored'] == transaction_num
+        assert ledger.count_transactions(domain_id, asset_group_id) == transaction_num
+        assert any(txids is None for ranges in range_responses for start, end, txids in ranges)
+        assert len(transaction_responses) >= transaction_num
+        assert max(transaction_responses) == 1
+        assert cores[0].ledger_manager.get_range_digest(domain_id, asset_group_id, bytes(32)) == \
+            ledger.get_range_digest(domain_id, asset_group_id, bytes(32))
+
+    def test_03_in_sync(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        del range_responses[:]
+        del transaction_responses[:]
+        domain = cores[1].networking.domains[domain_id]
+        session = domain.anti_entropy.start_session(cores[0].networking.domains[domain_id].node_id, asset_group_id)
+        wait_for_session(session)
+        assert range_responses == [[]]
+        assert len(transaction_responses) == 0
+
+    def test_04_session_limit(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        # the session stops after the first transaction exceeds the limit
+        del transaction_responses[:]
+        domain = cores[1].networking.domains[domain_id]
+        domain.anti_entropy.max_bytes_per_session = 1
+        insert_transactions_only_in_core0(5)
+        session = domain.anti_entropy.start_session(cores[0].networking.domains[domain_id].node_id, asset_group_id)
+        wait_for_session(session)
+        assert session.data['stored'] == 1
+        assert transaction_responses == [1]
+        assert cores[1].ledger_manager.count_transactions(domain_id, asset_group_id) == transaction_num + 1
+
+        # the rest is transferred in the next session
+        domain.anti_entropy.max_bytes_per_session = anti_entropy.MAX_BYTES_PER_SESSION
+        session = domain.anti_entropy.start_session(cores[0].networking.domains[domain_id].node_id, asset_group_id)
+        wait_for_session(session)
+        assert session.data['stored'] == 4
+        assert cores[1].ledger_manager.count_transactions(domain_id, asset_group_id) == transaction_num + 5
+
+    @pytest.mark.unregister
+    def test_99_unregister(self):
+        for cl in clients:
+            cl['app'].unregister_from_core()
+
+
+if __name__ == '__main__':
+    pytest.main()
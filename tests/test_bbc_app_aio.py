@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import asyncio
+import os
+import subprocess
+
+import sys
+sys.path.extend(["../"])
+from bbc1.common import bbclib
+from bbc1.common.message_key_types import KeyType
+from bbc1.common.bbc_error import *
+from bbc1.app import aio
+from bbc1.core.bbc_config import DEFAULT_CORE_PORT
+from testutils import prepare, start_core_thread, domain_and_asset_group_setup
+
+LOGLEVEL = 'debug'
+LOGLEVEL = 'info'
+
+core_num = 2
+request_num = 200
+domain_id = bbclib.get_new_id("testdomain")
+asset_group_id = bbclib.get_new_id("asset_group_1")
+keypairs = [None, None]
+user_ids = [bbclib.get_new_id("user_0"), bbclib.get_new_id("user_1")]
+clients = [None, None]
+transactions = list()
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def make_transaction(idx, body):
+    txobj = bbclib.make_transaction_for_base_asset(asset_group_id=asset_group_id, event_num=1)
+    txobj.events[0].asset.add(user_id=user_ids[idx], asset_body=body)
+    txobj.digest()
+    sig = txobj.sign(keypair=keypairs[idx])
+    txobj.add_signature(user_id=user_ids[idx], signature=sig)
+    return txobj
+
+
+async def make_client(idx, cores):
+    client = aio.AioBBcAppClient(cores=cores, loglevel=LOGLEVEL, timeout=10)
+    client.set_user_id(user_ids[idx])
+    client.set_asset_group_id(asset_group_id)
+    assert await client.connect()
+    return client
+
+
+class TestAioBBcAppClient(object):
+
+    def test_00_no_monkey_patch(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        code = "import sys; sys.path.insert(0, '..'); import bbc1.app.aio; print('gevent' in sys.modules)"
+        out = subprocess.check_output([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)))
+        assert out.strip() == b'False'
+
+    def test_01_setup(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        prepare(core_num=core_num, client_num=2, loglevel=LOGLEVEL)
+        for i in range(core_num):
+            start_core_thread(index=i, core_port_increment=i, p2p_port_increment=i)
+            domain_and_asset_group_setup(i, domain_id, asset_group_id)
+        for i in range(2):
+            keypairs[i] = bbclib.KeyPair()
+            keypairs[i].generate()
+        cores = [('127.0.0.1', DEFAULT_CORE_PORT + i) for i in range(core_num)]
+        clients[0] = run(make_client(0, cores))
+        clients[1] = run(make_client(1, cores[:1]))
+        run(asyncio.sleep(1))
+        assert all(c.is_connected() for c in clients[0].connections)
+
+    def test_02_insert(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        for i in range(request_num):
+            transactions.append(make_transaction(0, b'aio-%d' % i))
+
+        async def insert_all():
+            return await asyncio.gather(*[clients[0].insert_transaction(asset_group_id, txobj)
+                                          for txobj in transactions])
+        for txobj, dat in zip(transactions, run(insert_all())):
+            assert dat[KeyType.command] == bbclib.ServiceMessageType.RESPONSE_INSERT
+            assert dat[KeyType.status] == ESUCCESS
+            assert dat[KeyType.transaction_id] == txobj.transaction_id
+        assert len(clients[0].pending_requests) == 0
+
+    def test_03_search(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        # the cores are not connected with each other, so each transaction is found only in the core node
+        # where it was inserted (asyncio.gather does not start the inserts in the order of the list, so which one
+        # is not known, but the round robin put the same number of transactions in each core node)
+        async def search(txid, connection):
+            dat = clients[0].make_message_structure(asset_group_id, bbclib.ServiceMessageType.REQUEST_SEARCH_TRANSACTION)
+            dat[KeyType.transaction_id] = txid
+            return await clients[0].request(dat, connection)
+
+        async def search_all(connection):
+            return await asyncio.gather(*[search(txobj.transaction_id, connection) for txobj in transactions])
+        found = [0 for i in range(core_num)]
+        results = [run(search_all(connection)) for connection in clients[0].connections]
+        for i, txobj in enumerate(transactions):
+            cores = [j for j in range(core_num) if results[j][i][KeyType.status] == ESUCCESS]
+            assert len(cores) == 1
+            dat = results[cores[0]][i]
+            assert bbclib.recover_transaction_object_from_rawdata(dat[KeyType.transaction_data]).transaction_id == \
+                txobj.transaction_id
+            found[cores[0]] += 1
+        assert found == [request_num // core_num for i in range(core_num)]
+
+        dat = run(clients[0].search_transaction(asset_group_id, b'4898g9fh'))
+        assert dat[KeyType.status] < ESUCCESS
+
+    def test_04_gather_signature(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+
+        async def sign(dat):
+            txobj = bbclib.recover_transaction_object_from_rawdata(dat[KeyType.transaction_data])
+            sig = txobj.sign(keypair=keypairs[1])
+            await clients[1].sendback_signature(asset_group_id, dat[KeyType.source_user_id], -1, sig,
+                                                query_id=dat[KeyType.query_id])
+        clients[1].set_message_handler(sign)
+
+        txobj = bbclib.make_transaction_for_base_asset(asset_group_id=asset_group_id, event_num=1)
+        txobj.events[0].asset.add(user_id=user_ids[0], asset_body=b'gather')
+        txobj.digest()
+        responses = run(clients[0].gather_signatures(asset_group_id, txobj, destinations=[user_ids[0], user_ids[1]]))
+        assert len(responses) == 1
+        assert responses[0][KeyType.command] == bbclib.ServiceMessageType.RESPONSE_GATHER_SIGNATURE
+        assert responses[0][KeyType.source_user_id] == user_ids[1]
+        assert len(clients[0].gathering) == 0
+
+    def test_05_message(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        clients[1].set_message_handler(None)
+        assert run(clients[0].send_message(b'hello', asset_group_id, user_ids[1]))
+        dat = run(clients[1].receive_message(timeout=10))
+        assert dat[KeyType.message] == b'hello'
+
+    def test_06_reconnect(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        connection = clients[0].connections[1]
+        connection.writer.close()
+        run(asyncio.sleep(0.1))
+        assert not connection.is_connected()
+        # requests go to the other core node while disconnected
+        for i in range(4):
+            assert clients[0].select_connection() is clients[0].connections[0]
+        run(asyncio.wait_for(connection.connected.wait(), 10))
+        dat = run(clients[0].search_transaction(asset_group_id, transactions[0].transaction_id))
+        assert KeyType.status in dat
+
+    def test_99_unregister(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        for client in clients:
+            assert run(client.unregister_from_core())
+        assert not any(c.is_connected() for c in clients[0].connections)
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import binascii
+import time
+
+import sys
+sys.path.extend(["../"])
+from bbc1.common import bbclib
+from bbc1.common.message_key_types import KeyType
+from bbc1.common.bbc_error import *
+from bbc1.app import bbc_app
+from bbc1.core.bbc_config import DEFAULT_CORE_PORT
+from testutils import prepare, get_core_client, start_core_thread, make_client, domain_and_asset_group_setup
+
+LOGLEVEL = 'debug'
+LOGLEVEL = 'info'
+
+core_num = 1
+client_num = 3
+request_num = 500
+cores = None
+clients = None
+domain_id = bbclib.get_new_id("testdomain")
+asset_group_id = bbclib.get_new_id("asset_group_1")
+transactions = list()
+
+
+class SignProcessor(bbc_app.Callback):
+    def __init__(self, index=0):
+        super(SignProcessor, self).__init__(self)
+        self.idx = index
+
+    def proc_cmd_sign_request(self, dat):
+        txobj = bbclib.recover_transaction_object_from_rawdata(dat[KeyType.transaction_data])
+        sig = txobj.sign(keypair=clients[self.idx]['keypair'])
+        clients[self.idx]['app'].sendback_signature(asset_group_id, dat[KeyType.source_user_id], -1, sig,
+                                                    query_id=dat[KeyType.query_id])
+
+
+class LegacySignProcessor(SignProcessor):
+    def proc_cmd_sign_request(self, dat):
+        # the query_id of the sign request is not given (the core node sets it to the response)
+        txobj = bbclib.recover_transaction_object_from_rawdata(dat[KeyType.transaction_data])
+        sig = txobj.sign(keypair=clients[self.idx]['keypair'])
+        clients[self.idx]['app'].sendback_signature(asset_group_id, dat[KeyType.source_user_id], -1, sig)
+
+
+def make_transaction(user_id, keypair, body):
+    txobj = bbclib.make_transaction_for_base_asset(asset_group_id=asset_group_id, event_num=1)
+    txobj.events[0].asset.add(user_id=user_id, asset_body=body)
+    txobj.digest()
+    sig = txobj.sign(keypair=keypair)
+    txobj.add_signature(user_id=user_id, signature=sig)
+    return txobj
+
+
+class TestBBcAppClientPipelined(object):
+
+    def test_00_setup(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        prepare(core_num=core_num, client_num=client_num, loglevel=LOGLEVEL)
+        start_core_thread(index=0)
+        domain_and_asset_group_setup(0, domain_id, asset_group_id)
+        for i in range(client_num):
+            make_client(index=i, core_port_increment=0, connect_to_core=False)
+        time.sleep(1)
+
+        global cores, clients
+        cores, clients = get_core_client()
+        for i in range(client_num):
+            clients[i]['app'] = bbc_app.BBcAppClient(port=DEFAULT_CORE_PORT, loglevel=LOGLEVEL, pipelined=True)
+            clients[i]['app'].set_user_id(clients[i]['user_id'])
+            clients[i]['app'].set_asset_group_id(asset_group_id)
+            assert clients[i]['app'].register_to_core()
+        clients[1]['app'].set_callback(SignProcessor(index=1))
+        clients[2]['app'].set_callback(LegacySignProcessor(index=2))
+        time.sleep(1)
+
+    def test_01_query_id(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        app = clients[0]['app']
+        dat1 = app.make_message_structure(asset_group_id, bbclib.ServiceMessageType.REQUEST_SEARCH_ASSET)
+        dat2 = app.make_message_structure(asset_group_id, bbclib.ServiceMessageType.REQUEST_SEARCH_ASSET)
+        assert int.from_bytes(dat2[KeyType.query_id], 'little') == \
+            (int.from_bytes(dat1[KeyType.query_id], 'little') + 1) % 65536
+        app.query_id = (65535).to_bytes(2, 'little')
+        dat3 = app.make_message_structure(asset_group_id, bbclib.ServiceMessageType.REQUEST_SEARCH_ASSET)
+        assert dat3[KeyType.query_id] == (0).to_bytes(2, 'little')
+
+    def test_02_insert(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        for i in range(request_num):
+            transactions.append(make_transaction(clients[0]['user_id'], clients[0]['keypair'],
+                                                 b'pipelined-%d' % i))
+        results = [clients[0]['app'].insert_transaction(asset_group_id, txobj) for txobj in transactions]
+        assert len(clients[0]['app'].pending_requests) > 0
+        for txobj, result in zip(transactions, results):
+            dat = result.get(timeout=30)
+            assert dat[KeyType.command] == bbclib.ServiceMessageType.RESPONSE_INSERT
+            assert dat[KeyType.status] == ESUCCESS
+            assert dat[KeyType.transaction_id] == txobj.transaction_id
+        assert len(clients[0]['app'].pending_requests) == 0
+
+    def test_03_search(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        results = list()
+        for txobj in transactions:
+            results.append(clients[0]['app'].search_transaction(asset_group_id, txobj.transaction_id))
+            results.append(clients[0]['app'].search_asset(asset_group_id, txobj.events[0].asset.asset_id))
+        for i, result in enumerate(results):
+            dat = result.get(timeout=30)
+            assert dat[KeyType.status] == ESUCCESS
+            txobj = bbclib.recover_transaction_object_from_rawdata(dat[KeyType.transaction_data])
+            assert txobj.transaction_id == transactions[i // 2].transaction_id
+
+    def test_04_search_not_found(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        result = clients[0]['app'].search_transaction(asset_group_id, b'4898g9fh')
+        dat = result.get(timeout=10)
+        assert dat[KeyType.command] == bbclib.ServiceMessageType.RESPONSE_SEARCH_TRANSACTION
+        assert dat[KeyType.status] < ESUCCESS
+
+    def test_05_gather_signature(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        txobj = bbclib.make_transaction_for_base_asset(asset_group_id=asset_group_id, event_num=1)
+        txobj.events[0].asset.add(user_id=clients[0]['user_id'], asset_body=b'gather')
+        txobj.digest()
+        result = clients[0]['app'].gather_signatures(asset_group_id, txobj, destinations=[clients[1]['user_id']])
+        responses = result.get(timeout=10)
+        assert len(responses) == 1
+        assert responses[0][KeyType.command] == bbclib.ServiceMessageType.RESPONSE_GATHER_SIGNATURE
+        assert responses[0][KeyType.source_user_id] == clients[1]['user_id']
+        print("signature from", binascii.b2a_hex(responses[0][KeyType.source_user_id]))
+
+    def test_06_gather_signatures_from_multiple_users(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        app = clients[0]['app']
+        txobj = bbclib.make_transaction_for_base_asset(asset_group_id=asset_group_id, event_num=1)
+        txobj.events[0].asset.add(user_id=clients[0]['user_id'], asset_body=b'gather2')
+        txobj.digest()
+        searches = [app.search_transaction(asset_group_id, tx.transaction_id) for tx in transactions[:20]]
+        result = app.gather_signatures(asset_group_id, txobj,
+                                       destinations=[clients[0]['user_id'], clients[1]['user_id'],
+                                                     clients[2]['user_id']])
+        searches.extend(app.search_transaction(asset_group_id, tx.transaction_id) for tx in transactions[20:40])
+        responses = result.get(timeout=10)
+        assert sorted(dat[KeyType.source_user_id] for dat in responses) == \
+            sorted([clients[1]['user_id'], clients[2]['user_id']])
+        for dat in responses:
+            assert dat[KeyType.command] == bbclib.ServiceMessageType.RESPONSE_GATHER_SIGNATURE
+            assert dat[KeyType.status] == ESUCCESS
+        # the signatures are not taken as the responses of the other requests
+        for tx, search in zip(transactions[:40], searches):
+            dat = search.get(timeout=10)
+            assert dat[KeyType.command] == bbclib.ServiceMessageType.RESPONSE_SEARCH_TRANSACTION
+            assert bbclib.recover_transaction_object_from_rawdata(dat[KeyType.transaction_data]).transaction_id == \
+                tx.transaction_id
+        assert len(app.pending_requests) == 0 and len(app.gathering) == 0
+
+    def test_07_disconnect(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        app = clients[0]['app']
+        dat = app.make_message_structure(asset_group_id, bbclib.ServiceMessageType.REQUEST_SEARCH_ASSET)
+        dat[KeyType.asset_id] = b'x' * 32
+        app.connection.close()
+        result = app.send_request(dat)
+        with pytest.raises(ConnectionError):
+            result.get(timeout=10)
+
+    @pytest.mark.unregister
+    def test_99_unregister(self):
+        for i in range(1, client_num):
+            ret = clients[i]['app'].unregister_from_core()
+            assert ret
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import binascii
+import time
+
+import sys
+sys.path.extend(["../"])
+from bbc1.common import bbclib
+from bbc1.common.message_key_types import KeyType
+from bbc1.common.bbc_error import *
+from bbc1.app import bbc_app
+from bbc1.core.bbc_config import DEFAULT_CORE_PORT
+from testutils import prepare, get_core_client, start_core_thread, make_client, domain_and_asset_group_setup
+
+LOGLEVEL = 'debug'
+LOGLEVEL = 'info'
+
+core_num = 3
+client_num = 3
+request_num = 300
+cores = None
+clients = None
+domain_id = bbclib.get_new_id("testdomain")
+asset_group_id = bbclib.get_new_id("asset_group_1")
+transactions = list()
+
+pools = [None, None]
+pool_users = [dict(), dict()]
+
+
+class SignProcessor(bbc_app.Callback):
+    def __init__(self, index=0):
+        super(SignProcessor, self).__init__(self)
+        self.idx = index
+
+    def proc_cmd_sign_request(self, dat):
+        txobj = bbclib.recover_transaction_object_from_rawdata(dat[KeyType.transaction_data])
+        sig = txobj.sign(keypair=pool_users[self.idx]['keypair'])
+        pools[self.idx].sendback_signature(asset_group_id, dat[KeyType.source_user_id], -1, sig,
+                                           query_id=dat[KeyType.query_id])
+
+
+class TestBBcAppClientPool(object):
+
+    def test_00_setup(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        prepare(core_num=core_num, client_num=client_num, loglevel=LOGLEVEL)
+        for i in range(core_num):
+            start_core_thread(index=i, core_port_increment=i, p2p_port_increment=i)
+        time.sleep(1)
+        for i in range(client_num):
+            domain_and_asset_group_setup(i, domain_id, asset_group_id)
+            make_client(index=i, core_port_increment=i, asset_group_id=asset_group_id)
+        time.sleep(1)
+
+        global cores, clients
+        cores, clients = get_core_client()
+
+    def test_01_setup_network(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        clients[0]['app'].get_domain_peerlist(domain_id=domain_id)
+        node_id, ipv4, ipv6, port = clients[0]['app'].callback.synchronize()[0]
+        for i in range(1, client_num):
+            clients[i]['app'].set_domain_static_node(domain_id, node_id, ipv4, ipv6, port)
+            clients[i]['app'].callback.synchronize()
+        time.sleep(3)
+
+    def test_02_make_pools(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        core_addresses = [('127.0.0.1', DEFAULT_CORE_PORT + i) for i in range(core_num)]
+        for i in range(2):
+            pool_users[i]['user_id'] = bbclib.get_new_id("pool_user_%d" % i)
+            pool_users[i]['keypair'] = bbclib.KeyPair()
+            pool_users[i]['keypair'].generate()
+            pools[i] = bbc_app.BBcAppClientPool(cores=core_addresses, loglevel=LOGLEVEL, reconnect_interval=1)
+            pools[i].set_user_id(pool_users[i]['user_id'])
+            pools[i].set_asset_group_id(asset_group_id)
+            assert pools[i].register_to_core()
+            assert len(pools[i].get_clients()) == core_num
+        pools[1].set_callback(SignProcessor(index=1))
+        time.sleep(1)
+
+    def test_03_insert(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        for i in range(request_num):
+            txobj = bbclib.make_transaction_for_base_asset(asset_group_id=asset_group_id, event_num=1)
+            txobj.events[0].asset.add(user_id=pool_users[0]['user_id'], asset_body=b'pool-%d' % i)
+            txobj.digest()
+            sig = txobj.sign(keypair=pool_users[0]['keypair'])
+            txobj.add_signature(user_id=pool_users[0]['user_id'], signature=sig)
+            transactions.append(txobj)
+        results = [pools[0].insert_transaction(asset_group_id, txobj) for txobj in transactions]
+        for txobj, result in zip(transactions, results):
+            dat = result.get(timeout=30)
+            assert dat[KeyType.status] == ESUCCESS
+            assert dat[KeyType.transaction_id] == txobj.transaction_id
+        # the requests are distributed over all the core nodes
+        inserted = [core.stats.get_stats()['commands'].get('REQUEST_INSERT', {}).get('count', 0) for core in cores]
+        print("inserted:", inserted)
+        assert all(count > 0 for count in inserted)
+
+    def test_04_search(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        time.sleep(2)
+        results = [pools[0].search_transaction(asset_group_id, txobj.transaction_id) for txobj in transactions]
+        for txobj, result in zip(transactions, results):
+            dat = result.get(timeout=30)
+            assert dat[KeyType.status] == ESUCCESS
+            assert bbclib.recover_transaction_object_from_rawdata(dat[KeyType.transaction_data]).transaction_id == \
+                txobj.transaction_id
+
+    def test_05_gather_signature(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        txobj = bbclib.make_transaction_for_base_asset(asset_group_id=asset_group_id, event_num=1)
+        txobj.events[0].asset.add(user_id=pool_users[0]['user_id'], asset_body=b'gather')
+        txobj.digest()
+        primary = pools[0].primary_client()
+        result = pools[0].gather_signatures(asset_group_id, txobj, destinations=[pool_users[1]['user_id']])
+        responses = result.get(timeout=10)
+        assert len(responses) == 1
+        assert responses[0][KeyType.command] == bbclib.ServiceMessageType.RESPONSE_GATHER_SIGNATURE
+        assert responses[0][KeyType.source_user_id] == pool_users[1]['user_id']
+        assert pools[0].primary_client() is primary
+        print("signature from", binascii.b2a_hex(responses[0][KeyType.source_user_id]))
+
+    def test_06_failover(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        primary = pools[0].primary_client()
+        primary.connection.close()
+        time.sleep(0.5)
+        assert not primary.connected
+        assert pools[0].primary_client() is not primary
+        results = [pools[0].search_transaction(asset_group_id, txobj.transaction_id) for txobj in transactions[:50]]
+        for result in results:
+            assert result.get(timeout=30)[KeyType.status] == ESUCCESS
+        time.sleep(2)
+        assert len(pools[0].get_clients()) == core_num
+
+    @pytest.mark.unregister
+    def test_99_unregister(self):
+        for pool in pools:
+            assert pool.unregister_from_core()
+        for cl in clients:
+            cl['app'].unregister_from_core()
+
+
+if __name__ == '__main__':
+    pytest.main()
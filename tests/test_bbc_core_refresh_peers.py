@@ -43,7 +43,7 @@ def wait_results(count):
     return total
 
 
-def dummy_send_message(data):
+def dummy_send_message(data, sock=None):
     print("[Core] recv=%s" % data)
     if KeyType.reason in data:
         result_queue.put(0)
@@ -88,6 +88,69 @@ class TestBBcLedger(object):
         assert ret is not None
         print(ret)
 
+    def test_10_range_digest(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        asset_group_id2 = bbclib.get_new_id("asset_group_range_digest")
+        txids = [bytes([0x10] * 32), bytes([0x10, 0x20] + [0] * 30), bytes([0x80] * 32), bytes([0xf0] * 32)]
+        for txid in txids:
+            ledger_manager.insert_locally(domain_id=domain_id, asset_group_id=asset_group_id2, resource_id=txid,
+                                          data=b'dummy', resource_type=ResourceType.Transaction_data)
+        assert ledger_manager.get_transaction_ids(domain_id, asset_group_id2, bytes(32)) == txids
+        assert ledger_manager.get_transaction_ids(domain_id, asset_group_id2, bytes(32), txids[3]) == txids[:3]
+        count, digest = ledger_manager.get_range_digest(domain_id, asset_group_id2, bytes([0x10] * 32))
+        assert count == 4
+        count2, digest2 = ledger_manager.get_range_digest(domain_id, asset_group_id2, bytes([0x11] * 32))
+        assert count2 == 2 and digest != digest2
+        count3, digest3 = ledger_manager.get_range_digest(domain_id, asset_group_id2, bytes(32), bytes([0x80] * 32))
+        assert count3 == 2
+        assert ledger_manager.get_range_digest(domain_id, asset_group_id2, bytes([0x81] * 32), bytes([0xf0] * 32)) \
+            == (0, bytes(32))
+
+        # the digests kept for the prefixes match those calculated from the DB
+        ranges = [[bytes(32), None], [bytes([0x10] * 32), bytes([0x10, 0x21] + [0] * 30)],
+                  [bytes([0x10, 0x20] + [0] * 30), bytes([0xf0] * 32)], [bytes([0x0f] + [0xff] * 31), None]]
+        for i in range(20):
+            ranges.append(sorted([bbclib.get_random_id(), bbclib.get_random_id()]))
+        for start, end in ranges:
+            assert ledger_manager.get_range_digest(domain_id, asset_group_id2, start, end) == \
+                ledger_manager.get_range_digest_from_db(domain_id, asset_group_id2, start, end)
+
+        # the digests are updated by insertion/removal
+        ledger_manager.insert_locally(domain_id=domain_id, asset_group_id=asset_group_id2, resource_id=bytes([0x10, 0x30] + [0] * 30),
+                                      data=b'dummy', resource_type=ResourceType.Transaction_data)
+        assert ledger_manager.get_range_digest(domain_id, asset_group_id2, bytes([0x10] * 32))[0] == 5
+        ledger_manager.remove(domain_id, asset_group_id2, bytes([0x10, 0x30] + [0] * 30))
+        assert ledger_manager.get_range_digest(domain_id, asset_group_id2, bytes([0x10] * 32)) == (count, digest)
+
+    def test_11_export_and_import(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        tx_upper = ledger_manager.get_max_row_id(domain_id)
+        rows = ledger_manager.export_transactions(domain_id, asset_group_id, 0, tx_upper, 1000)
+        assert len(rows) == ledger_manager.count_transactions(domain_id, asset_group_id)
+
+        # the auxiliary records are made from the imported transactions
+        transaction2 = bbclib.make_transaction_for_base_asset(asset_group_id=asset_group_id, event_num=1)
+        transaction2.events[0].asset.add(user_id=user_id, asset_body=b'snapshot')
+        transaction2.digest()
+        transaction3 = bbclib.make_transaction_for_base_asset(asset_group_id=asset_group_id, event_num=0)
+        bbclib.add_reference_to_transaction(asset_group_id, transaction3, transaction2, 0)
+        transaction3.digest()
+        transactions = [[transaction2, transaction2.serialize()], [transaction3, transaction3.serialize()]]
+        domain_id2 = bbclib.get_new_id("test_domain_2")
+        ledger_manager.add_domain(domain_id2)
+        assert ledger_manager.import_transactions(domain_id2, asset_group_id, transactions)
+        assert ledger_manager.import_transactions(domain_id2, asset_group_id, transactions)
+        assert ledger_manager.count_transactions(domain_id2, asset_group_id) == 2
+        asset_id = transaction2.events[0].asset.asset_id
+        assert ledger_manager.find_locally(domain_id2, asset_group_id, asset_id, ResourceType.Asset_ID) == \
+            transaction2.transaction_id
+        assert ledger_manager.find_locally(domain_id2, asset_group_id, transaction2.transaction_id,
+                                           ResourceType.Edge_incoming) == transaction3.transaction_id
+        assert ledger_manager.find_locally(domain_id2, asset_group_id, transaction3.transaction_id,
+                                           ResourceType.Edge_outgoing) == transaction2.transaction_id
+        rows = ledger_manager.exec_sql(domain_id2, "auxiliary_db", "select resource_type from auxiliary_table")
+        assert sorted(row[0] for row in rows) == [ResourceType.Asset_ID, ResourceType.Edge_incoming,
+                                                  ResourceType.Edge_outgoing, ResourceType.Owner_asset]
 
 if __name__ == '__main__':
     pytest.main()
@@ -132,15 +132,26 @@ class TestBBcNetwork(object):
         time.sleep(2)
         networkings[0].domains[domain_id].print_peerlist()
 
+        # the new nodes have been pushed to the neighbors in NOTIFY_PEERLIST_DELTA without alive_check
+        for i in range(core_nodes):
+            for j in range(core_nodes):
+                if i != j:
+                    assert nodes[j] in networkings[i].domains[domain_id].id_ip_mapping
         ret = networkings[2].domains[domain_id].send_ping(nodes[3], None)
-        assert not ret
+        assert ret
 
     def test_04_alive_check(self):
         print("-----", sys._getframe().f_code.co_name, "-----")
+        digest = networkings[0].domains[domain_id].get_peer_list_digest()
+        requested_at = [dict(networkings[i].domains[domain_id].peerlist_requested_at) for i in range(core_nodes)]
         networkings[0].domains[domain_id].alive_check()
         time.sleep(2)
         networkings[1].domains[domain_id].print_peerlist()
-        assert len(networkings[1].domains[domain_id].id_ip_mapping) == 10-1
+        assert len(networkings[1].domains[domain_id].id_ip_mapping) == core_nodes-1
+        for i in range(1, core_nodes):
+            assert networkings[i].domains[domain_id].get_peer_list_digest() == digest
+            # the lists are the same, so the full list is not requested
+            assert networkings[i].domains[domain_id].peerlist_requested_at == requested_at[i]
 
         ret = networkings[2].domains[domain_id].send_ping(nodes[3], None)
         assert ret
@@ -161,6 +172,45 @@ class TestBBcNetwork(object):
         time.sleep(2)
         networkings[0].domains[domain_id].print_peerlist()
 
+    def test_05_user_directory(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        for i in range(core_nodes):
+            for j in range(core_nodes):
+                if i == j:
+                    continue
+                assert networkings[i].domains[domain_id].lookup_user_directory(asset_group_id, users[j]) == nodes[j]
+
+        networkings[9].remove_user_id(asset_group_id, users[9])
+        networkings[8].register_user_id(domain_id, asset_group_id, users[9])
+        time.sleep(1)
+        for i in range(core_nodes - 1):
+            assert networkings[i].domains[domain_id].lookup_user_directory(asset_group_id, users[9]) == nodes[8]
+        networkings[8].remove_user_id(asset_group_id, users[9])
+        time.sleep(1)
+        assert networkings[1].domains[domain_id].lookup_user_directory(asset_group_id, users[9]) is None
+        networkings[9].register_user_id(domain_id, asset_group_id, users[9])
+        time.sleep(1)
+        assert networkings[1].domains[domain_id].lookup_user_directory(asset_group_id, users[9]) == nodes[9]
+
+    def test_05_purge_user_directory(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        domain = networkings[1].domains[domain_id]
+        gone_node = bbclib.get_new_id("gone_node")
+        gone_user = bbclib.get_new_id("gone_user")
+        domain.apply_user_directory([asset_group_id, gone_user, gone_node, int(time.time() * 1000), False])
+
+        # the entry is kept until the node has been missing from the peer list for the TTL
+        domain.purge_user_directory()
+        assert gone_node in domain.user_directory[asset_group_id][gone_user]
+        domain.user_directory_missing[gone_node] -= bbc_network.USER_DIRECTORY_TOMBSTONE_TTL + 1
+        domain.purge_user_directory()
+        assert gone_user not in domain.user_directory[asset_group_id]
+        assert gone_node not in domain.user_directory_missing
+
+        # the entries of the nodes in the peer list are kept
+        for j in range(2, core_nodes):
+            assert domain.lookup_user_directory(asset_group_id, users[j]) == nodes[j]
+
     def test_06_route_message(self):
         print("-----", sys._getframe().f_code.co_name, "-----")
         for i in range(core_nodes):
@@ -234,6 +284,7 @@ class TestBBcNetwork(object):
         print("wait queue: 1")
         total = wait_results(1)
         assert total == 1
+        assert any(nodeinfo.rtt is not None for nodeinfo in networkings[1].domains[domain_id].id_ip_mapping.values())
 
     def test_12_get_failure(self):
         print("-----", sys._getframe().f_code.co_name, "-----")
@@ -251,6 +302,24 @@ class TestBBcNetwork(object):
         total = wait_results(1)
         assert total == 0
 
+    def test_12_put_with_replication_factor(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        resource_id = bbclib.get_new_id("dummy_resource_id")
+        placement = networkings[1].domains[domain_id].get_placement(resource_id, 3)
+        for i in range(2, core_nodes):
+            assert networkings[i].domains[domain_id].get_placement(resource_id, 3) == placement
+        conf = networkings[1].domains[domain_id].config.get_config()['network']['modules']['simple_cluster']
+        conf['replication_factor'] = 3
+        copies = len([nd for nd in placement if nd != nodes[1]])
+        networkings[1].put(domain_id=domain_id, asset_group_id=asset_group_id,
+                           resource_id=resource_id, resource=b'bbbbbb')
+        print("wait queue: %d" % copies)
+        total = wait_results(copies)
+        assert total == copies
+        time.sleep(1)
+        assert result_queue.empty()
+        conf['replication_factor'] = 0
+
     def test_13_leave_domain(self):
         print("-----", sys._getframe().f_code.co_name, "-----")
         for i in range(2, core_nodes):
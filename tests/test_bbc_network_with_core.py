@@ -52,7 +52,7 @@ def get_test_func_failure(query_entry):
     result_queue.put(0)
 
 
-def dummy_send_message(data):
+def dummy_send_message(data, sock=None):
     print("[Core] recv=%s" % data)
     if KeyType.reason in data:
         result_queue.put(0)
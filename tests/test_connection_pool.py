@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import queue
+import socket
+import struct
+import time
+
+import sys
+sys.path.extend(["../"])
+import gevent
+from bbc1.common import message_key_types
+from bbc1.common.message_key_types import PayloadType
+from bbc1.core import connection_pool
+
+
+LOGLEVEL = 'none'
+
+result_queue = queue.Queue()
+server_pool = None
+client_pool = None
+listen_socket = None
+
+
+class DummyNodeInfo:
+    def __init__(self, node_id, port):
+        self.node_id = node_id
+        self.ipv4 = "127.0.0.1"
+        self.ipv6 = "::"
+        self.port = port
+
+
+def server_callback(conn, msg, payload_type):
+    result_queue.put(msg)
+    server_pool.bind(conn, DummyNodeInfo(b'client', 1))
+    server_pool.send(DummyNodeInfo(b'client', 1),
+                     message_key_types.make_message(PayloadType.Type_msgpack, {b'reply': msg[b'seq']}))
+
+
+def client_callback(conn, msg, payload_type):
+    result_queue.put(msg)
+
+
+def accept_loop():
+    while True:
+        conn, address = listen_socket.accept()
+        gevent.spawn(server_pool.add_accepted(conn).reader_loop)
+
+
+class TestConnectionPool(object):
+
+    def test_01_setup(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        global server_pool, client_pool, listen_socket
+        server_pool = connection_pool.ConnectionPool(server_callback, max_connections_per_peer=1, loglevel=LOGLEVEL)
+        client_pool = connection_pool.ConnectionPool(client_callback, idle_timeout=1, loglevel=LOGLEVEL)
+        listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listen_socket.bind(("127.0.0.1", 0))
+        listen_socket.listen(10)
+        gevent.spawn(accept_loop)
+
+    def test_02_send_and_reply_on_same_connection(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        server = DummyNodeInfo(b'server', listen_socket.getsockname()[1])
+        for i in range(5):
+            client_pool.send(server, message_key_types.make_message(PayloadType.Type_msgpack, {b'seq': i}))
+        received = [result_queue.get(timeout=3) for i in range(10)]
+        assert sorted(m[b'seq'] for m in received if b'seq' in m) == list(range(5))
+        assert sorted(m[b'reply'] for m in received if b'reply' in m) == list(range(5))
+        key = connection_pool.get_pool_key(server)
+        assert 0 < len(client_pool.connections[key]) <= connection_pool.MAX_CONNECTIONS_PER_PEER
+        assert len(server_pool.connections) == 1
+
+    def test_03_close_misbehaving_connection(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        sock = socket.create_connection(listen_socket.getsockname())
+        sock.sendall(struct.pack(">HHI", 0xFFFF, 0, 4) + b'xxxx')
+        sock.settimeout(3)
+        assert sock.recv(10) == b''
+        sock.close()
+
+    def test_04_idle_eviction(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        time.sleep(2.5)
+        assert len(client_pool.connections) == 0
+
+    def test_05_report_dropped_messages(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        dropped = queue.Queue()
+        pool = connection_pool.ConnectionPool(client_callback, loglevel=LOGLEVEL,
+                                              callback_dropped=lambda node_id, count: dropped.put((node_id, count)))
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        for i in range(3):
+            assert pool.send(DummyNodeInfo(b'down', port),
+                             message_key_types.make_message(PayloadType.Type_msgpack, {b'seq': i}))
+        # the messages may be spread over the connections to the peer, and each connection reports its own
+        count = 0
+        while count < 3:
+            node_id, dropped_count = dropped.get(timeout=connection_pool.CONNECT_TIMEOUT + 1)
+            assert node_id == b'down'
+            count += dropped_count
+        assert count == 3
+        assert len(pool.connections) == 0
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import collections
+import struct
+import time
+
+import sys
+sys.path.extend(["../"])
+from bbc1.common import bbclib
+from bbc1.common.message_key_types import KeyType
+from bbc1.common.bbc_error import *
+from testutils import prepare, get_core_client, start_core_thread, make_client, domain_and_asset_group_setup
+
+
+LOGLEVEL = 'debug'
+LOGLEVEL = 'info'
+
+core_num = 2
+client_num = 2
+batch_size = 4
+batch_delay = 1
+cores = None
+clients = None
+domain_ids = [bbclib.get_new_id("testdomain%d" % i) for i in range(core_num)]
+asset_group_ids = [bbclib.get_new_id("asset_group_%d" % i) for i in range(core_num)]
+sent_counts = list()
+transaction_ids = list()
+
+
+def record_cross_ref_messages(domain):
+    random_send = domain.random_send
+
+    def wrapper(msg, count):
+        sent_counts.append(struct.unpack(">H", msg[KeyType.cross_refs][:2])[0])
+        random_send(msg, count)
+    domain.random_send = wrapper
+
+
+def insert_transactions(num):
+    user_id = clients[0]['user_id']
+    for i in range(num):
+        txobj = bbclib.make_transaction_for_base_asset(asset_group_id=asset_group_ids[0], event_num=1)
+        txobj.events[0].asset.add(user_id=user_id, asset_body=b'cross_ref %d' % i)
+        txobj.digest()
+        sig = txobj.sign(keypair=clients[0]['keypair'])
+        txobj.add_signature(user_id=user_id, signature=sig)
+        clients[0]['app'].insert_transaction(asset_group_ids[0], txobj)
+        dat = clients[0]['app'].callback.synchronize()
+        assert dat[KeyType.status] == ESUCCESS
+        transaction_ids.append(txobj.transaction_id)
+
+
+def get_cross_refs(num):
+    clients[1]['app'].get_cross_refs(asset_group_id=asset_group_ids[1], number=num)
+    return [(ref.asset_group_id, ref.transaction_id) for ref in clients[1]['app'].callback.synchronize()]
+
+
+class TestCrossRef(object):
+
+    def test_00_setup(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        prepare(core_num=core_num, client_num=client_num, loglevel=LOGLEVEL)
+        for i in range(core_num):
+            start_core_thread(index=i, core_port_increment=i, p2p_port_increment=i, use_global=True)
+            domain_and_asset_group_setup(i, domain_ids[i], asset_group_ids[i])
+        time.sleep(1)
+        for i in range(client_num):
+            make_client(index=i, core_port_increment=i, asset_group_id=asset_group_ids[i])
+        time.sleep(1)
+
+        global cores, clients
+        cores, clients = get_core_client()
+        for cl in clients:
+            assert cl['app'].register_to_core()
+        time.sleep(1)
+
+        networking = cores[0].networking
+        networking.cross_ref_batch_size = batch_size
+        networking.cross_ref_batch_delay = batch_delay
+        record_cross_ref_messages(networking.domains[bbclib.domain_global_0])
+
+    def test_01_setup_network_global(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        clients[0]['app'].get_domain_peerlist(domain_id=bbclib.domain_global_0)
+        node_id, ipv4, ipv6, port = clients[0]['app'].callback.synchronize()[0]
+        clients[1]['app'].set_domain_static_node(bbclib.domain_global_0, node_id, ipv4, ipv6, port)
+        clients[1]['app'].callback.synchronize()
+        time.sleep(1)
+        assert cores[1].networking.domains[bbclib.domain_global_0].node_id in \
+            cores[0].networking.domains[bbclib.domain_global_0].id_ip_mapping
+
+    def test_02_batch(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        insert_transactions(batch_size * 2)
+        time.sleep(1)
+        assert sent_counts == [batch_size, batch_size]
+        refs = get_cross_refs(batch_size * 2)
+        assert refs == [(asset_group_ids[0], txid) for txid in transaction_ids]
+
+    def test_03_batch_delay(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        del sent_counts[:]
+        del transaction_ids[:]
+        insert_transactions(batch_size - 1)
+        assert sent_counts == []
+        time.sleep(batch_delay + 1)
+        assert sent_counts == [batch_size - 1]
+        refs = get_cross_refs(batch_size)
+        assert refs == [(asset_group_ids[0], txid) for txid in transaction_ids]
+
+    def test_04_bounded_buffer(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        # the oldest cross_refs are dropped when the buffer is full
+        networking = cores[1].networking
+        networking.cross_ref_batch_size = 100
+        networking.cross_ref_buffer = collections.deque(maxlen=3)
+        txids = [bbclib.get_new_id("txid_%d" % i) for i in range(5)]
+        for txid in txids:
+            networking.disseminate_cross_ref(txid, asset_group_ids[1])
+        assert list(networking.cross_ref_buffer) == [(asset_group_ids[1], txid) for txid in txids[2:]]
+        networking.flush_cross_refs()
+        assert len(networking.cross_ref_buffer) == 0
+
+    @pytest.mark.unregister
+    def test_99_unregister(self):
+        for cl in clients:
+            cl['app'].unregister_from_core()
+
+
+if __name__ == '__main__':
+    pytest.main()
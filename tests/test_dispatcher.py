@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import sys
+sys.path.extend(["../"])
+from bbc1.common.dispatcher import Dispatcher
+
+
+def tagging(tag, log):
+    def middleware(cmd, handler):
+        def wrapped(dat):
+            log.append((tag, cmd))
+            return handler(dat)
+        return wrapped
+    return middleware
+
+
+class TestDispatcher(object):
+
+    def test_01_register(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        dispatcher = Dispatcher()
+        dispatcher.register(1, lambda dat: ("one", dat))
+        dispatcher.register(2, lambda dat: ("two", dat))
+        assert dispatcher.get(1)("x") == ("one", "x")
+        assert dispatcher.get(3) is None
+        dispatcher.register(2, lambda dat: ("two-replaced", dat))
+        assert dispatcher.get(2)("y") == ("two-replaced", "y")
+        dispatcher.unregister(2)
+        assert 2 not in dispatcher
+        assert 1 in dispatcher
+
+    def test_02_middleware(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        log = []
+        dispatcher = Dispatcher()
+        dispatcher.register(1, lambda dat: dat)
+        outer = tagging("outer", log)
+        dispatcher.add_middleware(outer)
+        dispatcher.add_middleware(tagging("only2", log), commands=[2])
+        dispatcher.register(2, lambda dat: dat * 2)  # registered after the middlewares
+        assert dispatcher.get(1)(3) == 3
+        assert log == [("outer", 1)]
+        log.clear()
+        assert dispatcher.get(2)(3) == 6
+        assert log == [("outer", 2), ("only2", 2)]
+
+        log.clear()
+        dispatcher.remove_middleware(outer)
+        dispatcher.get(1)(3)
+        dispatcher.get(2)(3)
+        assert log == [("only2", 2)]
+
+    def test_03_middleware_can_reject(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        def auth(cmd, handler):
+            def checked(dat):
+                if dat.get('user') != 'admin':
+                    return "denied"
+                return handler(dat)
+            return checked
+
+        dispatcher = Dispatcher()
+        dispatcher.register(10, lambda dat: "done")
+        dispatcher.add_middleware(auth, commands=[10])
+        assert dispatcher.get(10)({'user': 'guest'}) == "denied"
+        assert dispatcher.get(10)({'user': 'admin'}) == "done"
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import time
+
+import sys
+sys.path.extend(["../"])
+
+from bbc1.common import bbclib
+from bbc1.common.message_key_types import KeyType
+from bbc1.core import bbc_network, bbc_config, query_management, simple_cluster
+
+
+LOGLEVEL = 'debug'
+LOGLEVEL = 'info'
+
+core_nodes = 4
+protocol_period = 2
+suspect_timeout = 3
+networkings = [None for i in range(core_nodes)]
+nodes = [None for i in range(core_nodes)]
+domains = [None for i in range(core_nodes)]
+
+domain_id = bbclib.get_new_id("test_domain")
+dead_node = bbclib.NodeInfo(node_id=bbclib.get_new_id("dead_node"), ipv4="127.0.0.1", port=6679)
+indirect_pings = list()
+
+
+class DummyCore:
+    class DB:
+        def add_domain(self, domain_id):
+            pass
+
+    class Storage:
+        def set_storage_path(self, domain_id, from_config):
+            pass
+
+    def __init__(self):
+        self.ledger_manager = DummyCore.DB()
+        self.storage_manager = DummyCore.Storage()
+
+
+def make_delta(src, dst, added=(), removed=(), version=1, digest=None):
+    peer_list = bytearray(len(added).to_bytes(4, 'little'))
+    for nodeinfo in added:
+        for item in nodeinfo.get_nodeinfo():
+            peer_list.extend(item)
+    msg = domains[src].make_message(dst_node_id=nodes[dst], nonce=None,
+                                    msg_type=bbc_network.InfraMessageTypeBase.NOTIFY_PEERLIST_DELTA)
+    msg[KeyType.peer_list] = bytes(peer_list)
+    msg[KeyType.peer_list_removed] = list(removed)
+    msg[KeyType.peer_list_version] = version
+    msg[KeyType.peer_list_digest] = digest if digest is not None else domains[src].get_peer_list_digest()
+    return msg
+
+
+def record_indirect_pings(detector):
+    send_indirect_pings = detector.send_indirect_pings
+
+    def wrapper(entry):
+        indirect_pings.append(entry.data[KeyType.node_id])
+        send_indirect_pings(entry)
+    detector.send_indirect_pings = wrapper
+
+
+class TestFailureDetector(object):
+
+    def test_01_start(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        dummycore = DummyCore()
+        for i in range(core_nodes):
+            config = bbc_config.BBcConfig(directory=".bbc1-%d" % i)
+            config.get_config()['network']['modules']['simple_cluster'] = {'protocol_period': protocol_period,
+                                                                           'suspect_timeout': suspect_timeout}
+            networkings[i] = bbc_network.BBcNetwork(core=dummycore, config=config, p2p_port=6671+i, loglevel=LOGLEVEL)
+            networkings[i].create_domain(network_module="simple_cluster", domain_id=domain_id)
+            domains[i] = networkings[i].domains[domain_id]
+            nodes[i] = domains[i].node_id
+            assert domains[i].failure_detector.protocol_period == protocol_period
+            record_indirect_pings(domains[i].failure_detector)
+
+    def test_02_join(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        for i in range(1, core_nodes):
+            domains[i].add_peer_node(node_id=nodes[0], ip4=True,
+                                     addr_info=(networkings[0].ip_address, networkings[0].port))
+            assert domains[i].send_ping(nodes[0], None)
+        time.sleep(simple_cluster.PEERLIST_DELTA_DELAY + 1)
+        for i in range(core_nodes):
+            for j in range(core_nodes):
+                if i != j:
+                    assert nodes[j] in domains[i].id_ip_mapping
+
+    def test_03_peerlist_delta(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        domains[2].process_NOTIFY_PEERLIST_DELTA(make_delta(1, 2, added=[dead_node], version=2))
+        assert dead_node.node_id in domains[2].id_ip_mapping
+        assert domains[2].peer_versions[nodes[1]] == 2
+
+        # a recently heard node is not removed by the delta of the neighbor
+        domains[2].process_NOTIFY_PEERLIST_DELTA(make_delta(1, 2, removed=[nodes[3]], version=3))
+        assert nodes[3] in domains[2].id_ip_mapping
+
+        # a node not heard from for suspect_timeout is removed
+        domains[2].id_ip_mapping[dead_node.node_id].updated_at -= suspect_timeout + 1
+        domains[2].process_NOTIFY_PEERLIST_DELTA(make_delta(1, 2, removed=[dead_node.node_id], version=4))
+        assert dead_node.node_id not in domains[2].id_ip_mapping
+
+    def test_04_request_peerlist(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        domains[2].peerlist_requested_at.clear()
+        digest = domains[2].get_peer_list_digest()
+
+        # the same list and no version missed
+        domains[2].process_NOTIFY_PEERLIST_DELTA(make_delta(1, 2, version=5, digest=digest))
+        assert nodes[1] not in domains[2].peerlist_requested_at
+
+        # some versions were missed
+        domains[2].process_NOTIFY_PEERLIST_DELTA(make_delta(1, 2, version=10, digest=digest))
+        requested_at = domains[2].peerlist_requested_at.get(nodes[1])
+        assert requested_at is not None
+
+        # the full list is not requested again within PEERLIST_REQUEST_INTERVAL
+        domains[2].process_NOTIFY_PEERLIST_DELTA(make_delta(1, 2, version=20, digest=digest))
+        assert domains[2].peerlist_requested_at[nodes[1]] == requested_at
+
+        # the lists are different
+        domains[2].process_NOTIFY_PEERLIST_DELTA(make_delta(3, 2, version=domains[2].peer_versions.get(nodes[3], 0) + 1,
+                                                            digest=b'x' * 32))
+        assert nodes[3] in domains[2].peerlist_requested_at
+
+        # the nodes in the full list are added (and the others are kept)
+        domains[1].id_ip_mapping[dead_node.node_id] = bbclib.NodeInfo(node_id=dead_node.node_id,
+                                                                      ipv4=dead_node.ipv4, port=dead_node.port)
+        domains[2].peerlist_requested_at.clear()
+        domains[2].request_peerlist(nodes[1])
+        time.sleep(1)
+        assert dead_node.node_id in domains[2].id_ip_mapping
+        assert nodes[3] in domains[2].id_ip_mapping
+        domains[1].remove_peer_node(dead_node.node_id)
+        domains[2].remove_peer_node(dead_node.node_id)
+
+    def test_04_known_peer_by_tcp(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        sent_to = list()
+        send_peerlist = domains[2].send_peerlist
+        domains[2].send_peerlist = lambda node_id: sent_to.append(node_id)
+        domains[2].peerlist_added.clear()
+
+        # a message received by TCP has no address, and it is not a new peer
+        assert not domains[2].add_peer_node(nodes[1], True, None)
+        assert len(sent_to) == 0
+        assert nodes[1] not in domains[2].peerlist_added
+        domains[2].send_peerlist = send_peerlist
+
+    def test_05_indirect_ping(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        detector = domains[0].failure_detector
+        detector.suspects[nodes[3]] = time.time() + 100
+        entry = query_management.QueryEntry(expire_after=protocol_period,
+                                            callback=detector.probe_succeeded,
+                                            data={KeyType.node_id: nodes[3]},
+                                            retry_count=0)
+        detector.send_indirect_pings(entry)
+        time.sleep(1)
+        # the other peers pinged node 3 on behalf of node 0
+        assert nodes[3] not in detector.suspects
+
+    def test_06_failed_peer(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        del indirect_pings[:]
+        for i in range(core_nodes):
+            domains[i].id_ip_mapping[dead_node.node_id] = bbclib.NodeInfo(node_id=dead_node.node_id,
+                                                                          ipv4=dead_node.ipv4, port=dead_node.port)
+        suspected = set()
+        deadline = time.time() + protocol_period * (core_nodes + 2) + suspect_timeout
+        while time.time() < deadline:
+            for i in range(core_nodes):
+                if dead_node.node_id in domains[i].failure_detector.suspects:
+                    suspected.add(i)
+            if all(dead_node.node_id not in domains[i].id_ip_mapping for i in range(core_nodes)):
+                break
+            time.sleep(0.2)
+        print("suspected by:", suspected)
+        assert len(suspected) > 0
+        assert dead_node.node_id in indirect_pings
+        for i in range(core_nodes):
+            assert dead_node.node_id not in domains[i].id_ip_mapping
+            for j in range(core_nodes):
+                if i != j:
+                    assert nodes[j] in domains[i].id_ip_mapping
+
+    def test_07_leave_domain(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        for i in range(core_nodes):
+            networkings[i].remove_domain(domain_id)
+
+
+if __name__ == '__main__':
+    pytest.main()
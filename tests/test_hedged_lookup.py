@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import queue
+import time
+
+import sys
+sys.path.extend(["../"])
+
+from bbc1.common import bbclib
+from bbc1.common.message_key_types import KeyType
+from bbc1.core import bbc_network, bbc_config, query_management, simple_cluster
+from bbc1.core.bbc_ledger import ResourceType
+
+
+LOGLEVEL = 'debug'
+LOGLEVEL = 'info'
+
+ticker = query_management.get_ticker()
+core_nodes = 5
+networkings = [None for i in range(core_nodes)]
+nodes = [None for i in range(core_nodes)]
+domains = [None for i in range(core_nodes)]
+
+domain_id = bbclib.get_new_id("test_domain")
+asset_group_id = bbclib.get_new_id("asset_group_1")
+resource = b'hedged resource'
+result_queue = queue.Queue()
+lookup_rounds = list()
+
+
+class DummyCore:
+    class DB:
+        def add_domain(self, domain_id):
+            pass
+
+    class Storage:
+        def set_storage_path(self, domain_id, from_config):
+            pass
+
+    def __init__(self):
+        self.ledger_manager = DummyCore.DB()
+        self.storage_manager = DummyCore.Storage()
+
+
+def set_responder(index, has_resource=None, silent=False):
+    """
+    make the node respond (with the resource if has_resource() returns True) or not respond at all
+    """
+    domain = domains[index]
+
+    def find_resource_locally(asset_group_id, resource_id, resource_type):
+        if has_resource is not None and has_resource():
+            return resource_id, resource_type, resource
+        return resource_id, resource_type, None
+    domain.find_resource_locally = find_resource_locally
+    if silent:
+        domain.process_REQUEST_FIND_VALUE = lambda msg: None
+    else:
+        domain.process_REQUEST_FIND_VALUE = simple_cluster.NetworkDomain.process_REQUEST_FIND_VALUE.__get__(domain)
+
+
+def record_lookup_rounds(domain):
+    select_lookup_targets = domain.select_lookup_targets
+
+    def wrapper(query_entry):
+        targets = select_lookup_targets(query_entry)
+        lookup_rounds.append(targets)
+        return targets
+    domain.select_lookup_targets = wrapper
+
+
+def make_query():
+    query_entry = query_management.QueryEntry(expire_after=10,
+                                              callback_expire=lambda e: result_queue.put(None),
+                                              data={KeyType.domain_id: domain_id,
+                                                    KeyType.asset_group_id: asset_group_id,
+                                                    KeyType.resource_id: bbclib.get_new_id("resource"),
+                                                    KeyType.resource_type: ResourceType.Transaction_data},
+                                              retry_count=0)
+    query_entry.update(10, callback=lambda e: result_queue.put(e.data[KeyType.resource]))
+    return query_entry
+
+
+class TestHedgedLookup(object):
+
+    def test_01_start(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        dummycore = DummyCore()
+        for i in range(core_nodes):
+            config = bbc_config.BBcConfig(directory=".bbc1-%d" % i)
+            config.get_config()['network']['modules']['simple_cluster'] = {'hedged_lookup_num': 2}
+            networkings[i] = bbc_network.BBcNetwork(core=dummycore, config=config, p2p_port=6691+i, loglevel=LOGLEVEL)
+            networkings[i].create_domain(network_module="simple_cluster", domain_id=domain_id)
+            domains[i] = networkings[i].domains[domain_id]
+            nodes[i] = domains[i].node_id
+        for i in range(core_nodes):
+            for j in range(core_nodes):
+                if i != j:
+                    domains[i].add_peer_node(node_id=nodes[j], ip4=True,
+                                             addr_info=(networkings[j].ip_address, networkings[j].port))
+        assert domains[0].hedged_lookup_num == 2
+        record_lookup_rounds(domains[0])
+
+    def test_02_first_response(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        # only node 1 responds, and the requests to the other nodes are cancelled
+        domains[0].hedged_lookup_num = core_nodes - 1
+        set_responder(1, has_resource=lambda: True)
+        for i in range(2, core_nodes):
+            set_responder(i, silent=True)
+        del lookup_rounds[:]
+        query_entry = make_query()
+        networkings[0].get(query_entry)
+        assert result_queue.get(timeout=5) == resource
+        assert len(lookup_rounds) == 1
+
+        for nonce in query_entry.data['hedged_nonces']:
+            entry = ticker.get_entry(nonce)
+            assert entry is None or not entry.active
+        time.sleep(simple_cluster.INTERVAL_RETRY + 1)
+        assert result_queue.empty()
+        assert domains[0].id_ip_mapping[nodes[1]].rtt is not None
+        for i in range(2, core_nodes):
+            # cancelled, not regarded as lost
+            assert domains[0].id_ip_mapping[nodes[i]].inflight == 0
+            assert domains[0].id_ip_mapping[nodes[i]].loss_rate == 0
+
+    def test_03_next_targets(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        # the nodes asked first do not have the resource, and the next ones are asked without waiting for timeout
+        domains[0].hedged_lookup_num = 2
+        for i in range(1, core_nodes):
+            set_responder(i, has_resource=lambda i=i: nodes[i] not in lookup_rounds[0])
+        del lookup_rounds[:]
+        start = time.time()
+        networkings[0].get(make_query())
+        assert result_queue.get(timeout=5) == resource
+        assert time.time() - start < simple_cluster.INTERVAL_RETRY
+        assert len(lookup_rounds) == 2
+        assert len(lookup_rounds[0]) == 2
+        assert set(lookup_rounds[0]).isdisjoint(lookup_rounds[1])
+
+    def test_04_peer_stats(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        domain = domains[0]
+        nodeinfo = domain.id_ip_mapping[nodes[1]]
+        nodeinfo.rtt = None
+        nodeinfo.loss_rate = 0.0
+        nodeinfo.inflight = 0
+        domain.record_request(nodes[1])
+        domain.record_request(nodes[1])
+        assert nodeinfo.inflight == 2
+        domain.record_response(nodes[1], time.time() - 0.1)
+        assert nodeinfo.inflight == 1
+        assert 0.1 <= nodeinfo.rtt < 0.2
+        domain.record_loss(nodes[1])
+        assert nodeinfo.inflight == 0
+        assert nodeinfo.loss_rate == pytest.approx(bbclib.LOSS_RATE_SMOOTHING)
+        domain.record_request(nodes[1])
+        domain.record_cancel(nodes[1])
+        assert nodeinfo.inflight == 0
+        assert nodeinfo.loss_rate == pytest.approx(bbclib.LOSS_RATE_SMOOTHING)
+
+    def test_05_select_peers(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        domain = domains[0]
+        stats = {nodes[1]: (0.1, 0.0, 0),    # slow
+                 nodes[2]: (0.01, 0.0, 1),   # fast but busy
+                 nodes[3]: (0.01, 0.95, 0),  # fast but lossy
+                 nodes[4]: (None, 0.0, 0)}   # not measured yet, regarded as the fastest
+        for nd, (rtt, loss_rate, inflight) in stats.items():
+            nodeinfo = domain.id_ip_mapping[nd]
+            nodeinfo.rtt, nodeinfo.loss_rate, nodeinfo.inflight = rtt, loss_rate, inflight
+        assert domain.select_peers(core_nodes) == [nodes[4], nodes[2], nodes[1], nodes[3]]
+        assert domain.select_peers(2) == [nodes[4], nodes[2]]
+        assert domain.select_peers(2, excludes=(nodes[4],)) == [nodes[2], nodes[1]]
+        assert domain.select_peers(2, candidates=[nodes[3], nodes[1], nodes[0]]) == [nodes[1], nodes[3]]
+
+        # the lossy peer becomes preferable after it has recovered
+        domain.id_ip_mapping[nodes[3]].loss_rate = 0.0
+        assert set(domain.select_peers(2)) == {nodes[4], nodes[3]}
+
+    def test_09_leave_domain(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        for i in range(core_nodes):
+            networkings[i].remove_domain(domain_id)
+
+
+if __name__ == '__main__':
+    pytest.main()
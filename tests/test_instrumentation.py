@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import os
+import pstats
+import shutil
+import time
+
+import sys
+sys.path.extend(["../"])
+from bbc1.core import instrumentation
+
+
+def busy(duration, fail=False):
+    time.sleep(duration)
+    if fail:
+        raise ValueError("fail")
+    return duration
+
+
+class TestInstrumentation(object):
+
+    def test_01_histogram(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        h = instrumentation.LatencyHistogram(buckets=(0.001, 0.01, 0.1))
+        for elapsed in (0.0005, 0.0005, 0.005, 0.05, 0.5):
+            h.record(elapsed)
+        h.record(0.005, error=True)
+        stats = h.get_stats()
+        assert stats['count'] == 6
+        assert stats['errors'] == 1
+        assert stats['buckets'] == {'<=1': 2, '<=10': 2, '<=100': 1, 'inf': 1}
+        assert stats['p50'] == 10
+        assert stats['p99'] == 500
+        assert stats['max'] == 500
+
+    def test_02_commands_and_spans(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        inst = instrumentation.Instrumentation(spans_enabled=False)
+        assert inst.run("REQUEST_INSERT", busy, 0.01) == 0.01
+        with pytest.raises(ValueError):
+            inst.run("REQUEST_INSERT", busy, 0, True)
+        with inst.span("insert.validate"):
+            pass
+        stats = inst.get_stats()
+        assert stats['commands']['REQUEST_INSERT']['count'] == 2
+        assert stats['commands']['REQUEST_INSERT']['errors'] == 1
+        assert stats['commands']['REQUEST_INSERT']['max'] >= 10
+        assert stats['spans'] == {}
+
+        inst.spans_enabled = True
+        for i in range(3):
+            with inst.span("insert.validate"):
+                busy(0.001)
+        assert inst.get_stats()['spans']['insert.validate']['count'] == 3
+        inst.reset()
+        assert inst.get_stats()['commands'] == {}
+
+    def test_03_profile(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        workingdir = ".bbc1-profile"
+        if os.path.exists(workingdir):
+            shutil.rmtree(workingdir)
+        os.mkdir(workingdir)
+        inst = instrumentation.Instrumentation(workingdir=workingdir)
+        assert inst.stop_profile() is None
+        inst.start_profile(sample_rate=1.0)
+        for i in range(5):
+            inst.run("REQUEST_SEARCH_TRANSACTION", busy, 0)
+        assert inst.get_stats()['profiling']
+        path = inst.stop_profile()
+        assert inst.profiled_count == 5
+        assert os.path.dirname(path) == workingdir
+        assert any(func[2] == "busy" for func in pstats.Stats(path).stats.keys())
+        shutil.rmtree(workingdir)
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import time
+
+import sys
+sys.path.extend(["../"])
+from bbc1.common.lru_cache import LRUCache
+
+
+class TestLRUCache(object):
+
+    def test_01_evict_least_recently_used(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        cache = LRUCache(max_size=3)
+        for i in range(3):
+            cache.put(i, "value%d" % i)
+        assert cache.get(0) == "value0"
+        cache.put(3, "value3")
+        assert 1 not in cache
+        assert [k for k in range(4) if k in cache] == [0, 2, 3]
+        assert len(cache) == 3
+        stats = cache.get_stats()
+        assert stats['evictions'] == 1
+        assert stats['hits'] == 1
+
+    def test_02_update_existing_key(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        cache = LRUCache(max_size=2)
+        cache.put(b'a', 1)
+        cache.put(b'b', 2)
+        cache.put(b'a', 3)
+        cache.put(b'c', 4)
+        assert cache.get(b'a') == 3
+        assert cache.get(b'b') is None
+        assert cache.pop(b'c') == 4
+        assert cache.pop(b'c', 'none') == 'none'
+        stats = cache.get_stats()
+        assert stats['size'] == 1
+        assert stats['misses'] == 1
+
+    def test_03_ttl(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        cache = LRUCache(max_size=10, ttl=0.5)
+        cache.put(b'a', 1)
+        cache.put(b'b', 2, ttl=10)
+        cache.put(b'c', 3)
+        assert cache.get(b'a') == 1
+        time.sleep(0.6)
+        assert cache.get(b'a') is None
+        assert cache.get(b'b') == 2
+        assert cache.purge_expired() == 1
+        assert len(cache) == 1
+        assert cache.get_stats()['expirations'] == 2
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import socket
+
+import sys
+sys.path.extend(["../"])
+from bbc1.common import message_key_types
+from bbc1.common.message_key_types import KeyType, PayloadType
+
+
+messages = [{KeyType.command: i, KeyType.resource: b'x' * (i * 7 % 300)} for i in range(3000)]
+
+
+class TestMessage(object):
+
+    def test_01_parse_fragmented_stream(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        stream = b"".join(message_key_types.make_message(PayloadType.Type_msgpack, m) for m in messages)
+        parser = message_key_types.Message()
+        results = []
+        for pos in range(0, len(stream), 1000):
+            parser.recv(stream[pos:pos+1000])
+            while True:
+                msg = parser.parse()
+                if msg is None:
+                    break
+                results.append(msg)
+        assert results == messages
+        assert len(parser.pending_buf) - parser.read_pos == 0
+
+    def test_02_compaction(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        stream = b"".join(message_key_types.make_message(PayloadType.Type_msgpack, m) for m in messages)
+        parser = message_key_types.Message()
+        count = 0
+        for pos in range(0, len(stream), 333):
+            parser.recv(stream[pos:pos+333])
+            assert parser.read_pos <= message_key_types.Message.COMPACTION_THRESHOLD + 333
+            while parser.parse() is not None:
+                count += 1
+        assert count == len(messages)
+
+    def test_03_gather_write(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        parts = message_key_types.make_message_parts(PayloadType.Type_msgpack, messages[100])
+        assert b"".join(parts) == message_key_types.make_message(PayloadType.Type_msgpack, messages[100])
+        s1, s2 = socket.socketpair()
+        message_key_types.sendall_message_parts(s1, parts)
+        parser = message_key_types.Message()
+        parser.recv(s2.recv(8192))
+        assert parser.parse() == messages[100]
+        s1.close()
+        s2.close()
+
+    def test_04_codec_fragmented_stream(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        stream = b"".join(message_key_types.make_message(PayloadType.Type_msgpack, m) for m in messages)
+        for chunk_size in (1, 5, 1000, len(stream)):
+            codec = message_key_types.MessageCodec()
+            results = []
+            for pos in range(0, len(stream), chunk_size):
+                results.extend(msg for payload_type, msg in codec.feed(stream[pos:pos+chunk_size]))
+            assert results == messages
+
+    def test_05_codec_reject_invalid_message(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        codec = message_key_types.MessageCodec(max_message_size=100)
+        with pytest.raises(ValueError):
+            codec.feed(message_key_types.make_message(PayloadType.Type_msgpack, messages[100]))
+        dat = message_key_types.make_message(PayloadType.Type_msgpack, messages[1])
+        dat = dat[:7] + bytes([dat[7] + 1]) + dat[8:] + b'\x00'
+        for chunk_size in (1, len(dat)):
+            codec = message_key_types.MessageCodec()
+            with pytest.raises(ValueError):
+                for pos in range(0, len(dat), chunk_size):
+                    codec.feed(dat[pos:pos+chunk_size])
+
+    def test_06_tlv_format(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        msg = {KeyType.command: 39, KeyType.status: -1, KeyType.reason: "text", KeyType.query_id: b'\x01\x00',
+               KeyType.transaction_data: b'x' * 1000, KeyType.transactions: [b'a', b'b'], KeyType.result: True,
+               KeyType.all_asset_files: {b'a' * 32: b'file'}, KeyType.count: 1 << 63}
+        dat = message_key_types.make_message(PayloadType.Type_binary, msg)
+        codec = message_key_types.MessageCodec()
+        assert codec.feed(dat) == [(PayloadType.Type_binary, msg)]
+        with pytest.raises(ValueError):
+            message_key_types.make_dictionary_from_TLV_format(dat[8:-1])
+        with pytest.raises(ValueError):
+            message_key_types.make_TLV_formatted_message({b'key': b'value'})
+
+    def test_07_compression(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        msg = {KeyType.command: 39, KeyType.transaction_data: b'\x00' * 600, KeyType.asset_group_id: b'\x01' * 32}
+        accepted = message_key_types.ACCEPTED_COMPRESSION
+        compression_type = message_key_types.select_compression_type(accepted)
+        assert compression_type != message_key_types.CompressionType.Type_none
+        assert message_key_types.select_compression_type(0) == message_key_types.CompressionType.Type_none
+        for payload_type in (PayloadType.Type_msgpack, PayloadType.Type_binary):
+            plain = message_key_types.make_message(payload_type, msg)
+            dat = message_key_types.make_message(payload_type, msg, compression_type=compression_type)
+            assert len(dat) < len(plain)
+            codec = message_key_types.MessageCodec()
+            results = []
+            for pos in range(0, len(dat), 10):
+                results.extend(codec.feed(dat[pos:pos+10]))
+            assert results == [(payload_type, msg)]
+            assert codec.accepted_compression == accepted
+            parser = message_key_types.Message()
+            parser.recv(dat)
+            assert parser.parse() == msg
+        dat = message_key_types.make_message(PayloadType.Type_msgpack, {KeyType.resource: b'\x00' * 100000},
+                                             compression_type=compression_type)
+        with pytest.raises(ValueError):
+            message_key_types.MessageCodec(max_message_size=50000).feed(dat)
+
+
+if __name__ == '__main__':
+    pytest.main()
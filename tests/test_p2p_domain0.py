@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import time
+
+import sys
+sys.path.extend(["../"])
+from bbc1.common import bbclib
+from bbc1.core import bbc_network, bbc_config, p2p_domain0
+
+
+LOGLEVEL = 'debug'
+LOGLEVEL = 'info'
+
+asset_group_ids = [bbclib.get_new_id("asset_group_%d" % i) for i in range(5)]
+node_ids = [bbclib.get_new_id("node_%d" % i) for i in range(3)]
+networkings = [None, None]
+domains = [None, None]
+
+
+class DummyCore:
+    class DB:
+        def add_domain(self, domain_id):
+            pass
+
+    def __init__(self):
+        self.ledger_manager = DummyCore.DB()
+
+
+def advertise(lost=False):
+    send_message_to_peer = domains[0].send_message_to_peer
+    if lost:
+        domains[0].send_message_to_peer = lambda msg, *args: True
+    domains[0].advertise_asset_group_info()
+    domains[0].send_message_to_peer = send_message_to_peer
+    time.sleep(0.5)
+
+
+class TestAssetGroupDirectory(object):
+
+    def test_01_list_format(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        data = p2p_domain0.make_asset_group_list(asset_group_ids)
+        assert len(data) == 2 + 32 * len(asset_group_ids)
+        assert p2p_domain0.parse_asset_group_list(data) == asset_group_ids
+
+    def test_02_update(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        directory = p2p_domain0.AssetGroupDirectory(lifetime=None)
+        directory.update(node_ids[0], asset_group_ids[:3], replace=True)
+        directory.update(node_ids[1], asset_group_ids[2:4], replace=True)
+        assert directory.get_nodes(asset_group_ids[2]) == {node_ids[0], node_ids[1]}
+        assert len(directory) == 4
+
+        directory.update(node_ids[0], [asset_group_ids[4]], [asset_group_ids[0]])
+        assert directory.get_asset_groups(node_ids[0]) == {asset_group_ids[1], asset_group_ids[2], asset_group_ids[4]}
+        assert len(directory.get_nodes(asset_group_ids[0])) == 0
+
+        directory.update(node_ids[0], [asset_group_ids[1]], replace=True)
+        assert directory.get_asset_groups(node_ids[0]) == {asset_group_ids[1]}
+        assert directory.get_nodes(asset_group_ids[2]) == {node_ids[1]}
+
+        directory.remove_node(node_ids[1])
+        assert set(directory.get_asset_group_ids()) == {asset_group_ids[1]}
+
+    def test_03_expire(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        directory = p2p_domain0.AssetGroupDirectory(lifetime=None, generations=2)
+        directory.update(node_ids[0], asset_group_ids[:2], replace=True)
+        directory.update(node_ids[1], asset_group_ids[1:3], replace=True)
+        directory.sweep()
+        directory.update(node_ids[1], [], [])
+        directory.sweep()
+        assert directory.get_asset_groups(node_ids[0]) == set()
+        assert directory.get_nodes(asset_group_ids[1]) == {node_ids[1]}
+        directory.sweep()
+        assert len(directory) == 0
+
+
+class TestAdvertisement(object):
+
+    def test_01_start(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        dummycore = DummyCore()
+        for i in range(len(networkings)):
+            config = bbc_config.BBcConfig(directory=".bbc1-%d" % i)
+            networkings[i] = bbc_network.BBcNetwork(core=dummycore, config=config, p2p_port=6681+i, loglevel=LOGLEVEL)
+            networkings[i].create_domain(network_module="p2p_domain0", domain_id=bbclib.domain_global_0)
+            domains[i] = networkings[i].domains[bbclib.domain_global_0]
+        for i in range(len(networkings)):
+            domains[i].add_peer_node(node_id=domains[1-i].node_id, ip4=True,
+                                     addr_info=(networkings[1-i].ip_address, networkings[1-i].port))
+
+    def test_02_advertise(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        networkings[0].asset_groups_to_advertise.update(asset_group_ids[:2])
+        advertise()
+        directory = domains[1].asset_group_directory
+        assert directory.get_asset_groups(domains[0].node_id) == set(asset_group_ids[:2])
+        assert directory.get_version(domains[0].node_id) == domains[0].advertise_version
+
+        networkings[0].asset_groups_to_advertise.add(asset_group_ids[2])
+        advertise()
+        assert directory.get_asset_groups(domains[0].node_id) == set(asset_group_ids[:3])
+        assert domains[0].node_id not in domains[1].list_requested_at
+
+    def test_03_lost_delta(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        directory = domains[1].asset_group_directory
+        networkings[0].asset_groups_to_advertise.add(asset_group_ids[3])
+        advertise(lost=True)
+        assert asset_group_ids[3] not in directory.get_asset_groups(domains[0].node_id)
+
+        # the next delta has no change but the digest is different, so that the full list is requested
+        advertise()
+        assert directory.get_asset_groups(domains[0].node_id) == set(asset_group_ids[:4])
+
+    def test_04_missed_version(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        directory = domains[1].asset_group_directory
+        domains[1].list_requested_at.clear()
+        networkings[0].asset_groups_to_advertise.discard(asset_group_ids[0])
+        advertise(lost=True)
+        networkings[0].asset_groups_to_advertise.add(asset_group_ids[4])
+        advertise()
+        assert directory.get_asset_groups(domains[0].node_id) == set(asset_group_ids[1:5])
+        assert directory.get_version(domains[0].node_id) == domains[0].advertise_version
+
+    def test_05_delta_without_entry(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        directory = domains[1].asset_group_directory
+        domains[1].list_requested_at.clear()
+        directory.remove_node(domains[0].node_id)
+        advertise()
+        assert directory.get_asset_groups(domains[0].node_id) == set(asset_group_ids[1:5])
+
+    def test_06_leave_domain(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        for i in range(len(networkings)):
+            domains[i].leave_domain()
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import binascii
+import queue
+import random
+import time
+
+import sys
+sys.path.extend(["../"])
+
+from bbc1.common import bbclib
+from bbc1.common.message_key_types import KeyType
+from bbc1.core import bbc_network, bbc_config, query_management
+from bbc1.core.bbc_ledger import ResourceType
+
+
+LOGLEVEL = 'debug'
+LOGLEVEL = 'info'
+
+ticker = query_management.get_ticker()
+core_nodes = 10
+k_value = 3
+networkings = [None for i in range(core_nodes)]
+nodes = [None for i in range(core_nodes)]
+
+domain_id = bbclib.get_new_id("test_domain")
+asset_group_id = bbclib.get_new_id("asset_group_1")
+users = [bbclib.get_new_id("test_user_%i" % i) for i in range(core_nodes)]
+
+result_queue = queue.Queue()
+
+sample_resource_id = bbclib.get_new_id("sample_resource_id")
+
+
+def get_random_data(length=16):
+    import random
+    source_str = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    return "".join([random.choice(source_str) for x in range(length)])
+
+
+def wait_results(count):
+    total = 0
+    for i in range(count):
+        total += result_queue.get()
+    return total
+
+
+def get_test_func_success(query_entry):
+    print("get_test_func_success: ", query_entry.data[KeyType.resource])
+    result_queue.put(1)
+
+
+def get_test_func_failure(query_entry):
+    print("get_test_func_failure()")
+    result_queue.put(0)
+
+
+class DummyCore:
+    class DB:
+        def add_domain(self, domain_id):
+            pass
+
+        def insert_locally(self, domain_id, asset_group_id, resource_id, resource_type, data):
+            print("insert_locally: domain_id=%s, resource_id=%s" % (binascii.b2a_hex(domain_id[:4]),
+                                                                    binascii.b2a_hex(resource_id[:4])))
+            result_queue.put(1)
+
+        def find_locally(self, domain_id, asset_group_id, resource_id, resource_type):
+            if resource_id == sample_resource_id:
+                print("find_locally: FOUND %s" % binascii.b2a_hex(resource_id[:4]))
+                return b'sample_resource'
+            else:
+                print("find_locally: NOTFOUND!!!!!!!")
+                return None
+
+    class Storage:
+        def set_storage_path(self, domain_id, from_config):
+            pass
+
+    def __init__(self):
+        self.ledger_manager = DummyCore.DB()
+        self.storage_manager = DummyCore.Storage()
+
+    def send_message(self, data):
+        print("[Core] recv=%s" % data)
+        result_queue.put(1)
+
+    def error_reply(self, msg=None, err_code=0, txt=""):
+        print("[Core] error=%s" % txt)
+        result_queue.put(0)
+
+    def insert_transaction(self, asset_group_id, txdata, asset_files, no_network_put=False):
+        print("[Core] insert_transaction")
+        result_queue.put(1)
+
+
+class TestP2PKademlia(object):
+
+    def test_01_start(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        dummycore = DummyCore()
+        global networkings, nodes, conf
+        for i, nw in enumerate(networkings):
+            config = bbc_config.BBcConfig(directory=".bbc1-%d"%i)
+            config.get_config()['network'].setdefault('modules', dict())['p2p_kademlia'] = {'k_value': k_value}
+            networkings[i] = bbc_network.BBcNetwork(core=dummycore, config=config, p2p_port=6741+i, loglevel=LOGLEVEL)
+            networkings[i].create_domain(network_module="p2p_kademlia", domain_id=domain_id)
+            nodes[i] = networkings[i].domains[domain_id].node_id
+            assert nodes[i] is not None
+            assert networkings[i].domains[domain_id].k_value == k_value
+        for i in range(core_nodes):
+            networkings[i].register_user_id(domain_id, asset_group_id, users[i])
+
+    def test_02_set_initial_peer(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        for i in range(1, core_nodes):
+            networkings[i].domains[domain_id].add_peer_node(node_id=nodes[0],
+                                                            ip4=True,
+                                                            addr_info=(networkings[0].ip_address, networkings[0].port))
+            assert nodes[0] in networkings[i].domains[domain_id].routing_table
+
+    def test_03_bootstrap(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        for i in range(1, core_nodes):
+            networkings[i].domains[domain_id].send_ping(nodes[0], None)
+        time.sleep(2)
+        for i in range(core_nodes):
+            networkings[i].domains[domain_id].alive_check()
+        print("sleep 5 seconds")
+        time.sleep(5)
+        for i in range(core_nodes):
+            networkings[i].domains[domain_id].print_peerlist()
+            assert len(networkings[i].domains[domain_id].routing_table) > 1
+
+    def test_04_route_message(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        for i in range(core_nodes):
+            msg = {b'aaaaa': 1, b'bbbb': "AAAAAA from %d" % i}
+            networkings[i].route_message(domain_id=domain_id, asset_group_id=asset_group_id,
+                                         dst_user_id=users[0], msg_to_send=msg)
+        print("wait queue: 10")
+        total = wait_results(10)
+        assert total == 10
+
+    def test_05_route_message_inavlid_user(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        dummy_user_id = bbclib.get_new_id("dummy_user_id")
+        msg = {KeyType.command:3, KeyType.query_id:4, b'aaaaa': 1, b'bbbb': "CCCCCC from 1"}
+        networkings[1].route_message(domain_id=domain_id, asset_group_id=asset_group_id,
+                                     dst_user_id=dummy_user_id, msg_to_send=msg)
+        total = wait_results(1)
+        assert total == 0
+
+    def test_06_put(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        resource = b'aaaaaa'
+        resource_id = bbclib.get_new_id("dummy_resource_id")
+        closest = sorted(nodes, key=lambda nd: int.from_bytes(nd, 'big') ^ int.from_bytes(resource_id, 'big'))[:3]
+        copies = len([nd for nd in closest if nd != nodes[1]])
+        networkings[1].put(domain_id=domain_id, asset_group_id=asset_group_id,
+                           resource_id=resource_id, resource=resource)
+        print("wait queue: %d" % copies)
+        total = wait_results(copies)
+        assert total == copies
+
+    def test_07_get(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        query_entry = query_management.QueryEntry(expire_after=10,
+                                                  callback_expire=get_test_func_failure,
+                                                  data={KeyType.domain_id: domain_id,
+                                                        KeyType.asset_group_id: asset_group_id,
+                                                        KeyType.resource_id: sample_resource_id,
+                                                        KeyType.resource_type: ResourceType.Transaction_data},
+                                                  retry_count=3)
+        query_entry.update(2, callback=get_test_func_success)
+        networkings[1].get(query_entry)
+        print("wait queue: 1")
+        total = wait_results(1)
+        assert total == 1
+
+    def test_08_get_failure(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        resource_id = bbclib.get_new_id("dummy_resource_id_2")
+        query_entry = query_management.QueryEntry(expire_after=10,
+                                                  callback_expire=get_test_func_failure,
+                                                  data={KeyType.domain_id: domain_id,
+                                                        KeyType.asset_group_id: asset_group_id,
+                                                        KeyType.resource_id: resource_id,
+                                                        KeyType.resource_type: ResourceType.Transaction_data},
+                                                  retry_count=1)
+        query_entry.update(2, callback=get_test_func_success)
+        networkings[2].get(query_entry)
+        print("wait queue: 1")
+        total = wait_results(1)
+        assert total == 0
+
+    def test_09_leave_domain(self):
+        print("-----", sys._getframe().f_code.co_name, "-----")
+        for i in range(2, core_nodes):
+            networkings[i].remove_domain(domain_id)
+        time.sleep(1)
+        networkings[0].domains[domain_id].print_peerlist()
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import time
+
+import sys
+sys.path.extend(["../"])
+from bbc1.common import bbclib
+from bbc1.common.message_key_types import KeyType
+from bbc1.common.bbc_error import *
+from bbc1.core.bbc_ledger import ResourceType
+from testutils import prepare, get_core_client, start_core_thread, make_client, domain_and_asset_group_setup
+
+
+LOGLEVEL = 'debug'
+LOGLEVEL = 'info'
+
+core_num = 2
+client_num = 2
+cores = None
+clients = None
+domain_ids = [bbclib.get_new_id("testdomain%d" % i) for i in range(core_num)]
+asset_group_ids = [bbclib.get_new_id("asset_group_%d" % i) for i in range(core_num)]
+transaction = None
+
+
+class TestProxySearch(object):
+
+    def test_00_setup(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        prepare(core_num=core_num, client_num=client_num, loglevel=LOGLEVEL)
+        for i in range(core_num):
+            start_core_thread(index=i, core_port_increment=i, p2p_port_increment=i, use_global=True)
+            domain_and_asset_group_setup(i, domain_ids[i], asset_group_ids[i], advertise_in_domain0=(i == 0))
+        time.sleep(1)
+        for i in range(client_num):
+            make_client(index=i, core_port_increment=i, asset_group_id=asset_group_ids[i])
+        time.sleep(1)
+
+        global cores, clients
+        cores, clients = get_core_client()
+        for cl in clients:
+            assert cl['app'].register_to_core()
+        time.sleep(1)
+
+    def test_01_setup_network_global(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        clients[0]['app'].get_domain_peerlist(domain_id=bbclib.domain_global_0)
+        node_id, ipv4, ipv6, port = clients[0]['app'].callback.synchronize()[0]
+        clients[1]['app'].set_domain_static_node(bbclib.domain_global_0, node_id, ipv4, ipv6, port)
+        clients[1]['app'].callback.synchronize()
+        time.sleep(1)
+
+        domain0 = cores[0].networking.domains[bbclib.domain_global_0]
+        directory = cores[1].networking.domains[bbclib.domain_global_0].asset_group_directory
+        for i in range(20):
+            domain0.advertise_asset_group_info()
+            time.sleep(0.5)
+            if len(directory.get_nodes(asset_group_ids[0])) > 0:
+                break
+        assert directory.get_nodes(asset_group_ids[0]) == {domain0.node_id}
+
+    def test_02_insert(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        global transaction
+        user_id = clients[0]['user_id']
+        transaction = bbclib.make_transaction_for_base_asset(asset_group_id=asset_group_ids[0], event_num=1)
+        transaction.events[0].asset.add(user_id=user_id, asset_file=b'proxied file')
+        transaction.digest()
+        sig = transaction.sign(keypair=clients[0]['keypair'])
+        transaction.add_signature(user_id=user_id, signature=sig)
+        clients[0]['app'].insert_transaction(asset_group_ids[0], transaction)
+        dat = clients[0]['app'].callback.synchronize()
+        assert dat[KeyType.status] == ESUCCESS
+
+    def test_03_search_transaction(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        assert asset_group_ids[0] not in cores[1].asset_group_domain_mapping
+        clients[1]['app'].search_transaction(asset_group_ids[0], transaction.transaction_id)
+        dat = clients[1]['app'].callback.synchronize(timeout=10)
+        assert dat is not None
+        assert dat[KeyType.status] == ESUCCESS
+        assert dat[KeyType.transaction_data] == transaction.serialize()
+        assert cores[1].proxy_cache.get((asset_group_ids[0], ResourceType.Transaction_data,
+                                         transaction.transaction_id)) is not None
+
+    def test_04_search_asset(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        asid = transaction.events[0].asset.asset_id
+        clients[1]['app'].search_asset(asset_group_ids[0], asid)
+        dat = clients[1]['app'].callback.synchronize(timeout=10)
+        assert dat is not None
+        assert dat[KeyType.status] == ESUCCESS
+        assert dat[KeyType.transaction_data] == transaction.serialize()
+        assert dat[KeyType.asset_file] == b'proxied file'
+
+    def test_05_search_from_cache(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        # no node to ask is left, so that the responses must come from the cache
+        domain0 = cores[0].networking.domains[bbclib.domain_global_0]
+        cores[1].networking.domains[bbclib.domain_global_0].asset_group_directory.remove_node(domain0.node_id)
+
+        clients[1]['app'].search_transaction(asset_group_ids[0], transaction.transaction_id)
+        dat = clients[1]['app'].callback.synchronize(timeout=10)
+        assert dat is not None
+        assert dat[KeyType.status] == ESUCCESS
+        assert dat[KeyType.transaction_data] == transaction.serialize()
+
+        clients[1]['app'].search_asset(asset_group_ids[0], transaction.events[0].asset.asset_id)
+        dat = clients[1]['app'].callback.synchronize(timeout=10)
+        assert dat is not None
+        assert dat[KeyType.status] == ESUCCESS
+        assert dat[KeyType.asset_file] == b'proxied file'
+
+    @pytest.mark.unregister
+    def test_99_unregister(self):
+        for cl in clients:
+            cl['app'].unregister_from_core()
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import time
+
+import sys
+sys.path.extend(["../"])
+from bbc1.common import bbclib
+from bbc1.common.message_key_types import KeyType
+from bbc1.common.bbc_error import *
+from bbc1.core import bbc_network, query_management, snapshot
+from bbc1.core.bbc_ledger import ResourceType
+from testutils import prepare, get_core_client, start_core_thread, make_client, domain_and_asset_group_setup
+
+
+LOGLEVEL = 'debug'
+LOGLEVEL = 'info'
+
+core_num = 2
+client_num = 2
+transaction_num = 20
+cores = None
+clients = None
+domain_id = bbclib.get_new_id("testdomain")
+asset_group_id = bbclib.get_new_id("asset_group_1")
+transactions = list()
+forged_txid = None
+tampered_asid = None
+listing_count = [0]
+
+
+class TestSnapshot(object):
+
+    def test_00_setup(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        prepare(core_num=core_num, client_num=client_num, loglevel=LOGLEVEL)
+        for i in range(core_num):
+            start_core_thread(index=i, core_port_increment=i, p2p_port_increment=i)
+        time.sleep(1)
+        for i in range(client_num):
+            domain_and_asset_group_setup(i, domain_id, asset_group_id)
+            make_client(index=i, core_port_increment=i, asset_group_id=asset_group_id)
+        time.sleep(1)
+
+        global cores, clients
+        cores, clients = get_core_client()
+        for cl in clients:
+            assert cl['app'].register_to_core()
+        time.sleep(1)
+
+    def test_01_insert(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        user_id = clients[0]['user_id']
+        for i in range(transaction_num):
+            txobj = bbclib.make_transaction_for_base_asset(asset_group_id=asset_group_id, event_num=1)
+            txobj.events[0].asset.add(user_id=user_id, asset_file=b'file-%d' % i)
+            if len(transactions) > 0:
+                bbclib.add_reference_to_transaction(asset_group_id, txobj, transactions[-1], 0)
+            txobj.digest()
+            sig = txobj.sign(keypair=clients[0]['keypair'])
+            txobj.add_signature(user_id=user_id, signature=sig)
+            clients[0]['app'].insert_transaction(asset_group_id, txobj)
+            dat = clients[0]['app'].callback.synchronize()
+            assert dat[KeyType.status] == ESUCCESS
+            transactions.append(txobj)
+
+    def test_02_tamper(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        # a record whose transaction_id does not match the transaction data, and an asset file not matching its digest
+        global forged_txid, tampered_asid
+        forged_txid = bbclib.get_new_id("forged")
+        assert cores[0].ledger_manager.insert_locally(domain_id, asset_group_id, forged_txid,
+                                                      ResourceType.Transaction_data, transactions[0].serialize())
+        tampered_asid = transactions[1].events[0].asset.asset_id
+        assert cores[0].storage_manager.store_locally(domain_id, asset_group_id, tampered_asid, b'tampered')
+
+    def test_03_snapshot(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        # an asset file in each chunk, while the files are listed only once
+        cores[0].networking.domains[domain_id].snapshot.max_bytes_per_message = 1
+        storage = cores[0].storage_manager
+        get_asset_ids = storage.get_asset_ids
+
+        def count_listing(*args):
+            listing_count[0] += 1
+            return get_asset_ids(*args)
+        storage.get_asset_ids = count_listing
+
+        clients[0]['app'].get_domain_peerlist(domain_id=domain_id)
+        node_id, ipv4, ipv6, port = clients[0]['app'].callback.synchronize()[0]
+        clients[1]['app'].set_domain_static_node(domain_id, node_id, ipv4, ipv6, port)
+        clients[1]['app'].callback.synchronize()
+        ledger = cores[1].ledger_manager
+        for i in range(50):
+            if ledger.count_transactions(domain_id, asset_group_id) >= transaction_num:
+                break
+            time.sleep(0.2)
+        time.sleep(1)
+        assert ledger.count_transactions(domain_id, asset_group_id) == transaction_num
+        assert ledger.find_locally(domain_id, asset_group_id, forged_txid, ResourceType.Transaction_data) is None
+        assert listing_count[0] == 1
+
+    def test_04_auxiliary_records(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        ledger = cores[1].ledger_manager
+        for i, txobj in enumerate(transactions):
+            asid = txobj.events[0].asset.asset_id
+            assert ledger.find_locally(domain_id, asset_group_id, asid, ResourceType.Asset_ID) == txobj.transaction_id
+            if i > 0:
+                assert ledger.find_locally(domain_id, asset_group_id, txobj.transaction_id,
+                                           ResourceType.Edge_outgoing) == transactions[i - 1].transaction_id
+
+    def test_05_asset_files(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        storage = cores[1].storage_manager
+        for i, txobj in enumerate(transactions):
+            asid = txobj.events[0].asset.asset_id
+            if asid == tampered_asid:
+                assert storage.get_locally(domain_id, asset_group_id, asid) is None
+            else:
+                assert storage.get_locally(domain_id, asset_group_id, asid) == b'file-%d' % i
+
+    def test_06_stale_response(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        domain = cores[1].networking.domains[domain_id]
+        cursor = [snapshot.STAGE_ASSET_FILE, None, 100]
+        session = query_management.QueryEntry(expire_after=10, data={KeyType.node_id: domain.node_id,
+                                                                     KeyType.asset_group_id: asset_group_id,
+                                                                     'cursor': list(cursor), 'count': [0, 0]})
+        txobj = bbclib.make_transaction_for_base_asset(asset_group_id=asset_group_id, event_num=0)
+        txobj.digest()
+        msg = domain.make_message(dst_node_id=domain.node_id, nonce=session.nonce,
+                                  msg_type=bbc_network.InfraMessageTypeBase.RESPONSE_SNAPSHOT)
+        msg[KeyType.snapshot_cursor] = [snapshot.STAGE_TRANSACTION, 0, 100]
+        msg[KeyType.snapshot_next_cursor] = [snapshot.STAGE_TRANSACTION, 1, 100]
+        msg[KeyType.snapshot_rows] = [[txobj.transaction_id, txobj.serialize()]]
+        domain.snapshot.process_RESPONSE_SNAPSHOT(msg)
+        assert session.data['cursor'] == cursor
+        assert cores[1].ledger_manager.count_transactions(domain_id, asset_group_id) == transaction_num
+
+        # the response to the last request is accepted
+        msg[KeyType.snapshot_cursor] = cursor
+        msg[KeyType.snapshot_next_cursor] = [snapshot.STAGE_DONE, None, 100]
+        msg[KeyType.snapshot_rows] = []
+        domain.snapshot.process_RESPONSE_SNAPSHOT(msg)
+        assert session.data['cursor'] == [snapshot.STAGE_DONE, None, 100]
+        assert not session.active
+
+    @pytest.mark.unregister
+    def test_99_unregister(self):
+        for cl in clients:
+            cl['app'].unregister_from_core()
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -123,7 +123,38 @@ def get_peerlist(client):
             if k == 0:
                 print("*myself*    %s, %s, %s, %d" % (binascii.b2a_hex(node_id[:4]), ipv4, ipv6, port))
             else:
-                print("            %s, %s, %s, %d" % (binascii.b2a_hex(node_id[:4]), ipv4, ipv6, port))
+                print("            %s, %s, %s, %d" % (binascii.b2a_hex(node_id[:4]), ipv4, ipv6, port), end="")
+                stats = bbcclient.callback.peer_stats.get(bytes(node_id))
+                if stats is not None and stats[0] is not None:
+                    print("  (rtt=%.1fms, loss=%.2f, inflight=%d)" % (stats[0] * 1000, stats[1], stats[2]))
+                else:
+                    print("")
+
+
+def get_stats(client):
+    client.get_stats()
+    stats = client.callback.synchronize()
+    if stats is None:
+        print("Failed to get stats")
+        return
+    print("====== commands (uptime %.0f sec) =====" % stats['uptime'])
+    for kind in ('commands', 'spans'):
+        if kind == 'spans':
+            print("====== spans =====")
+        for name, h in sorted(stats[kind].items()):
+            print("%-36s count=%-8d errors=%-5d mean=%.2fms p50=%.2fms p90=%.2fms p99=%.2fms max=%.2fms" %
+                  (name, h['count'], h['errors'], h['mean'], h['p50'], h['p90'], h['p99'], h['max']))
+
+
+def manipulate_profiler(client, enable, sample_rate=None):
+    client.manipulate_profiler(enable=enable, sample_rate=sample_rate)
+    dat = client.callback.synchronize()
+    if enable:
+        print("profiling started")
+    elif dat.get(KeyType.result, False):
+        print("profile is written in %s (on bbc_core)" % dat[KeyType.profile_file])
+    else:
+        print("profiling is not running")
 
 
 def argument_parser():
@@ -138,6 +169,12 @@ def argument_parser():
     argparser.add_argument('-i', '--id', action='store',  help='SHA256 ID calculation from the given strings')
     argparser.add_argument('-t', '--timebaseid', action='store',  help='SHA256 ID calculation from the given strings '
                                                                        'including timestamp')
+    argparser.add_argument('-s', '--stats', action='store_true', default=False,
+                           help='Get statistics of commands in bbc_core')
+    argparser.add_argument('--profile', choices=['start', 'stop'], default=None,
+                           help='Start/stop the sampling profiler in bbc_core')
+    argparser.add_argument('--sample_rate', type=float, default=None,
+                           help='Probability that a command is profiled (with --profile start)')
     argparser.add_argument('file', action='store', nargs='?', default=None,  help='Json config file')
     return argparser.parse_args()
 
@@ -172,6 +209,10 @@ if __name__ == '__main__':
         get_mynodeinfo(bbcclient)
     elif parsed_args.getpeerlist:
         get_peerlist(bbcclient)
+    elif parsed_args.stats:
+        get_stats(bbcclient)
+    elif parsed_args.profile is not None:
+        manipulate_profiler(bbcclient, parsed_args.profile == 'start', parsed_args.sample_rate)
     elif parsed_args.file:
         if os.path.exists(parsed_args.file):
             with open(parsed_args.file, "r") as f: